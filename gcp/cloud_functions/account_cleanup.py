@@ -0,0 +1,308 @@
+# アカウント削除時にユーザーのデータ (Firestore / Cloud Storage) をまとめて消す
+#
+# - users/{uid} の photos と categoryCounts はページごとに読み、500件ずつのWriteBatchを並列にコミットする
+# - Cloud Storageの users_photo/{uid}/ 以下は一覧のページごとにバッチAPI (100件ずつ) で並列に消す
+# - 期限 (deadline) を過ぎたら新しいページには進まず、途中までの件数を返す。
+#   削除は冪等なので、もう一度呼べば残りから再開できる
+# - 途中で止まった場合の進捗は accountDeletions/{uid} に記録する。削除し終えたら進捗も消し、
+#   再開されないままの進捗も expireAt (PROGRESS_TTL_DAYS後) を過ぎたらFirestoreのTTLで消える
+# - 写真のバケット名は GCP_PROJECT (Cloud Runと同じ)、無ければ GCLOUD_PROJECT から読む。
+#   どちらも無い場合は何も消さずにエラーにする
+# - 一覧の取得に失敗した場合も complete=False を返し、users/{uid} とAuthのアカウントは残す
+# - クライアントは引数で受け取るため、ローカルのフェイクでも動かせる
+# Standard Library
+import logging
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, Dict, Iterable, List, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+GCS_PREFIX = "photo-jp-my-gourmet-image-classification-2023-08"
+SUBCOLLECTIONS = ("photos", "categoryCounts")
+PROGRESS_COLLECTION = "accountDeletions"
+PROGRESS_TTL_DAYS = 30
+# WriteBatchの上限 / GCSのバッチAPIで推奨される上限 / 一覧の1ページの件数
+FIRESTORE_BATCH_SIZE = 500
+GCS_BATCH_SIZE = 100
+GCS_PAGE_SIZE = 1000
+WORKERS = int(os.getenv("DELETION_WORKERS", "16"))
+# 一括削除で同時にデータを消すユーザー数
+USER_CONCURRENCY = int(os.getenv("DELETION_USER_CONCURRENCY", "8"))
+# auth.delete_usersの1回あたりの上限と、呼び出しの間隔 (サーバー側で1秒に1回に制限されている)
+AUTH_BATCH_SIZE = 1000
+AUTH_INTERVAL_SECONDS = 1.0
+
+
+@dataclass
+class DeletionResult:
+    uid: str
+    documents_deleted: int = 0
+    blobs_deleted: int = 0
+    errors: int = 0
+    complete: bool = False
+    elapsed: float = 0.0
+
+    def to_dict(self) -> dict:
+        return {
+            "uid": self.uid,
+            "documentsDeleted": self.documents_deleted,
+            "blobsDeleted": self.blobs_deleted,
+            "errors": self.errors,
+            "complete": self.complete,
+            "elapsedSeconds": round(self.elapsed, 2),
+        }
+
+
+class _Tasks:
+    # 同時に実行中のタスクを上限までに抑えつつ、結果 (削除件数) を集計する
+
+    def __init__(self, pool: ThreadPoolExecutor, limit: int) -> None:
+        self._pool = pool
+        self._limit = limit
+        self._pending: Set["Future[int]"] = set()
+        self.done = 0
+        self.errors = 0
+
+    def _collect(self, futures: Set["Future[int]"]) -> None:
+        for future in futures:
+            error = future.exception()
+            if error is None:
+                self.done += future.result()
+            else:
+                self.errors += 1
+                logger.warning("Deletion batch failed: %s", error)
+
+    def submit(self, func: Callable[..., int], *args: Any) -> None:
+        if len(self._pending) >= self._limit:
+            finished, self._pending = wait(self._pending, return_when=FIRST_COMPLETED)
+            self._collect(finished)
+        self._pending.add(self._pool.submit(func, *args))
+
+    def join(self) -> None:
+        finished = wait(self._pending).done
+        self._pending = set()
+        self._collect(finished)
+
+
+def _commit_deletes(db: Any, references: List[Any]) -> int:
+    batch = db.batch()
+    for reference in references:
+        batch.delete(reference)
+    batch.commit()
+    return len(references)
+
+
+def photo_bucket_name() -> str:
+    # 写真のバケット名はプロジェクトIDと同じ (GCLOUD_PROJECTはCloud Functionsが設定する)
+    name = os.getenv("GCP_PROJECT") or os.getenv("GCLOUD_PROJECT")
+    if not name:
+        raise RuntimeError("GCP_PROJECT or GCLOUD_PROJECT must name the photo bucket")
+    return name
+
+
+def delete_documents(
+    collection: Any, db: Any, pool: ThreadPoolExecutor, deadline: float
+) -> Tuple[int, int, bool]:
+    # カーソルで次のページを読みながら、前のページの削除を並列にコミットする
+    tasks = _Tasks(pool, WORKERS)
+    query = collection.select([]).limit(FIRESTORE_BATCH_SIZE)
+    last = None
+    exhausted = False
+    try:
+        while time.monotonic() < deadline:
+            page = query.start_after(last) if last is not None else query
+            snapshots = list(page.stream())
+            if not snapshots:
+                exhausted = True
+                break
+            tasks.submit(_commit_deletes, db, [snapshot.reference for snapshot in snapshots])
+            last = snapshots[-1]
+    except Exception as e:
+        tasks.errors += 1
+        logger.warning("Listing documents failed: %s", e)
+    tasks.join()
+    return tasks.done, tasks.errors, exhausted
+
+
+def _delete_blob_chunk(storage_client: Any, bucket: Any, blobs: List[Any]) -> int:
+    # 1回のHTTPリクエストでまとめて消す。既に無いオブジェクトのエラーは無視する
+    with storage_client.batch(raise_exception=False):
+        bucket.delete_blobs(blobs, on_error=lambda blob: None)
+    return len(blobs)
+
+
+def delete_blobs(
+    bucket_name: str, prefix: str, storage_client: Any, pool: ThreadPoolExecutor, deadline: float
+) -> Tuple[int, int, bool]:
+    tasks = _Tasks(pool, WORKERS)
+    bucket = storage_client.bucket(bucket_name)
+    exhausted = True
+    try:
+        pages = storage_client.list_blobs(bucket_name, prefix=prefix, page_size=GCS_PAGE_SIZE).pages
+        for page in pages:
+            blobs = list(page)
+            for start in range(0, len(blobs), GCS_BATCH_SIZE):
+                tasks.submit(
+                    _delete_blob_chunk,
+                    storage_client,
+                    bucket,
+                    blobs[start : start + GCS_BATCH_SIZE],
+                )
+            if time.monotonic() >= deadline:
+                exhausted = False
+                break
+    except Exception as e:
+        # バケットが無い・権限が無いなど。消せた分は数え、再実行で残りから再開する
+        tasks.errors += 1
+        exhausted = False
+        logger.warning("Listing blobs in %s failed: %s", bucket_name, e)
+    tasks.join()
+    return tasks.done, tasks.errors, exhausted
+
+
+def _record_progress(db: Any, result: DeletionResult) -> None:
+    # 削除し終えたユーザーのuidを残さないよう、完了したら進捗のドキュメントも消す
+    progress_ref = db.collection(PROGRESS_COLLECTION).document(result.uid)
+    if result.complete:
+        progress_ref.delete()
+        return
+
+    # Third Party Library
+    from google.cloud.firestore import Increment  # type: ignore
+
+    now = datetime.now(timezone.utc)
+    progress_ref.set(
+        {
+            "status": "incomplete",
+            "updatedAt": now,
+            "expireAt": now + timedelta(days=PROGRESS_TTL_DAYS),
+            "documentsDeleted": Increment(result.documents_deleted),
+            "blobsDeleted": Increment(result.blobs_deleted),
+        },
+        merge=True,
+    )
+
+
+def delete_user_data(
+    uid: str, db: Any, storage_client: Any, deadline: float, pool: ThreadPoolExecutor
+) -> DeletionResult:
+    """ユーザーのFirestoreのドキュメントとCloud Storageの写真を削除する
+
+    deadline (time.monotonic()の値) までに終わらなければ complete=False を返す
+    """
+    started = time.monotonic()
+    # バケットが設定されていなければ、何も消す前にエラーにする
+    bucket_name = photo_bucket_name()
+    result = DeletionResult(uid)
+    user_ref = db.collection("users").document(uid)
+
+    # FirestoreとCloud Storageは並行して消す (ページの読み込みは各1スレッド、削除はpoolで並列)
+    with ThreadPoolExecutor(len(SUBCOLLECTIONS) + 1) as listers:
+        document_jobs = [
+            listers.submit(delete_documents, user_ref.collection(name), db, pool, deadline)
+            for name in SUBCOLLECTIONS
+        ]
+        blob_job = listers.submit(
+            delete_blobs,
+            bucket_name,
+            f"{GCS_PREFIX}/users_photo/{uid}/",
+            storage_client,
+            pool,
+            deadline,
+        )
+        complete = True
+        for job in document_jobs:
+            deleted, errors, exhausted = job.result()
+            result.documents_deleted += deleted
+            result.errors += errors
+            complete = complete and exhausted
+        deleted, errors, exhausted = blob_job.result()
+        result.blobs_deleted += deleted
+        result.errors += errors
+        complete = complete and exhausted
+
+    # サブコレクションが全て消えてから親のドキュメントを消す (途中で止まっても再開の起点が残る)
+    result.complete = complete and result.errors == 0
+    if result.complete:
+        user_ref.delete()
+        result.documents_deleted += 1
+    result.elapsed = time.monotonic() - started
+    _record_progress(db, result)
+    logger.info("Deleted data of user %s: %s", uid, result.to_dict())
+    return result
+
+
+def _delete_user_data_safely(
+    uid: str, db: Any, storage_client: Any, deadline: float, pool: ThreadPoolExecutor
+) -> DeletionResult:
+    try:
+        return delete_user_data(uid, db, storage_client, deadline, pool)
+    except Exception as e:
+        logger.error("Failed to delete data of user %s: %s", uid, e)
+        return DeletionResult(uid, errors=1)
+
+
+def delete_accounts(
+    uids: Iterable[str],
+    db: Any,
+    storage_client: Any,
+    auth_client: Any,
+    deadline: float,
+    pool: ThreadPoolExecutor,
+) -> Dict[str, Dict[str, Any]]:
+    """複数のアカウントをデータごと削除し、uidごとの結果を返す
+
+    AUTH_BATCH_SIZE件ずつ、データの削除をUSER_CONCURRENCY人ずつ並行して行い、
+    データを消し終えたユーザーのアカウントだけをauth.delete_usersでまとめて消す。
+    期限を過ぎた場合、残りのユーザーは authDeleted=False, complete=False で返す (再実行で再開する)
+    """
+    unique = list(dict.fromkeys(uid for uid in uids if uid))
+    results: Dict[str, Dict[str, Any]] = {}
+    last_auth_call = 0.0
+    with ThreadPoolExecutor(USER_CONCURRENCY) as users:
+        for start in range(0, len(unique), AUTH_BATCH_SIZE):
+            chunk = unique[start : start + AUTH_BATCH_SIZE]
+            if time.monotonic() >= deadline:
+                for uid in chunk:
+                    results[uid] = {**DeletionResult(uid).to_dict(), "authDeleted": False}
+                continue
+            deleted_data = list(
+                users.map(
+                    lambda uid: _delete_user_data_safely(uid, db, storage_client, deadline, pool),
+                    chunk,
+                )
+            )
+            for result in deleted_data:
+                results[result.uid] = {**result.to_dict(), "authDeleted": False}
+
+            deletable = [result.uid for result in deleted_data if result.complete]
+            if not deletable:
+                continue
+            time.sleep(max(0.0, last_auth_call + AUTH_INTERVAL_SECONDS - time.monotonic()))
+            try:
+                outcome = auth_client.delete_users(deletable)
+                failed = {deletable[error.index]: error.reason for error in outcome.errors}
+            except Exception as e:
+                logger.error("auth.delete_users failed for %d users: %s", len(deletable), e)
+                failed = {uid: str(e) for uid in deletable}
+            last_auth_call = time.monotonic()
+            for uid in deletable:
+                results[uid]["authDeleted"] = uid not in failed
+                if uid in failed:
+                    results[uid]["error"] = failed[uid]
+    return results
+
+
+def summarize(results: Dict[str, Dict[str, Any]]) -> Dict[str, int]:
+    return {
+        "requested": len(results),
+        "deleted": sum(1 for result in results.values() if result["authDeleted"]),
+        "incomplete": sum(1 for result in results.values() if not result["complete"]),
+        "authErrors": sum(1 for result in results.values() if "error" in result),
+        "documentsDeleted": sum(result["documentsDeleted"] for result in results.values()),
+        "blobsDeleted": sum(result["blobsDeleted"] for result in results.values()),
+    }
@@ -0,0 +1,52 @@
+# 複数のアカウントをデータごとまとめて削除する管理用のCLI
+# 実行方法: python bulk_delete.py uids.txt --output results.json
+#   uids.txt は1行に1つのuid ("-" で標準入力から読む)。
+#   途中で止まった場合は同じファイルでもう一度実行すると残りから再開する
+# Standard Library
+import argparse
+import json
+import logging
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
+
+# Third Party Library
+from account_cleanup import WORKERS, delete_accounts, summarize
+
+
+def read_uids(path: str) -> List[str]:
+    stream = sys.stdin if path == "-" else open(path, encoding="utf-8")
+    with stream:
+        return [line.strip() for line in stream if line.strip()]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("uids", help="file with one uid per line, or - for stdin")
+    parser.add_argument("--output", help="write per-uid results as JSON to this file")
+    parser.add_argument("--budget", type=float, default=3600.0, help="seconds before stopping")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    # Third Party Library
+    from firebase_admin import auth, firestore, initialize_app  # type: ignore
+    from google.cloud import storage  # type: ignore
+
+    initialize_app()
+    uids = read_uids(args.uids)
+    deadline = time.monotonic() + args.budget
+    with ThreadPoolExecutor(WORKERS) as pool:
+        results = delete_accounts(uids, firestore.client(), storage.Client(), auth, deadline, pool)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+    summary = summarize(results)
+    print(json.dumps(summary, indent=2))
+    if summary["deleted"] < summary["requested"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
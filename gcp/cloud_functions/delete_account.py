@@ -1,19 +1,36 @@
 # Standard Library
 import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 # Third Party Library
-from firebase_admin import auth, exceptions, initialize_app  # type: ignore;
+from account_cleanup import (
+    WORKERS,
+    delete_accounts,
+    delete_user_data,
+    photo_bucket_name,
+    summarize,
+)
+from firebase_admin import auth, exceptions, firestore, initialize_app  # type: ignore;
 from firebase_functions import https_fn  # type: ignore
+from google.cloud import storage  # type: ignore
 
 app = initialize_app()
 
-# db = firestore.client()
+db = firestore.client()
+storage_client = storage.Client()
 
 logging.basicConfig(level=logging.INFO)
 # logging.basicConfig(level=logging.ERROR)
 
+# 関数のタイムアウトと、データ削除に使う時間 (残りはAuthの削除と応答に残す)
+TIMEOUT_SECONDS = 540
+DELETION_BUDGET_SECONDS = TIMEOUT_SECONDS - 40
+# 一括削除で1回に受け付けるuidの数
+MAX_BULK_UIDS = 10000
 
-@https_fn.on_call()
+
+@https_fn.on_call(timeout_sec=TIMEOUT_SECONDS)
 def delete_user_account(req: https_fn.CallableRequest):
     try:
         # IDトークンを検証
@@ -23,11 +40,29 @@ def delete_user_account(req: https_fn.CallableRequest):
         # UIDの存在を確認
         if not userId:
             return {"error": "Invalid token: userId not found"}, 403
+        # 本人のアカウントのみ削除できる
+        if req.auth is None or req.auth.uid != userId:
+            return {"error": "Invalid token: userId does not match"}, 403
+
+        # 写真などのデータを先に消す。時間内に終わらなければAuthのアカウントは残し、
+        # もう一度呼んでもらって残りから再開する
+        deadline = time.monotonic() + DELETION_BUDGET_SECONDS
+        with ThreadPoolExecutor(WORKERS) as pool:
+            result = delete_user_data(userId, db, storage_client, deadline, pool)
+        if not result.complete:
+            logging.warning("User data deletion is incomplete: %s", result.to_dict())
+            return {
+                "message": "User data deletion in progress.",
+                "result": result.to_dict(),
+            }
 
         # 指定されたユーザーIDのアカウントを削除
         auth.delete_user(userId)
         logging.info("Successfully deleted user")
-        return {"message": "User account successfully deleted."}
+        return {
+            "message": "User account successfully deleted.",
+            "result": result.to_dict(),
+        }
     except ValueError as e:
         # トークンの検証でエラー（トークンが無効な場合）
         logging.error("ValueError: %s", e)
@@ -36,3 +71,35 @@ def delete_user_account(req: https_fn.CallableRequest):
         # Firebase Auth関連のエラー
         logging.error("FirebaseError: %s", e)
         return {"error": "Error deleting user"}, 500
+    except Exception as e:
+        # 設定の誤りやFirestore / Cloud Storageのエラー (Authのアカウントは残るので再実行できる)
+        logging.exception("Failed to delete user data: %s", e)
+        return {"error": "Error deleting user data"}, 500
+
+
+@https_fn.on_call(timeout_sec=TIMEOUT_SECONDS)
+def bulk_delete_user_accounts(req: https_fn.CallableRequest):
+    # 管理者 (カスタムクレーム admin=true) のみ、複数のアカウントをまとめて削除できる
+    if req.auth is None or req.auth.token.get("admin") is not True:
+        return {"error": "Permission denied"}, 403
+    userIds = req.data.get("userIds") or []
+    if not isinstance(userIds, list) or not all(isinstance(uid, str) for uid in userIds):
+        return {"error": "userIds must be a list of strings"}, 400
+    if len(userIds) > MAX_BULK_UIDS:
+        return {"error": f"At most {MAX_BULK_UIDS} userIds per call"}, 400
+
+    try:
+        # 設定の誤りは全員分の削除を試す前に返す
+        photo_bucket_name()
+    except RuntimeError as e:
+        logging.error("Bulk deletion is not configured: %s", e)
+        return {"error": "Error deleting user data"}, 500
+
+    deadline = time.monotonic() + DELETION_BUDGET_SECONDS
+    with ThreadPoolExecutor(WORKERS) as pool:
+        results = delete_accounts(userIds, db, storage_client, auth, deadline, pool)
+    summary = summarize(results)
+    logging.info("Bulk deletion finished: %s", summary)
+    # 削除できなかったuidだけ詳細を返す (同じuidで呼び直せば再開する)
+    failures = {uid: result for uid, result in results.items() if not result["authDeleted"]}
+    return {"summary": summary, "failures": failures}
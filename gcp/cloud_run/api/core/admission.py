@@ -0,0 +1,187 @@
+# ルート単位の受付制御 (同時実行数の上限・待ち行列・待ち時間の期限)
+#
+# 上限を超えたリクエストは待ち行列に入り、行列が一杯か期限までに順番が来なければ
+# 429とRetry-Afterを返してすぐに断る。行列が degrade_depth 以上になると
+# request.state.degraded を立て、エンドポイント側で重い処理を省く (縮退モード)。
+#
+# 上限はワーカー (プロセス) ごと。ADMISSION_LIMITS で上書きできる
+#   例) "findNearbyRestaurants=8,32,2,8;categorizeFood=4,16,5,8"
+#       (同時実行数, 待ち行列の長さ, 待ち時間の期限 秒, 縮退を始める行列の長さ)
+# Standard Library
+import asyncio
+import math
+import os
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Callable, Deque, Dict, Iterable, Tuple
+
+# Third Party Library
+from fastapi import HTTPException, Request  # type: ignore
+
+# First Party Library
+from api.core.metrics import Labels, describe, increment, observe, register_collector
+
+
+@dataclass
+class AdmissionPolicy:
+    max_concurrent: int
+    max_queue: int
+    queue_timeout: float
+    degrade_depth: int
+
+
+DEFAULT_POLICIES: Dict[str, AdmissionPolicy] = {
+    "findNearbyRestaurants": AdmissionPolicy(8, 32, 2.0, 8),
+    "categorizeFood": AdmissionPolicy(4, 16, 5.0, 8),
+}
+
+# 処理時間の指数移動平均の重み (Retry-Afterの見積もりに使う)
+EWMA_WEIGHT = 0.2
+
+describe("admission_queue_depth", "gauge", "Requests waiting for an admission slot.")
+describe("admission_in_flight", "gauge", "Requests holding an admission slot.")
+describe("admission_shed_total", "counter", "Requests rejected with 429, by reason.")
+describe("admission_degraded_total", "counter", "Requests served in degraded mode.")
+describe("admission_queue_seconds", "histogram", "Time spent waiting for an admission slot.")
+
+
+class Shed(Exception):
+    def __init__(self, reason: str, retry_after: int) -> None:
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class AdmissionLimiter:
+    # イベントループ上でのみ使う (スレッドセーフではない)
+
+    def __init__(self, name: str, policy: AdmissionPolicy) -> None:
+        self.name = name
+        self.policy = policy
+        self.in_flight = 0
+        self.waiters: Deque["asyncio.Future[None]"] = deque()
+        self.service_seconds = 1.0
+        self.labels: Labels = (("route", name),)
+
+    @property
+    def degraded(self) -> bool:
+        return len(self.waiters) >= self.policy.degrade_depth
+
+    def retry_after(self) -> int:
+        # 今の行列がはけるまでの見積もり (秒、最低1秒)
+        backlog = len(self.waiters) + 1
+        return max(1, math.ceil(self.service_seconds * backlog / self.policy.max_concurrent))
+
+    def _shed(self, reason: str) -> Shed:
+        increment("admission_shed_total", 1.0, self.labels + (("reason", reason),))
+        return Shed(reason, self.retry_after())
+
+    async def acquire(self) -> None:
+        if self.in_flight < self.policy.max_concurrent and not self.waiters:
+            self.in_flight += 1
+            observe("admission_queue_seconds", 0.0, self.labels)
+            return
+        if len(self.waiters) >= self.policy.max_queue:
+            raise self._shed("queue_full")
+
+        waiter: "asyncio.Future[None]" = asyncio.get_running_loop().create_future()
+        self.waiters.append(waiter)
+        started = time.perf_counter()
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), self.policy.queue_timeout)
+        except asyncio.TimeoutError:
+            if waiter.done():
+                # 期限と同時に枠を譲られた場合はそのまま処理する
+                pass
+            else:
+                waiter.cancel()
+                self.waiters.remove(waiter)
+                raise self._shed("queue_timeout")
+        except asyncio.CancelledError:
+            # クライアントの切断など。譲られた枠があれば次に回す
+            if waiter.done() and not waiter.cancelled():
+                self.release()
+            else:
+                waiter.cancel()
+                self.waiters.remove(waiter)
+            raise
+        observe("admission_queue_seconds", time.perf_counter() - started, self.labels)
+
+    def release(self) -> None:
+        # 待っているリクエストがあれば枠をそのまま譲る
+        while self.waiters:
+            waiter = self.waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.in_flight -= 1
+
+    def record_service_time(self, seconds: float) -> None:
+        self.service_seconds += EWMA_WEIGHT * (seconds - self.service_seconds)
+
+
+def parse_policies(spec: str) -> Dict[str, AdmissionPolicy]:
+    policies = {}
+    for item in spec.split(";"):
+        name, _, values = item.partition("=")
+        if not name.strip() or not values.strip():
+            continue
+        concurrent, queue, timeout, degrade = values.split(",")
+        policies[name.strip()] = AdmissionPolicy(
+            int(concurrent), int(queue), float(timeout), int(degrade)
+        )
+    return policies
+
+
+_policies = {**DEFAULT_POLICIES, **parse_policies(os.getenv("ADMISSION_LIMITS", ""))}
+_limiters: Dict[str, AdmissionLimiter] = {}
+
+
+def get_limiter(name: str) -> AdmissionLimiter:
+    limiter = _limiters.get(name)
+    if limiter is None:
+        limiter = _limiters[name] = AdmissionLimiter(name, _policies[name])
+    return limiter
+
+
+def _collect() -> Iterable[Tuple[str, str, Labels, float]]:
+    for limiter in list(_limiters.values()):
+        yield "gauge", "admission_queue_depth", limiter.labels, float(len(limiter.waiters))
+        yield "gauge", "admission_in_flight", limiter.labels, float(limiter.in_flight)
+
+
+register_collector(_collect)
+
+
+def admission(name: str) -> Callable[[Request], AsyncIterator[None]]:
+    """ルートの依存関係として使う受付制御
+
+    @router.post("/categorizeFood", dependencies=[Depends(admission("categorizeFood"))])
+    """
+
+    async def dependency(request: Request) -> AsyncIterator[None]:
+        limiter = get_limiter(name)
+        try:
+            await limiter.acquire()
+        except Shed as e:
+            raise HTTPException(
+                status_code=429,
+                detail=f"Too many requests ({e.reason})",
+                headers={"Retry-After": str(e.retry_after)},
+            )
+        request.state.degraded = limiter.degraded
+        if request.state.degraded:
+            increment("admission_degraded_total", 1.0, limiter.labels)
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            limiter.record_service_time(time.perf_counter() - started)
+            limiter.release()
+
+    return dependency
+
+
+def is_degraded(request: Any) -> bool:
+    return bool(getattr(request.state, "degraded", False))
@@ -1,20 +1,37 @@
 # Standard Library
 import logging
-from typing import Any
+from typing import Any, Dict, Optional
 
 # Third Party Library
 from fastapi import HTTPException  # type: ignore
 
+# First Party Library
+from api.cruds.write_behind import get_write_buffer
+
+logger = logging.getLogger(__name__)
+
 READY_FOR_USE = "readyForUse"
 
 
-def authenticate_user(access_token: str, user_id: str) -> None:
-    if not access_token:
-        raise HTTPException(status_code=401, detail="AccessToken not provided")
+def authenticate_user(claims: Optional[Dict[str, Any]], user_id: str) -> None:
+    # claimsはmain.pyのミドルウェアがAuthorizationヘッダのIDトークンを検証したもの
+    if not claims:
+        raise HTTPException(
+            status_code=401,
+            detail="アクセストークンが提供されていないか無効です",
+        )
     if not user_id:
-        raise HTTPException(status_code=400, detail="userId not provided")
-    logging.info(f"Processing saveImage request for user: {user_id} with accessToken: [REDACTED]")
+        raise HTTPException(status_code=400, detail="userIdが提供されていません")
+    if claims["uid"] != user_id:
+        raise HTTPException(status_code=403, detail="userIdがトークンと一致しません")
+    logger.debug("Processing request for user %s", user_id)
 
 
 def update_user_doc_status(user_id: str, db: Any) -> None:
-    db.collection("users").document(user_id).update({"classifyPhotosStatus": READY_FOR_USE})
+    # 直近に同じ値を書いていれば送らない (書き込みはライトビハインドでまとめる)
+    get_write_buffer().set(
+        db,
+        db.collection("users").document(user_id),
+        {"classifyPhotosStatus": READY_FOR_USE},
+        dedupe=True,
+    )
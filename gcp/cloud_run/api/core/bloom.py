@@ -0,0 +1,37 @@
+# 省メモリな集合の所属判定 (Bloomフィルタ)
+# 偽陽性 (含まれていないのに含まれると判定) はあるが偽陰性は無い
+# Standard Library
+import hashlib
+import math
+from typing import Iterable
+
+
+class BloomFilter:
+    def __init__(self, expected_items: int, false_positive_rate: float = 1e-4) -> None:
+        expected_items = max(1, expected_items)
+        # 最適なビット数とハッシュ関数の数
+        self.size = max(8, int(-expected_items * math.log(false_positive_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / expected_items * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, item: str) -> Iterable[int]:
+        # 1回のハッシュから2つの値を取り、組み合わせてk個の位置を作る (double hashing)
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], "little")
+        second = int.from_bytes(digest[8:], "little") | 1
+        return ((first + index * second) % self.size for index in range(self.hashes))
+
+    def add(self, item: str) -> None:
+        for position in self._positions(item):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, item: str) -> bool:
+        return all(
+            self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(item)
+        )
+
+    @property
+    def memory_bytes(self) -> int:
+        return len(self.bits)
@@ -0,0 +1,77 @@
+# 外部サービスのクライアント (重いライブラリは初回利用時にimportし、プロセス内で使い回す)
+# Standard Library
+import os
+import threading
+from functools import lru_cache
+from typing import Any
+
+SERVICE_ACCOUNT_PATH = os.getenv("SERVICE_ACCOUNT_PATH", "/auth/service_account.json")
+
+_firebase_lock = threading.Lock()
+_firebase_initialized = False
+
+
+def initialize_firebase() -> None:
+    global _firebase_initialized
+    if _firebase_initialized:
+        return
+    with _firebase_lock:
+        if _firebase_initialized:
+            return
+        # Third Party Library
+        from firebase_admin import credentials, initialize_app  # type: ignore
+
+        initialize_app(credentials.Certificate(SERVICE_ACCOUNT_PATH))
+        _firebase_initialized = True
+
+
+def get_firestore_client() -> Any:
+    initialize_firebase()
+    # Third Party Library
+    from firebase_admin import firestore  # type: ignore
+
+    return firestore.client()
+
+
+def get_async_firestore_client() -> Any:
+    # 非同期ルート用 (I/Oの待ち時間にイベントループを止めない)
+    initialize_firebase()
+    # Third Party Library
+    from firebase_admin import firestore_async  # type: ignore
+
+    return firestore_async.client()
+
+
+@lru_cache(maxsize=None)
+def get_storage_client() -> Any:
+    # Third Party Library
+    from google.cloud import storage  # type: ignore
+
+    return storage.Client()
+
+
+@lru_cache(maxsize=None)
+def get_gmaps_client(api_key: str) -> Any:
+    # Third Party Library
+    import googlemaps  # type: ignore
+
+    # OVER_QUERY_LIMIT の再試行は api.core.rate_limit で行う (クライアント内で最大60秒待たせない)
+    return googlemaps.Client(key=api_key, retry_over_query_limit=False)
+
+
+@lru_cache(maxsize=None)
+def get_http_session() -> Any:
+    # Place Photoのダウンロードでコネクションを使い回す
+    # Third Party Library
+    import requests  # type: ignore
+
+    return requests.Session()
+
+
+@lru_cache(maxsize=None)
+def get_gemini_model(api_key: str, model_name: str = "gemini-1.5-flash") -> Any:
+    # Third Party Library
+    import google.generativeai as genai  # type: ignore
+
+    genai.configure(api_key=api_key)
+    return genai.GenerativeModel(model_name)
@@ -1,7 +1,7 @@
 # Standard Library
 from dataclasses import dataclass, field
 from datetime import datetime
-from typing import List
+from typing import List, Optional
 
 
 @dataclass
@@ -17,4 +17,5 @@ class StoreData:
     phoneNumber: str
     website: str = ""
     openingHours: dict = field(default_factory=dict)
+    openingIntervals: Optional[List[int]] = None
     imageUrls: List[str] = field(default_factory=list)
@@ -0,0 +1,25 @@
+# Standard Library
+from typing import Optional
+
+# Geminiの回答に含まれるカテゴリ名と、保存するカテゴリのID
+CATEGORY_TRANSLATION = {
+    "ラーメン": "ramen",
+    "カフェ": "cafe",
+    "和食": "japanese_food",
+    "洋食": "western_food",
+    "エスニック": "ethnic_food",
+    "飲食物ではない": "not_food",
+}
+
+
+def find_category(text: str) -> Optional[str]:
+    # 回答に含まれる最初のカテゴリ名 (ストリーミングの途中でも判定できる)
+    for key in CATEGORY_TRANSLATION:
+        if key in text:
+            return key
+    return None
+
+
+def translate_food_category(category: str) -> str:
+    key = find_category(category)
+    return CATEGORY_TRANSLATION[key] if key else "not_food"
@@ -1,38 +1,159 @@
+# Geminiによる料理カテゴリの判定
+#
+# - 判定全体を GEMINI_DEADLINE_SECONDS で打ち切る (止まった呼び出しでリクエストを塞がない)
+# - 直近のレイテンシの GEMINI_HEDGE_PERCENTILE (0で無効) を過ぎても返ってこなければ
+#   2本目のリクエストを投げ、先に返った方を使う
+# - ストリーミングはカテゴリ名が届いた時点で読むのをやめる
+# - 各呼び出しには期限までの残り時間をタイムアウトとして渡す
+#   (期限後に放棄した呼び出しやヘッジがスレッドと実行中の外部呼び出しの数を使い続けないようにする)
+# - 期限切れの場合は GEMINI_FALLBACK_CATEGORY を返す (未設定なら504)。
+#   値はGeminiの回答と同じ日本語のカテゴリ名 (api.core.food_category.CATEGORY_TRANSLATION のキー) にする
 # Standard Library
 import logging
 import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
 from io import BytesIO
-from typing import Any
+from typing import Any, Deque, List, Optional
 
 # Third Party Library
-import google.generativeai as genai
-from PIL import Image
+from fastapi import HTTPException  # type: ignore
 
+# First Party Library
+from api.core.clients import get_gemini_model
+from api.core.food_category import CATEGORY_TRANSLATION, find_category
+from api.core.metrics import describe, increment, span
+from api.core.rate_limit import governed
 
-def categorize_from_gemini_api(
-    photo_data: bytes,
-) -> str:
-    logging.info("Preparing to categorize from gemini api")
+logger = logging.getLogger(__name__)
 
-    GEMINI_API_KEY = os.getenv("GEMINI_API_KEY", "default-gemini")
+PROMPT = "画像の飲食物は、ラーメン/カフェ/和食/洋食/エスニック/飲食物ではない のいずれに当てはまるか単語で答えよ"
 
-    genai.configure(api_key=GEMINI_API_KEY)
+DEADLINE_SECONDS = float(os.getenv("GEMINI_DEADLINE_SECONDS", "10"))
+HEDGE_PERCENTILE = float(os.getenv("GEMINI_HEDGE_PERCENTILE", "0.95"))
+FALLBACK_CATEGORY = os.getenv("GEMINI_FALLBACK_CATEGORY", "")
+# 期限切れを表す例外 (重いライブラリをimportしないよう名前で判定する)
+DEADLINE_EXCEPTIONS = frozenset({"DeadlineExceeded", "TimeoutError", "ReadTimeout"})
+# ヘッジの閾値を決めるのに必要な件数と、保持する直近のレイテンシの件数
+HEDGE_MIN_SAMPLES = 20
+LATENCY_WINDOW = 200
 
-    model = genai.GenerativeModel("gemini-1.5-flash")
+# 期限切れで放棄した呼び出しもスレッドを使い続けるため、リクエスト処理とは別のプールで実行する
+if FALLBACK_CATEGORY and FALLBACK_CATEGORY not in CATEGORY_TRANSLATION:
+    raise ValueError(
+        f"GEMINI_FALLBACK_CATEGORY must be one of {list(CATEGORY_TRANSLATION)}: "
+        f"{FALLBACK_CATEGORY!r}"
+    )
+
+_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv("GEMINI_MAX_WORKERS", "32")), thread_name_prefix="gemini"
+)
+_latencies: Deque[float] = deque(maxlen=LATENCY_WINDOW)
+_latencies_lock = threading.Lock()
+
+describe("gemini_hedged_total", "counter", "Gemini calls that sent a hedged second request.")
+describe("gemini_hedge_wins_total", "counter", "Hedged Gemini requests that answered first.")
+describe("gemini_deadline_exceeded_total", "counter", "Gemini calls abandoned at the deadline.")
 
-    # バイトデータをBytesIOオブジェクトに変換
-    img_data = BytesIO(photo_data)
-    img = Image.open(img_data)
 
+def hedge_delay() -> Optional[float]:
+    if HEDGE_PERCENTILE <= 0:
+        return None
+    with _latencies_lock:
+        samples = sorted(_latencies)
+    if len(samples) < HEDGE_MIN_SAMPLES:
+        return None
+    return samples[min(len(samples) - 1, int(HEDGE_PERCENTILE * len(samples)))]
+
+
+def generate_category(model: Any, img: Any, cancelled: threading.Event, deadline: float) -> str:
+    # 期限 (time.monotonic() の値) までの残り時間をタイムアウトにする
+    timeout = deadline - time.monotonic()
+    if timeout <= 0:
+        raise TimeoutError("Gemini deadline exceeded")
     response = model.generate_content(
-        [
-            "画像の飲食物は、ラーメン/カフェ/和食/洋食/エスニック/飲食物ではない のいずれに当てはまるか単語で答えよ",
-            img,
-        ],
-        stream=True,
+        [PROMPT, img], stream=True, request_options={"timeout": timeout}
+    )
+    text = ""
+    for chunk in response:
+        text += chunk.text
+        # カテゴリ名が揃うか、他方のリクエストが先に返ったら残りは読まない
+        if find_category(text) or cancelled.is_set():
+            break
+        if time.monotonic() >= deadline:
+            raise TimeoutError("Gemini deadline exceeded")
+    return text
+
+
+def _attempt(model: Any, img: Any, cancelled: threading.Event, deadline: float) -> str:
+    started = time.perf_counter()
+    text = governed(
+        "gemini", "gemini.generate_content", generate_category, model, img, cancelled, deadline
     )
-    response.resolve()
+    with _latencies_lock:
+        _latencies.append(time.perf_counter() - started)
+    return text
+
+
+def categorize_from_gemini_api(photo_data: bytes, use_fallback: bool = True) -> str:
+    # use_fallback=Falseなら期限切れでもフォールバックを返さず504にする (バックフィルなど)
+    logger.debug("Preparing to categorize from gemini api")
+
+    # Third Party Library
+    from PIL import Image
+
+    GEMINI_API_KEY = os.getenv("GEMINI_API_KEY", "default-gemini")
+
+    model = get_gemini_model(GEMINI_API_KEY)
+
+    # バイトデータをBytesIOオブジェクトに変換
+    img_data = BytesIO(photo_data)
+    with span("image.open"):
+        img = Image.open(img_data)
+        # ヘッジしたリクエストから同時に読めるよう先にデコードしておく
+        img.load()
+
+    deadline = time.monotonic() + DEADLINE_SECONDS
+    cancelled = threading.Event()
+    futures: List["Future[str]"] = [_executor.submit(_attempt, model, img, cancelled, deadline)]
+
+    delay = hedge_delay()
+    if delay is not None and delay < DEADLINE_SECONDS:
+        done, _ = wait(futures, timeout=delay)
+        if not done:
+            increment("gemini_hedged_total")
+            futures.append(_executor.submit(_attempt, model, img, cancelled, deadline))
+
+    errors: List[BaseException] = []
+    pending = set(futures)
+    while pending:
+        done, pending = wait(
+            pending, timeout=max(0.0, deadline - time.monotonic()), return_when=FIRST_COMPLETED
+        )
+        if not done:
+            break
+        for future in done:
+            error = future.exception()
+            if error is not None:
+                errors.append(error)
+                continue
+            cancelled.set()
+            if len(futures) > 1 and future is futures[1]:
+                increment("gemini_hedge_wins_total")
+            text = future.result()
+            logger.info("Gemini response: %s", text)
+            return text
 
-    logging.info(f"response.text: , {response.text}")
+    cancelled.set()
+    failures = [e for e in errors if type(e).__name__ not in DEADLINE_EXCEPTIONS]
+    if failures and not pending:
+        # 期限切れ以外の理由で全てのリクエストが失敗した場合は最初のエラーをそのまま返す
+        raise failures[0]
 
-    return response.text
+    increment("gemini_deadline_exceeded_total")
+    logger.warning("Gemini did not respond within %.1fs", DEADLINE_SECONDS)
+    if FALLBACK_CATEGORY and use_fallback:
+        return FALLBACK_CATEGORY
+    raise HTTPException(status_code=504, detail="Gemini did not respond in time")
@@ -0,0 +1,67 @@
+# 緯度経度を地図タイル (Webメルカトルの z/x/y) に分ける
+#
+# - 近くの店舗の検索結果はズーム NEARBY_ZOOM のタイル (日本付近で約15m四方) ごとにまとめてキャッシュする
+#   (タイルの中心から、検索の半径にタイルの中心から角までの距離を足して検索する。タイルのどこで撮った
+#   写真でも、半径内の店舗が検索結果に含まれる)
+# - リクエストが集中する地域はズーム HOT_TILE_ZOOM のタイル (約500m四方) で数える
+# Standard Library
+import math
+import os
+from typing import Tuple
+
+NEARBY_ZOOM = int(os.getenv("PLACES_NEARBY_ZOOM", "21"))
+HOT_TILE_ZOOM = 16
+# Webメルカトルで表せる緯度の範囲
+MAX_LATITUDE = 85.05112878
+EARTH_RADIUS_METERS = 6371008.8
+
+Tile = Tuple[int, int, int]
+
+
+def tile_for(lat: float, lon: float, zoom: int = NEARBY_ZOOM) -> Tile:
+    lat = max(-MAX_LATITUDE, min(MAX_LATITUDE, lat))
+    scale = 1 << zoom
+    x = int((lon + 180.0) / 360.0 * scale)
+    y = int((1.0 - math.asinh(math.tan(math.radians(lat))) / math.pi) / 2.0 * scale)
+    return zoom, min(max(x, 0), scale - 1), min(max(y, 0), scale - 1)
+
+
+def _tile_point(zoom: int, x: float, y: float) -> Tuple[float, float]:
+    scale = 1 << zoom
+    lon = x / scale * 360.0 - 180.0
+    lat = math.degrees(math.atan(math.sinh(math.pi * (1.0 - 2.0 * y / scale))))
+    return lat, lon
+
+
+def tile_center(tile: Tile) -> Tuple[float, float]:
+    zoom, x, y = tile
+    return _tile_point(zoom, x + 0.5, y + 0.5)
+
+
+def distance_meters(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    # 数百m以内の距離を求める (正距円筒図法の近似)
+    mean_lat = math.radians((lat1 + lat2) / 2.0)
+    dx = math.radians(lon2 - lon1) * math.cos(mean_lat)
+    dy = math.radians(lat2 - lat1)
+    return EARTH_RADIUS_METERS * math.hypot(dx, dy)
+
+
+def tile_radius_meters(tile: Tile) -> float:
+    # タイルの中心から最も遠い角までの距離 (対角線の約半分)
+    zoom, x, y = tile
+    center = tile_center(tile)
+    return max(
+        distance_meters(*center, *_tile_point(zoom, corner_x, corner_y))
+        for corner_x in (x, x + 1)
+        for corner_y in (y, y + 1)
+    )
+
+
+def parent_tile(tile: Tile, zoom: int) -> Tile:
+    shift = tile[0] - zoom
+    return zoom, tile[1] >> shift, tile[2] >> shift
+
+
+def tile_key(tile: Tile) -> str:
+    # Firestoreのドキュメント名に使う ("/" は使えない)
+    return "_".join(str(value) for value in tile)
@@ -0,0 +1,222 @@
+# Firebase IDトークンをローカルで検証する (リクエストごとにネットワークへ出ない)
+#
+# - Googleの公開鍵 (X.509証明書) はCache-Controlのmax-ageまでキャッシュし、
+#   期限の少し前にバックグラウンドのスレッドで取り直す
+# - ミドルウェアからは verify_id_token_async を使う。メモ化済みのトークンはその場で返し、
+#   それ以外 (署名の検証と、更新が間に合わなかった場合の鍵の取得) はスレッドで行う
+# - 検証済みのクレームはトークンの有効期限 (exp) までメモ化する
+# - プロジェクトIDは FIREBASE_PROJECT_ID / GOOGLE_CLOUD_PROJECT、
+#   どちらも無ければサービスアカウントのJSONから読む
+# Standard Library
+import asyncio
+import json
+import logging
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+# First Party Library
+from api.core import clients
+from api.core.metrics import describe, increment, span
+
+logger = logging.getLogger(__name__)
+
+CERTS_URL = (
+    "https://www.googleapis.com/robot/v1/metadata/x509/securetoken@system.gserviceaccount.com"
+)
+ISSUER_PREFIX = "https://securetoken.google.com/"
+CLOCK_SKEW_SECONDS = 60
+# 期限のこの秒数前に鍵を取り直す / 取得に失敗した場合の再試行間隔
+REFRESH_MARGIN_SECONDS = 300
+RETRY_SECONDS = 30
+# Cache-Controlが無い場合の鍵の有効期間
+DEFAULT_MAX_AGE = 3600
+# 未知のkidで鍵を取り直す間隔の下限 (不正なトークンで取得が連発しないように)
+UNKNOWN_KID_REFRESH_SECONDS = 60
+MEMO_SIZE = int(os.getenv("ID_TOKEN_MEMO_SIZE", "10000"))
+
+_MAX_AGE_PATTERN = re.compile(r"max-age=(\d+)")
+
+describe("id_token_verifications_total", "counter", "ID token checks by result.")
+
+
+class InvalidIdToken(Exception):
+    pass
+
+
+class SigningKeys:
+    # Googleの公開鍵をキャッシュし、期限前にバックグラウンドで更新する
+
+    def __init__(self, url: str = CERTS_URL) -> None:
+        self.url = url
+        self.certs: Dict[str, str] = {}
+        self.expires_at = 0.0
+        self.fetched_at = 0.0
+        self._lock = threading.Lock()
+        # 同時に期限切れに気付いたリクエストから取得が重ならないようにする
+        self._fetch_lock = threading.Lock()
+        self._timer: Optional[threading.Timer] = None
+
+    def install(self, certs: Dict[str, str], max_age: float) -> None:
+        now = time.time()
+        with self._lock:
+            self.certs = dict(certs)
+            self.fetched_at = now
+            self.expires_at = now + max_age
+
+    def fetch(self) -> None:
+        with span("auth.fetch_certs"):
+            response = clients.get_http_session().get(self.url, timeout=10)
+            response.raise_for_status()
+        match = _MAX_AGE_PATTERN.search(response.headers.get("Cache-Control", ""))
+        max_age = int(match.group(1)) if match else DEFAULT_MAX_AGE
+        self.install(response.json(), max_age)
+        logger.info("Fetched %d Firebase signing keys (max-age %ds)", len(self.certs), max_age)
+
+    def _refresh_in_background(self) -> None:
+        try:
+            self.fetch()
+            delay = max(RETRY_SECONDS, self.expires_at - time.time() - REFRESH_MARGIN_SECONDS)
+        except Exception as e:
+            logger.warning("Failed to refresh Firebase signing keys: %s", e)
+            delay = RETRY_SECONDS
+        self.schedule_refresh(delay)
+
+    def schedule_refresh(self, delay: float) -> None:
+        timer = threading.Timer(delay, self._refresh_in_background)
+        timer.daemon = True
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+            self._timer = timer
+        timer.start()
+
+    def start(self) -> None:
+        # 起動時に1回取得し、以降は期限前に更新する
+        self.fetch()
+        self.schedule_refresh(
+            max(RETRY_SECONDS, self.expires_at - time.time() - REFRESH_MARGIN_SECONDS)
+        )
+
+    def _needs_fetch(self, kid: str) -> bool:
+        now = time.time()
+        # バックグラウンドの更新が間に合わなかった場合と、
+        # 鍵のローテーション直後で未知のkidが来た場合はその場で取り直す
+        return now >= self.expires_at or (
+            kid not in self.certs and now - self.fetched_at > UNKNOWN_KID_REFRESH_SECONDS
+        )
+
+    def get(self, kid: str) -> Dict[str, str]:
+        # 取得はブロックするため、イベントループからは直接呼ばない (verify_id_token_async)
+        if self._needs_fetch(kid):
+            with self._fetch_lock:
+                if self._needs_fetch(kid):
+                    self.fetch()
+        return self.certs
+
+
+_keys = SigningKeys()
+_memo: "OrderedDict[str, Tuple[Dict[str, Any], float]]" = OrderedDict()
+_memo_lock = threading.Lock()
+_project_id: Optional[str] = None
+
+
+def get_signing_keys() -> SigningKeys:
+    return _keys
+
+
+def get_project_id() -> str:
+    global _project_id
+    if _project_id is None:
+        project_id = os.getenv("FIREBASE_PROJECT_ID") or os.getenv("GOOGLE_CLOUD_PROJECT")
+        if not project_id:
+            with open(clients.SERVICE_ACCOUNT_PATH, encoding="utf-8") as f:
+                project_id = json.load(f)["project_id"]
+        _project_id = project_id
+    return _project_id
+
+
+def _remember(token: str, claims: Dict[str, Any]) -> None:
+    with _memo_lock:
+        _memo[token] = (claims, float(claims["exp"]))
+        while len(_memo) > MEMO_SIZE:
+            _memo.popitem(last=False)
+
+
+def _decode(token: str) -> Dict[str, Any]:
+    # Third Party Library
+    from google.auth import jwt  # type: ignore
+
+    try:
+        header = jwt.decode_header(token)
+    except (ValueError, TypeError) as e:
+        raise InvalidIdToken(f"Malformed token: {e}")
+    if header.get("alg") != "RS256":
+        raise InvalidIdToken("Unexpected signing algorithm")
+    kid = header.get("kid")
+    certs = _keys.get(kid or "")
+    if kid not in certs:
+        raise InvalidIdToken("Unknown signing key")
+
+    project_id = get_project_id()
+    try:
+        claims: Dict[str, Any] = jwt.decode(
+            token,
+            certs=certs,
+            audience=project_id,
+            clock_skew_in_seconds=CLOCK_SKEW_SECONDS,
+        )
+    except ValueError as e:
+        raise InvalidIdToken(str(e))
+
+    if claims.get("iss") != ISSUER_PREFIX + project_id:
+        raise InvalidIdToken("Unexpected issuer")
+    if not claims.get("sub") or len(claims["sub"]) > 128:
+        raise InvalidIdToken("Missing subject")
+    if claims.get("auth_time", 0) > time.time() + CLOCK_SKEW_SECONDS:
+        raise InvalidIdToken("auth_time is in the future")
+    claims["uid"] = claims["sub"]
+    return claims
+
+
+def _memoized(token: str) -> Optional[Dict[str, Any]]:
+    with _memo_lock:
+        cached = _memo.get(token)
+        if cached is not None:
+            _memo.move_to_end(token)
+    if cached is None:
+        return None
+    claims, expires_at = cached
+    if time.time() < expires_at + CLOCK_SKEW_SECONDS:
+        increment("id_token_verifications_total", 1.0, (("result", "memoized"),))
+        return claims
+    with _memo_lock:
+        _memo.pop(token, None)
+    return None
+
+
+def verify_id_token(token: str) -> Dict[str, Any]:
+    """Firebase IDトークンを検証してクレームを返す (不正な場合は InvalidIdToken)"""
+    claims = _memoized(token)
+    if claims is not None:
+        return claims
+
+    try:
+        claims = _decode(token)
+    except InvalidIdToken:
+        increment("id_token_verifications_total", 1.0, (("result", "invalid"),))
+        raise
+    increment("id_token_verifications_total", 1.0, (("result", "verified"),))
+    _remember(token, claims)
+    return claims
+
+
+async def verify_id_token_async(token: str) -> Dict[str, Any]:
+    """verify_id_token と同じ。メモ化されていなければスレッドで検証し、イベントループを止めない"""
+    claims = _memoized(token)
+    if claims is not None:
+        return claims
+    return await asyncio.to_thread(verify_id_token, token)
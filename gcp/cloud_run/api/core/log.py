@@ -0,0 +1,82 @@
+# APIとジョブのロギング設定 (main.py と各ジョブの main で1回だけ呼び出す)
+#
+# - Cloud Loggingが解釈できるJSON (severity / message) を1行ずつ標準出力に書く
+# - ロガーには遅延評価の%形式で渡す: logger.info("Saved store %s", store_id)
+#   extraで渡したキーはJSONのフィールドになる: logger.info("...", extra={"storeId": ...})
+# - LOG_LEVEL: ルートのレベル (既定 INFO)
+# - LOG_LEVELS: ロガー別のレベル 例) "api.cruds=WARNING,api.core.gemini=DEBUG"
+# - LOG_INFO_SAMPLE_RATE: INFO以下のログを出力する割合 (既定 1.0、WARNING以上は常に出力)
+# Standard Library
+import json
+import logging
+import os
+import random
+import sys
+from datetime import datetime, timezone
+from typing import Any, Dict, Optional
+
+# LogRecordの標準属性 (これ以外はextraで渡されたフィールドとして出力する)
+_RESERVED_ATTRS = frozenset(
+    vars(logging.LogRecord("", logging.INFO, "", 0, "", None, None)).keys()
+) | {"message", "asctime", "taskName"}
+
+_configured = False
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        payload: Dict[str, Any] = {
+            "severity": record.levelname,
+            "message": record.getMessage(),
+            "logger": record.name,
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RESERVED_ATTRS:
+                payload[key] = value
+        if record.exc_info:
+            payload["exception"] = self.formatException(record.exc_info)
+        return json.dumps(payload, ensure_ascii=False, default=str)
+
+
+class InfoSamplingFilter(logging.Filter):
+    # 大量に出るINFO以下のログを間引く (WARNING以上は間引かない)
+
+    def __init__(self, rate: float) -> None:
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        return record.levelno >= logging.WARNING or random.random() < self.rate
+
+
+def parse_levels(spec: str) -> Dict[str, str]:
+    levels = {}
+    for item in spec.split(","):
+        name, _, level = item.partition("=")
+        if name.strip() and level.strip():
+            levels[name.strip()] = level.strip().upper()
+    return levels
+
+
+def setup_logging(stream: Optional[Any] = None, force: bool = False) -> None:
+    global _configured
+    if _configured and not force:
+        return
+
+    handler = logging.StreamHandler(stream or sys.stdout)
+    handler.setFormatter(JsonFormatter())
+    sample_rate = float(os.getenv("LOG_INFO_SAMPLE_RATE", "1.0"))
+    if sample_rate < 1.0:
+        handler.addFilter(InfoSamplingFilter(sample_rate))
+
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    root.setLevel(os.getenv("LOG_LEVEL", "INFO").upper())
+
+    for name, level in parse_levels(os.getenv("LOG_LEVELS", "")).items():
+        logging.getLogger(name).setLevel(level)
+
+    _configured = True
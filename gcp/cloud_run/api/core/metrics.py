@@ -0,0 +1,207 @@
+# Standard Library
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+Labels = Tuple[Tuple[str, str], ...]
+
+# 外部API呼び出しを想定したレイテンシのバケット (秒)
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+UPSTREAM_DURATION = "upstream_call_duration_seconds"
+UPSTREAM_ERRORS = "upstream_call_errors_total"
+
+_DESCRIPTIONS: Dict[str, Tuple[str, str]] = {
+    UPSTREAM_DURATION: ("histogram", "Latency of upstream calls by stage."),
+    UPSTREAM_ERRORS: ("counter", "Upstream calls that raised, by stage."),
+    "http_request_duration_seconds": ("histogram", "Latency of API requests by route."),
+    "cache_hits_total": ("counter", "Cache hits by cache name."),
+    "cache_misses_total": ("counter", "Cache misses by cache name."),
+    "upstream_calls_in_flight": ("gauge", "Upstream calls currently in progress."),
+}
+
+
+class Histogram:
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> None:
+        self.buckets = buckets
+        # 最後の要素は +Inf
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+_lock = threading.Lock()
+_histograms: Dict[Tuple[str, Labels], Histogram] = {}
+_counters: Dict[Tuple[str, Labels], float] = {}
+_gauges: Dict[Tuple[str, Labels], float] = {}
+_collectors: List[Callable[[], Iterable[Tuple[str, str, Labels, float]]]] = []
+# 実行中の外部呼び出しの数 (シャットダウン時にこれが0になるまで待つ)
+_in_flight = 0
+
+
+def describe(name: str, kind: str, help_text: str) -> None:
+    _DESCRIPTIONS[name] = (kind, help_text)
+
+
+def observe(name: str, value: float, labels: Labels = ()) -> None:
+    key = (name, labels)
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = Histogram()
+        histogram.observe(value)
+
+
+def increment(name: str, value: float = 1.0, labels: Labels = ()) -> None:
+    key = (name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0.0) + value
+
+
+def set_gauge(name: str, value: float, labels: Labels = ()) -> None:
+    with _lock:
+        _gauges[(name, labels)] = value
+
+
+def register_collector(collector: Callable[[], Iterable[Tuple[str, str, Labels, float]]]) -> None:
+    # 出力時に (種別, 名前, ラベル, 値) を返すコールバック (lru_cacheの統計など)
+    _collectors.append(collector)
+
+
+def upstream_calls_in_flight() -> int:
+    return _in_flight
+
+
+class _TraceExporter:
+    # spanをJSON Linesでローカルファイルに書き出す (TRACE_EXPORT_PATH指定時のみ)
+
+    def __init__(self, path: str) -> None:
+        self._file = open(path, "a", buffering=1, encoding="utf-8")
+        self._lock = threading.Lock()
+
+    def export(self, stage: str, started: float, duration: float, error: Optional[str]) -> None:
+        line = json.dumps(
+            {
+                "stage": stage,
+                "start": started,
+                "durationMs": round(duration * 1e3, 3),
+                "thread": threading.get_ident(),
+                "error": error,
+            }
+        )
+        with self._lock:
+            self._file.write(line + "\n")
+
+
+_TRACE_EXPORT_PATH = os.getenv("TRACE_EXPORT_PATH")
+_exporter: Optional[_TraceExporter] = (
+    _TraceExporter(_TRACE_EXPORT_PATH) if _TRACE_EXPORT_PATH else None
+)
+
+
+class span:
+    """外部呼び出しの所要時間をstage別のヒストグラムに記録する
+
+    with span("places.details"):
+        gmaps.place(...)
+    """
+
+    __slots__ = ("labels", "started")
+
+    def __init__(self, stage: str) -> None:
+        self.labels: Labels = (("stage", stage),)
+        self.started = 0.0
+
+    def __enter__(self) -> "span":
+        global _in_flight
+        with _lock:
+            _in_flight += 1
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type: Any, exc: Any, tb: Any) -> None:
+        global _in_flight
+        duration = time.perf_counter() - self.started
+        # 実行中の数・ヒストグラム・エラー数をまとめて1回のロックで更新する
+        key = (UPSTREAM_DURATION, self.labels)
+        with _lock:
+            _in_flight -= 1
+            histogram = _histograms.get(key)
+            if histogram is None:
+                histogram = _histograms[key] = Histogram()
+            histogram.observe(duration)
+            if exc_type is not None:
+                error_key = (UPSTREAM_ERRORS, self.labels)
+                _counters[error_key] = _counters.get(error_key, 0.0) + 1.0
+        if _exporter is not None:
+            _exporter.export(
+                self.labels[0][1],
+                time.time() - duration,
+                duration,
+                exc_type.__name__ if exc_type is not None else None,
+            )
+
+
+def _escape_label(value: Any) -> str:
+    # テキスト形式ではラベルの値の \ と " と改行をエスケープする
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels: Labels, extra: str = "") -> str:
+    pairs = [f'{key}="{_escape_label(value)}"' for key, value in labels]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def render_prometheus() -> str:
+    # Prometheusのテキスト形式 (version 0.0.4) で出力する
+    with _lock:
+        histograms = [
+            (key, list(histogram.counts), histogram.buckets, histogram.sum, histogram.count)
+            for key, histogram in _histograms.items()
+        ]
+        scalars: List[Tuple[str, str, Labels, float]] = [
+            ("counter", name, labels, value) for (name, labels), value in _counters.items()
+        ] + [("gauge", name, labels, value) for (name, labels), value in _gauges.items()]
+        scalars.append(("gauge", "upstream_calls_in_flight", (), float(_in_flight)))
+    for collector in _collectors:
+        scalars.extend(collector())
+
+    lines: List[str] = []
+    described = set()
+
+    def header(name: str, kind: str) -> None:
+        if name in described:
+            return
+        described.add(name)
+        kind, help_text = _DESCRIPTIONS.get(name, (kind, name))
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+
+    for (name, labels), counts, buckets, total, count in sorted(histograms):
+        header(name, "histogram")
+        cumulative = 0
+        for bound, bucket_count in zip(buckets + (float("inf"),), counts):
+            cumulative += bucket_count
+            le = "+Inf" if bound == float("inf") else repr(bound)
+            bucket_labels = _format_labels(labels, 'le="' + le + '"')
+            lines.append(f"{name}_bucket{bucket_labels} {cumulative}")
+        lines.append(f"{name}_sum{_format_labels(labels)} {total}")
+        lines.append(f"{name}_count{_format_labels(labels)} {count}")
+
+    for kind, name, labels, value in sorted(scalars, key=lambda item: (item[1], item[2])):
+        header(name, kind)
+        lines.append(f"{name}{_format_labels(labels)} {value}")
+
+    return "\n".join(lines) + "\n"
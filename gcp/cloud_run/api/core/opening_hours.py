@@ -0,0 +1,66 @@
+# Standard Library
+from bisect import bisect_right
+from datetime import datetime
+from typing import List, Optional
+from zoneinfo import ZoneInfo
+
+MINUTES_PER_DAY = 24 * 60
+MINUTES_PER_WEEK = 7 * MINUTES_PER_DAY
+
+# Places APIの営業時間は店舗のローカル時刻 (日本国内のみ対象)
+STORE_TIMEZONE = ZoneInfo("Asia/Tokyo")
+
+
+def _to_minute_of_week(day: int, time_str: str) -> int:
+    # Places APIのdayは 0=日曜日 ... 6=土曜日、timeは "HHMM"
+    return day * MINUTES_PER_DAY + int(time_str[:2]) * 60 + int(time_str[2:])
+
+
+def build_opening_intervals(opening_hours: dict) -> Optional[List[int]]:
+    """Places APIのperiodsを週内分 (日曜0:00起点) の区間リストに変換する
+
+    Firestoreは配列の入れ子を保存できないため、[開始, 終了, 開始, 終了, ...] の
+    ソート済み・重複なしのフラットな配列で返す。営業時間が不明な場合はNoneを返す。
+    """
+    if "periods" not in opening_hours:
+        return None
+
+    intervals = []
+    for period in opening_hours["periods"]:
+        start = _to_minute_of_week(period["open"]["day"], period["open"]["time"])
+        if "close" not in period:
+            # closeが無い場合は24時間営業
+            return [0, MINUTES_PER_WEEK]
+
+        end = _to_minute_of_week(period["close"]["day"], period["close"]["time"])
+        if end <= start:
+            # 土曜日から日曜日にまたがる場合は週末で分割
+            intervals.append((start, MINUTES_PER_WEEK))
+            if end > 0:
+                intervals.append((0, end))
+        else:
+            intervals.append((start, end))
+
+    # 隣接・重複する区間をマージ
+    merged: List[List[int]] = []
+    for start, end in sorted(intervals):
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+
+    return [minute for interval in merged for minute in interval]
+
+
+def minute_of_week(at: datetime) -> int:
+    # タイムゾーン無しの日時は店舗のローカル時刻とみなす
+    if at.tzinfo is not None:
+        at = at.astimezone(STORE_TIMEZONE)
+    # datetime.weekday()は 0=月曜日 のため日曜日起点に補正
+    day = (at.weekday() + 1) % 7
+    return day * MINUTES_PER_DAY + at.hour * 60 + at.minute
+
+
+def is_open_at(intervals: List[int], minute: int) -> bool:
+    # 境界値の個数が奇数なら区間 [開始, 終了) の内側にいる
+    return bisect_right(intervals, minute) % 2 == 1
@@ -0,0 +1,201 @@
+# リクエスト単位のCPU/メモリプロファイリング (本番での調査用、既定では無効)
+#
+# 以下のいずれかでプロファイル対象になる
+#   - X-Profile-Token ヘッダが環境変数 PROFILE_TOKEN と一致する
+#   - 環境変数 PROFILE_SAMPLE_RATE (0.0〜1.0) の確率で抽選に当たる
+# CPUはサンプリングスレッドでスタックを定期採取し、メモリはtracemallocの差分を取る。
+# 結果は直近 PROFILE_KEEP 件をメモリに保持し (/debug/profiles)、
+# PROFILE_OUTPUT_DIR が指定されていればJSONファイルにも書き出す。
+# Standard Library
+import json
+import logging
+import os
+import random
+import secrets
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter, OrderedDict
+from datetime import datetime, timezone
+from pathlib import Path
+from types import FrameType
+from typing import Any, Dict, List, Optional
+
+PROFILE_HEADER = "X-Profile-Token"
+PROFILE_TOKEN = os.getenv("PROFILE_TOKEN", "")
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "5"))
+PROFILE_OUTPUT_DIR = os.getenv("PROFILE_OUTPUT_DIR", "")
+PROFILE_KEEP = int(os.getenv("PROFILE_KEEP", "20"))
+TOP_ENTRIES = 30
+# 待機中のスレッド (スレッドプールのワーカーやイベントループのselect) は集計しない
+IDLE_FRAMES = ("threading.py:wait", "selectors.py:select", "queue.py:get")
+
+_profiles: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+_profiles_lock = threading.Lock()
+# tracemallocはプロセス全体で1つのため、同時にプロファイルするリクエストは1件に限る
+_active_lock = threading.Lock()
+
+logger = logging.getLogger(__name__)
+
+
+def is_authorized(token: Optional[str]) -> bool:
+    return (
+        bool(PROFILE_TOKEN) and token is not None and secrets.compare_digest(token, PROFILE_TOKEN)
+    )
+
+
+def should_profile(token: Optional[str]) -> bool:
+    if is_authorized(token):
+        return True
+    return PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE
+
+
+def _collapse(frame: Optional[FrameType]) -> str:
+    # flamegraph.plのcollapsed形式 (呼び出し元;...;呼び出し先)
+    names: List[str] = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{os.path.basename(code.co_filename)}:{code.co_name}:{frame.f_lineno}")
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+class _StackSampler(threading.Thread):
+    # 一定間隔で全スレッドのスタックを採取する統計的プロファイラ
+    # (同時に処理中の他リクエストのスタックも含まれる)
+
+    def __init__(self, interval: float) -> None:
+        super().__init__(name="request-profiler", daemon=True)
+        self.interval = interval
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self._stop_event = threading.Event()
+
+    def run(self) -> None:
+        own_id = threading.get_ident()
+        while not self._stop_event.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = _collapse(frame)
+                if not stack.rsplit(";", 1)[-1].startswith(IDLE_FRAMES):
+                    self.stacks[stack] += 1
+            self.samples += 1
+
+    def stop(self) -> None:
+        self._stop_event.set()
+        self.join()
+
+
+class RequestProfiler:
+    def __init__(self) -> None:
+        self.active = False
+        self.profile_id = ""
+        self._sampler: Optional[_StackSampler] = None
+        self._snapshot: Optional[tracemalloc.Snapshot] = None
+        self._started_tracemalloc = False
+        self._started = 0.0
+        self.result: Dict[str, Any] = {}
+
+    def __enter__(self) -> "RequestProfiler":
+        if not _active_lock.acquire(blocking=False):
+            return self
+        self.active = True
+        self.profile_id = secrets.token_hex(8)
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(10)
+            self._started_tracemalloc = True
+        tracemalloc.reset_peak()
+        self._snapshot = tracemalloc.take_snapshot()
+        self._sampler = _StackSampler(PROFILE_INTERVAL_MS / 1e3)
+        self._started = time.perf_counter()
+        self._sampler.start()
+        return self
+
+    def __exit__(self, exc_type: Any, exc: Any, tb: Any) -> None:
+        if not self.active:
+            return
+        try:
+            duration = time.perf_counter() - self._started
+            assert self._sampler is not None and self._snapshot is not None
+            self._sampler.stop()
+            after = tracemalloc.take_snapshot()
+            _, peak = tracemalloc.get_traced_memory()
+            if self._started_tracemalloc:
+                tracemalloc.stop()
+
+            functions: Counter = Counter()
+            for stack, count in self._sampler.stacks.items():
+                functions[stack.rsplit(";", 1)[-1]] += count
+
+            memory_diff = after.compare_to(self._snapshot, "lineno")
+            self.result = {
+                "id": self.profile_id,
+                "durationMs": round(duration * 1e3, 2),
+                "cpu": {
+                    "intervalMs": PROFILE_INTERVAL_MS,
+                    "samples": self._sampler.samples,
+                    "topStacks": [
+                        {"stack": stack, "count": count}
+                        for stack, count in self._sampler.stacks.most_common(TOP_ENTRIES)
+                    ],
+                    "topFunctions": [
+                        {"function": function, "count": count}
+                        for function, count in functions.most_common(TOP_ENTRIES)
+                    ],
+                },
+                "memory": {
+                    "peakBytes": peak,
+                    "topAllocations": [
+                        {
+                            "location": str(stat.traceback[0]),
+                            "sizeDiffBytes": stat.size_diff,
+                            "countDiff": stat.count_diff,
+                        }
+                        for stat in memory_diff[:TOP_ENTRIES]
+                    ],
+                },
+            }
+        finally:
+            _active_lock.release()
+
+    def save(self, route: str, method: str, user_id: Optional[str]) -> None:
+        if not self.result:
+            return
+        self.result.update(
+            {
+                "route": route,
+                "method": method,
+                "userId": user_id,
+                "capturedAt": datetime.now(timezone.utc).isoformat(),
+            }
+        )
+        with _profiles_lock:
+            _profiles[self.profile_id] = self.result
+            while len(_profiles) > PROFILE_KEEP:
+                _profiles.popitem(last=False)
+
+        if PROFILE_OUTPUT_DIR:
+            output_dir = Path(PROFILE_OUTPUT_DIR)
+            output_dir.mkdir(parents=True, exist_ok=True)
+            filename = f"{int(time.time())}_{route.strip('/').replace('/', '_')}_{self.profile_id}"
+            (output_dir / f"{filename}.json").write_text(json.dumps(self.result, indent=2))
+        logger.info("Captured profile %s for %s %s", self.profile_id, method, route)
+
+
+def list_profiles() -> List[Dict[str, Any]]:
+    with _profiles_lock:
+        return [
+            {
+                key: profile[key]
+                for key in ("id", "route", "method", "userId", "capturedAt", "durationMs")
+            }
+            for profile in reversed(_profiles.values())
+        ]
+
+
+def get_profile(profile_id: str) -> Optional[Dict[str, Any]]:
+    with _profiles_lock:
+        return _profiles.get(profile_id)
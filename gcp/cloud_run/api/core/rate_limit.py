@@ -0,0 +1,197 @@
+# 外部API (Places / Gemini) の呼び出しペースをプロセス全体で制御するトークンバケット
+#
+# - 呼び出し前にトークンを予約し、足りなければ待ってから呼ぶ (失敗させずにペースを落とす)
+# - 上流がスロットリング (OVER_QUERY_LIMIT / 429 / ResourceExhausted) を返したら
+#   ジッタ付きの指数バックオフで再試行し、レートを半分に下げる。成功が続けば設定値まで戻す
+# - 待ち時間が RATE_LIMIT_MAX_WAIT 秒を超える、または再試行し尽くした場合は
+#   500ではなく503とRetry-Afterを返す
+#
+# レートはプロセスごとで、RATE_LIMITS で指定した上流だけペースを制御する (QPS, バースト)
+#   例) "places=10,20;places_photo=5,10;gemini=5,10"
+#   (places_photo は店舗写真のダウンロード。指定の無い上流はスロットリング時のバックオフだけ行う)
+# Standard Library
+import logging
+import math
+import os
+import random
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, Optional, Tuple, TypeVar
+
+# Third Party Library
+from fastapi import HTTPException  # type: ignore
+
+# First Party Library
+from api.core.metrics import Labels, describe, increment, observe, register_collector, span
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+MAX_WAIT = float(os.getenv("RATE_LIMIT_MAX_WAIT", "10"))
+MAX_RETRIES = int(os.getenv("RATE_LIMIT_MAX_RETRIES", "3"))
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 8.0
+# スロットリング後に下げるレートの下限 (設定値に対する割合) と、成功1回あたりの回復量
+MIN_RATE_RATIO = 0.1
+RECOVERY_RATIO = 0.05
+
+# スロットリングを表す例外 (重いライブラリをimportしないよう名前で判定する)
+THROTTLE_EXCEPTIONS = frozenset({"_OverQueryLimit", "ResourceExhausted", "TooManyRequests"})
+
+describe("rate_limit_wait_seconds", "histogram", "Time callers waited for an upstream token.")
+describe("rate_limit_throttled_total", "counter", "Throttling responses from upstreams.")
+describe("rate_limit_rejected_total", "counter", "Calls rejected after waiting or retrying.")
+describe("rate_limit_qps", "gauge", "Current pacing rate per upstream.")
+
+
+def is_throttled(error: BaseException) -> bool:
+    if type(error).__name__ in THROTTLE_EXCEPTIONS:
+        return True
+    if getattr(error, "status", None) == "OVER_QUERY_LIMIT":
+        return True
+    response = getattr(error, "response", None)
+    return getattr(response, "status_code", None) == 429 or getattr(error, "code", None) == 429
+
+
+class TokenBucket:
+    def __init__(self, name: str, qps: Optional[float] = None, burst: float = 1.0) -> None:
+        # qpsがNoneならペースは制御せず、スロットリング後のバックオフだけ行う
+        self.name = name
+        self.limited = qps is not None
+        self.max_qps = qps or 0.0
+        self.qps = self.max_qps
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        # スロットリング後、この時刻まではトークンを出さない
+        self.paused_until = 0.0
+        self.throttle_streak = 0
+        self.labels: Labels = (("upstream", name),)
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.qps)
+        self.updated = now
+
+    def reserve(self) -> float:
+        # トークンを1つ予約し、呼び出し可能になるまでの待ち時間 (秒) を返す
+        with self._lock:
+            now = time.monotonic()
+            if not self.limited:
+                return max(0.0, self.paused_until - now)
+            self._refill(now)
+            self.tokens -= 1
+            wait = max(0.0, -self.tokens / self.qps, self.paused_until - now)
+            if wait > MAX_WAIT:
+                self.tokens += 1
+        return wait
+
+    def acquire(self) -> None:
+        wait = self.reserve()
+        if wait > MAX_WAIT:
+            increment("rate_limit_rejected_total", 1.0, self.labels + (("reason", "wait"),))
+            raise HTTPException(
+                status_code=503,
+                detail=f"{self.name} quota exhausted",
+                headers={"Retry-After": str(math.ceil(wait))},
+            )
+        observe("rate_limit_wait_seconds", wait, self.labels)
+        if wait > 0:
+            time.sleep(wait)
+
+    def on_success(self) -> None:
+        if not self.limited:
+            with self._lock:
+                self.throttle_streak = 0
+            return
+        with self._lock:
+            self.throttle_streak = 0
+            if self.qps < self.max_qps:
+                self.qps = min(self.max_qps, self.qps + self.max_qps * RECOVERY_RATIO)
+
+    def on_throttle(self) -> float:
+        # レートを半分に下げ、ジッタ付きの指数バックオフの間は呼び出しを止める
+        with self._lock:
+            self.throttle_streak += 1
+            if self.limited:
+                self.qps = max(self.max_qps * MIN_RATE_RATIO, self.qps / 2)
+            backoff = min(BACKOFF_MAX, BACKOFF_BASE * 2 ** (self.throttle_streak - 1))
+            backoff = random.uniform(backoff / 2, backoff)
+            self.paused_until = max(self.paused_until, time.monotonic() + backoff)
+        increment("rate_limit_throttled_total", 1.0, self.labels)
+        logger.warning(
+            "%s throttled, backing off %.2fs at %s qps",
+            self.name,
+            backoff,
+            f"{self.qps:.1f}" if self.limited else "unlimited",
+            extra={"upstream": self.name},
+        )
+        return backoff
+
+
+def parse_limits(spec: str) -> Dict[str, Tuple[float, float]]:
+    limits = {}
+    for item in spec.split(";"):
+        name, _, values = item.partition("=")
+        if not name.strip() or not values.strip():
+            continue
+        qps, burst = values.split(",")
+        limits[name.strip()] = (float(qps), float(burst))
+    return limits
+
+
+_limits = parse_limits(os.getenv("RATE_LIMITS", ""))
+_buckets: Dict[str, TokenBucket] = {}
+_buckets_lock = threading.Lock()
+
+
+def get_bucket(upstream: str) -> TokenBucket:
+    bucket = _buckets.get(upstream)
+    if bucket is None:
+        with _buckets_lock:
+            bucket = _buckets.get(upstream)
+            if bucket is None:
+                bucket = _buckets[upstream] = TokenBucket(
+                    upstream, *_limits.get(upstream, (None, 1.0))
+                )
+    return bucket
+
+
+def _collect() -> Iterable[Tuple[str, str, Labels, float]]:
+    for bucket in list(_buckets.values()):
+        if bucket.limited:
+            yield "gauge", "rate_limit_qps", bucket.labels, bucket.qps
+
+
+register_collector(_collect)
+
+
+def governed(upstream: str, stage: str, func: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    """upstreamのレートに合わせて func を呼び出す (スロットリング時は待ってから再試行する)
+
+    details = governed("places", "places.details", gmaps.place, place_id=place_id)
+    """
+    bucket = get_bucket(upstream)
+    for attempt in range(MAX_RETRIES + 1):
+        bucket.acquire()
+        try:
+            with span(stage):
+                result = func(*args, **kwargs)
+        except Exception as e:
+            if not is_throttled(e):
+                raise
+            backoff = bucket.on_throttle()
+            if attempt == MAX_RETRIES:
+                increment(
+                    "rate_limit_rejected_total", 1.0, bucket.labels + (("reason", "retries"),)
+                )
+                raise HTTPException(
+                    status_code=503,
+                    detail=f"{upstream} quota exhausted",
+                    headers={"Retry-After": str(math.ceil(backoff))},
+                )
+            continue
+        bucket.on_success()
+        return result
+    raise AssertionError("unreachable")
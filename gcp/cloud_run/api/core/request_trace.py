@@ -0,0 +1,216 @@
+# 負荷試験の再生用に、実際のリクエストの形をローカルファイルへ記録する (既定では無効)
+#
+# - REQUEST_TRACE_DIR を指定すると、1リクエスト1行のJSONを trace-<pid>-<時刻>.jsonl に書く
+#   (REQUEST_TRACE_MAX_FILE_MB を超えたら次のファイルに切り替える)。再生は bench/replay.py
+# - 記録するのはルート・到着時刻・所要時間・ステータス・リクエスト/レスポンスのバイト数・座標・本文の形だけ
+#     - 写真 (base64) はバイト数と内容のハッシュだけ残す (同じ写真の再送がわかる)
+#     - ユーザーID・写真IDなどは鍵付きハッシュ (REQUEST_TRACE_SALT) に置き換える
+#       (同じ値は同じハッシュになり、ユーザーごとの連続したリクエストや再試行がわかる)
+#     - 検索語などの自由入力は文字数だけ残す。座標は REQUEST_TRACE_COORD_DECIMALS 桁 (既定3桁、約100m) に
+#       丸める (5桁 (約1m) では自宅などの位置から個人を特定できる)
+#     - ヘッダ (IDトークン) とレスポンスの本文は記録しない
+# - REQUEST_TRACE_SAMPLE_RATE の割合のユーザーを記録する (ユーザー単位で抽選し、一連の操作を残す)
+# - 書き込みは専用のスレッドで行う。キューが溢れた分は捨てる (request_trace_dropped_total)
+# Standard Library
+import hashlib
+import hmac
+import json
+import logging
+import os
+import queue
+import secrets
+import threading
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Dict, Optional, TextIO
+
+# First Party Library
+from api.core.metrics import describe, increment
+
+logger = logging.getLogger(__name__)
+
+TRACE_DIR = os.getenv("REQUEST_TRACE_DIR", "")
+TRACE_SAMPLE_RATE = float(os.getenv("REQUEST_TRACE_SAMPLE_RATE", "1.0"))
+# 未指定の場合はプロセスごとの乱数 (複数インスタンスの記録をまとめる場合は同じ値を指定する)
+TRACE_SALT = os.getenv("REQUEST_TRACE_SALT", "") or secrets.token_hex(16)
+TRACE_MAX_FILE_BYTES = int(float(os.getenv("REQUEST_TRACE_MAX_FILE_MB", "64")) * 2**20)
+TRACE_COORD_DECIMALS = int(os.getenv("REQUEST_TRACE_COORD_DECIMALS", "3"))
+TRACE_MAX_PENDING = 10000
+# 記録しないパス (監視・デバッグ用)
+SKIP_PATHS = ("/metrics", "/readyz", "/debug")
+
+# 本文・クエリのフィールドごとの扱い (ここに無い文字列は文字数だけ残す)
+ID_FIELDS = frozenset({"userId", "photo_id", "photoId", "storeId", "cursor"})
+COORD_FIELDS = frozenset({"lat", "lon"})
+PHOTO_FIELDS = frozenset({"photo"})
+KEEP_FIELDS = frozenset({"returnStores", "fields", "category", "pageSize", "limit", "at"})
+
+describe("request_trace_records_total", "counter", "Request trace records written.")
+describe("request_trace_dropped_total", "counter", "Request trace records dropped.")
+
+
+def pseudonym(value: Any) -> str:
+    digest = hmac.new(TRACE_SALT.encode(), str(value).encode(), hashlib.sha256).hexdigest()
+    return digest[:16]
+
+
+def is_traced_path(path: str) -> bool:
+    return bool(TRACE_DIR) and not path.startswith(SKIP_PATHS)
+
+
+def should_trace(user_id: Optional[str]) -> bool:
+    if TRACE_SAMPLE_RATE >= 1.0:
+        return True
+    if user_id is None:
+        return secrets.randbelow(10**6) < TRACE_SAMPLE_RATE * 10**6
+    # 同じユーザーは常に同じ判定になる
+    return int(pseudonym(user_id)[:8], 16) < TRACE_SAMPLE_RATE * 16**8
+
+
+def sanitize_value(key: str, value: Any) -> Any:
+    if value is None or isinstance(value, bool):
+        return value
+    if key in COORD_FIELDS and isinstance(value, (int, float)):
+        return round(float(value), TRACE_COORD_DECIMALS)
+    if key in ID_FIELDS:
+        return f"id:{pseudonym(value)}"
+    if key in PHOTO_FIELDS and isinstance(value, str):
+        # base64をデコードせずに元のバイト数を求める
+        size = len(value) * 3 // 4 - value[-2:].count("=")
+        return {"sha": pseudonym(value), "bytes": size}
+    if key in KEEP_FIELDS or isinstance(value, (int, float)):
+        return value
+    if isinstance(value, str):
+        return f"text:{len(value)}"
+    if isinstance(value, list):
+        return [sanitize_value(key, item) for item in value]
+    if isinstance(value, dict):
+        return sanitize(value)
+    return None
+
+
+def sanitize(fields: Dict[str, Any]) -> Dict[str, Any]:
+    return {key: sanitize_value(key, value) for key, value in fields.items()}
+
+
+def parse_body(body: bytes) -> Optional[Dict[str, Any]]:
+    if not body:
+        return None
+    try:
+        parsed = json.loads(body)
+    except ValueError:
+        return None
+    return parsed if isinstance(parsed, dict) else None
+
+
+class TraceRecorder:
+    def __init__(self, directory: str, max_file_bytes: int = TRACE_MAX_FILE_BYTES) -> None:
+        self.directory = Path(directory)
+        self.max_file_bytes = max_file_bytes
+        self._queue: "queue.Queue[Optional[Dict[str, Any]]]" = queue.Queue(TRACE_MAX_PENDING)
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self._file: Optional[TextIO] = None
+        self._written = 0
+
+    def record(self, entry: Dict[str, Any]) -> None:
+        self._ensure_thread()
+        try:
+            self._queue.put_nowait(entry)
+        except queue.Full:
+            increment("request_trace_dropped_total")
+
+    def _ensure_thread(self) -> None:
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="request-trace", daemon=True)
+                self._thread.start()
+
+    def _open(self) -> TextIO:
+        self.directory.mkdir(parents=True, exist_ok=True)
+        started = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S%f")
+        path = self.directory / f"trace-{os.getpid()}-{started}.jsonl"
+        logger.info("Writing request traces to %s", path)
+        self._written = 0
+        return open(path, "a", encoding="utf-8")
+
+    def _run(self) -> None:
+        while True:
+            entry = self._queue.get()
+            if entry is None:
+                break
+            line = json.dumps(entry, ensure_ascii=False, separators=(",", ":")) + "\n"
+            try:
+                if self._file is None or self._written >= self.max_file_bytes:
+                    if self._file is not None:
+                        self._file.close()
+                    self._file = self._open()
+                self._file.write(line)
+                self._written += len(line)
+                if self._queue.empty():
+                    self._file.flush()
+                increment("request_trace_records_total")
+            except OSError as e:
+                increment("request_trace_dropped_total")
+                logger.warning("Failed to write a request trace: %s", e)
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def close(self) -> None:
+        # キューに残った記録を書いてから閉じる (シャットダウン時に呼ぶ)
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            self._queue.put(None)
+            thread.join()
+
+
+_recorder: Optional[TraceRecorder] = None
+_recorder_lock = threading.Lock()
+
+
+def get_trace_recorder() -> TraceRecorder:
+    global _recorder
+    if _recorder is None:
+        with _recorder_lock:
+            if _recorder is None:
+                _recorder = TraceRecorder(TRACE_DIR)
+    return _recorder
+
+
+def close_trace_recorder() -> None:
+    if _recorder is not None:
+        _recorder.close()
+
+
+def build_entry(
+    method: str,
+    route: str,
+    status: int,
+    started: float,
+    duration: float,
+    request_bytes: int,
+    response_bytes: int,
+    body: Optional[Dict[str, Any]],
+    query: Dict[str, str],
+) -> Dict[str, Any]:
+    user_id = (body or {}).get("userId") or query.get("userId")
+    entry: Dict[str, Any] = {
+        "time": datetime.fromtimestamp(started, timezone.utc).isoformat(),
+        "t": round(started, 6),
+        "method": method,
+        "route": route,
+        "status": status,
+        "durationMs": round(duration * 1e3, 3),
+        "requestBytes": request_bytes,
+        "responseBytes": response_bytes,
+        "user": pseudonym(user_id) if user_id else None,
+    }
+    if body is not None:
+        entry["body"] = sanitize(body)
+    if query:
+        entry["query"] = sanitize(query)
+    return entry
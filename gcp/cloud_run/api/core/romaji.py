@@ -0,0 +1,178 @@
+# Standard Library
+import threading
+from functools import lru_cache
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# First Party Library
+from api.core.metrics import Labels, register_collector
+
+# 辞書に無い仮名部分のフォールバック (ヘボン式)
+KANA_ROMAJI = {
+    "あ": "a", "い": "i", "う": "u", "え": "e", "お": "o",
+    "か": "ka", "き": "ki", "く": "ku", "け": "ke", "こ": "ko",
+    "さ": "sa", "し": "shi", "す": "su", "せ": "se", "そ": "so",
+    "た": "ta", "ち": "chi", "つ": "tsu", "て": "te", "と": "to",
+    "な": "na", "に": "ni", "ぬ": "nu", "ね": "ne", "の": "no",
+    "は": "ha", "ひ": "hi", "ふ": "fu", "へ": "he", "ほ": "ho",
+    "ま": "ma", "み": "mi", "む": "mu", "め": "me", "も": "mo",
+    "や": "ya", "ゆ": "yu", "よ": "yo",
+    "ら": "ra", "り": "ri", "る": "ru", "れ": "re", "ろ": "ro",
+    "わ": "wa", "ゐ": "i", "ゑ": "e", "を": "o", "ん": "n",
+    "が": "ga", "ぎ": "gi", "ぐ": "gu", "げ": "ge", "ご": "go",
+    "ざ": "za", "じ": "ji", "ず": "zu", "ぜ": "ze", "ぞ": "zo",
+    "だ": "da", "ぢ": "ji", "づ": "zu", "で": "de", "ど": "do",
+    "ば": "ba", "び": "bi", "ぶ": "bu", "べ": "be", "ぼ": "bo",
+    "ぱ": "pa", "ぴ": "pi", "ぷ": "pu", "ぺ": "pe", "ぽ": "po",
+    "ぁ": "a", "ぃ": "i", "ぅ": "u", "ぇ": "e", "ぉ": "o", "ゔ": "vu",
+    "きゃ": "kya", "きゅ": "kyu", "きょ": "kyo",
+    "しゃ": "sha", "しゅ": "shu", "しょ": "sho",
+    "ちゃ": "cha", "ちゅ": "chu", "ちょ": "cho",
+    "にゃ": "nya", "にゅ": "nyu", "にょ": "nyo",
+    "ひゃ": "hya", "ひゅ": "hyu", "ひょ": "hyo",
+    "みゃ": "mya", "みゅ": "myu", "みょ": "myo",
+    "りゃ": "rya", "りゅ": "ryu", "りょ": "ryo",
+    "ぎゃ": "gya", "ぎゅ": "gyu", "ぎょ": "gyo",
+    "じゃ": "ja", "じゅ": "ju", "じょ": "jo",
+    "びゃ": "bya", "びゅ": "byu", "びょ": "byo",
+    "ぴゃ": "pya", "ぴゅ": "pyu", "ぴょ": "pyo",
+}  # fmt: skip
+
+# 区切り文字と、変換済みの地名の直後では落とす行政区画の接尾辞
+SEPARATORS = frozenset(" 　・-")
+ADMIN_SUFFIXES = frozenset("都道府県市区町村郡")
+
+# 片仮名は平仮名に寄せてから変換する
+_KATAKANA_TO_HIRAGANA = {code: code - 0x60 for code in range(ord("ァ"), ord("ヶ") + 1)}
+
+
+def _is_kana(char: str) -> bool:
+    return "ぁ" <= char <= "ゖ" or "ァ" <= char <= "ヺ" or char == "ー"
+
+
+def kana_to_romaji(kana: str) -> str:
+    hiragana = kana.translate(_KATAKANA_TO_HIRAGANA)
+    romaji: List[str] = []
+    i = 0
+    double_next = False
+    while i < len(hiragana):
+        char = hiragana[i]
+        if char == "っ":
+            double_next = True
+            i += 1
+            continue
+        if char == "ー":
+            # 長音は表記しない (辞書側の "Tokyo" などと揃える)
+            i += 1
+            continue
+        syllable = KANA_ROMAJI.get(hiragana[i : i + 2]) or KANA_ROMAJI.get(char, "")
+        i += 2 if hiragana[i : i + 2] in KANA_ROMAJI else 1
+        if double_next and syllable:
+            syllable = ("t" if syllable.startswith("ch") else syllable[0]) + syllable
+        double_next = False
+        romaji.append(syllable)
+    return "".join(romaji)
+
+
+class RomajiTrie:
+    # 地名辞書の最長一致分解用トライ
+    # ノードは {文字: 子ノード} のdictで、値は "" キーに持つ (地名に空文字は現れない)
+
+    def __init__(self, entries: Dict[str, str]) -> None:
+        self.root: dict = {}
+        for key, value in entries.items():
+            node = self.root
+            for char in key:
+                node = node.setdefault(char, {})
+            node[""] = value
+
+    def prefixes(self, text: str, start: int) -> List[Tuple[int, str]]:
+        # text[start:]の先頭に一致する辞書語を (終了位置, ローマ字) で長い順に返す
+        matches: List[Tuple[int, str]] = []
+        node = self.root
+        for end in range(start, len(text)):
+            next_node = node.get(text[end])
+            if next_node is None:
+                break
+            node = next_node
+            if "" in node:
+                matches.append((end + 1, node[""]))
+        matches.reverse()
+        return matches
+
+
+class RomajiConverter:
+    def __init__(self, entries: Dict[str, str]) -> None:
+        self.entries = entries
+        self.trie = RomajiTrie(entries)
+
+    def decompose(self, text: str, start: int = 0) -> Optional[List[str]]:
+        # 文字列全体を辞書語・仮名・接尾辞で被覆できた場合のみ分解結果を返す
+        if start == len(text):
+            return []
+
+        char = text[start]
+        if char in SEPARATORS:
+            return self.decompose(text, start + 1)
+
+        for end, romaji in self.trie.prefixes(text, start):
+            rest = self.decompose(text, end)
+            if rest is not None:
+                return [romaji] + rest
+
+        if _is_kana(char):
+            end = start
+            while end < len(text) and _is_kana(text[end]):
+                end += 1
+            rest = self.decompose(text, end)
+            if rest is not None:
+                return [kana_to_romaji(text[start:end]).capitalize()] + rest
+
+        if char in ADMIN_SUFFIXES and start > 0:
+            return self.decompose(text, start + 1)
+
+        # 辞書に無い漢字が含まれる場合は分解しない
+        return None
+
+    def convert(self, text: str) -> str:
+        romaji = self.entries.get(text)
+        if romaji is not None:
+            return romaji
+        segments = self.decompose(text)
+        if not segments:
+            return text
+        return " ".join(segments)
+
+
+_converter: Optional[RomajiConverter] = None
+_converter_lock = threading.Lock()
+
+
+def get_converter() -> RomajiConverter:
+    # 辞書とトライは初回利用時に構築する
+    global _converter
+    if _converter is None:
+        with _converter_lock:
+            if _converter is None:
+                # First Party Library
+                from api.core.romaji_conversion_dict import romaji_conversion_dict
+                from api.core.romaji_ward_dict import romaji_ward_dict
+
+                _converter = RomajiConverter({**romaji_ward_dict, **romaji_conversion_dict})
+    return _converter
+
+
+@lru_cache(maxsize=4096)
+def convert_to_romaji(text: str) -> str:
+    return get_converter().convert(text)
+
+
+def _collect_cache_metrics() -> Iterable[Tuple[str, str, Labels, float]]:
+    cache_info = convert_to_romaji.cache_info()
+    labels: Labels = (("cache", "romaji"),)
+    return [
+        ("counter", "cache_hits_total", labels, float(cache_info.hits)),
+        ("counter", "cache_misses_total", labels, float(cache_info.misses)),
+    ]
+
+
+register_collector(_collect_cache_metrics)
@@ -0,0 +1,132 @@
+# romaji_ward_dict.py
+# 政令指定都市の行政区 (romaji_conversion_dictに無いもの)
+# "横浜市中区" のような市区名は romaji.convert_to_romaji で "横浜市" + "中区" に分解される
+romaji_ward_dict = {
+    # 複数の市で共通の区名
+    "中区": "Naka",
+    "東区": "Higashi",
+    "西区": "Nishi",
+    "南区": "Minami",
+    "緑区": "Midori",
+    "青葉区": "Aoba",
+    "泉区": "Izumi",
+    "旭区": "Asahi",
+    "鶴見区": "Tsurumi",
+    # 札幌市
+    "白石区": "Shiroishi",
+    "厚別区": "Atsubetsu",
+    "豊平区": "Toyohira",
+    "清田区": "Kiyota",
+    "手稲区": "Teine",
+    # 仙台市
+    "宮城野区": "Miyagino",
+    "若林区": "Wakabayashi",
+    "太白区": "Taihaku",
+    # さいたま市
+    "大宮区": "Omiya",
+    "見沼区": "Minuma",
+    "桜区": "Sakura",
+    "浦和区": "Urawa",
+    "岩槻区": "Iwatsuki",
+    # 千葉市
+    "花見川区": "Hanamigawa",
+    "稲毛区": "Inage",
+    "若葉区": "Wakaba",
+    "美浜区": "Mihama",
+    # 横浜市
+    "神奈川区": "Kanagawa",
+    "港南区": "Konan",
+    "保土ケ谷区": "Hodogaya",
+    "磯子区": "Isogo",
+    "金沢区": "Kanazawa",
+    "港北区": "Kohoku",
+    "都筑区": "Tsuzuki",
+    "戸塚区": "Totsuka",
+    "栄区": "Sakae",
+    "瀬谷区": "Seya",
+    # 川崎市
+    "川崎区": "Kawasaki",
+    "幸区": "Saiwai",
+    "中原区": "Nakahara",
+    "高津区": "Takatsu",
+    "宮前区": "Miyamae",
+    "多摩区": "Tama",
+    "麻生区": "Asao",
+    # 新潟市
+    "江南区": "Konan",
+    "秋葉区": "Akiha",
+    "西蒲区": "Nishikan",
+    # 静岡市
+    "葵区": "Aoi",
+    "駿河区": "Suruga",
+    "清水区": "Shimizu",
+    # 浜松市
+    "浜名区": "Hamana",
+    "天竜区": "Tenryu",
+    # 名古屋市
+    "千種区": "Chikusa",
+    "中村区": "Nakamura",
+    "昭和区": "Showa",
+    "瑞穂区": "Mizuho",
+    "熱田区": "Atsuta",
+    "中川区": "Nakagawa",
+    "守山区": "Moriyama",
+    "名東区": "Meito",
+    "天白区": "Tempaku",
+    # 京都市
+    "上京区": "Kamigyo",
+    "左京区": "Sakyo",
+    "中京区": "Nakagyo",
+    "東山区": "Higashiyama",
+    "下京区": "Shimogyo",
+    "右京区": "Ukyo",
+    "伏見区": "Fushimi",
+    "山科区": "Yamashina",
+    "西京区": "Nishikyo",
+    # 大阪市
+    "都島区": "Miyakojima",
+    "福島区": "Fukushima",
+    "此花区": "Konohana",
+    "大正区": "Taisho",
+    "天王寺区": "Tennoji",
+    "浪速区": "Naniwa",
+    "西淀川区": "Nishiyodogawa",
+    "東淀川区": "Higashiyodogawa",
+    "東成区": "Higashinari",
+    "生野区": "Ikuno",
+    "城東区": "Joto",
+    "阿倍野区": "Abeno",
+    "住吉区": "Sumiyoshi",
+    "東住吉区": "Higashisumiyoshi",
+    "西成区": "Nishinari",
+    "淀川区": "Yodogawa",
+    "住之江区": "Suminoe",
+    "平野区": "Hirano",
+    # 堺市
+    "堺区": "Sakai",
+    "美原区": "Mihara",
+    # 神戸市
+    "東灘区": "Higashinada",
+    "灘区": "Nada",
+    "兵庫区": "Hyogo",
+    "長田区": "Nagata",
+    "須磨区": "Suma",
+    "垂水区": "Tarumi",
+    # 広島市
+    "安佐南区": "Asaminami",
+    "安佐北区": "Asakita",
+    "安芸区": "Aki",
+    "佐伯区": "Saeki",
+    # 北九州市
+    "門司区": "Moji",
+    "若松区": "Wakamatsu",
+    "戸畑区": "Tobata",
+    "小倉北区": "Kokurakita",
+    "小倉南区": "Kokuraminami",
+    "八幡東区": "Yahatahigashi",
+    "八幡西区": "Yahatanishi",
+    # 福岡市
+    "博多区": "Hakata",
+    "城南区": "Jonan",
+    "早良区": "Sawara",
+}
@@ -0,0 +1,173 @@
+# 起動時のウォームアップと起動時間のレポート
+#
+# 重いライブラリのimportとクライアントの初期化をstartupイベントで並行して行い、
+# モジュール・初期化処理ごとの所要時間を記録する。/readyz はウォームアップ完了まで503を返す
+# (失敗した処理があれば、完了後も errors を返して503のままにする)。
+# STARTUP_BUDGET_MS を超えた場合は警告ログを出す。
+# シャットダウンはCloud Runの猶予 (SIGTERMから10秒でSIGKILL) に収まるよう SHUTDOWN_BUDGET_SECONDS を分け合う:
+#   処理中のリクエストを待つ (api.serve の TIMEOUT_GRACEFUL_SHUTDOWN、既定は残り全部)
+#   → 実行中の外部呼び出しを待つ (SHUTDOWN_DRAIN_SECONDS)
+#   → バッファ中の書き込みとトレースを書き出す (SHUTDOWN_FLUSH_SECONDS、前の段が延びても削らない)
+# Standard Library
+import asyncio
+import functools
+import importlib
+import logging
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+# First Party Library
+from api.core import clients
+from api.core.id_token import get_signing_keys
+from api.core.metrics import upstream_calls_in_flight
+from api.core.romaji import get_converter
+
+logger = logging.getLogger(__name__)
+
+STARTUP_BUDGET_MS = float(os.getenv("STARTUP_BUDGET_MS", "3000"))
+SHUTDOWN_BUDGET_SECONDS = float(os.getenv("SHUTDOWN_BUDGET_SECONDS", "9"))
+SHUTDOWN_DRAIN_SECONDS = float(os.getenv("SHUTDOWN_DRAIN_SECONDS", "2"))
+SHUTDOWN_FLUSH_SECONDS = float(os.getenv("SHUTDOWN_FLUSH_SECONDS", "2"))
+
+# ルートで使われる重いモジュール (起動時に並行してimportしておく)
+WARMUP_MODULES = [
+    "firebase_admin.firestore",
+    "google.cloud.storage",
+    "googlemaps",
+    "google.generativeai",
+    "PIL.Image",
+    "requests",
+]
+
+# (名前, 処理) の順に実行する初期化処理
+WARMUP_STEPS: List[Tuple[str, Callable[[], Any]]] = [
+    ("firebase", clients.initialize_firebase),
+    ("firestore_client", clients.get_firestore_client),
+    ("storage_client", clients.get_storage_client),
+    ("http_session", clients.get_http_session),
+    ("firebase_signing_keys", lambda: get_signing_keys().start()),
+    ("romaji_converter", get_converter),
+]
+
+_report: Dict[str, Any] = {
+    "ready": False,
+    "appImportMs": None,
+    "imports": {},
+    "initialisation": {},
+    "errors": {},
+    "warmupMs": None,
+    "budgetMs": STARTUP_BUDGET_MS,
+}
+
+
+def record_app_import(started: float) -> None:
+    _report["appImportMs"] = round((time.perf_counter() - started) * 1e3, 2)
+
+
+def _timed(section: str, name: str, func: Callable[[], Any]) -> None:
+    started = time.perf_counter()
+    try:
+        func()
+    except Exception as e:
+        _report["errors"][name] = str(e)
+        logger.error("Warm-up step %s failed: %s", name, e)
+    finally:
+        _report[section][name] = round((time.perf_counter() - started) * 1e3, 2)
+
+
+async def warm_up() -> None:
+    started = time.perf_counter()
+    # importはモジュールごとに並行して行う
+    await asyncio.gather(
+        *(
+            asyncio.to_thread(
+                _timed, "imports", module, functools.partial(importlib.import_module, module)
+            )
+            for module in WARMUP_MODULES
+        )
+    )
+    for name, step in WARMUP_STEPS:
+        await asyncio.to_thread(_timed, "initialisation", name, step)
+
+    warmup_ms = round((time.perf_counter() - started) * 1e3, 2)
+    _report["warmupMs"] = warmup_ms
+    _report["ready"] = not _report["errors"]
+
+    total_ms = warmup_ms + (_report["appImportMs"] or 0)
+    if _report["errors"]:
+        logger.error(
+            "Startup finished in %.0fms with failed steps: %s",
+            total_ms,
+            ", ".join(_report["errors"]),
+            extra={"startupReport": _report},
+        )
+    elif total_ms > STARTUP_BUDGET_MS:
+        logger.warning(
+            "Startup took %.0fms, over the %.0fms budget",
+            total_ms,
+            STARTUP_BUDGET_MS,
+            extra={"startupReport": _report},
+        )
+    else:
+        logger.info("Startup finished in %.0fms", total_ms, extra={"startupReport": _report})
+
+
+def is_ready() -> bool:
+    return bool(_report["ready"])
+
+
+def get_report() -> Dict[str, Any]:
+    return dict(_report)
+
+
+def start_warm_up(loop: Optional[asyncio.AbstractEventLoop] = None) -> "asyncio.Task[None]":
+    # リクエストの受付を止めないようバックグラウンドで実行する
+    return (loop or asyncio.get_running_loop()).create_task(warm_up())
+
+
+def configure_threadpool() -> None:
+    # 同期処理を逃がすスレッドプールの上限 (api.serve がワーカーあたりの同時実行数に合わせて設定する)
+    size = os.getenv("THREADPOOL_SIZE")
+    if size:
+        # Third Party Library
+        from anyio import to_thread
+
+        to_thread.current_default_thread_limiter().total_tokens = int(size)
+
+
+def graceful_shutdown_seconds() -> float:
+    # 処理中のリクエストを待てる秒数 (外部呼び出しの待ちと書き出しの分を残す)
+    return max(0.0, SHUTDOWN_BUDGET_SECONDS - SHUTDOWN_DRAIN_SECONDS - SHUTDOWN_FLUSH_SECONDS)
+
+
+async def drain_upstream_calls(timeout: float = SHUTDOWN_DRAIN_SECONDS) -> None:
+    # スレッドプールで実行中の外部呼び出しが終わるのを待つ (タイムアウト後は打ち切る)
+    deadline = time.monotonic() + timeout
+    while upstream_calls_in_flight() > 0:
+        if time.monotonic() >= deadline:
+            logger.warning(
+                "Shutting down with %d upstream calls in flight", upstream_calls_in_flight()
+            )
+            return
+        await asyncio.sleep(0.05)
+
+
+def _run_logged(func: Callable[[], Any]) -> None:
+    try:
+        func()
+    except Exception as e:
+        logger.error("Shutdown flush failed: %s", e)
+
+
+async def flush_before_exit(
+    func: Callable[[], Any], timeout: float = SHUTDOWN_FLUSH_SECONDS
+) -> None:
+    # デーモンスレッドで書き出し、間に合わなければ待たずに終了する
+    # (スレッドプールで実行するとイベントループの終了時に書き出しの完了まで待ってしまう)
+    thread = threading.Thread(target=_run_logged, args=(func,), name="shutdown-flush", daemon=True)
+    thread.start()
+    await asyncio.to_thread(thread.join, timeout)
+    if thread.is_alive():
+        logger.error("Shutdown flush did not finish within %.1fs", timeout)
@@ -0,0 +1,39 @@
+# 店舗データ (stores/{place_id}) の鮮度
+#
+# - 店舗を保存するたびに staleAt (期限) を書く。期限は STORE_TTL_SECONDS に ±STORE_TTL_JITTER の
+#   ばらつきを加えた店舗ごとの値にし、同時に保存した店舗の期限切れが一度に集中しないようにする
+# - STORE_REFRESH_MODE でリクエスト時の扱いを決める
+#     always     : 毎回Places APIから取り直す (従来の動作)
+#     ttl        : 期限内の店舗はPlacesの詳細・写真を取らずに保存済みのデータを使う (既定)
+#     background : 保存済みの店舗は期限切れでもそのまま使い、取り直しは api.jobs.refresh_stores に任せる
+# Standard Library
+import os
+import random
+from datetime import datetime, timedelta
+from typing import Any, Dict
+
+STORE_TTL_SECONDS = float(os.getenv("STORE_TTL_SECONDS", str(7 * 24 * 3600)))
+STORE_TTL_JITTER = float(os.getenv("STORE_TTL_JITTER", "0.1"))
+STORE_REFRESH_MODE = os.getenv("STORE_REFRESH_MODE", "ttl")
+REFRESH_MODES = ("always", "ttl", "background")
+
+if STORE_REFRESH_MODE not in REFRESH_MODES:
+    raise ValueError(f"STORE_REFRESH_MODE must be one of {REFRESH_MODES}: {STORE_REFRESH_MODE!r}")
+
+
+def next_stale_at(now: datetime) -> datetime:
+    ratio = random.uniform(1 - STORE_TTL_JITTER, 1 + STORE_TTL_JITTER)
+    return now + timedelta(seconds=STORE_TTL_SECONDS * ratio)
+
+
+def is_fresh(store: Dict[str, Any], now: datetime) -> bool:
+    # staleAtを持たない店舗 (この仕組みより前に保存されたもの) は期限切れとして扱う
+    stale_at = store.get("staleAt")
+    return stale_at is not None and stale_at > now
+
+
+def needs_refresh(store: Dict[str, Any], now: datetime) -> bool:
+    # 保存済みの店舗をリクエスト時にPlacesから取り直すか
+    if STORE_REFRESH_MODE == "background":
+        return False
+    return STORE_REFRESH_MODE == "always" or not is_fresh(store, now)
@@ -0,0 +1,286 @@
+# 店舗 (stores) の名前・市区町村・都道府県を検索するメモリ上のインデックス
+#
+# - 日本語は文字のn-gram (1文字と2文字) の転置インデックスで候補を絞り、正規化した文字列の部分一致で確かめる
+# - ローマ字 (convert_to_romaji で変換したもの) と英数字は単語の前方一致。単語はソート済みの配列に持ち、
+#   二分探索で前方一致する範囲を引く (ノードごとにdictを持つトライより、100万件でもメモリが小さい)
+# - 文字列はNFKCで正規化し、小文字・平仮名に寄せる (「ラーメン」と「らーめん」は同じ語になる)
+# - 店舗は内部の連番で持ち、転置リストは連番のarray (1件4バイト)。内容が変わった店舗は古い連番を消して
+#   新しい連番で足し、消した連番が全体の1/4を超えたら作り直す
+# - 検索語は空白で区切った全ての語を含む店舗を返す。店舗名に一致した語が多い順、名前の短い順に並べる
+# Standard Library
+import bisect
+import heapq
+import re
+import threading
+import unicodedata
+from array import array
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+# First Party Library
+from api.core.metrics import register_collector
+from api.core.romaji import convert_to_romaji
+
+# 検索用の文字列のフィールドの区切り (検索語には現れない)
+SEPARATOR = "\x1f"
+# 消した連番がこの件数と全体の1/4を超えたら作り直す
+COMPACT_MIN_REMOVED = 1000
+# 前方一致する単語がこれより多い語は、候補の絞り込みに使わない
+MAX_PREFIX_WORDS = 10000
+
+_KATAKANA_TO_HIRAGANA = {code: code - 0x60 for code in range(ord("ァ"), ord("ヶ") + 1)}
+_TOKEN = re.compile(r"[a-z0-9]+|[^\x00-\x7f\s・]+")
+_WORD = re.compile(r"[a-z0-9]+")
+_JAPANESE = re.compile(r"[^\x00-\x7f\s・]+")
+
+
+@dataclass(frozen=True)
+class SearchHit:
+    store_id: str
+    name: str
+    city: str
+    prefecture: str
+
+
+@dataclass(frozen=True)
+class Term:
+    text: str
+    # Trueは単語の前方一致 (英数字)、Falseは部分一致 (日本語)
+    prefix: bool
+
+
+def normalize(text: Optional[str]) -> str:
+    return unicodedata.normalize("NFKC", text or "").lower().translate(_KATAKANA_TO_HIRAGANA)
+
+
+def ngrams(text: str) -> Set[str]:
+    return {*text, *(text[i : i + 2] for i in range(len(text) - 1))}
+
+
+def parse_query(query: str) -> List[Term]:
+    terms = (Term(token, token.isascii()) for token in _TOKEN.findall(normalize(query)))
+    return list(dict.fromkeys(terms))
+
+
+def _romaji_words(text: Optional[str]) -> List[str]:
+    # 辞書・仮名で変換できない名前はそのまま返るため、英数字の単語だけを使う
+    return _WORD.findall(normalize(convert_to_romaji(text))) if text else []
+
+
+def analyze(name: Optional[str], city: Optional[str], prefecture: Optional[str]) -> Tuple[str, str]:
+    # (検索用の文字列, 表示用の文字列) を返す
+    # 検索用は "名前 市区町村 都道府県 ␣名前の単語 ␣地名の単語" をSEPARATORでつないだもの
+    # (単語はそれぞれ空白を前に付け、" 語" の部分一致で前方一致を確かめる)
+    fields = [normalize(name), normalize(city), normalize(prefecture)]
+    name_words = {*_WORD.findall(fields[0]), *_romaji_words(name)}
+    place_words = {
+        *_WORD.findall(fields[1]),
+        *_WORD.findall(fields[2]),
+        *_romaji_words(city),
+        *_romaji_words(prefecture),
+    }
+    searchable = SEPARATOR.join(
+        [
+            *fields,
+            "".join(f" {word}" for word in sorted(name_words)),
+            "".join(f" {word}" for word in sorted(place_words)),
+        ]
+    )
+    display = SEPARATOR.join([name or "", city or "", prefecture or ""])
+    return searchable, display
+
+
+def index_terms(searchable: str) -> Tuple[Set[str], Set[str]]:
+    # 検索用の文字列から (n-gram, 単語) を取り出す
+    name, city, prefecture, name_words, place_words = searchable.split(SEPARATOR)
+    grams: Set[str] = set()
+    for field in (name, city, prefecture):
+        for run in _JAPANESE.findall(field):
+            grams |= ngrams(run)
+    return grams, {*name_words.split(), *place_words.split()}
+
+
+def matches(term: Term, searchable: str) -> bool:
+    return (f" {term.text}" if term.prefix else term.text) in searchable
+
+
+def name_score(terms: List[Term], searchable: str) -> int:
+    name, _, _, name_words, _ = searchable.split(SEPARATOR)
+    return sum(
+        1 for term in terms if (f" {term.text}" in name_words if term.prefix else term.text in name)
+    )
+
+
+class StoreSearchIndex:
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._clear()
+
+    def _clear(self) -> None:
+        # 連番ごとの店舗ID・検索用の文字列・表示用の文字列 (消した連番はNone)
+        self._ids: List[Optional[str]] = []
+        self._searchable: List[Optional[str]] = []
+        self._display: List[Optional[str]] = []
+        self._numbers: Dict[str, int] = {}
+        self._grams: Dict[str, array] = {}
+        self._words: Dict[str, array] = {}
+        self._vocabulary: List[str] = []
+        self._removed = 0
+
+    def __len__(self) -> int:
+        return len(self._numbers)
+
+    def __contains__(self, store_id: str) -> bool:
+        return store_id in self._numbers
+
+    def _add(self, store_id: str, searchable: str, display: str, sort_vocabulary: bool) -> None:
+        number = len(self._ids)
+        self._ids.append(store_id)
+        self._searchable.append(searchable)
+        self._display.append(display)
+        self._numbers[store_id] = number
+        grams, words = index_terms(searchable)
+        for gram in grams:
+            postings = self._grams.get(gram)
+            if postings is None:
+                postings = self._grams[gram] = array("I")
+            postings.append(number)
+        for word in words:
+            postings = self._words.get(word)
+            if postings is None:
+                postings = self._words[word] = array("I")
+                if sort_vocabulary:
+                    bisect.insort(self._vocabulary, word)
+            postings.append(number)
+
+    def _remove(self, number: int) -> None:
+        store_id = self._ids[number]
+        if store_id is not None and self._numbers.get(store_id) == number:
+            del self._numbers[store_id]
+        self._ids[number] = None
+        self._searchable[number] = None
+        self._display[number] = None
+        self._removed += 1
+
+    def _compact(self) -> None:
+        # 消した連番を除いて転置リストを作り直す
+        live = [
+            (store_id, searchable, display)
+            for store_id, searchable, display in zip(self._ids, self._searchable, self._display)
+            if store_id is not None and searchable is not None and display is not None
+        ]
+        self._clear()
+        for store_id, searchable, display in live:
+            self._add(store_id, searchable, display, sort_vocabulary=False)
+        self._vocabulary = sorted(self._words)
+
+    def upsert(
+        self, store_id: str, name: Optional[str], city: Optional[str], prefecture: Optional[str]
+    ) -> None:
+        searchable, display = analyze(name, city, prefecture)
+        with self._lock:
+            number = self._numbers.get(store_id)
+            if number is not None:
+                if self._searchable[number] == searchable:
+                    self._display[number] = display
+                    return
+                self._remove(number)
+            self._add(store_id, searchable, display, sort_vocabulary=True)
+            if self._removed > COMPACT_MIN_REMOVED and self._removed * 4 > len(self._ids):
+                self._compact()
+
+    def build(
+        self, stores: Iterable[Tuple[str, Optional[str], Optional[str], Optional[str]]]
+    ) -> None:
+        # (店舗ID, 名前, 市区町村, 都道府県) から作り直す。作っている間も古い内容で検索できる
+        fresh = StoreSearchIndex()
+        for store_id, name, city, prefecture in stores:
+            searchable, display = analyze(name, city, prefecture)
+            number = fresh._numbers.get(store_id)
+            if number is not None:
+                fresh._remove(number)
+            fresh._add(store_id, searchable, display, sort_vocabulary=False)
+        fresh._vocabulary = sorted(fresh._words)
+        with self._lock:
+            self._ids, self._searchable, self._display = (
+                fresh._ids,
+                fresh._searchable,
+                fresh._display,
+            )
+            self._numbers, self._grams, self._words = fresh._numbers, fresh._grams, fresh._words
+            self._vocabulary, self._removed = fresh._vocabulary, fresh._removed
+
+    def _term_postings(self, term: Term) -> Optional[List[array]]:
+        # 語を含む店舗の候補 (転置リストの和集合)。絞り込みに使えない語はNone
+        if not term.prefix:
+            # 部分一致は、語のn-gramのうち最も件数の少ないもの (1つでも無ければ一致しない)
+            lists = []
+            for gram in ngrams(term.text):
+                postings = self._grams.get(gram)
+                if postings is None:
+                    return []
+                lists.append(postings)
+            return [min(lists, key=len)]
+        start = bisect.bisect_left(self._vocabulary, term.text)
+        end = bisect.bisect_left(self._vocabulary, term.text + "\uffff", lo=start)
+        if end - start > MAX_PREFIX_WORDS:
+            return None
+        return [self._words[word] for word in self._vocabulary[start:end]]
+
+    def _candidates(self, terms: List[Term], within: Optional[List[str]]) -> Iterable[int]:
+        # 最も件数の少ない語の候補を使う (ユーザーの店舗の方が少なければそちらを使う)
+        best: Optional[List[array]] = None
+        best_size = float("inf")
+        for term in terms:
+            lists = self._term_postings(term)
+            size = sum(len(postings) for postings in lists) if lists is not None else best_size
+            if size < best_size:
+                best, best_size = lists, size
+        if within is not None and len(within) <= best_size:
+            return (self._numbers[store_id] for store_id in within if store_id in self._numbers)
+        # 絞り込める語が無い場合 (短すぎる前方一致だけの場合) は全件を確かめる
+        candidates: Iterable[int] = (
+            range(len(self._ids))
+            if best is None
+            else (number for postings in best for number in postings)
+        )
+        if within is None:
+            return candidates
+        allowed = {self._numbers[store_id] for store_id in within if store_id in self._numbers}
+        return (number for number in candidates if number in allowed)
+
+    def search(
+        self, query: str, limit: int = 20, within: Optional[List[str]] = None
+    ) -> List[SearchHit]:
+        # withinを渡すとその店舗の中だけを検索する
+        terms = parse_query(query)
+        if not terms:
+            return []
+        with self._lock:
+            found: List[Tuple[int, int, int]] = []
+            seen: Set[int] = set()
+            for number in self._candidates(terms, within):
+                searchable = self._searchable[number]
+                if searchable is None or number in seen:
+                    continue
+                seen.add(number)
+                if all(matches(term, searchable) for term in terms):
+                    name_length = searchable.index(SEPARATOR)
+                    found.append((-name_score(terms, searchable), name_length, number))
+            best = heapq.nsmallest(limit, found)
+            hits = []
+            for _, _, number in best:
+                store_id, display = self._ids[number], self._display[number]
+                if store_id is not None and display is not None:
+                    hits.append(SearchHit(store_id, *display.split(SEPARATOR)))
+            return hits
+
+
+_index = StoreSearchIndex()
+
+
+def get_store_index() -> StoreSearchIndex:
+    return _index
+
+
+register_collector(lambda: [("gauge", "store_search_stores", (), float(len(_index)))])
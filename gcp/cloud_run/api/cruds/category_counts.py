@@ -0,0 +1,155 @@
+# ユーザーごとのカテゴリ別の写真枚数 (users/{uid}/categoryCounts/{shard})
+#
+# - 写真のカテゴリを書くのと同じトランザクション / バッチで、変わったカテゴリだけを±1する
+#   (読む側は写真を全件読まずに、小さなドキュメントだけで枚数が分かる)
+# - 通常はシャード "0" の1ドキュメント。1ドキュメントへの書き込みは毎秒1回程度が目安のため、
+#   合計が HEAVY_USER_PHOTOS を超えたユーザーは SHARDS 個に分け、写真IDから決めたシャードに書く
+# - シャード数はシャード "0" の shards に持ち、増やすだけで減らさない。書き込み側はプロセス内に
+#   SHARD_CACHE_TTL 秒キャッシュする (古いシャード数で書いても、読む側は全シャードを足すので数は合う)
+# - 読む側はシャード "0" を1回読み、分かれている場合だけ残りをまとめて読む
+# - この仕組みより前の写真は数に入っていないため、シャード "0" に complete が無いユーザーは
+#   初回の読み込み時に写真を全件読んで数え直す (数え直すまではシャードを分けない)。
+#   数えている間の増減を失わないよう、シャード "0" と写真を同じトランザクションで読んでから置き換える
+# Standard Library
+import logging
+import os
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+# Third Party Library
+from fastapi import HTTPException  # type: ignore
+
+# First Party Library
+from api.core.metrics import span
+
+logger = logging.getLogger(__name__)
+
+COLLECTION = "categoryCounts"
+SHARDS = int(os.getenv("CATEGORY_COUNT_SHARDS", "8"))
+HEAVY_USER_PHOTOS = int(os.getenv("CATEGORY_COUNT_HEAVY_PHOTOS", "1000"))
+SHARD_CACHE_TTL = 300.0
+SHARD_CACHE_SIZE = 10000
+
+_shard_cache: "OrderedDict[str, Tuple[int, float]]" = OrderedDict()
+_shard_cache_lock = threading.Lock()
+
+
+def counts_ref(db: Any, user_id: str, shard: int = 0) -> Any:
+    return db.collection("users").document(user_id).collection(COLLECTION).document(str(shard))
+
+
+def shard_for(photo_id: str, shards: int) -> int:
+    # 同じ写真の増減は同じシャードに書く
+    return zlib.crc32(photo_id.encode()) % shards if shards > 1 else 0
+
+
+def count_changes(old: Optional[str], new: str) -> Optional[Dict[str, Any]]:
+    # カテゴリが変わった場合だけ、set(merge=True) で書く増減を返す
+    if old == new:
+        return None
+    # Third Party Library
+    from google.cloud.firestore import Increment  # type: ignore
+
+    counts = {new: Increment(1)}
+    if old:
+        counts[old] = Increment(-1)
+    return {"counts": counts}
+
+
+def cached_shards(user_id: str) -> Optional[int]:
+    with _shard_cache_lock:
+        cached = _shard_cache.get(user_id)
+    if cached is None or time.monotonic() - cached[1] > SHARD_CACHE_TTL:
+        return None
+    return cached[0]
+
+
+def remember_shards(user_id: str, shards: int) -> None:
+    with _shard_cache_lock:
+        _shard_cache[user_id] = (shards, time.monotonic())
+        _shard_cache.move_to_end(user_id)
+        while len(_shard_cache) > SHARD_CACHE_SIZE:
+            _shard_cache.popitem(last=False)
+
+
+def shards_to_use(head: Dict[str, Any]) -> Tuple[int, bool]:
+    # シャード "0" の内容から、書き込みに使うシャード数と、分割を始めるかを返す
+    shards = int(head.get("shards") or 1)
+    if shards > 1 or SHARDS == 1 or not head.get("complete"):
+        return shards, False
+    return (SHARDS, True) if sum(head["counts"].values()) >= HEAVY_USER_PHOTOS else (1, False)
+
+
+def get_shard_count(user_id: str, db: Any) -> int:
+    shards = cached_shards(user_id)
+    if shards is not None:
+        return shards
+    head_ref = counts_ref(db, user_id)
+    with span("firestore.get_category_shards"):
+        head = head_ref.get(field_paths=["shards", "counts", "complete"])
+    shards, split = shards_to_use(head.to_dict() or {})
+    if split:
+        logger.info("Splitting category counts of user %s into %d shards", user_id, shards)
+        head_ref.set({"shards": shards}, merge=True)
+    remember_shards(user_id, shards)
+    return shards
+
+
+def sum_counts(shards: Iterable[Optional[Dict[str, Any]]]) -> Dict[str, int]:
+    counts: Dict[str, int] = {}
+    for data in shards:
+        for category, value in ((data or {}).get("counts") or {}).items():
+            counts[category] = counts.get(category, 0) + int(value)
+    return {category: value for category, value in sorted(counts.items()) if value > 0}
+
+
+def _rebuild_in_transaction(transaction: Any, user_id: str, db: Any) -> Dict[str, int]:
+    head_ref = counts_ref(db, user_id)
+    data = head_ref.get(transaction=transaction).to_dict() or {}
+    if data.get("complete"):
+        # 他のリクエストが先に数え直していた
+        shards = int(data.get("shards") or 1)
+        rest = [counts_ref(db, user_id, shard) for shard in range(1, shards)]
+        others = [s.to_dict() for s in db.get_all(rest, transaction=transaction)] if rest else []
+        return sum_counts([data, *others])
+    photos = db.collection("users").document(user_id).collection("photos").select(["category"])
+    counts: Dict[str, int] = {}
+    with span("firestore.list_photos"):
+        for photo in photos.stream(transaction=transaction):
+            category = (photo.to_dict() or {}).get("category")
+            if category:
+                counts[category] = counts.get(category, 0) + 1
+    transaction.set(head_ref, {"counts": counts, "shards": 1, "complete": True})
+    return sum_counts([{"counts": counts}])
+
+
+def rebuild_category_counts(user_id: str, db: Any) -> Dict[str, int]:
+    # 写真を全件読んで数え直す (ユーザーごとに初回だけ。分割前なのでシャード "0" だけを置き換える)
+    # Third Party Library
+    from google.cloud.firestore import transactional  # type: ignore
+
+    # デコレータは再試行の状態を持つため呼び出しごとに作る
+    result: Dict[str, int] = transactional(_rebuild_in_transaction)(db.transaction(), user_id, db)
+    return result
+
+
+def get_category_counts(user_id: str, db: Any) -> Dict[str, int]:
+    try:
+        with span("firestore.get_category_counts"):
+            head = counts_ref(db, user_id).get()
+            data = head.to_dict() or {}
+            if not data.get("complete"):
+                return rebuild_category_counts(user_id, db)
+            shards = int(data.get("shards") or 1)
+            rest = [counts_ref(db, user_id, shard) for shard in range(1, shards)]
+            others = [snapshot.to_dict() for snapshot in db.get_all(rest)] if rest else []
+        return sum_counts([data, *others])
+    except Exception as e:
+        logger.error("An error occurred while reading from Firestore: %s", e)
+        raise HTTPException(
+            status_code=500,
+            detail=f"An error occurred while reading from Firestore: {e}",
+        )
@@ -1,123 +1,236 @@
 # Standard Library
 import logging
 from datetime import datetime, timezone
-from typing import Any
+from typing import Any, Callable, Dict, List, Optional
 
 # Third Party Library
 from fastapi import HTTPException  # type: ignore
 
 # First Party Library
 from api.core.data_class import StoreData  # type: ignore
+from api.core.metrics import span
+from api.core.store_freshness import next_stale_at
+from api.core.store_search import get_store_index
+from api.cruds.category_counts import count_changes, counts_ref, get_shard_count, shard_for
+from api.cruds.write_behind import get_write_buffer
+
+logger = logging.getLogger(__name__)
+
+# 時刻を持たない店舗 (以前の形式) に使う時刻
+UNKNOWN_TIME = datetime.fromtimestamp(0, timezone.utc)
+
+
+def store_to_dict(
+    store_data: StoreData, current_time: datetime, keep_image_urls: bool = False
+) -> Dict[str, Any]:
+    # createdAtは含めない (新規作成時だけ書き、取り直しでは上書きしない)
+    store_data_dict = {
+        "updatedAt": current_time,
+        "staleAt": next_stale_at(current_time),
+        "name": store_data.name,
+        "address": store_data.address,
+        "city": store_data.city,
+        "prefecture": store_data.prefecture,
+        "country": store_data.country,
+        "phoneNumber": store_data.phoneNumber,
+        "website": store_data.website,
+        "openingHours": store_data.openingHours,
+        "openingIntervals": store_data.openingIntervals,
+        "imageUrls": store_data.imageUrls,
+    }
+    if keep_image_urls:
+        # 写真を取得していない場合は保存済みのimageUrlsを上書きしない
+        del store_data_dict["imageUrls"]
+    return store_data_dict
+
+
+def _timestamp(value: Any, default: datetime) -> datetime:
+    return value if isinstance(value, datetime) else default
+
+
+def store_from_dict(store_id: str, data: Dict[str, Any]) -> StoreData:
+    # 更新日時の無い店舗は UNKNOWN_TIME、作成日時の無い店舗は更新日時で補う
+    updated_at = _timestamp(data.get("updatedAt"), UNKNOWN_TIME)
+    return StoreData(
+        store_id=store_id,
+        createdAt=_timestamp(data.get("createdAt"), updated_at),
+        updatedAt=updated_at,
+        name=str(data.get("name") or ""),
+        address=str(data.get("address") or ""),
+        city=data.get("city") or "",
+        prefecture=data.get("prefecture") or "",
+        country=data.get("country") or "",
+        phoneNumber=data.get("phoneNumber") or "",
+        website=data.get("website") or "",
+        openingHours=data.get("openingHours") or {},
+        openingIntervals=data.get("openingIntervals"),
+        imageUrls=data.get("imageUrls") or [],
+    )
+
 
-logging.basicConfig(level=logging.INFO)
+def add_store_to_photo(store_id: str, photo_id: str, user_id: str, db: Any) -> None:
+    # photoドキュメントのareaStoreIdsに店舗を追加する (読まずにArrayUnionでマージする)
+    photo_ref = db.collection("users").document(user_id).collection("photos").document(photo_id)
+    current_time = datetime.now(timezone.utc)
+    get_write_buffer().set(
+        db,
+        photo_ref,
+        {"updatedAt": current_time},
+        unions={"areaStoreIds": [store_id]},
+        # ドキュメントを新しく作る場合だけ書くフィールド
+        create_only={"createdAt": current_time, "userId": user_id, "storeId": store_id},
+    )
 
 
 def save_store_data_to_firestore(
-    store_data: StoreData, photo_id: str, user_id: str, db: Any
+    store_data: StoreData, photo_id: str, user_id: str, db: Any, keep_image_urls: bool = False
 ) -> None:
-    logging.info(f"Preparing to save store data to Firestore: {store_data}")
+    logger.debug("Preparing to save store %s to Firestore", store_data.store_id)
     try:
-        # Firestoreの`users`コレクションのphotoドキュメントを取得
-        user_ref = db.collection("users").document(user_id)
-        photo_ref = user_ref.collection("photos").document(photo_id)
-        photo_doc = photo_ref.get()
+        add_store_to_photo(store_data.store_id, photo_id, user_id, db)
 
         current_time = datetime.now(timezone.utc)
-
-        if photo_doc.exists:
-            # ドキュメントが存在する場合、areaStoreIdsを更新
-            logging.info(
-                f"Photo document {photo_id} exists for user {user_id}. Updating areaStoreIds."
-            )
-            photo_data = photo_doc.to_dict()
-            area_store_ids = photo_data.get("areaStoreIds", [])
-            if store_data.store_id not in area_store_ids:
-                area_store_ids.append(store_data.store_id)
-                photo_ref.update({"areaStoreIds": area_store_ids, "updatedAt": current_time})
-                logging.info(f"Updated areaStoreIds: {area_store_ids}")
-            else:
-                logging.info(f"Store ID {store_data.store_id} already in areaStoreIds.")
-        else:
-            # ドキュメントが存在しない場合、新しく作成
-            logging.info(
-                f"Photo document {photo_id} does not exist for user {user_id}. Creating new document."
-            )
-            photo_data = {
-                "createdAt": current_time,
-                "updatedAt": current_time,
-                "userId": user_id,
-                "storeId": store_data.store_id,
-                "areaStoreIds": [store_data.store_id],
-            }
-            photo_ref.set(photo_data)
-            logging.info(f"Created new photo document with data: {photo_data}")
-
-        store_data_dict = {
-            "createdAt": current_time,
-            "updatedAt": current_time,
-            "name": store_data.name,
-            "address": store_data.address,
-            "city": store_data.city,
-            "prefecture": store_data.prefecture,
-            "country": store_data.country,
-            "phoneNumber": store_data.phoneNumber,
-            "website": store_data.website,
-            "openingHours": store_data.openingHours,
-            "imageUrls": store_data.imageUrls,
-        }
-
-        db.collection("stores").document(store_data.store_id).set(store_data_dict)
-        logging.info(f"Saved store data to stores collection with ID {store_data.store_id}")
-
-        logging.info(f"Saved opening hours to stores/{store_data.store_id}/openingHours/hours")
+        store_ref = db.collection("stores").document(store_data.store_id)
+        get_write_buffer().set(
+            db,
+            store_ref,
+            store_to_dict(store_data, current_time, keep_image_urls),
+            create_only={"createdAt": current_time},
+        )
+        # このインスタンスの検索インデックスにはすぐ反映する
+        get_store_index().upsert(
+            store_data.store_id, store_data.name, store_data.city, store_data.prefecture
+        )
+        logger.info(
+            "Queued store %s for photo %s",
+            store_data.store_id,
+            photo_id,
+            extra={"userId": user_id, "storeId": store_data.store_id},
+        )
 
     except Exception as e:
-        logging.error(f"An error occurred while saving to Firestore: {e}")
+        logger.error("An error occurred while saving to Firestore: %s", e)
         raise HTTPException(
             status_code=500,
             detail=f"An error occurred while saving to Firestore: {e}",
         )
 
 
+def run_transaction(db: Any, func: Callable[..., Any], *args: Any) -> Any:
+    # Third Party Library
+    from google.cloud.firestore import transactional  # type: ignore
+
+    # デコレータは再試行の状態を持つため呼び出しごとに作る
+    return transactional(func)(db.transaction(), *args)
+
+
+def _save_category(
+    transaction: Any,
+    photo_ref: Any,
+    counts_shard_ref: Any,
+    fields: Dict[str, Any],
+    create_only: Dict[str, Any],
+) -> None:
+    # photoドキュメントと、カテゴリ別の枚数の増減を同じトランザクションで書く
+    snapshot = photo_ref.get(field_paths=["category"], transaction=transaction)
+    previous = (snapshot.to_dict() or {}).get("category") if snapshot.exists else None
+    data = dict(fields) if snapshot.exists else {**create_only, **fields}
+    transaction.set(photo_ref, data, merge=True)
+    changes = count_changes(previous, fields["category"])
+    if changes:
+        transaction.set(counts_shard_ref, changes, merge=True)
+
+
 def save_category_and_photo_to_firestore(
     user_id: str, photo_id: str, category: str, image_url: str, db: Any
 ) -> None:
-    logging.info(
-        f"Preparing to save category and photo to Firestore: category={category}, image_url={image_url}"
-    )
+    logger.debug("Preparing to save category %s for photo %s", category, photo_id)
     try:
-        # Firestoreの`users`コレクションのphotoドキュメントを取得
         user_ref = db.collection("users").document(user_id)
         photo_ref = user_ref.collection("photos").document(photo_id)
-        photo_doc = photo_ref.get()
-
+        shard = shard_for(photo_id, get_shard_count(user_id, db))
         current_time = datetime.now(timezone.utc)
-
-        if photo_doc.exists:
-            # ドキュメントが存在する場合、image_urlとcategoryを更新
-            logging.info(
-                f"Photo document {photo_id} exists for user {user_id}. Updating image_url and category."
+        with span("firestore.save_photo"):
+            run_transaction(
+                db,
+                _save_category,
+                photo_ref,
+                counts_ref(db, user_id, shard),
+                {"url": image_url, "category": category, "updatedAt": current_time},
+                {"createdAt": current_time, "userId": user_id},
             )
-            photo_ref.update({"url": image_url, "category": category, "updatedAt": current_time})
-            logging.info(f"Updated image_url and category: url={image_url}, category={category}")
-        else:
-            # ドキュメントが存在しない場合、新しく作成
-            logging.info(
-                f"Photo document {photo_id} does not exist for user {user_id}. Creating new document."
-            )
-            photo_data = {
-                "createdAt": current_time,
-                "updatedAt": current_time,
-                "userId": user_id,
-                "url": image_url,
-                "category": category,
-            }
-            photo_ref.set(photo_data)
-            logging.info(f"Created new photo document with data: {photo_data}")
+        logger.info(
+            "Saved category %s for photo %s",
+            category,
+            photo_id,
+            extra={"userId": user_id, "category": category},
+        )
 
     except Exception as e:
-        logging.error(f"An error occurred while saving to Firestore: {e}")
+        logger.error("An error occurred while saving to Firestore: %s", e)
         raise HTTPException(
             status_code=500,
             detail=f"An error occurred while saving to Firestore: {e}",
         )
+
+
+def get_user_store_ids(user_id: str, db: Any) -> List[str]:
+    # ユーザーのphotoドキュメントに紐づく店舗IDを重複なしで取得
+    photos_ref = db.collection("users").document(user_id).collection("photos")
+    store_ids: Dict[str, None] = {}
+    try:
+        with span("firestore.list_photos"):
+            for photo_doc in photos_ref.select(["storeId", "areaStoreIds"]).stream():
+                photo_data = photo_doc.to_dict()
+                if photo_data.get("storeId"):
+                    store_ids[photo_data["storeId"]] = None
+                for store_id in photo_data.get("areaStoreIds", []):
+                    store_ids[store_id] = None
+    except Exception as e:
+        logger.error("An error occurred while reading from Firestore: %s", e)
+        raise HTTPException(
+            status_code=500,
+            detail=f"An error occurred while reading from Firestore: {e}",
+        )
+    return list(store_ids)
+
+
+def get_store_opening_intervals(store_ids: List[str], db: Any) -> Dict[str, Optional[List[int]]]:
+    # 営業時間インデックスのフィールドのみをまとめて取得
+    if not store_ids:
+        return {}
+    store_refs = [db.collection("stores").document(store_id) for store_id in store_ids]
+    try:
+        with span("firestore.get_stores"):
+            return {
+                # 保存済みの古い店舗はフィールドを持たない (snapshot.getはKeyErrorになる)
+                store_doc.id: (store_doc.to_dict() or {}).get("openingIntervals")
+                for store_doc in db.get_all(store_refs, field_paths=["openingIntervals"])
+                if store_doc.exists
+            }
+    except Exception as e:
+        logger.error("An error occurred while reading from Firestore: %s", e)
+        raise HTTPException(
+            status_code=500,
+            detail=f"An error occurred while reading from Firestore: {e}",
+        )
+
+
+def get_stores(store_ids: List[str], db: Any) -> Dict[str, Dict[str, Any]]:
+    # 保存済みの店舗ドキュメントをまとめて取得 (存在しない店舗は含めない)
+    if not store_ids:
+        return {}
+    store_refs = [db.collection("stores").document(store_id) for store_id in store_ids]
+    try:
+        with span("firestore.get_stores"):
+            return {
+                store_doc.id: store_doc.to_dict()
+                for store_doc in db.get_all(store_refs)
+                if store_doc.exists
+            }
+    except Exception as e:
+        logger.error("An error occurred while reading from Firestore: %s", e)
+        raise HTTPException(
+            status_code=500,
+            detail=f"An error occurred while reading from Firestore: {e}",
+        )
@@ -0,0 +1,205 @@
+# api.cruds.firestore の非同期版 (google.cloud.firestore.AsyncClient を使う)
+#
+# - 関数名と引数は同期版と同じで、dbに非同期クライアントを渡してawaitする
+# - photoドキュメントの作成・更新はトランザクションで行い、同時のリクエストでも
+#   createdAtなどの作成時だけのフィールドを二重に書かない (競合時はSDKが再試行する)
+# Standard Library
+import logging
+from datetime import datetime, timezone
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+# Third Party Library
+from fastapi import HTTPException  # type: ignore
+
+# First Party Library
+from api.core.metrics import span
+from api.cruds import category_counts, photo_pages
+from api.cruds.category_counts import count_changes, counts_ref, shard_for
+from api.cruds.write_behind import get_write_buffer
+
+logger = logging.getLogger(__name__)
+
+READY_FOR_USE = "readyForUse"
+
+
+def _error(action: str, e: Exception) -> HTTPException:
+    logger.error("An error occurred while %s Firestore: %s", action, e)
+    return HTTPException(
+        status_code=500,
+        detail=f"An error occurred while {action} Firestore: {e}",
+    )
+
+
+async def run_transaction(db: Any, func: Callable[..., Awaitable[Any]], *args: Any) -> Any:
+    # Third Party Library
+    from google.cloud.firestore import async_transactional  # type: ignore
+
+    # デコレータは再試行の状態を持つため呼び出しごとに作る
+    return await async_transactional(func)(db.transaction(), *args)
+
+
+async def _save_category(
+    transaction: Any,
+    photo_ref: Any,
+    counts_shard_ref: Any,
+    fields: Dict[str, Any],
+    create_only: Dict[str, Any],
+) -> None:
+    # photoドキュメントと、カテゴリ別の枚数の増減を同じトランザクションで書く
+    snapshot = await photo_ref.get(field_paths=["category"], transaction=transaction)
+    previous = (snapshot.to_dict() or {}).get("category") if snapshot.exists else None
+    data = dict(fields) if snapshot.exists else {**create_only, **fields}
+    transaction.set(photo_ref, data, merge=True)
+    changes = count_changes(previous, fields["category"])
+    if changes:
+        transaction.set(counts_shard_ref, changes, merge=True)
+
+
+async def save_category_and_photo_to_firestore(
+    user_id: str, photo_id: str, category: str, image_url: str, db: Any
+) -> None:
+    logger.debug("Preparing to save category %s for photo %s", category, photo_id)
+    try:
+        photo_ref = db.collection("users").document(user_id).collection("photos").document(photo_id)
+        shard = shard_for(photo_id, await get_shard_count(user_id, db))
+        current_time = datetime.now(timezone.utc)
+        with span("firestore.save_photo"):
+            await run_transaction(
+                db,
+                _save_category,
+                photo_ref,
+                counts_ref(db, user_id, shard),
+                {"url": image_url, "category": category, "updatedAt": current_time},
+                {"createdAt": current_time, "userId": user_id},
+            )
+        logger.info(
+            "Saved category %s for photo %s",
+            category,
+            photo_id,
+            extra={"userId": user_id, "category": category},
+        )
+    except Exception as e:
+        raise _error("saving to", e)
+
+
+async def update_user_doc_status(user_id: str, db: Any, status: str = READY_FOR_USE) -> None:
+    # 同期版 (api.core.auth) と同じく、ユーザーのドキュメントが無ければマージで作る
+    user_ref = db.collection("users").document(user_id)
+    try:
+        with span("firestore.update_user"):
+            await user_ref.set({"classifyPhotosStatus": status}, merge=True)
+    except Exception as e:
+        raise _error("saving to", e)
+    # 書いた値を覚えておき、ライトビハインドの重複除去と整合させる
+    get_write_buffer().note_written(user_ref, {"classifyPhotosStatus": status})
+
+
+async def get_user_store_ids(user_id: str, db: Any) -> List[str]:
+    # ユーザーのphotoドキュメントに紐づく店舗IDを重複なしで取得
+    photos_ref = db.collection("users").document(user_id).collection("photos")
+    store_ids: Dict[str, None] = {}
+    try:
+        with span("firestore.list_photos"):
+            async for photo_doc in photos_ref.select(["storeId", "areaStoreIds"]).stream():
+                photo_data = photo_doc.to_dict()
+                if photo_data.get("storeId"):
+                    store_ids[photo_data["storeId"]] = None
+                for store_id in photo_data.get("areaStoreIds", []):
+                    store_ids[store_id] = None
+    except Exception as e:
+        raise _error("reading from", e)
+    return list(store_ids)
+
+
+async def get_store_opening_intervals(
+    store_ids: List[str], db: Any
+) -> Dict[str, Optional[List[int]]]:
+    # 営業時間インデックスのフィールドのみをまとめて取得
+    if not store_ids:
+        return {}
+    store_refs = [db.collection("stores").document(store_id) for store_id in store_ids]
+    try:
+        with span("firestore.get_stores"):
+            return {
+                # 保存済みの古い店舗はフィールドを持たない (snapshot.getはKeyErrorになる)
+                store_doc.id: (store_doc.to_dict() or {}).get("openingIntervals")
+                async for store_doc in db.get_all(store_refs, field_paths=["openingIntervals"])
+                if store_doc.exists
+            }
+    except Exception as e:
+        raise _error("reading from", e)
+
+
+async def get_shard_count(user_id: str, db: Any) -> int:
+    shards = category_counts.cached_shards(user_id)
+    if shards is not None:
+        return shards
+    head_ref = counts_ref(db, user_id)
+    with span("firestore.get_category_shards"):
+        head = await head_ref.get(field_paths=["shards", "counts", "complete"])
+    shards, split = category_counts.shards_to_use(head.to_dict() or {})
+    if split:
+        logger.info("Splitting category counts of user %s into %d shards", user_id, shards)
+        await head_ref.set({"shards": shards}, merge=True)
+    category_counts.remember_shards(user_id, shards)
+    return shards
+
+
+async def _rebuild_category_counts(transaction: Any, user_id: str, db: Any) -> Dict[str, int]:
+    # シャード "0" と写真を同じトランザクションで読み、数えている間の増減を失わないようにする
+    head_ref = counts_ref(db, user_id)
+    data = (await head_ref.get(transaction=transaction)).to_dict() or {}
+    if data.get("complete"):
+        # 他のリクエストが先に数え直していた
+        shards = int(data.get("shards") or 1)
+        rest = [counts_ref(db, user_id, shard) for shard in range(1, shards)]
+        others = (
+            [s.to_dict() async for s in db.get_all(rest, transaction=transaction)] if rest else []
+        )
+        return category_counts.sum_counts([data, *others])
+    photos = db.collection("users").document(user_id).collection("photos").select(["category"])
+    counts: Dict[str, int] = {}
+    with span("firestore.list_photos"):
+        async for photo in photos.stream(transaction=transaction):
+            category = (photo.to_dict() or {}).get("category")
+            if category:
+                counts[category] = counts.get(category, 0) + 1
+    transaction.set(head_ref, {"counts": counts, "shards": 1, "complete": True})
+    return category_counts.sum_counts([{"counts": counts}])
+
+
+async def rebuild_category_counts(user_id: str, db: Any) -> Dict[str, int]:
+    result: Dict[str, int] = await run_transaction(db, _rebuild_category_counts, user_id, db)
+    return result
+
+
+async def get_category_counts(user_id: str, db: Any) -> Dict[str, int]:
+    try:
+        with span("firestore.get_category_counts"):
+            head = await counts_ref(db, user_id).get()
+            data = head.to_dict() or {}
+            if not data.get("complete"):
+                return await rebuild_category_counts(user_id, db)
+            shards = int(data.get("shards") or 1)
+            rest = [counts_ref(db, user_id, shard) for shard in range(1, shards)]
+            others = [snapshot.to_dict() async for snapshot in db.get_all(rest)] if rest else []
+        return category_counts.sum_counts([data, *others])
+    except Exception as e:
+        raise _error("reading from", e)
+
+
+async def list_photos(
+    user_id: str,
+    db: Any,
+    fields: List[str],
+    category: Optional[str] = None,
+    cursor: Optional[str] = None,
+    page_size: int = photo_pages.DEFAULT_PAGE_SIZE,
+) -> Tuple[List[photo_pages.Photo], Optional[str]]:
+    query = photo_pages.photos_query(db, user_id, fields, category, cursor, page_size)
+    try:
+        with span("firestore.list_photos"):
+            snapshots = [snapshot async for snapshot in query.stream()]
+    except Exception as e:
+        raise _error("reading from", e)
+    return photo_pages.to_page(snapshots, page_size)
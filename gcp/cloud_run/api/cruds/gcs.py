@@ -1,17 +1,31 @@
 # Standard Library
 import logging
 import os
-from typing import Any
+from typing import Any, Optional
+from urllib.parse import unquote, urlparse
 
 # Third Party Library
 from fastapi import HTTPException  # type: ignore
-from google.cloud import storage  # type: ignore
+
+# First Party Library
+from api.core.metrics import span
+
+logger = logging.getLogger(__name__)
 
 # Constants
 GCS_PREFIX = "photo-jp-my-gourmet-image-classification-2023-08"
 PROJECT = os.getenv("GCP_PROJECT", "default-project")
 
 
+def object_name_from_url(url: str, bucket: str = PROJECT) -> Optional[str]:
+    # https://storage.googleapis.com/{bucket}/{name} から name を取り出す
+    parsed = urlparse(url)
+    prefix = f"/{bucket}/"
+    if parsed.netloc != "storage.googleapis.com" or not parsed.path.startswith(prefix):
+        return None
+    return unquote(parsed.path[len(prefix) :])
+
+
 def save_store_photo_to_cloud_storage(
     content: bytes, filename: str, store_id: str, storage_client: Any
 ) -> str:
@@ -20,15 +34,17 @@ def save_store_photo_to_cloud_storage(
         """Firebase Storageに画像をアップロードし、公開URLを取得する"""
         blob = bucket.blob(f"{GCS_PREFIX}/{store_id}/{filename}")
 
-        blob.upload_from_string(content, content_type="image/jpeg")
+        with span("gcs.upload"):
+            blob.upload_from_string(content, content_type="image/jpeg")
 
         # ファイルを公開して、公開URLを取得
-        blob.make_public()
+        with span("gcs.make_public"):
+            blob.make_public()
         image_url: str = blob.public_url
         return image_url
 
     except Exception as e:
-        logging.error(f"Failed to upload image to Cloud Storage: {e}")
+        logger.error("Failed to upload image to Cloud Storage: %s", e)
         raise HTTPException(
             status_code=500,
             detail=f"An error occurred while saving to Firestore: {e}",
@@ -42,15 +58,17 @@ def save_own_photo_to_cloud_storage(
         bucket = storage_client.bucket(PROJECT)
         blob = bucket.blob(f"{GCS_PREFIX}/users_photo/{user_id}/{filename}")
 
-        blob.upload_from_string(content, content_type="image/jpeg")
+        with span("gcs.upload"):
+            blob.upload_from_string(content, content_type="image/jpeg")
 
         # ファイルを公開して、公開URLを取得
-        blob.make_public()
+        with span("gcs.make_public"):
+            blob.make_public()
         image_url: str = blob.public_url
         return image_url
 
     except Exception as e:
-        logging.error(f"Failed to upload image to Cloud Storage: {e}")
+        logger.error("Failed to upload image to Cloud Storage: %s", e)
         raise HTTPException(
             status_code=500,
             detail=f"An error occurred while saving to Firestore: {e}",
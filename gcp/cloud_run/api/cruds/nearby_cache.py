@@ -0,0 +1,88 @@
+# 近くの店舗の検索結果 (Places Nearby Search の店舗ID) をタイルごとにFirestoreへキャッシュする
+#
+# - nearbySearches/{z_x_y} に places (タイルの中心から検索した店舗のIDと座標。Placesの返却順)、placeIds、
+#   complete、fetchedAt、staleAt を持つ。リクエストでは写真の座標から検索の半径内の店舗だけを使う
+#   (Placesの規約上、店舗IDは期限なく保存できる。店舗の詳細は stores 側の staleAt で管理する)
+# - complete は検索結果が1ページ (最大20件) に収まったか。収まらなかったタイルは広げた半径の遠い店舗で
+#   埋まり、写真の近くの店舗が漏れることがあるため、リクエストでは写真の座標で検索し直す
+# - complete を持たない以前の形式のキャッシュは使わない
+# - 期限は PLACES_NEARBY_TTL_SECONDS (既定1日)。0にするとキャッシュを使わず、
+#   これまでどおり写真の座標そのもので毎回検索する
+# - キャッシュの読み書きに失敗してもリクエストは失敗させず、Placesで検索する
+# Standard Library
+import logging
+import os
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+# First Party Library
+from api.core.geotile import Tile, tile_key
+from api.core.metrics import span
+from api.core.store_freshness import is_fresh
+from api.cruds.write_behind import get_write_buffer
+
+logger = logging.getLogger(__name__)
+
+NEARBY_TTL_SECONDS = float(os.getenv("PLACES_NEARBY_TTL_SECONDS", str(24 * 3600)))
+COLLECTION = "nearbySearches"
+# get_allで一度に読むドキュメント数
+READ_CHUNK = 300
+
+
+def nearby_cache_ref(tile: Tile, db: Any) -> Any:
+    return db.collection(COLLECTION).document(tile_key(tile))
+
+
+def get_nearby_cache(tile: Tile, db: Any) -> Optional[Dict[str, Any]]:
+    try:
+        with span("firestore.get_nearby_cache"):
+            snapshot = nearby_cache_ref(tile, db).get()
+    except Exception as e:
+        logger.warning("Failed to read the nearby search cache: %s", e)
+        return None
+    return snapshot.to_dict() if snapshot.exists else None
+
+
+def get_nearby_caches(tiles: List[Tile], db: Any) -> Dict[Tile, Dict[str, Any]]:
+    # 複数のタイルのキャッシュをまとめて読む (キャッシュの無いタイルは含めない)
+    by_key = {tile_key(tile): tile for tile in tiles}
+    found: Dict[Tile, Dict[str, Any]] = {}
+    for start in range(0, len(tiles), READ_CHUNK):
+        refs = [nearby_cache_ref(tile, db) for tile in tiles[start : start + READ_CHUNK]]
+        with span("firestore.get_nearby_cache"):
+            for snapshot in db.get_all(refs):
+                if snapshot.exists:
+                    found[by_key[snapshot.id]] = snapshot.to_dict() or {}
+    return found
+
+
+def fresh_search(
+    cached: Optional[Dict[str, Any]], now: datetime
+) -> Optional[Tuple[List[Dict[str, Any]], bool]]:
+    # 期限内のキャッシュの (店舗 ({"placeId", "lat", "lon"} のリスト), complete)。使えなければNone
+    if cached is None or "complete" not in cached or not is_fresh(cached, now):
+        return None
+    return list(cached.get("places") or []), bool(cached["complete"])
+
+
+def nearby_cache_dict(
+    places: List[Dict[str, Any]], complete: bool, now: datetime
+) -> Dict[str, Any]:
+    return {
+        "places": places,
+        "placeIds": [place["placeId"] for place in places],
+        "complete": complete,
+        "fetchedAt": now,
+        "staleAt": now + timedelta(seconds=NEARBY_TTL_SECONDS),
+    }
+
+
+def save_nearby_cache(
+    tile: Tile, places: List[Dict[str, Any]], complete: bool, now: datetime, db: Any
+) -> None:
+    try:
+        get_write_buffer().set(
+            db, nearby_cache_ref(tile, db), nearby_cache_dict(places, complete, now), replace=True
+        )
+    except Exception as e:
+        logger.warning("Failed to save the nearby search cache: %s", e)
@@ -0,0 +1,96 @@
+# ユーザーの写真 (users/{uid}/photos) を新しい順にページごとに読む
+#
+# - createdAtの降順 (同じ時刻はドキュメントIDの降順) に並べる。createdAtは作成時にだけ書くため、
+#   スクロール中に写真が更新されても順番は変わらず、ページの重複や抜けが起きない
+# - categoryで絞り込む場合は複合インデックス (category 昇順, createdAt 降順) を使う (terraform/*/main.tf)
+# - 読むフィールドはselectで指定したものだけにする (カーソルに使うcreatedAtは常に読む)
+# - カーソルは最後の写真の (createdAt, ID) をURLセーフなbase64にしたもの。続きはstart_afterで読む
+# - 1件多く読み、次のページがある場合だけカーソルを返す
+# Standard Library
+import base64
+import json
+import logging
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+# Third Party Library
+from fastapi import HTTPException  # type: ignore
+
+# First Party Library
+from api.core.metrics import span
+
+logger = logging.getLogger(__name__)
+
+PHOTO_FIELDS = ("url", "category", "storeId", "areaStoreIds", "createdAt", "updatedAt")
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+# (写真ID, 選んだフィールドの値)
+Photo = Tuple[str, Dict[str, Any]]
+
+
+def encode_cursor(created_at: datetime, photo_id: str) -> str:
+    raw = json.dumps([created_at.isoformat(), photo_id], separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, str]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        created_at, photo_id = json.loads(raw)
+        return datetime.fromisoformat(created_at), str(photo_id)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="cursorが不正です")
+
+
+def photos_query(
+    db: Any,
+    user_id: str,
+    fields: List[str],
+    category: Optional[str],
+    cursor: Optional[str],
+    page_size: int,
+) -> Any:
+    # 同期・非同期のどちらのクライアントでも同じクエリを組み立てる
+    query = db.collection("users").document(user_id).collection("photos")
+    if category:
+        query = query.where("category", "==", category)
+    query = (
+        query.order_by("createdAt", direction="DESCENDING")
+        .order_by("__name__", direction="DESCENDING")
+        .select(sorted({*fields, "createdAt"}))
+        .limit(page_size + 1)
+    )
+    if cursor:
+        created_at, photo_id = decode_cursor(cursor)
+        query = query.start_after({"createdAt": created_at, "__name__": photo_id})
+    return query
+
+
+def to_page(snapshots: List[Any], page_size: int) -> Tuple[List[Photo], Optional[str]]:
+    photos = [(snapshot.id, snapshot.to_dict() or {}) for snapshot in snapshots[:page_size]]
+    if len(snapshots) <= page_size:
+        return photos, None
+    last_id, last_data = photos[-1]
+    return photos, encode_cursor(last_data["createdAt"], last_id)
+
+
+def list_photos(
+    user_id: str,
+    db: Any,
+    fields: List[str],
+    category: Optional[str] = None,
+    cursor: Optional[str] = None,
+    page_size: int = DEFAULT_PAGE_SIZE,
+) -> Tuple[List[Photo], Optional[str]]:
+    query = photos_query(db, user_id, fields, category, cursor, page_size)
+    try:
+        with span("firestore.list_photos"):
+            snapshots = list(query.stream())
+    except Exception as e:
+        logger.error("An error occurred while reading from Firestore: %s", e)
+        raise HTTPException(
+            status_code=500,
+            detail=f"An error occurred while reading from Firestore: {e}",
+        )
+    return to_page(snapshots, page_size)
@@ -0,0 +1,126 @@
+# 店舗の検索インデックス (api/core/store_search.py) をFirestoreの stores から作り、更新を取り込む
+#
+# - 既定では全件を読まず、検索したユーザーの店舗と更新された店舗だけを持つ。STORE_SEARCH_PRELOAD=1 の場合は
+#   最初の検索でバックグラウンドのスレッドから stores を全件読んで作る (100万件で500MiB程度。
+#   ワーカーのプロセスごとに作るため、メモリに余裕のあるインスタンスでだけ有効にする)
+# - このインスタンスで保存した店舗は保存時にすぐ反映する (api/cruds/firestore.py)。他のインスタンスや
+#   ジョブの更新は、前回から STORE_SEARCH_SYNC_SECONDS 以上経った検索の前に、updatedAtが前回読んだ
+#   最大値以降の店舗だけを読んで取り込む
+# - ユーザーの店舗のうちインデックスに無いものはその場で読んで足す (全件を読み終わる前でも検索できる)
+# Standard Library
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Any, Iterable, Iterator, List, Optional, Tuple
+
+# First Party Library
+from api.core.metrics import span
+from api.core.store_search import StoreSearchIndex, get_store_index
+from api.cruds.firestore import get_stores
+
+logger = logging.getLogger(__name__)
+
+SYNC_SECONDS = float(os.getenv("STORE_SEARCH_SYNC_SECONDS", "60"))
+PRELOAD = os.getenv("STORE_SEARCH_PRELOAD", "0") != "0"
+FIELDS = ["name", "city", "prefecture", "updatedAt"]
+
+_state_lock = threading.Lock()
+_sync_lock = threading.Lock()
+_loader: Optional[threading.Thread] = None
+_loaded = False
+_watermark: Optional[datetime] = None
+_synced_at = 0.0
+
+
+def _entries(
+    snapshots: Iterable[Any], latest: List[Optional[datetime]]
+) -> Iterator[Tuple[str, Optional[str], Optional[str], Optional[str]]]:
+    # latest[0] に読んだ店舗のupdatedAtの最大値を残す
+    for snapshot in snapshots:
+        data = snapshot.to_dict() or {}
+        updated_at = data.get("updatedAt")
+        if updated_at is not None and (latest[0] is None or updated_at > latest[0]):
+            latest[0] = updated_at
+        yield snapshot.id, data.get("name"), data.get("city"), data.get("prefecture")
+
+
+def load_store_index(db: Any, index: Optional[StoreSearchIndex] = None) -> int:
+    # stores を全件読んで作り直す
+    global _loaded, _watermark, _synced_at
+    index = get_store_index() if index is None else index
+    started = time.monotonic()
+    latest: List[Optional[datetime]] = [None]
+    with span("firestore.list_stores"):
+        index.build(_entries(db.collection("stores").select(FIELDS).stream(), latest))
+    with _state_lock:
+        _loaded, _watermark, _synced_at = True, latest[0], time.monotonic()
+    logger.info("Indexed %d stores in %.1fs", len(index), time.monotonic() - started)
+    return len(index)
+
+
+def _load_in_background(db: Any) -> None:
+    global _loader
+    try:
+        load_store_index(db)
+    except Exception as e:
+        logger.error("Failed to build the store search index: %s", e)
+        with _state_lock:
+            # 次の検索でもう一度作る
+            _loader = None
+
+
+def sync_store_index(db: Any, index: Optional[StoreSearchIndex] = None) -> int:
+    # 前回読んだ最大のupdatedAt以降に保存された店舗を取り込む (同じ時刻の店舗を落とさないよう以上で読む)
+    global _watermark, _synced_at
+    index = get_store_index() if index is None else index
+    with _state_lock:
+        watermark = _watermark
+    query = db.collection("stores").select(FIELDS)
+    if watermark is not None:
+        query = query.where("updatedAt", ">=", watermark)
+    latest: List[Optional[datetime]] = [watermark]
+    count = 0
+    with span("firestore.list_stores"):
+        for store_id, name, city, prefecture in _entries(query.stream(), latest):
+            index.upsert(store_id, name, city, prefecture)
+            count += 1
+    with _state_lock:
+        _watermark, _synced_at = latest[0], time.monotonic()
+    return count
+
+
+def prepare_store_index(db: Any) -> None:
+    # 検索の前に呼ぶ。初回は全件の読み込みを始め、読み込み後は間隔をおいて差分を取り込む
+    global _loader, _loaded, _watermark, _synced_at
+    with _state_lock:
+        if not PRELOAD and not _loaded:
+            # 今より後に更新された店舗だけを取り込む
+            _loaded, _watermark, _synced_at = True, datetime.now(timezone.utc), time.monotonic()
+        if _loader is None and not _loaded:
+            _loader = threading.Thread(
+                target=_load_in_background, args=(db,), name="store-index", daemon=True
+            )
+            _loader.start()
+            return
+        due = _loaded and time.monotonic() - _synced_at >= SYNC_SECONDS
+    # 同時に来た検索のうち1つだけが取り込む (他は待たずに今の内容で検索する)
+    if due and _sync_lock.acquire(blocking=False):
+        try:
+            sync_store_index(db)
+        except Exception as e:
+            logger.warning("Failed to sync the store search index: %s", e)
+        finally:
+            _sync_lock.release()
+
+
+def ensure_stores_indexed(store_ids: List[str], db: Any) -> int:
+    index = get_store_index()
+    missing = [store_id for store_id in store_ids if store_id not in index]
+    if not missing:
+        return 0
+    stores = get_stores(missing, db)
+    for store_id, data in stores.items():
+        index.upsert(store_id, data.get("name"), data.get("city"), data.get("prefecture"))
+    return len(stores)
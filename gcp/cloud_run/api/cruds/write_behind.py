@@ -0,0 +1,307 @@
+# Firestoreへの書き込みをまとめるライトビハインド
+#
+# - 既定 (WRITE_BEHIND_WINDOW_MS=0) では呼び出しごとに1回で書き込む。まとめ (コアレス) や
+#   バッチ化は行わない。新規作成時だけ書くフィールド (createdAt など) がある場合は読まずに
+#   create() し、既に存在すれば (AlreadyExists) マージ書き込みに切り替える
+# - ウィンドウを指定した場合だけ、同じドキュメントへの書き込みをその間に1つにまとめ (マージ)、
+#   WriteBatch (最大500件) でまとめてコミットする。新規作成時だけ書くフィールドは
+#   フラッシュ時に対象ドキュメントをまとめて1回読み (get_all)、存在しないものにだけ付ける
+# - 書き込みが成功したドキュメントは STATUS_CACHE_TTL 秒の間「存在する」とみなし、
+#   create() や読み込みを省く
+# - 直近に書いた値と同じ書き込み (dedupe=True) は送らない。値はコミットが成功してから覚え、
+#   キャッシュは STATUS_CACHE_TTL 秒で失効させる (他のプロセスが書き換えた場合も一定時間で書き直す)
+#
+# 耐久性について
+# - 既定では同期で書き込み、失敗は呼び出し元に例外で返す
+#   (リクエストはコミットされた書き込みだけを成功として返す)
+# - ウィンドウを指定した場合、呼び出し元にはキューに積んだ時点で返るため、書き込みの失敗は
+#   リクエストに返らない (ログと write_behind_flush_errors_total で検知する)。
+#   書き込みを失ってもよいジョブなどで使う
+#     - フラッシュは WRITE_BEHIND_WINDOW_MS ごと、保留が WRITE_BEHIND_MAX_PENDING 件を超えた時、
+#       シャットダウン時 (main.py) に行う。SIGKILLやクラッシュでは最大1ウィンドウ分の書き込みが失われる
+#     - 失敗したバッチは1回だけ再試行し、それでも失敗した場合は破棄する
+#     - フラッシュまでの間は他のリクエストから書き込みが見えない (/findOpenStores など)
+# Standard Library
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+# First Party Library
+from api.core.metrics import describe, increment, register_collector, span
+
+logger = logging.getLogger(__name__)
+
+WINDOW_SECONDS = float(os.getenv("WRITE_BEHIND_WINDOW_MS", "0")) / 1e3
+MAX_PENDING = int(os.getenv("WRITE_BEHIND_MAX_PENDING", "500"))
+STATUS_CACHE_TTL = float(os.getenv("STATUS_CACHE_TTL", "60"))
+STATUS_CACHE_SIZE = 10000
+BATCH_SIZE = 500
+# create() が既存のドキュメントに当たった時の例外 (重い依存を読み込まないようにクラス名で判定する)
+ALREADY_EXISTS_EXCEPTIONS = frozenset({"AlreadyExists", "Conflict"})
+
+describe("write_behind_pending", "gauge", "Documents waiting to be written.")
+describe("write_behind_coalesced_total", "counter", "Writes merged into a pending write.")
+describe("write_behind_skipped_total", "counter", "Writes skipped as unchanged.")
+describe("write_behind_commits_total", "counter", "Commits sent to Firestore.")
+describe("write_behind_flush_errors_total", "counter", "Batched commits that were dropped.")
+
+
+@dataclass
+class PendingWrite:
+    db: Any
+    reference: Any
+    fields: Dict[str, Any] = field(default_factory=dict)
+    # ArrayUnionで追加する値
+    unions: Dict[str, List[Any]] = field(default_factory=dict)
+    # ドキュメントが存在しない場合だけ書くフィールド
+    create_only: Dict[str, Any] = field(default_factory=dict)
+    # Trueならマージせずにドキュメント全体を置き換える
+    replace: bool = False
+    # コミットが成功したら重複除去のキャッシュに覚える値
+    dedupe_fields: Dict[str, Any] = field(default_factory=dict)
+
+    def merge(
+        self,
+        fields: Dict[str, Any],
+        unions: Optional[Dict[str, List[Any]]],
+        create_only: Optional[Dict[str, Any]],
+        replace: bool,
+    ) -> None:
+        if replace:
+            # 置き換えの場合はそれまでのマージ内容を捨てる
+            self.fields, self.unions, self.dedupe_fields, self.replace = {}, {}, {}, True
+        self.fields.update(fields)
+        for name, values in (unions or {}).items():
+            merged = self.unions.setdefault(name, [])
+            merged.extend(value for value in values if value not in merged)
+        for name, value in (create_only or {}).items():
+            self.create_only.setdefault(name, value)
+
+
+class WriteBehindBuffer:
+    def __init__(self, window: float = WINDOW_SECONDS, max_pending: int = MAX_PENDING) -> None:
+        self.window = window
+        self.max_pending = max_pending
+        self._pending: Dict[str, PendingWrite] = {}
+        self._last_written: "OrderedDict[Tuple[str, str], Tuple[Any, float]]" = OrderedDict()
+        # 書き込みが成功した (存在が分かっている) ドキュメントのパスと時刻
+        self._existing: "OrderedDict[str, float]" = OrderedDict()
+        self._lock = threading.Lock()
+        # フラッシュは1スレッドずつ行う (順序を保つため)
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._thread_pid = 0
+
+    def pending_count(self) -> int:
+        return len(self._pending)
+
+    def _unchanged(self, path: str, fields: Dict[str, Any], now: float) -> bool:
+        for name, value in fields.items():
+            cached = self._last_written.get((path, name))
+            if cached is None or cached[0] != value or now - cached[1] > STATUS_CACHE_TTL:
+                return False
+        return True
+
+    def note_written(self, reference: Any, fields: Dict[str, Any]) -> None:
+        # バッファを通さずに書いた値も覚えておく (直後の同じ書き込みを省くため)
+        now = time.monotonic()
+        with self._lock:
+            for name, value in fields.items():
+                self._last_written[(reference.path, name)] = (value, now)
+                self._last_written.move_to_end((reference.path, name))
+            while len(self._last_written) > STATUS_CACHE_SIZE:
+                self._last_written.popitem(last=False)
+
+    def _forget(self, keys: List[Tuple[str, str]]) -> None:
+        with self._lock:
+            for key in keys:
+                self._last_written.pop(key, None)
+
+    def _known_to_exist(self, path: str, now: float) -> bool:
+        with self._lock:
+            written = self._existing.get(path)
+            return written is not None and now - written <= STATUS_CACHE_TTL
+
+    def _note_committed(self, writes: List[PendingWrite]) -> None:
+        now = time.monotonic()
+        with self._lock:
+            for write in writes:
+                self._existing[write.reference.path] = now
+                self._existing.move_to_end(write.reference.path)
+            while len(self._existing) > STATUS_CACHE_SIZE:
+                self._existing.popitem(last=False)
+        for write in writes:
+            if write.dedupe_fields:
+                self.note_written(write.reference, write.dedupe_fields)
+
+    def set(
+        self,
+        db: Any,
+        reference: Any,
+        fields: Dict[str, Any],
+        unions: Optional[Dict[str, List[Any]]] = None,
+        create_only: Optional[Dict[str, Any]] = None,
+        replace: bool = False,
+        dedupe: bool = False,
+    ) -> None:
+        path = reference.path
+        with self._lock:
+            if dedupe and path not in self._pending:
+                if self._unchanged(path, fields, time.monotonic()):
+                    increment("write_behind_skipped_total")
+                    return
+            pending = self._pending.get(path)
+            if self.window <= 0:
+                # 同期の場合は保留中の他の書き込みとまとめず、この書き込みだけをコミットする
+                pending = PendingWrite(db, reference)
+            elif pending is None:
+                pending = self._pending[path] = PendingWrite(db, reference)
+            else:
+                increment("write_behind_coalesced_total")
+            pending.merge(fields, unions, create_only, replace)
+            if dedupe:
+                pending.dedupe_fields.update(fields)
+            should_flush = len(self._pending) >= self.max_pending
+
+        if self.window <= 0:
+            self._commit([pending], self._create_or_merge, raise_errors=True)
+        elif should_flush:
+            self._wake.set()
+        self._ensure_thread()
+
+    def _ensure_thread(self) -> None:
+        # fork後の子プロセスではスレッドを作り直す
+        if self.window <= 0 or (self._thread is not None and self._thread_pid == os.getpid()):
+            return
+        with self._lock:
+            if self._thread is not None and self._thread_pid == os.getpid():
+                return
+            self._thread_pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name="write-behind", daemon=True)
+            self._thread.start()
+
+    def _run(self) -> None:
+        while True:
+            self._wake.wait(self.window)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Write-behind flush failed")
+
+    def flush(self) -> None:
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = list(self._pending.values()), {}
+            if not pending:
+                return
+            by_db: Dict[int, List[PendingWrite]] = {}
+            for write in pending:
+                by_db.setdefault(id(write.db), []).append(write)
+            for writes in by_db.values():
+                for start in range(0, len(writes), BATCH_SIZE):
+                    self._commit(writes[start : start + BATCH_SIZE], self._commit_batch)
+
+    def _data(self, write: PendingWrite) -> Dict[str, Any]:
+        data = dict(write.fields)
+        if write.unions:
+            # Third Party Library
+            from google.cloud.firestore import ArrayUnion  # type: ignore
+
+            for name, values in write.unions.items():
+                data[name] = ArrayUnion(values)
+        return data
+
+    def _create_or_merge(self, writes: List[PendingWrite]) -> None:
+        # 同期の書き込みは読まずに送る。新規作成時だけ書くフィールドがあればまずcreate()し、
+        # 既に存在すればそのフィールドを除いてマージする
+        now = time.monotonic()
+        for write in writes:
+            data = self._data(write)
+            with span("firestore.write_behind_commit"):
+                if write.create_only and not self._known_to_exist(write.reference.path, now):
+                    try:
+                        write.reference.create({**write.create_only, **data})
+                        continue
+                    except Exception as e:
+                        if type(e).__name__ not in ALREADY_EXISTS_EXCEPTIONS:
+                            raise
+                write.reference.set(data, merge=not write.replace)
+
+    def _existing_paths(self, db: Any, writes: List[PendingWrite]) -> Set[str]:
+        now = time.monotonic()
+        paths = {write.reference.path for write in writes if write.create_only}
+        existing = {path for path in paths if self._known_to_exist(path, now)}
+        references = [
+            write.reference
+            for write in writes
+            if write.create_only and write.reference.path not in existing
+        ]
+        if not references:
+            return existing
+        field_paths = sorted({name for write in writes for name in write.create_only})
+        with span("firestore.write_behind_get_all"):
+            return existing | {
+                snapshot.reference.path
+                for snapshot in db.get_all(references, field_paths=field_paths)
+                if snapshot.exists
+            }
+
+    def _commit_batch(self, writes: List[PendingWrite]) -> None:
+        db = writes[0].db
+        existing = self._existing_paths(db, writes)
+        batch = db.batch()
+        for write in writes:
+            data = self._data(write)
+            if write.reference.path not in existing:
+                for name, value in write.create_only.items():
+                    data.setdefault(name, value)
+            batch.set(write.reference, data, merge=not write.replace)
+        with span("firestore.write_behind_commit"):
+            batch.commit()
+
+    def _commit(
+        self,
+        writes: List[PendingWrite],
+        send: Callable[[List[PendingWrite]], None],
+        raise_errors: bool = False,
+    ) -> None:
+        error: Optional[Exception] = None
+        for attempt in range(2):
+            try:
+                send(writes)
+                increment("write_behind_commits_total")
+                logger.debug("Committed %d buffered writes", len(writes))
+                # 成功した書き込みだけを重複除去のキャッシュに覚える
+                self._note_committed(writes)
+                return
+            except Exception as e:
+                error = e
+                logger.warning("Write-behind commit failed (attempt %d): %s", attempt + 1, e)
+        # 書けたか分からない値はキャッシュから消し、次の書き込みを省かないようにする
+        self._forget(
+            [(write.reference.path, name) for write in writes for name in write.dedupe_fields]
+        )
+        if raise_errors and error is not None:
+            raise error
+        increment("write_behind_flush_errors_total")
+        logger.error(
+            "Dropped %d buffered writes",
+            len(writes),
+            extra={"paths": [write.reference.path for write in writes]},
+        )
+
+
+_buffer = WriteBehindBuffer()
+
+
+def get_write_buffer() -> WriteBehindBuffer:
+    return _buffer
+
+
+register_collector(lambda: [("gauge", "write_behind_pending", (), float(_buffer.pending_count()))])
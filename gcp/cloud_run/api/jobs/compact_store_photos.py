@@ -0,0 +1,190 @@
+# どの stores/{id}.imageUrls からも参照されていない店舗写真をGCSから削除する
+# 実行方法: python -m api.jobs.compact_store_photos --dry-run
+#
+# - 参照されているURLはstoresをページごとに読み、Bloomフィルタに入れる (件数によらず一定のメモリ)
+#   偽陽性は「参照されている」側に倒れるため、参照中の写真を消すことは無い (一部の孤立写真が残るだけ)
+# - バケットの一覧はページごとに読み、孤立した写真はバッチAPI (100件ずつ) で並列に削除する
+# - 直前にアップロードされ、まだFirestoreに書かれていない写真を消さないよう、
+#   --min-age-hours より新しいオブジェクトは対象外にする
+# - ユーザーの写真 (users_photo/) は対象外
+# Standard Library
+import argparse
+import json
+import logging
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from dataclasses import asdict, dataclass
+from datetime import datetime, timedelta, timezone
+from typing import Any, Iterator, List, Set
+
+# First Party Library
+from api.core.bloom import BloomFilter
+from api.core.log import setup_logging
+from api.cruds.gcs import GCS_PREFIX, PROJECT, object_name_from_url
+
+logger = logging.getLogger(__name__)
+
+STORE_PAGE_SIZE = 1000
+LIST_PAGE_SIZE = 1000
+DELETE_BATCH_SIZE = 100
+USER_PHOTO_PREFIX = f"{GCS_PREFIX}/users_photo/"
+
+
+@dataclass
+class CompactionReport:
+    referenced_urls: int = 0
+    filter_bytes: int = 0
+    listed: int = 0
+    referenced: int = 0
+    too_young: int = 0
+    orphaned: int = 0
+    orphaned_bytes: int = 0
+    deleted: int = 0
+    failed_batches: int = 0
+    elapsed_seconds: float = 0.0
+
+
+def iter_image_urls(db: Any) -> Iterator[str]:
+    # imageUrlsだけをページごとに読む (全件をメモリに載せない)
+    query = db.collection("stores").select(["imageUrls"]).limit(STORE_PAGE_SIZE)
+    last = None
+    while True:
+        page = list((query.start_after(last) if last is not None else query).stream())
+        if not page:
+            return
+        for snapshot in page:
+            yield from (snapshot.to_dict() or {}).get("imageUrls") or []
+        last = page[-1]
+
+
+def load_referenced(db: Any, bucket: str, expected: int, error_rate: float) -> BloomFilter:
+    referenced = BloomFilter(expected, error_rate)
+    for url in iter_image_urls(db):
+        name = object_name_from_url(url, bucket)
+        if name is not None:
+            referenced.add(name)
+    if referenced.count > expected:
+        logger.warning(
+            "Loaded %d URLs into a filter sized for %d; more orphans will be kept",
+            referenced.count,
+            expected,
+        )
+    return referenced
+
+
+class _Deleter:
+    # 孤立した写真を DELETE_BATCH_SIZE 件ずつ並列に削除する。実行中のバッチは workers*2 件までに抑え、
+    # 一覧を読み進めすぎないようにする
+
+    def __init__(self, storage_client: Any, bucket: Any, workers: int, report: CompactionReport):
+        self._storage_client = storage_client
+        self._bucket = bucket
+        self._pool = ThreadPoolExecutor(workers)
+        self._limit = workers * 2
+        self._pending: Set["Future[int]"] = set()
+        self._batch: List[Any] = []
+        self._report = report
+
+    def _delete(self, blobs: List[Any]) -> int:
+        with self._storage_client.batch(raise_exception=False):
+            self._bucket.delete_blobs(blobs, on_error=lambda blob: None)
+        return len(blobs)
+
+    def _collect(self, futures: Set["Future[int]"]) -> None:
+        for future in futures:
+            if future.exception() is None:
+                self._report.deleted += future.result()
+            else:
+                self._report.failed_batches += 1
+                logger.warning("Delete batch failed: %s", future.exception())
+
+    def _submit(self) -> None:
+        if len(self._pending) >= self._limit:
+            finished, self._pending = wait(self._pending, return_when=FIRST_COMPLETED)
+            self._collect(finished)
+        self._pending.add(self._pool.submit(self._delete, self._batch))
+        self._batch = []
+
+    def add(self, blob: Any) -> None:
+        self._batch.append(blob)
+        if len(self._batch) == DELETE_BATCH_SIZE:
+            self._submit()
+
+    def close(self) -> None:
+        if self._batch:
+            self._submit()
+        self._collect(wait(self._pending).done)
+        self._pool.shutdown()
+
+
+def compact(
+    db: Any,
+    storage_client: Any,
+    dry_run: bool = True,
+    min_age: timedelta = timedelta(hours=24),
+    expected_urls: int = 2_000_000,
+    error_rate: float = 1e-4,
+    workers: int = 16,
+    bucket_name: str = PROJECT,
+) -> CompactionReport:
+    started = time.monotonic()
+    report = CompactionReport()
+    referenced = load_referenced(db, bucket_name, expected_urls, error_rate)
+    report.referenced_urls = referenced.count
+    report.filter_bytes = referenced.memory_bytes
+    logger.info("Loaded %d referenced URLs (%d bytes)", referenced.count, referenced.memory_bytes)
+
+    cutoff = datetime.now(timezone.utc) - min_age
+    deleter = _Deleter(storage_client, storage_client.bucket(bucket_name), workers, report)
+    pages = storage_client.list_blobs(
+        bucket_name, prefix=f"{GCS_PREFIX}/", page_size=LIST_PAGE_SIZE
+    ).pages
+    try:
+        for page in pages:
+            for blob in page:
+                report.listed += 1
+                if blob.name.startswith(USER_PHOTO_PREFIX):
+                    continue
+                if blob.name in referenced:
+                    report.referenced += 1
+                elif blob.time_created is not None and blob.time_created > cutoff:
+                    report.too_young += 1
+                else:
+                    report.orphaned += 1
+                    report.orphaned_bytes += blob.size or 0
+                    if not dry_run:
+                        deleter.add(blob)
+    finally:
+        deleter.close()
+
+    report.elapsed_seconds = round(time.monotonic() - started, 2)
+    return report
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--dry-run", action="store_true", help="only report what would be deleted")
+    parser.add_argument("--min-age-hours", type=float, default=24.0)
+    parser.add_argument("--expected-urls", type=int, default=2_000_000)
+    parser.add_argument("--error-rate", type=float, default=1e-4)
+    parser.add_argument("--workers", type=int, default=16)
+    args = parser.parse_args()
+    setup_logging()
+
+    # First Party Library
+    from api.core.clients import get_firestore_client, get_storage_client
+
+    report = compact(
+        get_firestore_client(),
+        get_storage_client(),
+        dry_run=args.dry_run,
+        min_age=timedelta(hours=args.min_age_hours),
+        expected_urls=args.expected_urls,
+        error_rate=args.error_rate,
+        workers=args.workers,
+    )
+    print(json.dumps(asdict(report), indent=2))
+
+
+if __name__ == "__main__":
+    main()
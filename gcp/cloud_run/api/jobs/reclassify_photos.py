@@ -0,0 +1,268 @@
+# ユーザーの写真 (users/*/photos) のカテゴリを判定し直すバックフィル
+# 実行方法: python -m api.jobs.reclassify_photos --checkpoint reclassify.json
+#
+# - photosをコレクショングループクエリでドキュメント名順にページごとに読む (前のページの最後から続きを読む)
+# - ページ内の画像はGCSから並列に取得して判定し、カテゴリが変わったものだけWriteBatchでまとめて書く
+#   (カテゴリ別の枚数 api/cruds/category_counts.py の増減も同じバッチで書く)
+# - 判定エンジンは --engine で選ぶ。gemini (既定) か、画像のバイト列を受け取り回答の文字列を返す関数を
+#   "module:function" 形式で指定する (ローカルのモデルなど)。回答は translate_food_category で変換する
+#   (Geminiが期限内に返らなかった写真は GEMINI_FALLBACK_CATEGORY を使わず失敗として数え、書き換えない)
+# - Geminiの呼び出しペースはAPIと同じトークンバケットで制御する (RATE_LIMITS="gemini=2,4" などで指定する)
+# - ページを書き終えるたびに最後のドキュメントのパスと集計を --checkpoint に保存する。
+#   同じファイルを指定して再実行すると続きから再開する (最初からやり直す場合はファイルを消す)
+# Standard Library
+import argparse
+import importlib
+import json
+import logging
+import os
+import time
+from concurrent.futures import Executor, ThreadPoolExecutor
+from dataclasses import asdict, dataclass, field
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+# First Party Library
+from api.core.food_category import translate_food_category
+from api.core.log import setup_logging
+from api.cruds.category_counts import counts_ref, get_shard_count, shard_for
+from api.cruds.gcs import PROJECT, object_name_from_url
+
+logger = logging.getLogger(__name__)
+
+# 1ページ分の書き込み (写真とカウンタのシャード) が1つのWriteBatch (最大500件) に収まるようにする
+PAGE_SIZE = 250
+
+Engine = Callable[[bytes], str]
+# (photoドキュメント, 変更前のカテゴリ, 変更後のカテゴリ)
+Change = Tuple[Any, Optional[str], str]
+
+
+@dataclass
+class ReclassifyReport:
+    scanned: int = 0
+    skipped: int = 0
+    changed: int = 0
+    unchanged: int = 0
+    failed: int = 0
+    written: int = 0
+    batches: int = 0
+    elapsed_seconds: float = 0.0
+    photos_per_second: float = 0.0
+    complete: bool = False
+    # "変更前->変更後" ごとの件数
+    transitions: Dict[str, int] = field(default_factory=dict)
+
+
+def load_engine(spec: str) -> Engine:
+    if spec == "gemini":
+        # First Party Library
+        from api.core.gemini import categorize_from_gemini_api
+
+        return lambda photo_data: categorize_from_gemini_api(photo_data, use_fallback=False)
+    module_name, _, attr = spec.partition(":")
+    if not attr:
+        raise ValueError(f"engine must be 'gemini' or 'module:function', got {spec!r}")
+    engine: Engine = getattr(importlib.import_module(module_name), attr)
+    return engine
+
+
+def load_checkpoint(path: Optional[str]) -> Dict[str, Any]:
+    if not path or not os.path.exists(path):
+        return {}
+    with open(path, encoding="utf-8") as f:
+        state: Dict[str, Any] = json.load(f)
+    return state
+
+
+def save_checkpoint(path: str, cursor: Optional[str], report: ReclassifyReport) -> None:
+    # 書き込み途中で止まっても前回の内容が壊れないよう、一時ファイルから置き換える
+    temporary = f"{path}.tmp"
+    with open(temporary, "w", encoding="utf-8") as f:
+        json.dump({"cursor": cursor, "report": asdict(report)}, f, ensure_ascii=False, indent=2)
+    os.replace(temporary, path)
+
+
+def classify_photo(snapshot: Any, bucket: Any, engine: Engine) -> Optional[str]:
+    # 判定したカテゴリを返す。画像がこのプロジェクトのバケットに無い場合はNone
+    name = object_name_from_url((snapshot.to_dict() or {}).get("url") or "", bucket.name)
+    if name is None:
+        return None
+    photo_data = bucket.blob(name).download_as_bytes()
+    return translate_food_category(engine(photo_data))
+
+
+def _classify_safely(snapshot: Any, bucket: Any, engine: Engine) -> Tuple[str, Optional[str]]:
+    try:
+        category = classify_photo(snapshot, bucket, engine)
+    except Exception as e:
+        logger.warning("Failed to reclassify %s: %s", snapshot.reference.path, e)
+        return "failed", None
+    return ("skipped", None) if category is None else ("classified", category)
+
+
+def count_deltas(
+    db: Any, changes: List[Change], pool: Executor
+) -> List[Tuple[Any, Dict[str, Any]]]:
+    # カテゴリ別の枚数の増減を、カウンタのシャードごとにまとめる
+    # Third Party Library
+    from google.cloud.firestore import Increment  # type: ignore
+
+    user_ids = sorted({reference.path.split("/")[1] for reference, _, _ in changes})
+    shards = dict(zip(user_ids, pool.map(lambda user_id: get_shard_count(user_id, db), user_ids)))
+    deltas: Dict[Tuple[str, int], Dict[str, int]] = {}
+    for reference, previous, category in changes:
+        user_id = reference.path.split("/")[1]
+        counts = deltas.setdefault((user_id, shard_for(reference.id, shards[user_id])), {})
+        counts[category] = counts.get(category, 0) + 1
+        if previous:
+            counts[previous] = counts.get(previous, 0) - 1
+    return [
+        (
+            counts_ref(db, user_id, shard),
+            {"counts": {name: Increment(value) for name, value in counts.items() if value}},
+        )
+        for (user_id, shard), counts in deltas.items()
+        if any(counts.values())
+    ]
+
+
+def _write(db: Any, changes: List[Change], now: datetime, pool: Executor) -> None:
+    # 写真のカテゴリとカウンタの増減を1つのWriteBatchで書く
+    batch = db.batch()
+    for reference, _, category in changes:
+        batch.update(reference, {"category": category, "updatedAt": now})
+    for reference, data in count_deltas(db, changes, pool):
+        batch.set(reference, data, merge=True)
+    batch.commit()
+
+
+def commit_changes(
+    db: Any, changes: List[Change], now: datetime, report: ReclassifyReport, pool: Executor
+) -> None:
+    try:
+        _write(db, changes, now, pool)
+        report.written += len(changes)
+        report.batches += 1
+        return
+    except Exception as e:
+        # 途中で削除された写真があるとバッチ全体が失敗するため、1件ずつ書き直す
+        logger.warning("Batch commit failed, retrying one by one: %s", e)
+    for change in changes:
+        try:
+            _write(db, [change], now, pool)
+            report.written += 1
+        except Exception as e:
+            report.failed += 1
+            logger.warning("Failed to update %s: %s", change[0].path, e)
+
+
+def _apply_page(
+    db: Any,
+    page: List[Any],
+    outcomes: List[Tuple[str, Optional[str]]],
+    report: ReclassifyReport,
+    dry_run: bool,
+    pool: Executor,
+) -> None:
+    changes: List[Change] = []
+    for snapshot, (outcome, category) in zip(page, outcomes):
+        report.scanned += 1
+        previous = (snapshot.to_dict() or {}).get("category")
+        if outcome == "failed":
+            report.failed += 1
+        elif category is None:
+            report.skipped += 1
+        elif category == previous:
+            report.unchanged += 1
+        else:
+            report.changed += 1
+            transition = f"{previous}->{category}"
+            report.transitions[transition] = report.transitions.get(transition, 0) + 1
+            changes.append((snapshot.reference, previous, category))
+    if changes and not dry_run:
+        commit_changes(db, changes, datetime.now(timezone.utc), report, pool)
+
+
+def reclassify(
+    db: Any,
+    storage_client: Any,
+    engine: Engine,
+    checkpoint: Optional[str] = None,
+    dry_run: bool = False,
+    workers: int = 16,
+    page_size: int = PAGE_SIZE,
+    limit: Optional[int] = None,
+    bucket_name: str = PROJECT,
+) -> ReclassifyReport:
+    state = load_checkpoint(checkpoint)
+    report = ReclassifyReport(**state.get("report", {}))
+    if report.complete:
+        logger.info("Checkpoint %s is already complete", checkpoint)
+        return report
+    cursor: Optional[str] = state.get("cursor")
+    started = time.monotonic()
+    previous_elapsed = report.elapsed_seconds
+    scanned_at_start = report.scanned
+
+    query = db.collection_group("photos").order_by("__name__").limit(min(page_size, PAGE_SIZE))
+    bucket = storage_client.bucket(bucket_name)
+    # 再開時だけカーソルのドキュメントを読む (以降は前のページの最後のスナップショットを使う)
+    last = db.document(cursor).get() if cursor else None
+    with ThreadPoolExecutor(workers) as pool:
+        while limit is None or report.scanned - scanned_at_start < limit:
+            page = list((query.start_after(last) if last is not None else query).stream())
+            if not page:
+                report.complete = True
+                break
+            outcomes = list(pool.map(lambda s: _classify_safely(s, bucket, engine), page))
+            _apply_page(db, page, outcomes, report, dry_run, pool)
+            last = page[-1]
+
+            elapsed = time.monotonic() - started
+            report.elapsed_seconds = round(previous_elapsed + elapsed, 2)
+            report.photos_per_second = round(report.scanned / max(report.elapsed_seconds, 1e-9), 2)
+            if checkpoint and not dry_run:
+                save_checkpoint(checkpoint, last.reference.path, report)
+            logger.info(
+                "Scanned %d photos (%.1f/s this run), changed %d, failed %d",
+                report.scanned,
+                (report.scanned - scanned_at_start) / max(elapsed, 1e-9),
+                report.changed,
+                report.failed,
+            )
+
+    if checkpoint and not dry_run and report.complete:
+        save_checkpoint(checkpoint, last.reference.path if last is not None else cursor, report)
+    return report
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--engine", default="gemini", help="gemini or module:function")
+    parser.add_argument("--checkpoint", help="file to save progress to and resume from")
+    parser.add_argument("--dry-run", action="store_true", help="classify without writing")
+    parser.add_argument("--workers", type=int, default=16)
+    parser.add_argument("--page-size", type=int, default=PAGE_SIZE)
+    parser.add_argument("--limit", type=int, help="stop after about this many photos")
+    args = parser.parse_args()
+    setup_logging()
+
+    # First Party Library
+    from api.core.clients import get_firestore_client, get_storage_client
+
+    report = reclassify(
+        get_firestore_client(),
+        get_storage_client(),
+        load_engine(args.engine),
+        checkpoint=args.checkpoint,
+        dry_run=args.dry_run,
+        workers=args.workers,
+        page_size=args.page_size,
+        limit=args.limit,
+    )
+    print(json.dumps(asdict(report), ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+# 期限切れ (staleAt が現在より前) の店舗 (stores/{place_id}) をPlaces APIから取り直すジョブ
+# 実行方法: python -m api.jobs.refresh_stores --limit 5000
+# Cloud Schedulerなどから定期的に実行する (STORE_REFRESH_MODE=background の場合は必須)
+#
+# - 期限切れの店舗をstaleAtの順にページごとに読み、詳細の取得はスレッドで並列に行う
+#   (Placesの呼び出しペースはAPIと同じトークンバケットで制御する。RATE_LIMITS="places=5,10;places_photo=5,10" などで指定する)
+# - 書き込みはページごとのWriteBatchでマージする。createdAtは書かないので作成日時は変わらない
+# - --include-missing でstaleAtを持たない店舗 (期限を書く前に保存されたもの) も対象にする
+#   (店舗を全件読むため、移行時に一度だけ使う)
+# - --skip-photos で店舗写真の取り直しを省く (保存済みのimageUrlsを残す)
+# Standard Library
+import argparse
+import json
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass
+from datetime import datetime, timezone
+from typing import Any, Iterable, Iterator, List, Optional
+
+# First Party Library
+from api.core.log import setup_logging
+from api.core.store_freshness import is_fresh
+from api.cruds.firestore import store_to_dict
+from api.schemas.find_nearby_restaurant import build_store_data, get_place_details
+
+logger = logging.getLogger(__name__)
+
+# 1ページ分の書き込みが1つのWriteBatch (最大500件) に収まるようにする
+PAGE_SIZE = 500
+
+
+@dataclass
+class RefreshReport:
+    scanned: int = 0
+    refreshed: int = 0
+    failed: int = 0
+    batches: int = 0
+    elapsed_seconds: float = 0.0
+    stores_per_second: float = 0.0
+
+
+def iter_stale_pages(
+    db: Any, now: datetime, page_size: int, include_missing: bool
+) -> Iterator[List[Any]]:
+    if include_missing:
+        # staleAtの無い店舗は不等号のクエリに出てこないため、全件を読んで絞り込む
+        query = db.collection("stores").select(["staleAt"]).limit(page_size)
+    else:
+        query = (
+            db.collection("stores")
+            .where("staleAt", "<", now)
+            .order_by("staleAt")
+            .select(["staleAt"])
+            .limit(page_size)
+        )
+    last = None
+    while True:
+        page = list((query.start_after(last) if last is not None else query).stream())
+        if not page:
+            return
+        last = page[-1]
+        yield [snapshot for snapshot in page if not is_fresh(snapshot.to_dict() or {}, now)]
+
+
+def _refresh_one(store_id: str, api_key: str, storage_client: Any, mirror_photos: bool) -> Any:
+    try:
+        details = get_place_details(store_id, api_key)
+        return build_store_data(store_id, details, api_key, storage_client, mirror_photos)
+    except Exception as e:
+        logger.warning("Failed to refresh store %s: %s", store_id, e)
+        return None
+
+
+def _write_page(db: Any, page: List[Any], results: Iterable[Any], keep_image_urls: bool) -> int:
+    batch = db.batch()
+    current_time = datetime.now(timezone.utc)
+    count = 0
+    for snapshot, store_data in zip(page, results):
+        if store_data is not None:
+            batch.set(
+                snapshot.reference,
+                store_to_dict(store_data, current_time, keep_image_urls),
+                merge=True,
+            )
+            count += 1
+    if count:
+        batch.commit()
+    return count
+
+
+def refresh_stores(
+    db: Any,
+    storage_client: Any,
+    api_key: str,
+    workers: int = 8,
+    page_size: int = PAGE_SIZE,
+    limit: Optional[int] = None,
+    include_missing: bool = False,
+    mirror_photos: bool = True,
+) -> RefreshReport:
+    started = time.monotonic()
+    report = RefreshReport()
+    now = datetime.now(timezone.utc)
+    pages = iter_stale_pages(db, now, min(page_size, PAGE_SIZE), include_missing)
+    with ThreadPoolExecutor(workers) as pool:
+        for page in pages:
+            if limit is not None:
+                page = page[: limit - report.scanned]
+            if page:
+                results = pool.map(
+                    lambda s: _refresh_one(s.id, api_key, storage_client, mirror_photos), page
+                )
+                written = _write_page(db, page, list(results), not mirror_photos)
+                report.scanned += len(page)
+                report.refreshed += written
+                report.failed += len(page) - written
+                report.batches += written > 0
+                logger.info(
+                    "Refreshed %d of %d stale stores (%d failed)",
+                    report.refreshed,
+                    report.scanned,
+                    report.failed,
+                )
+            if limit is not None and report.scanned >= limit:
+                break
+
+    report.elapsed_seconds = round(time.monotonic() - started, 2)
+    report.stores_per_second = round(report.scanned / max(report.elapsed_seconds, 1e-9), 2)
+    return report
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--page-size", type=int, default=PAGE_SIZE)
+    parser.add_argument("--limit", type=int, help="refresh at most this many stores")
+    parser.add_argument(
+        "--include-missing", action="store_true", help="also stores without staleAt"
+    )
+    parser.add_argument("--skip-photos", action="store_true", help="keep the saved imageUrls")
+    args = parser.parse_args()
+    setup_logging()
+
+    # First Party Library
+    from api.core.clients import get_firestore_client, get_storage_client
+
+    report = refresh_stores(
+        get_firestore_client(),
+        get_storage_client(),
+        os.getenv("PLACE_API_KEY", "default-place-api-key"),
+        workers=args.workers,
+        page_size=args.page_size,
+        limit=args.limit,
+        include_missing=args.include_missing,
+        mirror_photos=not args.skip_photos,
+    )
+    print(json.dumps(asdict(report), indent=2))
+
+
+if __name__ == "__main__":
+    main()
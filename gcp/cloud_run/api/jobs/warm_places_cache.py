@@ -0,0 +1,306 @@
+# リクエストが集中する地域の近くの店舗の検索結果と店舗の詳細を、朝のピークの前に取得しておくジョブ
+# 実行方法: python -m api.jobs.warm_places_cache --log requests.jsonl --budget 2000
+# Cloud Schedulerなどからピークの前に実行する
+#
+# - 直近 --since-hours 時間のリクエストの座標を、JSONのログ (1行1件) から集める
+#   (api.core.log の出力、Cloud Loggingのエクスポート (jsonPayload)、記録したトレース (body) のどれでもよい)
+# - 座標を HOT_TILE_ZOOM のタイルで数え、上位 --top タイルに含まれる検索タイル (NEARBY_ZOOM) を
+#   リクエストの多い順に温める。検索結果のキャッシュ (api/cruds/nearby_cache.py) が期限切れなら検索し直し、
+#   期限切れ・未保存の店舗は詳細を取得して stores に保存する
+# - Placesの呼び出し (検索・詳細・写真のダウンロード) は --budget 回まで。写真の分が足りない店舗は
+#   写真を取らずに保存する。呼び出しペースはAPIと同じトークンバケットで制御する
+# - 集めたリクエストが温める前後のキャッシュでPlacesを呼ばずに済んだ割合 (ヒット率) を報告する
+#   (次のピークが直近と同じ地域に集まると仮定した見込み)
+# Standard Library
+import argparse
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+# First Party Library
+from api.core.geotile import HOT_TILE_ZOOM, Tile, parent_tile, tile_for
+from api.core.log import setup_logging
+from api.core.store_freshness import is_fresh
+from api.cruds.firestore import get_stores, store_to_dict
+from api.cruds.nearby_cache import fresh_search, get_nearby_caches, save_nearby_cache
+from api.cruds.write_behind import get_write_buffer
+from api.schemas.find_nearby_restaurant import (
+    build_store_data,
+    get_place_details,
+    search_tile_places,
+)
+
+logger = logging.getLogger(__name__)
+
+# ログの中で座標を探す場所 (ログのフィールド、Cloud Loggingのエクスポート、トレースのリクエスト本文)
+PAYLOAD_KEYS = ("jsonPayload", "body")
+TIME_KEYS = ("time", "timestamp")
+
+
+@dataclass
+class Sample:
+    lat: float
+    lon: float
+    at: Optional[datetime]
+
+
+@dataclass
+class WarmReport:
+    samples: int = 0
+    hot_tiles: int = 0
+    cells_planned: int = 0
+    cells_warmed: int = 0
+    stores_warmed: int = 0
+    nearby_calls: int = 0
+    details_calls: int = 0
+    photo_downloads: int = 0
+    budget: int = 0
+    budget_left: int = 0
+    nearby_hit_rate_before: float = 0.0
+    nearby_hit_rate_after: float = 0.0
+    hit_rate_before: float = 0.0
+    hit_rate_after: float = 0.0
+    elapsed_seconds: float = 0.0
+
+
+class Budget:
+    # Placesの呼び出し回数の上限 (スレッド間で共有する)
+
+    def __init__(self, calls: int) -> None:
+        self.left = calls
+        self._lock = threading.Lock()
+
+    def spend(self, calls: int) -> bool:
+        with self._lock:
+            if calls > self.left:
+                return False
+            self.left -= calls
+            return True
+
+
+def _parse_time(value: Any) -> Optional[datetime]:
+    if not isinstance(value, str):
+        return None
+    try:
+        parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    return parsed if parsed.tzinfo is not None else parsed.replace(tzinfo=timezone.utc)
+
+
+def parse_sample(entry: Dict[str, Any]) -> Optional[Sample]:
+    at = next((_parse_time(entry.get(key)) for key in TIME_KEYS if key in entry), None)
+    for payload in (entry, *(entry.get(key) for key in PAYLOAD_KEYS)):
+        if not isinstance(payload, dict):
+            continue
+        lat, lon = payload.get("lat"), payload.get("lon")
+        if isinstance(lat, (int, float)) and isinstance(lon, (int, float)):
+            return Sample(float(lat), float(lon), at)
+    return None
+
+
+def read_samples(lines: Iterable[str], since: Optional[datetime]) -> Iterator[Sample]:
+    # 時刻の無いエントリ (トレースなど) は期間によらず使う
+    for line in lines:
+        try:
+            entry = json.loads(line)
+        except ValueError:
+            continue
+        sample = parse_sample(entry) if isinstance(entry, dict) else None
+        if sample is not None and (since is None or sample.at is None or sample.at >= since):
+            yield sample
+
+
+def plan_cells(
+    samples: List[Sample], top: int, cells_per_tile: int
+) -> Tuple[List[Tile], "Counter[Tile]"]:
+    # (温める検索タイルの順, 検索タイルごとのリクエスト数) を返す
+    cells = Counter(tile_for(sample.lat, sample.lon) for sample in samples)
+    tiles: "Counter[Tile]" = Counter()
+    for cell, count in cells.items():
+        tiles[parent_tile(cell, HOT_TILE_ZOOM)] += count
+    hot = {tile for tile, _ in tiles.most_common(top)}
+    by_tile: Dict[Tile, List[Tile]] = {}
+    for cell, _ in cells.most_common():
+        tile = parent_tile(cell, HOT_TILE_ZOOM)
+        if tile in hot and len(by_tile.setdefault(tile, [])) < cells_per_tile:
+            by_tile[tile].append(cell)
+    planned = [cell for tile_cells in by_tile.values() for cell in tile_cells]
+    planned.sort(key=lambda cell: -cells[cell])
+    return planned, cells
+
+
+def hit_rates(cells: "Counter[Tile]", db: Any, now: datetime) -> Tuple[float, float]:
+    # (検索結果がキャッシュにある割合, 検索結果と全店舗の詳細が期限内でPlacesを呼ばずに済む割合)
+    total = sum(cells.values())
+    if not total:
+        return 0.0, 0.0
+    # (写真の座標で絞る前の、タイルで検索した店舗がすべて期限内かで数える。
+    #  件数の上限に達したタイルは写真の座標で検索し直すため、ヒットに数えない)
+    cached: Dict[Tile, List[str]] = {}
+    for cell, data in get_nearby_caches(list(cells), db).items():
+        search = fresh_search(data, now)
+        if search is not None and search[1]:
+            cached[cell] = [place["placeId"] for place in search[0]]
+    place_ids = sorted({place_id for ids in cached.values() for place_id in ids})
+    stores = get_stores(place_ids, db)
+    fresh = {store_id for store_id, data in stores.items() if is_fresh(data, now)}
+    nearby_hits = sum(cells[cell] for cell in cached)
+    hits = sum(
+        cells[cell] for cell, ids in cached.items() if all(place_id in fresh for place_id in ids)
+    )
+    return nearby_hits / total, hits / total
+
+
+class Warmer:
+    def __init__(
+        self, db: Any, storage_client: Any, api_key: str, budget: Budget, mirror_photos: bool
+    ) -> None:
+        self.db = db
+        self.storage_client = storage_client
+        self.api_key = api_key
+        self.budget = budget
+        self.mirror_photos = mirror_photos
+        self.report = WarmReport()
+        self._lock = threading.Lock()
+
+    def _count(self, **calls: int) -> None:
+        with self._lock:
+            for name, value in calls.items():
+                setattr(self.report, name, getattr(self.report, name) + value)
+
+    def _warm_store(self, store_id: str, now: datetime) -> bool:
+        if not self.budget.spend(1):
+            return False
+        details = get_place_details(store_id, self.api_key)
+        photos = len(details.get("photos") or []) if self.mirror_photos else 0
+        # 写真の分の予算が無ければ、写真を取らずに保存する (保存済みのimageUrlsは残す)
+        mirror_photos = self.mirror_photos and self.budget.spend(photos)
+        store_data = build_store_data(
+            store_id, details, self.api_key, self.storage_client, mirror_photos
+        )
+        get_write_buffer().set(
+            self.db,
+            self.db.collection("stores").document(store_id),
+            store_to_dict(store_data, now, keep_image_urls=not mirror_photos),
+            create_only={"createdAt": now},
+        )
+        self._count(details_calls=1, photo_downloads=photos if mirror_photos else 0)
+        return True
+
+    def warm(self, cell: Tile, cached: Optional[Dict[str, Any]]) -> None:
+        now = datetime.now(timezone.utc)
+        try:
+            search = fresh_search(cached, now)
+            if search is None:
+                if not self.budget.spend(1):
+                    return
+                search = search_tile_places(cell, self.api_key)
+                save_nearby_cache(cell, *search, now, self.db)
+                self._count(nearby_calls=1)
+            # 件数の上限に達したタイルも、検索で見つかった店舗の詳細は温めておく
+            place_ids = [place["placeId"] for place in search[0]]
+            saved = get_stores(place_ids, self.db)
+            stale = [
+                store_id
+                for store_id in place_ids
+                if store_id not in saved or not is_fresh(saved[store_id], now)
+            ]
+            warmed = 0
+            for store_id in stale:
+                if not self._warm_store(store_id, now):
+                    break
+                warmed += 1
+            self._count(stores_warmed=warmed, cells_warmed=warmed == len(stale))
+        except Exception as e:
+            logger.warning("Failed to warm tile %s: %s", cell, e)
+
+
+def warm_places_cache(
+    samples: List[Sample],
+    db: Any,
+    storage_client: Any,
+    api_key: str,
+    budget: int,
+    top: int = 50,
+    cells_per_tile: int = 20,
+    workers: int = 8,
+    mirror_photos: bool = True,
+    dry_run: bool = False,
+) -> WarmReport:
+    started = time.monotonic()
+    planned, cells = plan_cells(samples, top, cells_per_tile)
+    now = datetime.now(timezone.utc)
+    before = hit_rates(cells, db, now)
+
+    warmer = Warmer(db, storage_client, api_key, Budget(budget), mirror_photos)
+    report = warmer.report
+    if not dry_run:
+        cached = get_nearby_caches(planned, db)
+        with ThreadPoolExecutor(workers) as pool:
+            list(pool.map(lambda cell: warmer.warm(cell, cached.get(cell)), planned))
+        get_write_buffer().flush()
+        after = hit_rates(cells, db, datetime.now(timezone.utc))
+    else:
+        after = before
+
+    report.samples = len(samples)
+    report.hot_tiles = len({parent_tile(cell, HOT_TILE_ZOOM) for cell in planned})
+    report.cells_planned = len(planned)
+    report.budget, report.budget_left = budget, warmer.budget.left
+    report.nearby_hit_rate_before, report.hit_rate_before = (round(rate, 4) for rate in before)
+    report.nearby_hit_rate_after, report.hit_rate_after = (round(rate, 4) for rate in after)
+    report.elapsed_seconds = round(time.monotonic() - started, 2)
+    return report
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--log", action="append", default=[], help="JSON lines ('-' for stdin)")
+    parser.add_argument("--since-hours", type=float, default=24.0)
+    parser.add_argument("--budget", type=int, default=1000, help="max Places calls")
+    parser.add_argument("--top", type=int, default=50, help="number of hot tiles")
+    parser.add_argument("--cells-per-tile", type=int, default=20)
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--skip-photos", action="store_true", help="keep the saved imageUrls")
+    parser.add_argument("--dry-run", action="store_true", help="only report the hit rate")
+    args = parser.parse_args()
+    setup_logging()
+
+    # First Party Library
+    from api.core.clients import get_firestore_client, get_storage_client
+
+    since = datetime.now(timezone.utc) - timedelta(hours=args.since_hours)
+    samples: List[Sample] = []
+    for path in args.log or ["-"]:
+        if path == "-":
+            samples.extend(read_samples(sys.stdin, since))
+        else:
+            with open(path, encoding="utf-8") as f:
+                samples.extend(read_samples(f, since))
+
+    report = warm_places_cache(
+        samples,
+        get_firestore_client(),
+        get_storage_client(),
+        os.getenv("PLACE_API_KEY", "default-place-api-key"),
+        args.budget,
+        top=args.top,
+        cells_per_tile=args.cells_per_tile,
+        workers=args.workers,
+        mirror_photos=not args.skip_photos,
+        dry_run=args.dry_run,
+    )
+    print(json.dumps(asdict(report), indent=2))
+
+
+if __name__ == "__main__":
+    main()
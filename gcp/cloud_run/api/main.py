@@ -1,12 +1,42 @@
+# Standard Library
+import time
+
+_import_started = time.perf_counter()
+
+# Standard Library
+import logging  # noqa: E402
+from typing import Any, AsyncIterator, Awaitable, Callable  # noqa: E402
+
 # Third Party Library
-from fastapi import FastAPI  # type: ignore
-from fastapi.middleware.cors import CORSMiddleware  # type: ignore
-from firebase_admin import credentials, initialize_app  # type: ignore
+from fastapi import FastAPI, Request, Response  # type: ignore # noqa: E402
+from fastapi.middleware.cors import CORSMiddleware  # type: ignore # noqa: E402
+from fastapi.responses import JSONResponse  # type: ignore # noqa: E402
 
 # First Party Library
-from api.routers import router  # type: ignore
+from api.core.id_token import InvalidIdToken, verify_id_token_async  # noqa: E402
+from api.core.log import setup_logging  # noqa: E402
+from api.core.metrics import observe  # noqa: E402
+from api.core.profiling import PROFILE_HEADER, RequestProfiler, should_profile  # noqa: E402
+from api.core.request_trace import (  # noqa: E402
+    build_entry,
+    close_trace_recorder,
+    get_trace_recorder,
+    is_traced_path,
+    parse_body,
+    should_trace,
+)
+from api.core.startup import (  # noqa: E402
+    configure_threadpool,
+    drain_upstream_calls,
+    flush_before_exit,
+    record_app_import,
+    start_warm_up,
+)
+from api.cruds.write_behind import get_write_buffer  # noqa: E402
+from api.routers import router  # type: ignore # noqa: E402
 
-initialize_app(credentials.Certificate("/auth/service_account.json"))
+setup_logging()
+logger = logging.getLogger(__name__)
 
 app = FastAPI()
 app.include_router(router.router)
@@ -17,3 +47,128 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+
+record_app_import(_import_started)
+
+
+@app.on_event("startup")
+async def warm_up_clients() -> None:
+    # Firebaseの初期化や重いimportはリクエスト受付と並行して行う (完了は /readyz で確認)
+    configure_threadpool()
+    app.state.warm_up_task = start_warm_up()
+
+
+@app.on_event("shutdown")
+async def drain_in_flight_calls() -> None:
+    # 新規の受付が止まった後、スレッドプールで実行中の外部呼び出しを待ってから終了する
+    warm_up_task = getattr(app.state, "warm_up_task", None)
+    if warm_up_task is not None and not warm_up_task.done():
+        warm_up_task.cancel()
+    await drain_upstream_calls()
+    # バッファ中のFirestoreへの書き込みとトレースを書き出してから終了する
+    await flush_before_exit(flush_buffers)
+
+
+def flush_buffers() -> None:
+    get_write_buffer().flush()
+    close_trace_recorder()
+
+
+@app.middleware("http")
+async def verify_authorization(
+    request: Request, call_next: Callable[[Request], Awaitable[Response]]
+) -> Response:
+    # BearerのIDトークンがあればローカルで検証し、クレームを request.state.auth_claims に置く
+    # (トークンが必須かどうかは各エンドポイントが判断する)
+    auth_header = request.headers.get("Authorization")
+    if auth_header and auth_header.startswith("Bearer "):
+        try:
+            request.state.auth_claims = await verify_id_token_async(auth_header[len("Bearer ") :])
+        except InvalidIdToken as e:
+            logger.info("Rejected ID token: %s", e)
+            return JSONResponse({"detail": "Invalid ID token"}, status_code=401)
+        except Exception as e:
+            # 公開鍵を取得できない場合など
+            logger.error("Could not verify ID token: %s", e)
+            return JSONResponse({"detail": "Could not verify ID token"}, status_code=503)
+    return await call_next(request)
+
+
+@app.middleware("http")
+async def record_request_duration(
+    request: Request, call_next: Callable[[Request], Awaitable[Response]]
+) -> Response:
+    started = time.perf_counter()
+    response = await call_next(request)
+    # パスパラメータでラベルが増えないようルートのテンプレートを使う
+    route: Any = request.scope.get("route")
+    observe(
+        "http_request_duration_seconds",
+        time.perf_counter() - started,
+        (("route", route.path if route else "unmatched"), ("status", str(response.status_code))),
+    )
+    return response
+
+
+@app.middleware("http")
+async def profile_request(
+    request: Request, call_next: Callable[[Request], Awaitable[Response]]
+) -> Response:
+    if request.url.path.startswith("/debug") or not should_profile(
+        request.headers.get(PROFILE_HEADER)
+    ):
+        return await call_next(request)
+
+    with RequestProfiler() as profiler:
+        response = await call_next(request)
+    route: Any = request.scope.get("route")
+    profiler.save(
+        route.path if route else request.url.path,
+        request.method,
+        getattr(request.state, "user_id", None),
+    )
+    if profiler.profile_id:
+        response.headers["X-Profile-Id"] = profiler.profile_id
+    return response
+
+
+@app.middleware("http")
+async def trace_request(
+    request: Request, call_next: Callable[[Request], Awaitable[Response]]
+) -> Response:
+    # REQUEST_TRACE_DIR 指定時のみ、再生用にリクエストの形を記録する (api/core/request_trace.py)
+    if not is_traced_path(request.url.path):
+        return await call_next(request)
+    started, clock = time.time(), time.perf_counter()
+    raw_body = await request.body()
+    body = parse_body(raw_body)
+    query = dict(request.query_params)
+    if not should_trace((body or {}).get("userId") or query.get("userId")):
+        return await call_next(request)
+
+    response = await call_next(request)
+    route: Any = request.scope.get("route")
+    body_iterator: Any = getattr(response, "body_iterator")
+
+    async def record_after_body() -> AsyncIterator[bytes]:
+        # レスポンスを送り終えた時点の所要時間とバイト数を記録する
+        response_bytes = 0
+        async for chunk in body_iterator:
+            response_bytes += len(chunk)
+            yield chunk
+        get_trace_recorder().record(
+            build_entry(
+                request.method,
+                route.path if route else request.url.path,
+                response.status_code,
+                started,
+                time.perf_counter() - clock,
+                len(raw_body),
+                response_bytes,
+                body,
+                query,
+            )
+        )
+
+    setattr(response, "body_iterator", record_after_body())
+    return response
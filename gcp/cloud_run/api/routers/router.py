@@ -1,70 +1,98 @@
 # Standard Library
-import logging
-from typing import Any
+import os
+from typing import Any, Optional
 
 # Third Party Library
-from fastapi import APIRouter, Depends, Request  # type: ignore
-from firebase_admin import firestore  # type: ignore
-from google.cloud import storage  # type: ignore
+from fastapi import APIRouter, Depends, HTTPException, Request  # type: ignore
+from fastapi.concurrency import run_in_threadpool  # type: ignore
+from fastapi.responses import JSONResponse, PlainTextResponse, Response  # type: ignore
 
 # First Party Library
+from api.core import clients
+from api.core.admission import admission, is_degraded
+from api.core.metrics import render_prometheus
+from api.core.profiling import PROFILE_HEADER, get_profile, is_authorized, list_profiles
+from api.core.startup import get_report, is_ready
+
 # from api.schemas.classify_photos import save_image
 from api.schemas.categorize_food import categorize_food
+from api.schemas.category_counts import get_category_counts, get_category_counts_async
 from api.schemas.find_nearby_restaurant import find_nearby_restaurant
-from api.schemas.update_user_status import update_user_status
+from api.schemas.find_open_stores import find_open_stores, find_open_stores_async
+from api.schemas.list_photos import etag_for, is_not_modified, list_photos, list_photos_async
+from api.schemas.search_stores import search_stores
+from api.schemas.update_user_status import update_user_status, update_user_status_async
 
 router = APIRouter()
 
+# Firestoreだけを使うルートを非同期クライアントで処理する (0でスレッドプールの同期版に戻す)
+FIRESTORE_ASYNC = os.getenv("FIRESTORE_ASYNC", "1") != "0"
+
 
 # Firestore クライアントの取得
 def get_firestore_client() -> Any:
-    return firestore.client()
+    return clients.get_firestore_client()
+
+
+def get_async_firestore_client() -> Optional[Any]:
+    return clients.get_async_firestore_client() if FIRESTORE_ASYNC else None
 
 
 def get_storage_client() -> Any:
-    return storage.Client()
+    return clients.get_storage_client()
 
 
-@router.post("/findNearbyRestaurants")
+@router.post("/findNearbyRestaurants", dependencies=[Depends(admission("findNearbyRestaurants"))])
 async def find_nearby_restaurants_endpoint(
     request: Request,
     db: Any = Depends(get_firestore_client),
     storage_client: Any = Depends(get_storage_client),
-) -> dict[str, str]:
+) -> dict[str, Any]:
     body = await request.json()
     # TODO: アクセストークンではなく、
     # 特定のフィールドのIDを引数で受け取って、それが一致するかの確認処理を挟むようにする
     # userIdで良い？？
     user_id = body.get("userId")
+    request.state.user_id = user_id
     lat = body.get("lat")
     lon = body.get("lon")
     photo_id = body.get("photo_id")
-
-    return find_nearby_restaurant(
+    # trueの場合、保存した店舗データを近い順にレスポンスへ含める
+    return_stores = bool(body.get("returnStores", False))
+    # 返却する店舗フィールド (省略時は全フィールド)
+    fields = body.get("fields")
+
+    # ブロッキングな外部呼び出しでイベントループを止めないようスレッドプールで実行する
+    return await run_in_threadpool(
+        find_nearby_restaurant,
         user_id=user_id,
         lat=lat,
         lon=lon,
         photo_id=photo_id,
         db=db,
         storage_client=storage_client,
+        return_stores=return_stores,
+        fields=fields,
+        # 待ち行列が伸びている間は店舗写真の保存を省く
+        mirror_photos=not is_degraded(request),
     )
 
 
-@router.post("/categorizeFood")
+@router.post("/categorizeFood", dependencies=[Depends(admission("categorizeFood"))])
 async def categorize_food_endpoint(
     request: Request,
     db: Any = Depends(get_firestore_client),
     storage_client: Any = Depends(get_storage_client),
 ) -> dict[str, str]:
-    logging.info("categorize_food_endpoint start!!!")
-
     body = await request.json()
 
     user_id: str = body.get("userId")
+    request.state.user_id = user_id
     photo_id: str = body.get("photoId")
     photo: str = body.get("photo")
 
-    return categorize_food(
+    return await run_in_threadpool(
+        categorize_food,
         user_id=user_id,
         photo_id=photo_id,
         photo=photo,
@@ -77,13 +105,138 @@ async def categorize_food_endpoint(
 async def update_user_status_endpoint(
     request: Request,
     db: Any = Depends(get_firestore_client),
-    storage_client: Any = Depends(get_storage_client),
+    async_db: Optional[Any] = Depends(get_async_firestore_client),
 ) -> dict[str, str]:
     body = await request.json()
-    auth_header = request.headers.get("Authorization")
-    access_token = (
-        auth_header.split(" ")[1] if auth_header and auth_header.startswith("Bearer ") else None
-    )
     user_id = body.get("userId")
+    request.state.user_id = user_id
+    # 検証済みのIDトークンのクレーム (main.pyのミドルウェアが設定する)
+    claims = getattr(request.state, "auth_claims", None)
+
+    if async_db is not None:
+        return await update_user_status_async(user_id=user_id, claims=claims, db=async_db)
+    return await run_in_threadpool(update_user_status, user_id=user_id, claims=claims, db=db)
 
-    return update_user_status(user_id=user_id, access_token=access_token, db=db)
+
+@router.post("/findOpenStores")
+async def find_open_stores_endpoint(
+    request: Request,
+    db: Any = Depends(get_firestore_client),
+    async_db: Optional[Any] = Depends(get_async_firestore_client),
+) -> dict[str, Any]:
+    body = await request.json()
+    user_id = body.get("userId")
+    request.state.user_id = user_id
+    # 検証済みのIDトークンのクレーム (main.pyのミドルウェアが設定する)
+    claims = getattr(request.state, "auth_claims", None)
+    # ISO 8601形式の日時 (省略時は現在時刻)
+    at = body.get("at")
+
+    if async_db is not None:
+        return await find_open_stores_async(user_id=user_id, claims=claims, at=at, db=async_db)
+    return await run_in_threadpool(find_open_stores, user_id=user_id, claims=claims, at=at, db=db)
+
+
+@router.post("/categoryCounts")
+async def category_counts_endpoint(
+    request: Request,
+    db: Any = Depends(get_firestore_client),
+    async_db: Optional[Any] = Depends(get_async_firestore_client),
+) -> dict[str, Any]:
+    body = await request.json()
+    user_id = body.get("userId")
+    request.state.user_id = user_id
+    # 検証済みのIDトークンのクレーム (main.pyのミドルウェアが設定する)
+    claims = getattr(request.state, "auth_claims", None)
+
+    if async_db is not None:
+        return await get_category_counts_async(user_id=user_id, claims=claims, db=async_db)
+    return await run_in_threadpool(get_category_counts, user_id=user_id, claims=claims, db=db)
+
+
+@router.post("/searchStores")
+async def search_stores_endpoint(
+    request: Request,
+    db: Any = Depends(get_firestore_client),
+) -> dict[str, Any]:
+    body = await request.json()
+    user_id = body.get("userId")
+    request.state.user_id = user_id
+    # 検証済みのIDトークンのクレーム (main.pyのミドルウェアが設定する)
+    claims = getattr(request.state, "auth_claims", None)
+
+    # インデックスの検索はCPUを使うため、Firestoreの読み込みと合わせてスレッドプールで実行する
+    return await run_in_threadpool(
+        search_stores,
+        user_id=user_id,
+        claims=claims,
+        query=body.get("query"),
+        limit=body.get("limit"),
+        db=db,
+    )
+
+
+@router.get("/photos")
+async def list_photos_endpoint(
+    request: Request,
+    db: Any = Depends(get_firestore_client),
+    async_db: Optional[Any] = Depends(get_async_firestore_client),
+) -> Response:
+    # クエリパラメータ: userId, category, fields ("url,category,updatedAt"), cursor, pageSize
+    params = request.query_params
+    user_id = params.get("userId")
+    if not user_id:
+        raise HTTPException(status_code=400, detail="userIdが提供されていません")
+    request.state.user_id = user_id
+    # 検証済みのIDトークンのクレーム (main.pyのミドルウェアが設定する)
+    claims = getattr(request.state, "auth_claims", None)
+    options = {
+        "category": params.get("category"),
+        "fields": params.get("fields"),
+        "cursor": params.get("cursor"),
+        "page_size": params.get("pageSize"),
+    }
+
+    if async_db is not None:
+        page = await list_photos_async(user_id=user_id, claims=claims, db=async_db, **options)
+    else:
+        page = await run_in_threadpool(
+            list_photos, user_id=user_id, claims=claims, db=db, **options
+        )
+    response = JSONResponse(page)
+    # 内容が同じページは304で返す (クライアントはキャッシュを使い、毎回再検証する)
+    etag = etag_for(response.body)
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if is_not_modified(request.headers.get("If-None-Match"), etag):
+        return Response(status_code=304, headers=headers)
+    response.headers.update(headers)
+    return response
+
+
+@router.get("/metrics", response_class=PlainTextResponse)
+async def metrics_endpoint() -> PlainTextResponse:
+    return PlainTextResponse(render_prometheus(), media_type="text/plain; version=0.0.4")
+
+
+def require_profile_token(request: Request) -> None:
+    if not is_authorized(request.headers.get(PROFILE_HEADER)):
+        raise HTTPException(status_code=403, detail="Invalid profile token")
+
+
+@router.get("/debug/profiles", dependencies=[Depends(require_profile_token)])
+async def list_profiles_endpoint() -> list[dict[str, Any]]:
+    return list_profiles()
+
+
+@router.get("/debug/profiles/{profile_id}", dependencies=[Depends(require_profile_token)])
+async def get_profile_endpoint(profile_id: str) -> dict[str, Any]:
+    profile = get_profile(profile_id)
+    if profile is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return profile
+
+
+@router.get("/readyz")
+async def readiness_endpoint() -> JSONResponse:
+    # ウォームアップ完了までは503を返し、起動時間のレポートを添える
+    return JSONResponse(get_report(), status_code=200 if is_ready() else 503)
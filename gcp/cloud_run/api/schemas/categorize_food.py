@@ -8,32 +8,17 @@ from typing import Any
 from fastapi import FastAPI, HTTPException  # type: ignore
 
 # First Party Library
+from api.core.food_category import translate_food_category
 from api.core.gemini import categorize_from_gemini_api
+from api.core.metrics import span
 from api.cruds.firestore import save_category_and_photo_to_firestore
 from api.cruds.gcs import save_own_photo_to_cloud_storage
 
-logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
 
 app = FastAPI()
 
 
-def translate_food_category(category: str) -> str:
-    category_translation = {
-        "ラーメン": "ramen",
-        "カフェ": "cafe",
-        "和食": "japanese_food",
-        "洋食": "western_food",
-        "エスニック": "ethnic_food",
-        "飲食物ではない": "not_food",
-    }
-
-    for key in category_translation:
-        if key in category:
-            return category_translation[key]
-
-    return "not_food"
-
-
 def process_image(
     user_id: str,
     photo_id: str,
@@ -43,10 +28,10 @@ def process_image(
 ):
     try:
         # 画像をGCSに保存
-        logging.info("process_image start")
+        logger.debug("process_image start")
         filename = f"{photo_id}.jpg"
         image_url = save_own_photo_to_cloud_storage(photo_data, filename, user_id, storage_client)
-        logging.info(f"Image saved to GCS: {image_url}")
+        logger.debug("Image saved to GCS: %s", image_url)
 
         # 分析結果を返却
         category = categorize_from_gemini_api(photo_data)
@@ -56,7 +41,7 @@ def process_image(
         save_category_and_photo_to_firestore(user_id, photo_id, eng_category, image_url, db)
 
     except (AttributeError, KeyError) as e:
-        logging.error(f"Error processing image: {e}")
+        logger.error("Error processing image: %s", e)
         raise HTTPException(
             status_code=500,
             detail="An error occurred while processing the image",
@@ -71,7 +56,8 @@ def categorize_food(
     storage_client: Any,
 ):
     # Base64エンコードされた画像データをデコード
-    photo_data = b64decode(photo)
+    with span("base64.decode"):
+        photo_data = b64decode(photo)
 
     # 画像処理の実行
     process_image(user_id, photo_id, photo_data, db, storage_client)
@@ -0,0 +1,26 @@
+# Standard Library
+import logging
+from typing import Any, Dict, Optional
+
+# First Party Library
+from api.core.auth import authenticate_user
+from api.cruds import category_counts, firestore_async
+
+logger = logging.getLogger(__name__)
+
+
+def to_response(counts: Dict[str, int]) -> Dict[str, Any]:
+    return {"counts": counts, "total": sum(counts.values())}
+
+
+def get_category_counts(user_id: str, claims: Optional[Dict[str, Any]], db: Any) -> Dict[str, Any]:
+    authenticate_user(claims, user_id)
+    return to_response(category_counts.get_category_counts(user_id, db))
+
+
+async def get_category_counts_async(
+    user_id: str, claims: Optional[Dict[str, Any]], db: Any
+) -> Dict[str, Any]:
+    # dbは非同期クライアント (イベントループ上で直接実行する)
+    authenticate_user(claims, user_id)
+    return to_response(await firestore_async.get_category_counts(user_id, db))
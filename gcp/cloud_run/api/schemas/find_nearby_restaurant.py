@@ -1,35 +1,149 @@
 # Standard Library
 import logging
+import math
 import os
 import uuid
-from datetime import datetime
-from typing import Any, List
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
 
 # Third Party Library
-import googlemaps
-import requests  # type: ignore
-from fastapi import FastAPI  # type: ignore
+from fastapi import FastAPI, HTTPException  # type: ignore
 
 # First Party Library
-from api.core.romaji_conversion_dict import romaji_conversion_dict
-
-logging.basicConfig(level=logging.INFO)
-# First Party Library
-# logging.basicConfig(level=logging.ERROR)
 from api.core.auth import update_user_doc_status
+from api.core.clients import get_gmaps_client, get_http_session
 from api.core.data_class import StoreData
-from api.cruds.firestore import save_store_data_to_firestore
+from api.core.geotile import (
+    Tile,
+    distance_meters,
+    tile_center,
+    tile_for,
+    tile_radius_meters,
+)
+from api.core.metrics import describe, increment
+from api.core.opening_hours import build_opening_intervals
+from api.core.rate_limit import governed
+from api.core.romaji import convert_to_romaji
+from api.core.store_freshness import STORE_REFRESH_MODE, needs_refresh
+from api.cruds.firestore import (
+    add_store_to_photo,
+    get_stores,
+    save_store_data_to_firestore,
+    store_from_dict,
+)
 from api.cruds.gcs import save_store_photo_to_cloud_storage
+from api.cruds.nearby_cache import (
+    NEARBY_TTL_SECONDS,
+    fresh_search,
+    get_nearby_cache,
+    save_nearby_cache,
+)
+
+logger = logging.getLogger(__name__)
 
 app = FastAPI()
 
+# findNearbyRestaurantsのレスポンスで返却できる店舗フィールド
+STORE_RESPONSE_FIELDS = (
+    "storeId",
+    "name",
+    "address",
+    "city",
+    "prefecture",
+    "country",
+    "phoneNumber",
+    "website",
+    "openingHours",
+    "openingIntervals",
+    "imageUrls",
+)
+
+# 写真の座標から店舗を探す半径 (m)
+NEARBY_RADIUS_METERS = 15
+
+describe("store_refresh_total", "counter", "Stores fetched from Places or served from Firestore.")
+describe("places_nearby_cache_total", "counter", "Nearby searches served from the tile cache.")
+
 
 def get_place_details(place_id: str, api_key: str):
-    gmaps = googlemaps.Client(key=api_key)
-    details = gmaps.place(place_id=place_id, language="ja")
+    gmaps = get_gmaps_client(api_key)
+    details = governed("places", "places.details", gmaps.place, place_id=place_id, language="ja")
     return details["result"]
 
 
+def search_nearby_places(
+    lat: float, lon: float, radius: float, api_key: str
+) -> Tuple[List[Dict[str, Any]], bool]:
+    # (Placesの返却順の {"placeId", "lat", "lon"} (座標の無い店舗はNone), 1ページに収まったか)
+    gmaps = get_gmaps_client(api_key)
+    places = governed(
+        "places",
+        "places.nearby",
+        gmaps.places_nearby,
+        location=(lat, lon),
+        radius=radius,
+        type="restaurant",
+        language="ja",
+    )
+    found = []
+    for place in places["results"]:
+        location = (place.get("geometry") or {}).get("location") or {}
+        found.append(
+            {"placeId": place["place_id"], "lat": location.get("lat"), "lon": location.get("lng")}
+        )
+    return found, not places.get("next_page_token")
+
+
+def search_nearby_place_ids(lat: float, lon: float, api_key: str) -> List[str]:
+    places, _ = search_nearby_places(lat, lon, NEARBY_RADIUS_METERS, api_key)
+    return [place["placeId"] for place in places]
+
+
+def search_tile_places(tile: Tile, api_key: str) -> Tuple[List[Dict[str, Any]], bool]:
+    # タイルのどこから見ても半径内の店舗が漏れないよう、中心から角までの距離を足して検索する
+    radius = NEARBY_RADIUS_METERS + tile_radius_meters(tile)
+    return search_nearby_places(*tile_center(tile), math.ceil(radius), api_key)
+
+
+def place_ids_within(places: List[Dict[str, Any]], lat: float, lon: float) -> List[str]:
+    # 写真の座標から半径内の店舗 (座標の無い店舗は除かずに残す)
+    return [
+        place["placeId"]
+        for place in places
+        if place.get("lat") is None
+        or place.get("lon") is None
+        or distance_meters(lat, lon, place["lat"], place["lon"]) <= NEARBY_RADIUS_METERS
+    ]
+
+
+def nearby_place_ids(lat: float, lon: float, api_key: str, db: Any) -> List[str]:
+    # 写真の座標を含むタイルの検索結果を使う (期限内のキャッシュがあればPlacesを呼ばない)
+    if NEARBY_TTL_SECONDS <= 0:
+        return search_nearby_place_ids(lat, lon, api_key)
+    tile = tile_for(lat, lon)
+    now = datetime.now(timezone.utc)
+    search = fresh_search(get_nearby_cache(tile, db), now)
+    outcome = "hit"
+    if search is None:
+        outcome = "miss"
+        search = search_tile_places(tile, api_key)
+        save_nearby_cache(tile, *search, now, db)
+    places, complete = search
+    if not complete:
+        # 店舗の多いタイルは件数の上限で近くの店舗が漏れるため、写真の座標で検索する
+        increment("places_nearby_cache_total", 1.0, (("outcome", "truncated"),))
+        return search_nearby_place_ids(lat, lon, api_key)
+    increment("places_nearby_cache_total", 1.0, (("outcome", outcome),))
+    return place_ids_within(places, lat, lon)
+
+
+def download_place_photo(photo_url: str) -> bytes:
+    response = get_http_session().get(photo_url)
+    response.raise_for_status()
+    content: bytes = response.content
+    return content
+
+
 def format_time(time_str):
     return f"{time_str[:2]}:{time_str[2:]}"
 
@@ -100,114 +214,169 @@ def extract_address_component(address_components, component_type):
     return None
 
 
-def convert_to_romaji(text):
-    return romaji_conversion_dict.get(text, text)
-
-
-def find_nearby_restaurants(
-    lat: float, lon: float, api_key: str, user_id: str, photo_id: str, db: Any, storage_client: Any
+def build_store_data(
+    place_id: str,
+    details: Dict[str, Any],
+    api_key: str,
+    storage_client: Any,
+    mirror_photos: bool = True,
 ) -> StoreData:
-    gmaps = googlemaps.Client(key=api_key)
-    places = gmaps.places_nearby(location=(lat, lon), radius=15, type="restaurant", language="ja")
+    name = details.get("name")
+    address = details.get("formatted_address")
+
+    address_components = details.get("address_components", [])
+
+    prefecture = extract_address_component(address_components, "administrative_area_level_1")
+    city = extract_address_component(address_components, "locality")
+    country = extract_address_component(address_components, "country")
+
+    romaji_prefecture = convert_to_romaji(prefecture) if prefecture else ""
+    romaji_city = convert_to_romaji(city) if city else ""
+    romaji_country = convert_to_romaji(country) if country else ""
+
+    phone_number = details.get("formatted_phone_number")
+    website = details.get("website")
+    opening_hours = details.get("opening_hours", {})
+
+    formatted_hours = (
+        get_formatted_hours(opening_hours)
+        if "periods" in opening_hours
+        else {
+            "sunday_hours": "Unknown",
+            "monday_hours": "Unknown",
+            "tuesday_hours": "Unknown",
+            "wednesday_hours": "Unknown",
+            "thursday_hours": "Unknown",
+            "friday_hours": "Unknown",
+            "saturday_hours": "Unknown",
+        }
+    )
+
+    opening_intervals = build_opening_intervals(opening_hours)
+
+    image_urls: List[str] = []
+    # 縮退モードでは店舗写真のダウンロードとGCSへの保存を省く (保存済みのimageUrlsは残す)
+    if mirror_photos and "photos" in details:
+        for photo in details["photos"]:
+            photo_url = f"https://maps.googleapis.com/maps/api/place/photo?maxwidth=400&photoreference={photo['photo_reference']}&key={api_key}"
+            image_data = governed(
+                "places_photo", "places.photo_download", download_place_photo, photo_url
+            )
+
+            uploaded_image_url = save_store_photo_to_cloud_storage(
+                image_data, f"{uuid.uuid4()}.jpg", place_id, storage_client
+            )
+            logger.debug("Uploaded store photo %s", uploaded_image_url)
+
+            image_urls.append(uploaded_image_url)
+
+    return StoreData(
+        store_id=place_id,
+        createdAt=datetime.now(),
+        updatedAt=datetime.now(),
+        name=name or "",
+        address=address or "",
+        city=romaji_city,
+        prefecture=romaji_prefecture,
+        country=romaji_country,
+        phoneNumber=phone_number if phone_number else "",
+        website=website if website else "",
+        openingHours=formatted_hours,
+        openingIntervals=opening_intervals,
+        imageUrls=image_urls,
+    )
 
-    # 初期化
-    store_data = None
 
-    for place in places["results"]:
-        details = get_place_details(place["place_id"], api_key)
-        name = details.get("name")
-        address = details.get("formatted_address")
-
-        address_components = details.get("address_components", [])
-
-        prefecture = extract_address_component(address_components, "administrative_area_level_1")
-        city = extract_address_component(address_components, "locality")
-        country = extract_address_component(address_components, "country")
-
-        romaji_prefecture = convert_to_romaji(prefecture) if prefecture else ""
-        romaji_city = convert_to_romaji(city) if city else ""
-        romaji_country = convert_to_romaji(country) if country else ""
-
-        phone_number = details.get("formatted_phone_number")
-        website = details.get("website")
-        opening_hours = details.get("opening_hours", {})
-
-        formatted_hours = (
-            get_formatted_hours(opening_hours)
-            if "periods" in opening_hours
-            else {
-                "sunday_hours": "Unknown",
-                "monday_hours": "Unknown",
-                "tuesday_hours": "Unknown",
-                "wednesday_hours": "Unknown",
-                "thursday_hours": "Unknown",
-                "friday_hours": "Unknown",
-                "saturday_hours": "Unknown",
-            }
-        )
-
-        image_urls: List[str] = []
-        if "photos" in details:
-            for photo in details["photos"]:
-                photo_url = f"https://maps.googleapis.com/maps/api/place/photo?maxwidth=400&photoreference={photo['photo_reference']}&key={api_key}"
-                response = requests.get(photo_url)
-                response.raise_for_status()
-                image_data = response.content
-
-                uploaded_image_url = save_store_photo_to_cloud_storage(
-                    image_data, f"{uuid.uuid4()}.jpg", place["place_id"], storage_client
-                )
-                logging.info(f"uploaded_image_url: {uploaded_image_url}")
-
-                image_urls.append(uploaded_image_url)
-
-        store_data = StoreData(
-            store_id=place["place_id"],
-            createdAt=datetime.now(),
-            updatedAt=datetime.now(),
-            name=name,
-            address=address,
-            city=romaji_city,
-            prefecture=romaji_prefecture,
-            country=romaji_country,
-            phoneNumber=phone_number if phone_number else "",
-            website=website if website else "",
-            openingHours=formatted_hours,
-            imageUrls=image_urls,
-        )
-
-        save_store_data_to_firestore(store_data, photo_id, user_id, db)
-
-    if store_data is None:
-        # 初期化されていない場合のデフォルト値
-        store_data = StoreData(
-            store_id="",
-            createdAt=datetime.now(),
-            updatedAt=datetime.now(),
-            name="",
-            address="",
-            city="",
-            prefecture="",
-            country="",
-            phoneNumber="",
-            website="",
-            openingHours={},
-            imageUrls=[],
-        )
-
-    return store_data
+def find_nearby_restaurants(
+    lat: float,
+    lon: float,
+    api_key: str,
+    user_id: str,
+    photo_id: str,
+    db: Any,
+    storage_client: Any,
+    mirror_photos: bool = True,
+) -> List[StoreData]:
+    place_ids = nearby_place_ids(lat, lon, api_key, db)
+
+    # 保存済みの店舗をまとめて読み、期限内のものはPlacesの詳細・写真を取らずに使う
+    # (縮退モードでは取り直した店舗にも保存済みのimageUrlsを返すため、alwaysでも読む)
+    use_saved = STORE_REFRESH_MODE != "always" or not mirror_photos
+    saved = get_stores(place_ids, db) if use_saved else {}
+    now = datetime.now(timezone.utc)
+
+    # Places APIの返却順 (近い順) を保持する
+    stores: List[StoreData] = []
+
+    for place_id in place_ids:
+        if place_id in saved and not needs_refresh(saved[place_id], now):
+            increment("store_refresh_total", 1.0, (("outcome", "skipped"),))
+            store_data = store_from_dict(place_id, saved[place_id])
+            add_store_to_photo(place_id, photo_id, user_id, db)
+        else:
+            increment("store_refresh_total", 1.0, (("outcome", "fetched"),))
+            details = get_place_details(place_id, api_key)
+            store_data = build_store_data(place_id, details, api_key, storage_client, mirror_photos)
+            if not mirror_photos:
+                # 写真は取り直していないので、Firestoreに残る保存済みのimageUrlsを返す
+                store_data.imageUrls = list(saved.get(place_id, {}).get("imageUrls") or [])
+            save_store_data_to_firestore(
+                store_data, photo_id, user_id, db, keep_image_urls=not mirror_photos
+            )
+        stores.append(store_data)
+
+    return stores
 
 
 def process_image(
-    lat: float, lon: float, api_key: str, user_id: str, photo_id: str, db: Any, storage_client: Any
-):
+    lat: float,
+    lon: float,
+    api_key: str,
+    user_id: str,
+    photo_id: str,
+    db: Any,
+    storage_client: Any,
+    mirror_photos: bool = True,
+) -> List[StoreData]:
     try:
-        logging.info(f"lat: {lat}")
-        logging.info(f"lon: {lon}")
-        find_nearby_restaurants(lat, lon, api_key, user_id, photo_id, db, storage_client)
+        logger.info("Finding restaurants near %s,%s", lat, lon, extra={"lat": lat, "lon": lon})
+        return find_nearby_restaurants(
+            lat, lon, api_key, user_id, photo_id, db, storage_client, mirror_photos
+        )
 
     except (AttributeError, KeyError) as e:
-        logging.error(f"Could not retrieve location data for {lat},{lon}: {e}. Skipping...")
+        logger.error("Could not retrieve location data for %s,%s: %s. Skipping...", lat, lon, e)
+        return []
+
+
+def validate_store_fields(fields: Any) -> List[str]:
+    if fields is None:
+        return list(STORE_RESPONSE_FIELDS)
+    # リクエスト本文の値なので、文字列のリスト以外 (文字列・数値など) は反復する前に弾く
+    if not isinstance(fields, list) or not all(isinstance(field, str) for field in fields):
+        raise HTTPException(status_code=400, detail="fields must be a list of strings")
+    unknown_fields = [field for field in fields if field not in STORE_RESPONSE_FIELDS]
+    if unknown_fields:
+        raise HTTPException(status_code=400, detail=f"Unknown store fields: {unknown_fields}")
+    return fields
+
+
+def to_store_response(store_data: StoreData, fields: List[str]) -> Dict[str, Any]:
+    # クライアントがFirestoreから読み直さずに済むよう、保存した内容をそのまま返す
+    values = {
+        "storeId": store_data.store_id,
+        "name": store_data.name,
+        "address": store_data.address,
+        "city": store_data.city,
+        "prefecture": store_data.prefecture,
+        "country": store_data.country,
+        "phoneNumber": store_data.phoneNumber,
+        "website": store_data.website,
+        "openingHours": store_data.openingHours,
+        "openingIntervals": store_data.openingIntervals,
+        "imageUrls": store_data.imageUrls,
+    }
+    return {field: values[field] for field in fields}
 
 
 def find_nearby_restaurant(
@@ -217,12 +386,27 @@ def find_nearby_restaurant(
     photo_id: str,
     db: Any,
     storage_client: Any,
-) -> dict[str, str]:
+    return_stores: bool = False,
+    fields: Optional[List[str]] = None,
+    mirror_photos: bool = True,
+) -> dict[str, Any]:
 
     PLACE_API_KEY = os.getenv("PLACE_API_KEY", "default-place-api-key")
 
-    process_image(lat, lon, PLACE_API_KEY, user_id, photo_id, db, storage_client)
+    # 不正なフィールド指定は外部APIを呼ぶ前に弾く
+    store_fields = validate_store_fields(fields) if return_stores else []
+
+    stores = process_image(
+        lat, lon, PLACE_API_KEY, user_id, photo_id, db, storage_client, mirror_photos
+    )
 
     # Firestoreの更新ロジック
     update_user_doc_status(user_id, db)
-    return {"message": "Successfully processed photos"}
+
+    response: dict[str, Any] = {"message": "Successfully processed photos"}
+    if not mirror_photos:
+        # 店舗写真を更新していないことをクライアントに伝える
+        response["degraded"] = True
+    if return_stores:
+        response["stores"] = [to_store_response(store, store_fields) for store in stores]
+    return response
@@ -0,0 +1,68 @@
+# Standard Library
+import logging
+from datetime import datetime
+from time import perf_counter
+from typing import Any, Dict, List, Optional
+
+# Third Party Library
+from fastapi import HTTPException  # type: ignore
+
+# First Party Library
+from api.core.auth import authenticate_user
+from api.core.opening_hours import STORE_TIMEZONE, is_open_at, minute_of_week
+from api.cruds import firestore_async
+from api.cruds.firestore import get_store_opening_intervals, get_user_store_ids
+
+logger = logging.getLogger(__name__)
+
+
+def parse_at(at: Optional[str]) -> datetime:
+    if not at:
+        return datetime.now(STORE_TIMEZONE)
+    try:
+        return datetime.fromisoformat(at)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="atはISO 8601形式で指定してください")
+
+
+def find_open_stores(
+    user_id: str, claims: Optional[Dict[str, Any]], at: Optional[str], db: Any
+) -> Dict[str, Any]:
+    authenticate_user(claims, user_id)
+
+    minute = minute_of_week(parse_at(at))
+
+    store_ids = get_user_store_ids(user_id, db)
+    store_intervals = get_store_opening_intervals(store_ids, db)
+    return classify_stores(store_ids, store_intervals, minute)
+
+
+async def find_open_stores_async(
+    user_id: str, claims: Optional[Dict[str, Any]], at: Optional[str], db: Any
+) -> Dict[str, Any]:
+    # dbは非同期クライアント (イベントループ上で直接実行する)
+    authenticate_user(claims, user_id)
+
+    minute = minute_of_week(parse_at(at))
+
+    store_ids = await firestore_async.get_user_store_ids(user_id, db)
+    store_intervals = await firestore_async.get_store_opening_intervals(store_ids, db)
+    return classify_stores(store_ids, store_intervals, minute)
+
+
+def classify_stores(
+    store_ids: List[str], store_intervals: Dict[str, Optional[List[int]]], minute: int
+) -> Dict[str, Any]:
+    # 事前計算済みの区間インデックスのみで判定 (文字列のパースは行わない)
+    started = perf_counter()
+    open_store_ids: List[str] = []
+    unknown_store_ids: List[str] = []
+    for store_id in store_ids:
+        intervals = store_intervals.get(store_id)
+        if intervals is None:
+            unknown_store_ids.append(store_id)
+        elif is_open_at(intervals, minute):
+            open_store_ids.append(store_id)
+    logger.debug("Checked %d stores in %.1fus", len(store_ids), (perf_counter() - started) * 1e6)
+
+    return {"openStoreIds": open_store_ids, "unknownStoreIds": unknown_store_ids}
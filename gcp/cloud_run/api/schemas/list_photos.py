@@ -0,0 +1,106 @@
+# Standard Library
+import hashlib
+import logging
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+# Third Party Library
+from fastapi import HTTPException  # type: ignore
+
+# First Party Library
+from api.core.auth import authenticate_user
+from api.cruds import firestore_async, photo_pages
+from api.cruds.photo_pages import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, PHOTO_FIELDS, Photo
+
+logger = logging.getLogger(__name__)
+
+
+def parse_fields(fields: Optional[str]) -> List[str]:
+    # "url,category,updatedAt" の形式 (省略時は全フィールド)
+    if not fields:
+        return list(PHOTO_FIELDS)
+    names = list(dict.fromkeys(name.strip() for name in fields.split(",") if name.strip()))
+    unknown_fields = [name for name in names if name not in PHOTO_FIELDS]
+    if unknown_fields:
+        raise HTTPException(status_code=400, detail=f"Unknown photo fields: {unknown_fields}")
+    return names
+
+
+def parse_page_size(page_size: Optional[str]) -> int:
+    if not page_size:
+        return DEFAULT_PAGE_SIZE
+    try:
+        size = int(page_size)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="pageSizeは整数で指定してください")
+    if size < 1:
+        raise HTTPException(status_code=400, detail="pageSizeは1以上で指定してください")
+    return min(size, MAX_PAGE_SIZE)
+
+
+def compact_value(value: Any) -> Any:
+    # 日時はUNIX時間 (ミリ秒) にする
+    if isinstance(value, datetime):
+        return int(value.timestamp() * 1000)
+    return value
+
+
+def to_response(
+    fields: List[str], photos: List[Photo], next_cursor: Optional[str]
+) -> Dict[str, Any]:
+    # フィールド名は1回だけ返し、写真ごとは値の配列にする (無いフィールドはnull)
+    return {
+        "fields": ["id", *fields],
+        "photos": [
+            [photo_id, *(compact_value(data.get(name)) for name in fields)]
+            for photo_id, data in photos
+        ],
+        "nextCursor": next_cursor,
+    }
+
+
+def etag_for(body: bytes) -> str:
+    return '"' + hashlib.sha256(body).hexdigest()[:32] + '"'
+
+
+def is_not_modified(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    tags = [tag.strip() for tag in if_none_match.split(",")]
+    # 弱いETag (W/"...") も同じ値として比べる
+    return "*" in tags or etag in (tag[2:] if tag.startswith("W/") else tag for tag in tags)
+
+
+def list_photos(
+    user_id: str,
+    claims: Optional[Dict[str, Any]],
+    db: Any,
+    category: Optional[str] = None,
+    fields: Optional[str] = None,
+    cursor: Optional[str] = None,
+    page_size: Optional[str] = None,
+) -> Dict[str, Any]:
+    authenticate_user(claims, user_id)
+    names = parse_fields(fields)
+    photos, next_cursor = photo_pages.list_photos(
+        user_id, db, names, category, cursor, parse_page_size(page_size)
+    )
+    return to_response(names, photos, next_cursor)
+
+
+async def list_photos_async(
+    user_id: str,
+    claims: Optional[Dict[str, Any]],
+    db: Any,
+    category: Optional[str] = None,
+    fields: Optional[str] = None,
+    cursor: Optional[str] = None,
+    page_size: Optional[str] = None,
+) -> Dict[str, Any]:
+    # dbは非同期クライアント (イベントループ上で直接実行する)
+    authenticate_user(claims, user_id)
+    names = parse_fields(fields)
+    photos, next_cursor = await firestore_async.list_photos(
+        user_id, db, names, category, cursor, parse_page_size(page_size)
+    )
+    return to_response(names, photos, next_cursor)
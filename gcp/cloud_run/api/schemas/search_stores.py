@@ -0,0 +1,55 @@
+# Standard Library
+import logging
+from typing import Any, Dict, Optional
+
+# Third Party Library
+from fastapi import HTTPException  # type: ignore
+
+# First Party Library
+from api.core.auth import authenticate_user
+from api.core.store_search import get_store_index
+from api.cruds.firestore import get_user_store_ids
+from api.cruds.store_index import ensure_stores_indexed, prepare_store_index
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_LIMIT = 20
+MAX_LIMIT = 100
+MAX_QUERY_LENGTH = 100
+
+
+def parse_limit(limit: Any) -> int:
+    if limit is None:
+        return DEFAULT_LIMIT
+    try:
+        value = int(limit)
+    except (TypeError, ValueError):
+        raise HTTPException(status_code=400, detail="limitは整数で指定してください")
+    return max(1, min(value, MAX_LIMIT))
+
+
+def search_stores(
+    user_id: str, claims: Optional[Dict[str, Any]], query: Optional[str], limit: Any, db: Any
+) -> Dict[str, Any]:
+    # ユーザーが訪れた店舗 (写真のstoreId・areaStoreIds) の中から、名前・市区町村・都道府県で検索する
+    authenticate_user(claims, user_id)
+    if not query or not query.strip():
+        raise HTTPException(status_code=400, detail="queryが提供されていません")
+    if len(query) > MAX_QUERY_LENGTH:
+        raise HTTPException(status_code=400, detail="queryが長すぎます")
+
+    store_ids = get_user_store_ids(user_id, db)
+    prepare_store_index(db)
+    ensure_stores_indexed(store_ids, db)
+    hits = get_store_index().search(query, parse_limit(limit), within=store_ids)
+    return {
+        "stores": [
+            {
+                "storeId": hit.store_id,
+                "name": hit.name,
+                "city": hit.city,
+                "prefecture": hit.prefecture,
+            }
+            for hit in hits
+        ]
+    }
@@ -1,34 +1,45 @@
 # Standard Library
 import logging
-from typing import Any
+from typing import Any, Dict, Optional
 
 # Third Party Library
-from fastapi import FastAPI, HTTPException  # type: ignore
+from fastapi import FastAPI  # type: ignore
 
-logging.basicConfig(level=logging.INFO)
-# logging.basicConfig(level=logging.ERROR)
+# First Party Library
+from api.core.auth import authenticate_user
+from api.core.metrics import span
+from api.cruds import firestore_async
+from api.cruds.write_behind import get_write_buffer
 
+logger = logging.getLogger(__name__)
 
 app = FastAPI()
 
 
-def update_user_status(user_id: str, access_token: str, db: Any) -> dict[str, str]:
-    if not access_token:
-        raise HTTPException(
-            status_code=401,
-            detail="アクセストークンが提供されていないか無効です",
-        )
+NEW_STATE = "ready_for_use"
 
-    if not user_id:
-        raise HTTPException(status_code=400, detail="userIdが提供されていません")
+
+def update_user_status(user_id: str, claims: Optional[Dict[str, Any]], db: Any) -> dict[str, str]:
+    authenticate_user(claims, user_id)
 
     # Firestoreの更新ロジック
     users_ref = db.collection("users")
-    logging.info(f"users_ref={users_ref}")
-
     user_doc_ref = users_ref.document(user_id)
-    logging.info(f"user_doc_ref={user_doc_ref}")
+    logger.debug("Updating status of user %s", user_id)
+
+    # ドキュメントが無いユーザーはマージで作る (非同期版と同じ)
+    with span("firestore.update_user"):
+        user_doc_ref.set({"classifyPhotosStatus": NEW_STATE}, merge=True)
+    # 書いた値を覚えておき、以降のステータス更新を省かないようにする
+    get_write_buffer().note_written(user_doc_ref, {"classifyPhotosStatus": NEW_STATE})
+    return {"message": "Successfully processed photos"}
+
 
-    new_state = "ready_for_use"
-    user_doc_ref.update({"classifyPhotosStatus": new_state})
+async def update_user_status_async(
+    user_id: str, claims: Optional[Dict[str, Any]], db: Any
+) -> dict[str, str]:
+    # dbは非同期クライアント (イベントループ上で直接実行する)
+    authenticate_user(claims, user_id)
+    logger.debug("Updating status of user %s", user_id)
+    await firestore_async.update_user_doc_status(user_id, db, NEW_STATE)
     return {"message": "Successfully processed photos"}
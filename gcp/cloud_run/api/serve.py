@@ -0,0 +1,218 @@
+# 本番用のサーバー起動 (開発時は従来どおり `uvicorn api.main:app --reload` を使う)
+# 実行方法: python -m api.serve
+#
+# - 親プロセスでアプリと重いライブラリをimportしてからforkし、ワーカー間でメモリを共有する
+# - 各ワーカーはuvloop/httptoolsのuvicornで同じソケットを受け付ける
+# - SIGTERMを受けると受付を止め、処理中のリクエストと外部呼び出しを待ってから終了する
+#
+# 環境変数
+#   PORT: 待ち受けポート (Cloud Runが設定する、既定 8000)
+#   WEB_CONCURRENCY: ワーカー数 (既定はコンテナのCPU割り当て)
+#   CONTAINER_CONCURRENCY: インスタンスあたりの最大同時リクエスト数 (Cloud Runの設定値、既定 80)
+#   TIMEOUT_GRACEFUL_SHUTDOWN: 処理中のリクエストを待つ秒数 (既定は SHUTDOWN_BUDGET_SECONDS から
+#     外部呼び出しの待ちと書き出しの分を引いた残り。api.core.startup を参照)
+#   TIMEOUT_KEEP_ALIVE: keep-aliveの秒数 (既定 650、Cloud Runのロードバランサより長くする)
+# Standard Library
+import importlib
+import logging
+import math
+import os
+import signal
+import socket
+import sys
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+CGROUP_V2_CPU_MAX = Path("/sys/fs/cgroup/cpu.max")
+CGROUP_V1_QUOTA = Path("/sys/fs/cgroup/cpu/cpu.cfs_quota_us")
+CGROUP_V1_PERIOD = Path("/sys/fs/cgroup/cpu/cpu.cfs_period_us")
+
+# ワーカーが起動直後に落ち続ける場合に再起動を諦めるまでの回数
+MAX_QUICK_RESTARTS = 5
+QUICK_RESTART_SECONDS = 10.0
+
+
+def cpu_quota() -> int:
+    # cgroupのCPU割り当て (Cloud Runの --cpu) を優先し、取れなければ論理CPU数を使う
+    try:
+        quota, period = CGROUP_V2_CPU_MAX.read_text().split()
+        if quota != "max":
+            return max(1, math.ceil(int(quota) / int(period)))
+    except (OSError, ValueError):
+        pass
+    try:
+        quota_us = int(CGROUP_V1_QUOTA.read_text())
+        if quota_us > 0:
+            return max(1, math.ceil(quota_us / int(CGROUP_V1_PERIOD.read_text())))
+    except (OSError, ValueError):
+        pass
+    return os.cpu_count() or 1
+
+
+def load_settings() -> Dict[str, Any]:
+    # First Party Library
+    from api.core.startup import (
+        SHUTDOWN_BUDGET_SECONDS,
+        SHUTDOWN_DRAIN_SECONDS,
+        SHUTDOWN_FLUSH_SECONDS,
+        graceful_shutdown_seconds,
+    )
+
+    graceful = float(os.getenv("TIMEOUT_GRACEFUL_SHUTDOWN") or graceful_shutdown_seconds())
+    total = graceful + SHUTDOWN_DRAIN_SECONDS + SHUTDOWN_FLUSH_SECONDS
+    if total > SHUTDOWN_BUDGET_SECONDS:
+        logger.warning(
+            "Shutdown may take %.1fs, over the %.1fs budget", total, SHUTDOWN_BUDGET_SECONDS
+        )
+    workers = int(os.getenv("WEB_CONCURRENCY") or cpu_quota())
+    container_concurrency = int(os.getenv("CONTAINER_CONCURRENCY", "80"))
+    return {
+        "host": os.getenv("HOST", "0.0.0.0"),
+        "port": int(os.getenv("PORT", "8000")),
+        "workers": workers,
+        # Cloud Runの同時実行数をワーカーで分け合う (超えた分はuvicornが503を返す)
+        "limit_concurrency": max(1, math.ceil(container_concurrency / workers)),
+        "timeout_graceful_shutdown": graceful,
+        "timeout_keep_alive": int(os.getenv("TIMEOUT_KEEP_ALIVE", "650")),
+        "backlog": int(os.getenv("BACKLOG", "2048")),
+    }
+
+
+def preload(app_path: str = "api.main:app") -> Any:
+    # forkの前にアプリと重いライブラリをimportしておく (クライアントの生成はfork後に各ワーカーで行う)
+    module_name, _, attribute = app_path.partition(":")
+    app = getattr(importlib.import_module(module_name), attribute)
+    # First Party Library
+    from api.core.startup import WARMUP_MODULES
+
+    for module in WARMUP_MODULES:
+        try:
+            importlib.import_module(module)
+        except Exception as e:
+            logger.warning("Failed to preload %s: %s", module, e)
+    return app
+
+
+def bind_socket(host: str, port: int, backlog: int) -> socket.socket:
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    sock.set_inheritable(True)
+    return sock
+
+
+def run_worker(app: Any, sock: socket.socket, settings: Dict[str, Any]) -> None:
+    # Third Party Library
+    import uvicorn  # type: ignore
+
+    # スレッドプールの上限をワーカーの同時実行数に合わせる (api.core.startup.configure_threadpool)
+    os.environ.setdefault("THREADPOOL_SIZE", str(settings["limit_concurrency"]))
+    config = uvicorn.Config(
+        app,
+        loop="uvloop",
+        http="httptools",
+        lifespan="on",
+        # ログはapi.core.logの設定 (JSON) に任せる
+        log_config=None,
+        access_log=False,
+        limit_concurrency=settings["limit_concurrency"],
+        timeout_keep_alive=settings["timeout_keep_alive"],
+        timeout_graceful_shutdown=settings["timeout_graceful_shutdown"],
+    )
+    uvicorn.Server(config).run(sockets=[sock])
+
+
+class Supervisor:
+    # ワーカーをforkし、異常終了したものを再起動する。SIGTERM/SIGINTはワーカーに転送する
+
+    def __init__(self, app: Any, sock: socket.socket, settings: Dict[str, Any]) -> None:
+        self.app = app
+        self.sock = sock
+        self.settings = settings
+        self.workers: Dict[int, float] = {}
+        self.stopping = False
+        self.quick_restarts = 0
+
+    def spawn(self) -> None:
+        pid = os.fork()
+        if pid == 0:
+            # 子プロセス: 親のシグナルハンドラを戻してからサーバーを起動する
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            exit_code = 0
+            try:
+                run_worker(self.app, self.sock, self.settings)
+            except BaseException:
+                logger.exception("Worker %d crashed", os.getpid())
+                exit_code = 1
+            finally:
+                os._exit(exit_code)
+        self.workers[pid] = time.monotonic()
+        logger.info("Started worker %d", pid)
+
+    def stop(self, signum: int, frame: Optional[Any]) -> None:
+        if self.stopping:
+            return
+        self.stopping = True
+        logger.info("Received signal %d, draining %d workers", signum, len(self.workers))
+        for pid in list(self.workers):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    def run(self) -> int:
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        for _ in range(self.settings["workers"]):
+            self.spawn()
+
+        while self.workers:
+            try:
+                pid, status = os.wait()
+            except ChildProcessError:
+                break
+            except InterruptedError:
+                continue
+            started = self.workers.pop(pid, None)
+            if started is None or self.stopping:
+                continue
+            logger.warning("Worker %d exited with status %d, restarting", pid, status)
+            if time.monotonic() - started < QUICK_RESTART_SECONDS:
+                self.quick_restarts += 1
+                if self.quick_restarts > MAX_QUICK_RESTARTS:
+                    logger.error("Workers keep crashing on startup, shutting down")
+                    self.stop(signal.SIGTERM, None)
+                    continue
+            self.spawn()
+        return 1 if self.quick_restarts > MAX_QUICK_RESTARTS else 0
+
+
+def serve(app: Any, settings: Dict[str, Any]) -> int:
+    sock = bind_socket(settings["host"], settings["port"], settings["backlog"])
+    logger.info(
+        "Serving on %s:%d with %d workers",
+        settings["host"],
+        settings["port"],
+        settings["workers"],
+        extra={"serverSettings": settings},
+    )
+    if settings["workers"] <= 1:
+        # 1ワーカーならforkせずにこのプロセスで処理する
+        run_worker(app, sock, settings)
+        return 0
+    return Supervisor(app, sock, settings).run()
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    args = sys.argv[1:] if argv is None else argv
+    app_path = args[0] if args else "api.main:app"
+    sys.exit(serve(preload(app_path), load_settings()))
+
+
+if __name__ == "__main__":
+    main()
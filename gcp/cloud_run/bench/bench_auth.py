@@ -0,0 +1,84 @@
+# Firebase IDトークンのローカル検証を、ローカルで生成した鍵で確認し、1回あたりの時間を計測する
+# 実行方法: python -m bench.bench_auth --iterations 20000
+# Standard Library
+import argparse
+import time
+from typing import Callable, List, Tuple
+from unittest import mock
+
+# First Party Library
+from bench.fakes import FakeFirebaseAuth
+
+
+def check_cases(auth: FakeFirebaseAuth, other: FakeFirebaseAuth) -> List[Tuple[str, bool, bool]]:
+    # First Party Library
+    from api.core.id_token import InvalidIdToken, verify_id_token
+
+    now = int(time.time())
+    cases = [
+        ("valid", auth.mint("user_1"), True),
+        ("expired", auth.mint("user_1", exp=now - 3600, iat=now - 7200), False),
+        ("wrong audience", auth.mint("user_1", aud="other-project"), False),
+        ("wrong issuer", auth.mint("user_1", iss="https://example.com/bench-project"), False),
+        ("empty subject", auth.mint(""), False),
+        ("auth_time in future", auth.mint("user_1", auth_time=now + 3600), False),
+        ("signed by another key", other.mint("user_1"), False),
+        ("malformed", "not-a-token", False),
+    ]
+    results = []
+    for name, token, expected in cases:
+        try:
+            verify_id_token(token)
+            accepted = True
+        except InvalidIdToken:
+            accepted = False
+        results.append((name, expected, accepted))
+    return results
+
+
+def time_per_call(func: Callable[[], object], iterations: int) -> float:
+    started = time.perf_counter()
+    for _ in range(iterations):
+        func()
+    return (time.perf_counter() - started) / iterations * 1e6
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--iterations", type=int, default=20000)
+    args = parser.parse_args()
+
+    # First Party Library
+    from api.core import id_token
+
+    auth = FakeFirebaseAuth()
+    # 同じkidで別の鍵 (署名の検証に失敗するはず)
+    other = FakeFirebaseAuth()
+    id_token.get_signing_keys().install(auth.certs, max_age=86400)
+
+    with mock.patch.object(id_token, "_project_id", auth.project_id):
+        failures = 0
+        for name, expected, accepted in check_cases(auth, other):
+            ok = expected == accepted
+            failures += not ok
+            print(f"  {'ok ' if ok else 'NG '} {name:<24} accepted={accepted}")
+
+        tokens = [auth.mint(f"user_{index}") for index in range(200)]
+
+        def verify_cold() -> None:
+            id_token._memo.clear()
+            id_token.verify_id_token(tokens[0])
+
+        memo_token = tokens[1]
+        id_token.verify_id_token(memo_token)
+        cold = time_per_call(verify_cold, max(1, args.iterations // 20))
+        memoized = time_per_call(lambda: id_token.verify_id_token(memo_token), args.iterations)
+
+    print(f"\nsignature verification: {cold:8.1f} us/token")
+    print(f"memoized claims:        {memoized:8.2f} us/request")
+    if failures:
+        raise SystemExit(f"{failures} case(s) failed")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,165 @@
+# カテゴリ別の写真枚数 (api/cruds/category_counts.py) をフェイクのFirestoreで更新・取得し、
+# 写真を全件数えた結果と一致すること (カテゴリの変更・既存ユーザーの数え直し・シャードの分割を含む) と、
+# 1回の取得で読むドキュメント数を写真の全件読みと比べる
+# 実行方法: python -m bench.bench_category_counts --photos 300 --heavy 200
+# Standard Library
+import argparse
+import asyncio
+import random
+import time
+from typing import Any, Dict, List
+from unittest import mock
+
+# First Party Library
+from bench.fakes import UpstreamProfile, Upstreams
+from bench.harness import FakeBackend, make_backend, patched_app, request
+
+CATEGORIES = ["ramen", "cafe", "sushi", "curry", "other"]
+
+
+def scan_counts(backend: FakeBackend, user_id: str) -> Dict[str, int]:
+    # クライアントがこれまで行っていた、写真を全件読んで数える方法
+    counts: Dict[str, int] = {}
+    prefix = f"users/{user_id}/photos/"
+    for path, data in backend.db.documents.items():
+        if path.startswith(prefix) and data.get("category"):
+            counts[data["category"]] = counts.get(data["category"], 0) + 1
+    return dict(sorted(counts.items()))
+
+
+def shard_documents(backend: FakeBackend, user_id: str) -> int:
+    prefix = f"users/{user_id}/categoryCounts/"
+    return sum(1 for path in backend.db.documents if path.startswith(prefix))
+
+
+async def fetch(app: Any, backend: FakeBackend, user_id: str, use_async: bool) -> Dict[str, Any]:
+    # First Party Library
+    from api.routers import router
+
+    headers = {"Authorization": f"Bearer {backend.auth.token_for(user_id)}"}
+    with mock.patch.object(router, "FIRESTORE_ASYNC", use_async):
+        response = await request(app, "POST", "/categoryCounts", {"userId": user_id}, headers)
+    if response.status != 200:
+        raise RuntimeError(f"/categoryCounts returned {response.status}: {response.body!r}")
+    result: Dict[str, Any] = response.json()
+    return result
+
+
+async def save(
+    backend: FakeBackend, user_id: str, photo_id: str, category: str, index: int
+) -> None:
+    # 同期と非同期のクライアントを交互に使う
+    # First Party Library
+    from api.cruds import firestore, firestore_async
+
+    url = f"https://example.com/{user_id}/{photo_id}.jpg"
+    if index % 2:
+        await firestore_async.save_category_and_photo_to_firestore(
+            user_id, photo_id, category, url, backend.async_db
+        )
+    else:
+        await asyncio.to_thread(
+            firestore.save_category_and_photo_to_firestore,
+            user_id,
+            photo_id,
+            category,
+            url,
+            backend.db,
+        )
+
+
+async def run(args: argparse.Namespace) -> int:
+    # First Party Library
+    from api.cruds import category_counts
+
+    upstreams = Upstreams({"firestore": UpstreamProfile(args.firestore_ms, args.firestore_ms / 4)})
+    backend = make_backend(upstreams)
+    rng = random.Random(0)
+    failures = 0
+
+    def check(label: str, user_id: str, result: Dict[str, Any]) -> None:
+        nonlocal failures
+        expected = scan_counts(backend, user_id)
+        ok = result["counts"] == expected and result["total"] == sum(expected.values())
+        failures += not ok
+        print(
+            f"{label:<28} total {result['total']:>5}  shards {shard_documents(backend, user_id)}"
+            f"  {'ok' if ok else f'MISMATCH {result} != {expected}'}"
+        )
+
+    # 集計より前に保存された写真を持つユーザー (初回の取得で数え直す)
+    for index in range(args.photos):
+        backend.db.documents[f"users/legacy/photos/photo_{index}"] = {
+            "category": rng.choice(CATEGORIES),
+            "userId": "legacy",
+        }
+
+    with patched_app(backend) as app, mock.patch.object(
+        category_counts, "HEAVY_USER_PHOTOS", args.heavy
+    ):
+        category_counts._shard_cache.clear()
+        check("legacy user, rebuilt", "legacy", await fetch(app, backend, "legacy", True))
+
+        # 数え直しと同時に保存された写真の増減も失わない (同期のクライアントどうしで競合させる)
+        for index in range(args.photos):
+            backend.db.documents[f"users/racing/photos/photo_{index}"] = {
+                "category": rng.choice(CATEGORIES),
+                "userId": "racing",
+            }
+        racing: List[Any] = [fetch(app, backend, "racing", False)]
+        racing += [
+            save(backend, "racing", f"photo_{args.photos + index}", rng.choice(CATEGORIES), 0)
+            for index in range(20)
+        ]
+        await asyncio.gather(*racing)
+        check("legacy user, saved during", "racing", await fetch(app, backend, "racing", False))
+
+        # 新しい写真の保存と、保存済みの写真のカテゴリの変更 (同じカテゴリの再保存も混ぜる)
+        for index in range(args.photos // 2):
+            photo_id = f"photo_{rng.randrange(args.photos + 50)}"
+            await save(backend, "legacy", photo_id, rng.choice(CATEGORIES), index)
+        check("legacy user, updated", "legacy", await fetch(app, backend, "legacy", False))
+
+        # 写真が多いユーザー: 数え直した後の書き込みでシャードに分かれる
+        for index in range(args.heavy):
+            await save(backend, "heavy", f"photo_{index}", rng.choice(CATEGORIES), index)
+        check("heavy user, before split", "heavy", await fetch(app, backend, "heavy", True))
+        category_counts._shard_cache.clear()
+        writes: List[Any] = [
+            save(backend, "heavy", f"photo_{rng.randrange(args.heavy * 2)}", category, index)
+            for index, category in enumerate(rng.choices(CATEGORIES, k=args.heavy))
+        ]
+        await asyncio.gather(*writes)
+        # 書き込み側のキャッシュが古いシャード数のままでも数は合う
+        check("heavy user, sharded", "heavy", await fetch(app, backend, "heavy", True))
+        failures += shard_documents(backend, "heavy") <= 1
+
+        # 1回の取得のコスト: 集計ドキュメント (シャード数ぶん) と写真の全件読み
+        for user_id in ("legacy", "heavy"):
+            started = time.perf_counter()
+            for _ in range(args.reads):
+                await fetch(app, backend, user_id, True)
+            elapsed = (time.perf_counter() - started) / args.reads * 1e3
+            photos = sum(scan_counts(backend, user_id).values())
+            print(
+                f"\n{user_id:<6} {elapsed:6.1f} ms/read  documents read"
+                f" {shard_documents(backend, user_id):>2} (counters) vs {photos} (all photos)"
+            )
+    return failures
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--photos", type=int, default=300)
+    parser.add_argument("--heavy", type=int, default=200, help="photos before a user is sharded")
+    parser.add_argument("--firestore-ms", type=float, default=5.0)
+    parser.add_argument("--reads", type=int, default=20)
+    args = parser.parse_args()
+
+    failures = asyncio.run(run(args))
+    if failures:
+        raise SystemExit(f"{failures} check(s) failed")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+# コールドスタート時の `import api.main` の所要時間を新しいプロセスで計測する
+# 実行方法: python -m bench.bench_cold_start --runs 5
+# Standard Library
+import argparse
+import statistics
+import subprocess
+import sys
+from typing import List, Tuple
+
+SNIPPET = "import time; t = time.perf_counter(); import api.main; print(time.perf_counter() - t)"
+
+
+def import_times() -> List[Tuple[str, int]]:
+    # -X importtime の累積時間 (us) が大きいトップレベルのimportを返す
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import api.main"],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    times = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = (part.strip() for part in line[len("import time:") :].split("|"))
+        if not name.startswith(" "):
+            times.append((name.strip(), int(cumulative)))
+    return sorted(times, key=lambda item: item[1], reverse=True)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=10)
+    args = parser.parse_args()
+
+    durations = []
+    for _ in range(args.runs):
+        result = subprocess.run(
+            [sys.executable, "-W", "ignore", "-c", SNIPPET],
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+        durations.append(float(result.stdout.strip().splitlines()[-1]) * 1e3)
+    print(f"import api.main: median {statistics.median(durations):.0f} ms over {args.runs} runs")
+
+    print("top-level imports (cumulative):")
+    for name, cumulative in import_times()[: args.top]:
+        print(f"  {name:<40}{cumulative / 1e3:>8.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
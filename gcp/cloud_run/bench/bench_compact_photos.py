@@ -0,0 +1,108 @@
+# 孤立した店舗写真の削除ジョブ (api/jobs/compact_store_photos.py) をフェイクのFirestore / GCSで実行し、
+# 参照中の写真を消さないこと・孤立写真が消えること・ピークメモリを確認する
+# 実行方法: python -m bench.bench_compact_photos --stores 20000 --orphans 100000
+# Standard Library
+import argparse
+import sys
+import time
+import tracemalloc
+from dataclasses import asdict
+from datetime import timedelta
+from typing import Set, Tuple
+
+# First Party Library
+from bench.fakes import FakeFirestore, FakeStorage, UpstreamProfile, Upstreams
+
+
+def seed(
+    db: FakeFirestore, storage: FakeStorage, stores: int, photos_per_store: int, orphans: int
+) -> Tuple[Set[str], Set[str]]:
+    # First Party Library
+    from api.cruds.gcs import GCS_PREFIX, PROJECT
+
+    bucket = storage.bucket(PROJECT)
+    keep: Set[str] = set()
+    for index in range(stores):
+        names = [
+            f"{GCS_PREFIX}/place_{index}/kept_{photo}.jpg" for photo in range(photos_per_store)
+        ]
+        db.documents[f"stores/place_{index}"] = {
+            "name": f"store {index}",
+            "imageUrls": [bucket.blob(name).public_url for name in names],
+        }
+        for name in names:
+            bucket.objects[name] = b"x" * 100
+        keep.update(names)
+    orphaned: Set[str] = set()
+    for index in range(orphans):
+        name = f"{GCS_PREFIX}/place_{index % max(1, stores)}/orphan_{index}.jpg"
+        bucket.objects[name] = b"x" * 100
+        orphaned.add(name)
+    # ユーザーの写真と、アップロード直後の孤立写真は残るはず
+    for index in range(100):
+        name = f"{GCS_PREFIX}/users_photo/user_{index}/photo.jpg"
+        bucket.objects[name] = b"x"
+        keep.add(name)
+    young = f"{GCS_PREFIX}/place_0/just_uploaded.jpg"
+    bucket.blob(young).upload_from_string(b"x")
+    keep.add(young)
+    return keep, orphaned
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--stores", type=int, default=20000)
+    parser.add_argument("--photos-per-store", type=int, default=3)
+    parser.add_argument("--orphans", type=int, default=100000)
+    parser.add_argument("--gcs-ms", type=float, default=30.0)
+    parser.add_argument("--firestore-ms", type=float, default=20.0)
+    args = parser.parse_args()
+
+    # First Party Library
+    from api.cruds.gcs import PROJECT
+    from api.jobs.compact_store_photos import compact
+
+    upstreams = Upstreams(
+        {
+            "gcs": UpstreamProfile(args.gcs_ms, args.gcs_ms / 4),
+            "firestore": UpstreamProfile(args.firestore_ms, args.firestore_ms / 4),
+        }
+    )
+    db = FakeFirestore(upstreams)
+    storage = FakeStorage(upstreams)
+    keep, orphaned = seed(db, storage, args.stores, args.photos_per_store, args.orphans)
+    objects = storage.bucket(PROJECT).objects
+    expected_urls = args.stores * args.photos_per_store
+    failures = 0
+
+    dry = compact(db, storage, dry_run=True, expected_urls=expected_urls)
+    print(f"dry run  {asdict(dry)}")
+    failures += len(objects) != len(keep) + len(orphaned)
+
+    tracemalloc.start()
+    started = time.perf_counter()
+    report = compact(
+        db, storage, dry_run=False, min_age=timedelta(hours=1), expected_urls=expected_urls
+    )
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"compact  {asdict(report)}")
+
+    missing = len(keep - objects.keys())
+    left = len(orphaned & objects.keys())
+    # 参照中のURLを全て文字列の集合に持った場合のおおよそのメモリ
+    set_bytes = sys.getsizeof(keep) + sum(sys.getsizeof(name) for name in keep)
+    print(
+        f"\n{elapsed:.1f} s  deleted {report.deleted}  orphans left {left} (false positives)"
+        f"  referenced missing {missing}"
+        f"\npeak traced memory {peak / 1e6:.1f} MB  filter {report.filter_bytes / 1e6:.2f} MB"
+        f"  (a set of the referenced names would be ~{set_bytes / 1e6:.1f} MB)"
+    )
+    failures += missing > 0 or left > args.orphans * 0.001 or report.deleted != args.orphans - left
+    if failures:
+        raise SystemExit(f"{failures} check(s) failed")
+
+
+if __name__ == "__main__":
+    main()
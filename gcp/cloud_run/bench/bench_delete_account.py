@@ -0,0 +1,200 @@
+# アカウント削除 (gcp/cloud_functions/account_cleanup.py) をフェイクのFirestore / GCSで実行し、
+# 全て消えること・途中で打ち切っても再開できること・所要時間を確認する
+# 実行方法: python -m bench.bench_delete_account --photos 20000 --users 2000
+# Standard Library
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Tuple
+
+# First Party Library
+from bench.fakes import FakeAuthAdmin, FakeFirestore, FakeStorage, UpstreamProfile, Upstreams
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "..", "cloud_functions"))
+# 写真のバケット名 (Cloud Functionsでは GCLOUD_PROJECT が設定される)
+os.environ.setdefault("GCLOUD_PROJECT", "bench-project")
+
+# Third Party Library
+import account_cleanup  # noqa: E402
+
+
+def seed(db: FakeFirestore, storage: FakeStorage, uid: str, photos: int) -> None:
+    db.documents[f"users/{uid}"] = {"classifyPhotosStatus": "readyForUse"}
+    bucket = storage.bucket(account_cleanup.photo_bucket_name())
+    for index in range(photos):
+        db.documents[f"users/{uid}/photos/photo_{index:06d}"] = {"userId": uid}
+        bucket.objects[f"{account_cleanup.GCS_PREFIX}/users_photo/{uid}/photo_{index:06d}.jpg"] = (
+            b""
+        )
+    # 他のユーザーのデータは残るはず
+    db.documents["users/other/photos/photo_0"] = {"userId": "other"}
+    bucket.objects[f"{account_cleanup.GCS_PREFIX}/users_photo/other/photo_0.jpg"] = b""
+
+
+def remaining(db: FakeFirestore, storage: FakeStorage, uid: str) -> Tuple[int, int]:
+    documents = sum(1 for path in db.documents if path.startswith(f"users/{uid}"))
+    prefix = f"{account_cleanup.GCS_PREFIX}/users_photo/{uid}/"
+    blobs = sum(
+        1
+        for name in storage.bucket(account_cleanup.photo_bucket_name()).objects
+        if name.startswith(prefix)
+    )
+    return documents, blobs
+
+
+def naive_delete(db: FakeFirestore, storage: FakeStorage, uid: str) -> None:
+    # 比較用: 1件ずつ順番に消す
+    for snapshot in db.collection("users").document(uid).collection("photos").stream():
+        snapshot.reference.delete()
+    for blob in storage.list_blobs(
+        account_cleanup.photo_bucket_name(),
+        prefix=f"{account_cleanup.GCS_PREFIX}/users_photo/{uid}/",
+    ):
+        blob.delete()
+    db.collection("users").document(uid).delete()
+
+
+def make_backend(
+    args: argparse.Namespace,
+) -> Tuple[Upstreams, FakeFirestore, FakeStorage]:
+    upstreams = Upstreams(
+        {
+            "firestore": UpstreamProfile(args.firestore_ms, args.firestore_ms / 4),
+            "gcs": UpstreamProfile(args.gcs_ms, args.gcs_ms / 4),
+            "auth": UpstreamProfile(args.auth_ms, args.auth_ms / 4),
+        }
+    )
+    return upstreams, FakeFirestore(upstreams), FakeStorage(upstreams)
+
+
+def run_cleanup(db: Any, storage: Any, uid: str, budget: float) -> Dict[str, Any]:
+    with ThreadPoolExecutor(account_cleanup.WORKERS) as pool:
+        result = account_cleanup.delete_user_data(uid, db, storage, time.monotonic() + budget, pool)
+    progress: Dict[str, Any] = result.to_dict()
+    return progress
+
+
+def check_bulk(args: argparse.Namespace) -> int:
+    # 多数のアカウントの一括削除 (1人ずつ削除する場合と比べる)
+    uids = [f"bulk_{index}" for index in range(args.users)]
+    upstreams, db, storage = make_backend(args)
+    auth = FakeAuthAdmin(upstreams, uids)
+    for uid in uids:
+        seed(db, storage, uid, args.photos_per_user)
+
+    sample = uids[: args.naive_users]
+    started = time.perf_counter()
+    for uid in sample:
+        run_cleanup(db, storage, uid, 3600)
+        auth.delete_user(uid)
+    one_by_one = (time.perf_counter() - started) / len(sample) * len(uids)
+
+    # 削除に失敗するユーザーの結果が集計されることも確認する
+    auth.failing[uids[-1]] = "USER_NOT_DISABLED"
+    started = time.perf_counter()
+    with ThreadPoolExecutor(account_cleanup.WORKERS) as pool:
+        results = account_cleanup.delete_accounts(
+            uids, db, storage, auth, time.monotonic() + 3600, pool
+        )
+    elapsed = time.perf_counter() - started
+    summary = account_cleanup.summarize(results)
+    print(f"bulk one by one      {one_by_one:8.1f} s for {len(uids)} users (est.)")
+    print(f"bulk delete_accounts {elapsed:8.1f} s  {summary}")
+    print(
+        f"  auth calls {upstreams.snapshot().get('auth.delete_users')}  error {results[uids[-1]]}"
+    )
+    progress = [
+        path for path in db.documents if path.startswith(f"{account_cleanup.PROGRESS_COLLECTION}/")
+    ]
+    return int(
+        bool(progress)
+        or summary["deleted"] != len(uids) - 1
+        or results[uids[-1]].get("error") != "USER_NOT_DISABLED"
+        or auth.users != {uids[-1]}
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--photos", type=int, default=20000)
+    parser.add_argument("--naive-photos", type=int, default=200)
+    parser.add_argument("--firestore-ms", type=float, default=20.0)
+    parser.add_argument("--gcs-ms", type=float, default=30.0)
+    parser.add_argument("--auth-ms", type=float, default=100.0)
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--naive-users", type=int, default=20)
+    parser.add_argument("--photos-per-user", type=int, default=10)
+    args = parser.parse_args()
+    failures = 0
+
+    # 1件ずつ消す場合 (件数を減らして実行し、写真1枚あたりの時間から換算する)
+    _, db, storage = make_backend(args)
+    seed(db, storage, "naive", args.naive_photos)
+    started = time.perf_counter()
+    naive_delete(db, storage, "naive")
+    per_photo = (time.perf_counter() - started) / args.naive_photos
+    print(f"naive (one by one)   {per_photo * args.photos:8.1f} s for {args.photos} photos (est.)")
+
+    # まとめて並列に消す場合
+    upstreams, db, storage = make_backend(args)
+    seed(db, storage, "user_1", args.photos)
+    result = run_cleanup(db, storage, "user_1", 3600)
+    left = remaining(db, storage, "user_1")
+    calls = upstreams.snapshot()
+    print(
+        f"batched + parallel   {result['elapsedSeconds']:8.1f} s  remaining {left}  calls {calls}"
+    )
+    failures += left != (0, 0) or not result["complete"]
+
+    # 期限で打ち切ってから再開する場合 (上の所要時間の1/4で打ち切る)
+    _, db, storage = make_backend(args)
+    seed(db, storage, "user_2", args.photos)
+    first = run_cleanup(db, storage, "user_2", result["elapsedSeconds"] / 4)
+    after_first = remaining(db, storage, "user_2")
+    progress_path = f"{account_cleanup.PROGRESS_COLLECTION}/user_2"
+    progress = dict(db.documents.get(progress_path, {}))
+    second = run_cleanup(db, storage, "user_2", 3600)
+    left = remaining(db, storage, "user_2")
+    # 途中の進捗は期限付きで残し、削除し終えたら消す (uidを残さない)
+    kept_progress = progress_path in db.documents
+    print(
+        f"interrupted + resume complete={first['complete']} remaining {after_first}"
+        f" -> complete={second['complete']} remaining {left}"
+        f"  progress {progress} -> kept={kept_progress}"
+    )
+    failures += first["complete"] or left != (0, 0) or not second["complete"]
+    failures += "expireAt" not in progress or kept_progress
+
+    # 写真の一覧が取れない場合 (バケットが無いなど) は途中で止め、users/{uid} を残して再開できるようにする
+    _, db, storage = make_backend(args)
+    seed(db, storage, "user_3", 100)
+    list_blobs = storage.list_blobs
+
+    def missing_bucket(*args: Any, **kwargs: Any) -> Any:
+        raise RuntimeError("404 bucket not found")
+
+    storage.list_blobs = missing_bucket  # type: ignore
+    failed = run_cleanup(db, storage, "user_3", 3600)
+    kept = "users/user_3" in db.documents
+    storage.list_blobs = list_blobs  # type: ignore
+    retried = run_cleanup(db, storage, "user_3", 3600)
+    print(
+        f"listing failure      complete={failed['complete']} errors={failed['errors']}"
+        f" user doc kept={kept} -> retry complete={retried['complete']}"
+        f" remaining {remaining(db, storage, 'user_3')}"
+    )
+    failures += failed["complete"] or not kept or not retried["complete"]
+
+    if "users/other/photos/photo_0" not in db.documents:
+        failures += 1
+        print("NG other user's data was deleted")
+
+    failures += check_bulk(args)
+    if failures:
+        raise SystemExit(f"{failures} check(s) failed")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+# Firestoreの読み書きを、同期版 (ループ上で直接 / スレッドプール) と非同期版で比較する
+# 実行方法: python -m bench.bench_firestore_async --requests 400 --concurrency 100
+#
+# フェイクのFirestore (同期・非同期でデータを共有) に遅延を付け、/findOpenStores と
+# /updateUserStatus 相当の処理を同時に流して、スループット・レイテンシ・イベントループの遅れを測る
+# Standard Library
+import argparse
+import asyncio
+import time
+from datetime import datetime, timezone
+from typing import Any, Awaitable, Callable, Dict, List
+
+# First Party Library
+from bench.fakes import FakeAsyncFirestore, FakeFirestore, UpstreamProfile, Upstreams
+from bench.load_test import percentile
+
+USERS = 50
+PHOTOS_PER_USER = 5
+STORES_PER_PHOTO = 3
+LAG_INTERVAL = 0.005
+
+
+def seed(db: FakeFirestore) -> None:
+    now = datetime.now(timezone.utc)
+    for user in range(USERS):
+        db.documents[f"users/user_{user}"] = {"classifyPhotosStatus": "processing"}
+        for photo in range(PHOTOS_PER_USER):
+            store_ids = [f"store_{user}_{photo}_{index}" for index in range(STORES_PER_PHOTO)]
+            db.documents[f"users/user_{user}/photos/photo_{photo}"] = {
+                "createdAt": now,
+                "userId": f"user_{user}",
+                "storeId": store_ids[0],
+                "areaStoreIds": store_ids,
+            }
+            for store_id in store_ids[:-1]:
+                db.documents[f"stores/{store_id}"] = {"openingIntervals": [0, 10080]}
+            # 営業時間インデックスより前に保存された店舗 (openingIntervalsが無い)
+            db.documents[f"stores/{store_ids[-1]}"] = {"name": store_ids[-1]}
+
+
+def make_workloads(db: FakeFirestore, async_db: FakeAsyncFirestore) -> Dict[str, Callable]:
+    # Third Party Library
+    from fastapi.concurrency import run_in_threadpool  # type: ignore
+
+    # First Party Library
+    from api.schemas.find_open_stores import find_open_stores, find_open_stores_async
+    from api.schemas.update_user_status import update_user_status, update_user_status_async
+
+    def sync_request(user_id: str) -> None:
+        find_open_stores(user_id, {"uid": user_id}, None, db)
+        update_user_status(user_id, {"uid": user_id}, db)
+
+    async def sync_on_loop(user_id: str) -> None:
+        sync_request(user_id)
+
+    async def sync_in_threadpool(user_id: str) -> None:
+        await run_in_threadpool(sync_request, user_id)
+
+    async def async_client(user_id: str) -> None:
+        await find_open_stores_async(user_id, {"uid": user_id}, None, async_db)
+        await update_user_status_async(user_id, {"uid": user_id}, async_db)
+
+    return {
+        "sync on event loop": sync_on_loop,
+        "sync in threadpool": sync_in_threadpool,
+        "async client": async_client,
+    }
+
+
+async def run(
+    workload: Callable[[str], Awaitable[None]], requests: int, concurrency: int
+) -> Dict[str, Any]:
+    latencies: List[float] = []
+    lags: List[float] = []
+    queue: asyncio.Queue = asyncio.Queue()
+    for index in range(requests):
+        queue.put_nowait(f"user_{index % USERS}")
+    done = asyncio.Event()
+
+    async def measure_lag() -> None:
+        # 一定間隔で起きるはずのタスクがどれだけ遅れたか (イベントループが塞がれた時間)
+        while not done.is_set():
+            expected = time.perf_counter() + LAG_INTERVAL
+            await asyncio.sleep(LAG_INTERVAL)
+            lags.append(max(0.0, time.perf_counter() - expected) * 1e3)
+
+    async def worker() -> None:
+        while not queue.empty():
+            user_id = queue.get_nowait()
+            started = time.perf_counter()
+            await workload(user_id)
+            latencies.append((time.perf_counter() - started) * 1e3)
+
+    lag_task = asyncio.ensure_future(measure_lag())
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    done.set()
+    await lag_task
+
+    return {
+        "throughputRps": round(requests / elapsed, 1),
+        "p50Ms": round(percentile(latencies, 0.50), 1),
+        "p99Ms": round(percentile(latencies, 0.99), 1),
+        "loopLagP99Ms": round(percentile(lags, 0.99), 1),
+        "loopLagMaxMs": round(max(lags, default=0.0), 1),
+    }
+
+
+async def check_missing_user(db: FakeFirestore, async_db: FakeAsyncFirestore) -> int:
+    # ドキュメントの無いユーザーのステータス更新は、同期版・非同期版とも作成になる (500にしない)
+    # First Party Library
+    from api.schemas.update_user_status import update_user_status, update_user_status_async
+
+    update_user_status("missing_sync", {"uid": "missing_sync"}, db)
+    await update_user_status_async("missing_async", {"uid": "missing_async"}, async_db)
+    created = [
+        db.documents.get(f"users/{user_id}", {}).get("classifyPhotosStatus")
+        for user_id in ("missing_sync", "missing_async")
+    ]
+    print(f"status of users without a document: {created}")
+    return sum(status is None for status in created)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=400)
+    parser.add_argument("--concurrency", type=int, default=100)
+    parser.add_argument("--latency-ms", type=float, default=20.0)
+    parser.add_argument("--jitter-ms", type=float, default=5.0)
+    args = parser.parse_args()
+
+    upstreams = Upstreams({"firestore": UpstreamProfile(args.latency_ms, args.jitter_ms)})
+    db = FakeFirestore(upstreams)
+    async_db = FakeAsyncFirestore(db)
+    seed(db)
+
+    for name, workload in make_workloads(db, async_db).items():
+        calls_before = sum(upstreams.snapshot().values())
+        result = asyncio.run(run(workload, args.requests, args.concurrency))
+        calls = (sum(upstreams.snapshot().values()) - calls_before) / args.requests
+        print(
+            f"{name:<20} {result['throughputRps']:>7} req/s"
+            f"  p50 {result['p50Ms']:>7} ms  p99 {result['p99Ms']:>7} ms"
+            f"  loop lag p99 {result['loopLagP99Ms']:>6} ms  max {result['loopLagMaxMs']:>6} ms"
+            f"  {calls:.1f} calls/request"
+        )
+
+    failures = asyncio.run(check_missing_user(db, async_db))
+    if failures:
+        raise SystemExit(f"{failures} check(s) failed")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+# Geminiの判定のテールレイテンシを、期限・ヘッジの有無で比較する
+# 実行方法: python -m bench.bench_gemini --calls 200 --stall-rate 0.05
+#
+# 応答時間が対数正規分布で、一定割合の呼び出しが止まる (stall秒後に返る) フェイクのモデルを使う
+# モデルは request_options のタイムアウトで打ち切る。全ての判定が返った時点で残っている呼び出し
+# (期限後に放棄され、スレッドを使い続けているもの) の数も表示する
+# Standard Library
+import argparse
+import logging
+import random
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterator, List
+from unittest import mock
+
+# First Party Library
+from bench.harness import make_jpeg
+from bench.load_test import percentile
+
+
+class Chunk:
+    def __init__(self, text: str) -> None:
+        self.text = text
+
+
+class DeadlineExceeded(Exception):
+    # google.api_core.exceptions.DeadlineExceeded の代わり
+    pass
+
+
+class SlowModel:
+    def __init__(self, median: float, sigma: float, stall_rate: float, stall: float) -> None:
+        self.median = median
+        self.sigma = sigma
+        self.stall_rate = stall_rate
+        self.stall = stall
+        self.calls = 0
+        self.active = 0
+        self._random = random.Random(0)
+        self._lock = threading.Lock()
+
+    def generate_content(
+        self, contents: Any, stream: bool = False, request_options: Any = None
+    ) -> Iterator[Chunk]:
+        with self._lock:
+            self.calls += 1
+            self.active += 1
+            stalled = self._random.random() < self.stall_rate
+            latency = self.median * self._random.lognormvariate(0, self.sigma)
+        timeout = (request_options or {}).get("timeout", float("inf"))
+        try:
+            time.sleep(min(self.stall if stalled else latency, timeout))
+            if (self.stall if stalled else latency) > timeout:
+                raise DeadlineExceeded("504 Deadline Exceeded")
+        finally:
+            with self._lock:
+                self.active -= 1
+        # カテゴリ名の後ろに説明が続く回答 (後半は早期終了で読まれない)
+        for text in ["ラー", "メン", "です。", "スープ" * 20]:
+            yield Chunk(text)
+            time.sleep(0.02)
+
+
+def run(args: argparse.Namespace, hedge: float, deadline: float) -> Dict[str, Any]:
+    # First Party Library
+    from api.core import gemini
+
+    model = SlowModel(args.median, args.sigma, args.stall_rate, args.stall)
+    photo = make_jpeg()
+    latencies: List[float] = []
+    outcomes: Dict[str, int] = {}
+
+    def call(_: int) -> None:
+        started = time.perf_counter()
+        try:
+            outcome = gemini.categorize_from_gemini_api(photo)[:4]
+        except Exception as e:
+            outcome = type(e).__name__
+        latencies.append((time.perf_counter() - started) * 1e3)
+        outcomes[outcome] = outcomes.get(outcome, 0) + 1
+
+    with mock.patch.object(gemini, "get_gemini_model", lambda api_key: model), mock.patch.object(
+        gemini, "HEDGE_PERCENTILE", hedge
+    ), mock.patch.object(gemini, "DEADLINE_SECONDS", deadline), mock.patch.object(
+        gemini, "FALLBACK_CATEGORY", "飲食物ではない"
+    ):
+        gemini._latencies.clear()
+        with ThreadPoolExecutor(args.concurrency) as pool:
+            list(pool.map(call, range(args.calls)))
+
+    return {
+        "p50Ms": round(percentile(latencies, 0.50), 1),
+        "p99Ms": round(percentile(latencies, 0.99), 1),
+        "maxMs": round(max(latencies), 1),
+        "meanMs": round(statistics.fmean(latencies), 1),
+        "upstreamCalls": model.calls,
+        "leftRunning": model.active,
+        "outcomes": outcomes,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--calls", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--median", type=float, default=0.3, help="median latency in seconds")
+    parser.add_argument("--sigma", type=float, default=0.4)
+    parser.add_argument("--stall-rate", type=float, default=0.05)
+    parser.add_argument("--stall", type=float, default=6.0, help="seconds a stalled call takes")
+    parser.add_argument("--deadline", type=float, default=3.0)
+    args = parser.parse_args()
+    # 期限切れの警告ログで結果が読みにくくならないようにする
+    logging.getLogger("api").setLevel(logging.ERROR)
+
+    # First Party Library
+    from api.core import rate_limit
+
+    # ペース制御の影響を除くため上限を十分大きくする
+    rate_limit._limits["gemini"] = (1e6, 1e6)
+
+    # (ヘッジするパーセンタイル, 期限 秒)。期限が無い場合は止まった呼び出しをそのまま待つ
+    scenarios = {
+        "no deadline": (0.0, 3600.0),
+        "deadline only": (0.0, args.deadline),
+        "deadline + p95 hedge": (0.95, args.deadline),
+        "deadline + p90 hedge": (0.90, args.deadline),
+    }
+    for name, (hedge, deadline) in scenarios.items():
+        result = run(args, hedge, deadline)
+        print(
+            f"{name:<22} p50 {result['p50Ms']:>7} ms  p99 {result['p99Ms']:>7} ms"
+            f"  max {result['maxMs']:>7} ms  calls {result['upstreamCalls']:>4}"
+            f"  left running {result['leftRunning']:>2}"
+            f"  {result['outcomes']}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,177 @@
+# 写真の一覧 (GET /photos) をフェイクのFirestoreで最後までスクロールし、全ての写真が新しい順に1回ずつ
+# 返ること (スクロール中の更新・カテゴリでの絞り込みを含む) と、1ページの転送量・304での再検証を確認する
+# 実行方法: python -m bench.bench_list_photos --photos 1000 --page-size 50
+# Standard Library
+import argparse
+import asyncio
+import json
+import random
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional, Tuple
+from unittest import mock
+from urllib.parse import urlencode
+
+# First Party Library
+from bench.fakes import UpstreamProfile, Upstreams
+from bench.harness import FakeBackend, Response, make_backend, patched_app, request
+
+CATEGORIES = ["ramen", "cafe", "sushi", "curry", "other"]
+USER_ID = "user_0"
+
+
+def seed(backend: FakeBackend, photos: int) -> None:
+    rng = random.Random(0)
+    started = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    for index in range(photos):
+        # 同じ時刻に作られた写真も混ぜる (IDの順で並ぶ)
+        created_at = started + timedelta(minutes=index // 3)
+        backend.db.documents[f"users/{USER_ID}/photos/photo_{index:05d}"] = {
+            "url": f"https://storage.googleapis.com/bucket/{USER_ID}/photo_{index:05d}.jpg",
+            "category": rng.choice(CATEGORIES),
+            "storeId": f"place_{rng.randrange(100)}",
+            "areaStoreIds": [f"place_{rng.randrange(100)}" for _ in range(10)],
+            "userId": USER_ID,
+            "createdAt": created_at,
+            "updatedAt": created_at,
+        }
+
+
+def expected_ids(backend: FakeBackend, category: Optional[str] = None) -> List[str]:
+    prefix = f"users/{USER_ID}/photos/"
+    photos = [
+        (data["createdAt"], path[len(prefix) :])
+        for path, data in backend.db.documents.items()
+        if path.startswith(prefix) and (category is None or data.get("category") == category)
+    ]
+    return [photo_id for _, photo_id in sorted(photos, reverse=True)]
+
+
+async def get(
+    app: Any,
+    backend: FakeBackend,
+    use_async: bool,
+    headers: Optional[Dict[str, str]],
+    **params: Any,
+) -> Response:
+    # First Party Library
+    from api.routers import router
+
+    query = urlencode({"userId": USER_ID, **params})
+    with mock.patch.object(router, "FIRESTORE_ASYNC", use_async):
+        return await request(
+            app,
+            "GET",
+            f"/photos?{query}",
+            headers={
+                "Authorization": f"Bearer {backend.auth.token_for(USER_ID)}",
+                **(headers or {}),
+            },
+        )
+
+
+async def scroll(
+    app: Any, backend: FakeBackend, use_async: bool, update_at: int = -1, **params: Any
+) -> Tuple[List[str], int, float]:
+    # 最後のページまで読み、(IDの並び, ページ数, 1ページの平均バイト数) を返す
+    ids: List[str] = []
+    sizes: List[int] = []
+    cursor: Optional[str] = None
+    while True:
+        response = await get(
+            app, backend, use_async, None, **params, **({"cursor": cursor} if cursor else {})
+        )
+        if response.status != 200:
+            raise RuntimeError(f"/photos returned {response.status}: {response.body!r}")
+        page = response.json()
+        ids.extend(row[0] for row in page["photos"])
+        sizes.append(len(response.body))
+        if len(sizes) == update_at:
+            # スクロール中に表示済みの写真が更新されても、並びは変わらない
+            path = f"users/{USER_ID}/photos/{ids[0]}"
+            backend.db.documents[path]["updatedAt"] = datetime.now(timezone.utc)
+        cursor = page["nextCursor"]
+        if cursor is None:
+            return ids, len(sizes), sum(sizes) / len(sizes)
+
+
+async def run(args: argparse.Namespace) -> int:
+    upstreams = Upstreams({"firestore": UpstreamProfile(args.firestore_ms, args.firestore_ms / 4)})
+    backend = make_backend(upstreams)
+    seed(backend, args.photos)
+    failures = 0
+    page_size = str(args.page_size)
+
+    # クライアントがこれまで行っていた、写真のドキュメントを全件そのまま読む方法の転送量
+    full = [data for path, data in backend.db.documents.items() if path.startswith("users/")]
+    full_bytes = len(json.dumps(full, default=str, separators=(",", ":")).encode())
+
+    with patched_app(backend) as app:
+        for use_async in (True, False):
+            label = "async" if use_async else "sync"
+            started = time.perf_counter()
+            ids, pages, page_bytes = await scroll(
+                app,
+                backend,
+                use_async,
+                update_at=2,
+                pageSize=page_size,
+                fields="url,category,updatedAt",
+            )
+            elapsed = (time.perf_counter() - started) / pages * 1e3
+            ok = ids == expected_ids(backend)
+            failures += not ok
+            print(
+                f"{label:<5} {len(ids)} photos in {pages} pages  {elapsed:5.1f} ms/page"
+                f"  {page_bytes / 1024:5.1f} KiB/page  {'ok' if ok else 'MISMATCH'}"
+            )
+
+            category = CATEGORIES[0]
+            ids, pages, _ = await scroll(
+                app, backend, use_async, pageSize=page_size, category=category
+            )
+            ok = ids == expected_ids(backend, category)
+            failures += not ok
+            print(
+                f"{label:<5} category={category}  {len(ids)} photos in {pages} pages"
+                f"  {'ok' if ok else 'MISMATCH'}"
+            )
+
+        print(
+            f"\nall photo documents as-is  {full_bytes / 1024:7.1f} KiB"
+            f"  vs one page {page_bytes / 1024:5.1f} KiB"
+        )
+
+        # 同じページの再検証は本文なしの304になり、写真が変わると200に戻る
+        first = await get(app, backend, True, None, pageSize=page_size)
+        etag = first.headers.get("etag", "")
+        again = await get(app, backend, True, {"If-None-Match": etag}, pageSize=page_size)
+        newest = first.json()["photos"][0][0]
+        backend.db.documents[f"users/{USER_ID}/photos/{newest}"]["category"] = "changed"
+        changed = await get(app, backend, True, {"If-None-Match": etag}, pageSize=page_size)
+        print(
+            f"revalidate  unchanged {again.status} ({len(again.body)} bytes)"
+            f"  after an update {changed.status}"
+        )
+        failures += again.status != 304 or bool(again.body) or changed.status != 200
+
+        bad = await get(app, backend, True, None, cursor="not-a-cursor")
+        unknown = await get(app, backend, True, None, fields="url,secret")
+        failures += bad.status != 400 or unknown.status != 400
+    return failures
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--photos", type=int, default=1000)
+    parser.add_argument("--page-size", type=int, default=50)
+    parser.add_argument("--firestore-ms", type=float, default=5.0)
+    args = parser.parse_args()
+
+    failures = asyncio.run(run(args))
+    if failures:
+        raise SystemExit(f"{failures} check(s) failed")
+
+
+if __name__ == "__main__":
+    main()
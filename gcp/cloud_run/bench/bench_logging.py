@@ -0,0 +1,117 @@
+# 1リクエストあたりのロギングのオーバーヘッドを変更前後で比較する
+# 実行方法: python -m bench.bench_logging
+# Standard Library
+import argparse
+import io
+import logging
+import time
+from datetime import datetime
+from typing import Callable
+
+# First Party Library
+from api.core.data_class import StoreData
+from api.core.log import InfoSamplingFilter, JsonFormatter
+
+STORES_PER_REQUEST = 3
+
+
+def make_store(index: int) -> StoreData:
+    return StoreData(
+        store_id=f"ChIJ{index:020d}",
+        createdAt=datetime.now(),
+        updatedAt=datetime.now(),
+        name="ラーメン店",
+        address="日本、東京都渋谷区道玄坂1-2-3",
+        city="Shibuya",
+        prefecture="Tokyo",
+        country="Japan",
+        phoneNumber="03-1234-5678",
+        website="https://example.com",
+        openingHours={f"{day}_hours": "11:00-14:00, 17:00-22:00" for day in range(7)},
+        openingIntervals=list(range(28)),
+        imageUrls=[f"https://storage.googleapis.com/bucket/{index}/{n}.jpg" for n in range(10)],
+    )
+
+
+class FakeReference:
+    # Firestoreの参照オブジェクトのreprを模したもの
+    def __repr__(self) -> str:
+        return "<google.cloud.firestore_v1.document.DocumentReference object at 0x7f00>"
+
+
+def request_before(logger: logging.Logger, stores: list) -> None:
+    # 変更前: f-stringで全ペイロードを即時に整形していた
+    photo_id, user_id = "photo_1", "user_1"
+    logger.info(f"lat: {35.6595}")
+    logger.info(f"lon: {139.7005}")
+    for store in stores:
+        for url in store.imageUrls:
+            logger.info(f"uploaded_image_url: {url}")
+        logger.info(f"Preparing to save store data to Firestore: {store}")
+        logger.info(
+            f"Photo document {photo_id} does not exist for user {user_id}. Creating new document."
+        )
+        photo_data = {
+            "userId": user_id,
+            "storeId": store.store_id,
+            "areaStoreIds": [store.store_id],
+        }
+        logger.info(f"Created new photo document with data: {photo_data}")
+        logger.info(f"Saved store data to stores collection with ID {store.store_id}")
+        logger.info(f"Saved opening hours to stores/{store.store_id}/openingHours/hours")
+    logger.info(f"users_ref={FakeReference()}")
+    logger.info(f"user_doc_ref={FakeReference()}")
+
+
+def request_after(logger: logging.Logger, stores: list) -> None:
+    # 変更後: 遅延評価の%形式で、詳細はDEBUGに落としIDのみを出す
+    logger.info("Finding restaurants near %s,%s", 35.6595, 139.7005)
+    for store in stores:
+        for url in store.imageUrls:
+            logger.debug("Uploaded store photo %s", url)
+        logger.debug("Preparing to save store %s to Firestore", store.store_id)
+        logger.debug("Photo document %s does not exist for user %s", "photo_1", "user_1")
+        logger.debug("Created photo document %s", "photo_1")
+        logger.info("Saved store %s for photo %s", store.store_id, "photo_1")
+    logger.debug("Updating status of user %s", "user_1")
+
+
+def measure(
+    name: str,
+    request: Callable[[logging.Logger, list], None],
+    handler: logging.Handler,
+    iterations: int,
+) -> None:
+    logger = logging.getLogger(f"bench.{name}")
+    logger.propagate = False
+    logger.handlers = [handler]
+    logger.setLevel(logging.INFO)
+    stores = [make_store(index) for index in range(STORES_PER_REQUEST)]
+    started = time.perf_counter()
+    for _ in range(iterations):
+        request(logger, stores)
+    elapsed = time.perf_counter() - started
+    print(f"{name:<28}{elapsed / iterations * 1e6:>10.1f} us/request")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--iterations", type=int, default=2000)
+    args = parser.parse_args()
+
+    before = logging.StreamHandler(io.StringIO())
+    before.setFormatter(logging.Formatter(logging.BASIC_FORMAT))
+    measure("before (basicConfig)", request_before, before, args.iterations)
+
+    after = logging.StreamHandler(io.StringIO())
+    after.setFormatter(JsonFormatter())
+    measure("after (json)", request_after, after, args.iterations)
+
+    sampled = logging.StreamHandler(io.StringIO())
+    sampled.setFormatter(JsonFormatter())
+    sampled.addFilter(InfoSamplingFilter(0.1))
+    measure("after (json, 10% sampled)", request_after, sampled, args.iterations)
+
+
+if __name__ == "__main__":
+    main()
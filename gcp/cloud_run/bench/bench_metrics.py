@@ -0,0 +1,43 @@
+# metrics.span のオーバーヘッド計測と、ラベルの値のエスケープの確認
+# 実行方法: python -m bench.bench_metrics
+# Standard Library
+import argparse
+import time
+
+# First Party Library
+from api.core.metrics import increment, render_prometheus, span
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--iterations", type=int, default=100_000)
+    parser.add_argument("--rounds", type=int, default=5)
+    args = parser.parse_args()
+
+    # 他のプロセスの影響を除くため、各回のうち最も速いものを使う
+    elapsed = float("inf")
+    for _ in range(args.rounds):
+        started = time.perf_counter()
+        for _ in range(args.iterations):
+            pass
+        baseline = time.perf_counter() - started
+
+        started = time.perf_counter()
+        for _ in range(args.iterations):
+            with span("bench.noop"):
+                pass
+        elapsed = min(elapsed, time.perf_counter() - started - baseline)
+
+    print(f"span overhead: {elapsed / args.iterations * 1e9:.0f} ns/span")
+
+    # 引用符・バックスラッシュ・改行を含むラベルでも1行1サンプルのまま出力する
+    increment("bench_labels_total", 1.0, (("route", 'a"b\\c\nd'),))
+    payload = render_prometheus()
+    expected = 'bench_labels_total{route="a\\"b\\\\c\\nd"} 1.0'
+    print(f"/metrics payload: {len(payload)} bytes")
+    if expected not in payload.splitlines():
+        raise SystemExit("label values are not escaped")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+# 写真のカテゴリの再判定ジョブ (api/jobs/reclassify_photos.py) をフェイクのFirestore / GCS / Geminiで実行し、
+# 並列度によるスループットと、途中で止めて再開しても全ての写真を1回ずつ判定することを確認する
+# 実行方法: python -m bench.bench_reclassify --users 200 --photos-per-user 10
+# Standard Library
+import argparse
+import logging
+import os
+import tempfile
+import threading
+import time
+from typing import Dict
+from unittest import mock
+
+# First Party Library
+from bench.fakes import (
+    FakeFirestore,
+    FakeGeminiModule,
+    FakeStorage,
+    UpstreamProfile,
+    Upstreams,
+)
+from bench.harness import make_jpeg
+
+
+def seed(db: FakeFirestore, storage: FakeStorage, users: int, photos_per_user: int) -> int:
+    # First Party Library
+    from api.cruds.gcs import GCS_PREFIX, PROJECT
+
+    bucket = storage.bucket(PROJECT)
+    photo = make_jpeg()
+    for user in range(users):
+        for index in range(photos_per_user):
+            name = f"{GCS_PREFIX}/users_photo/user_{user}/photo_{index}.jpg"
+            bucket.objects[name] = photo
+            db.documents[f"users/user_{user}/photos/photo_{index}"] = {
+                "url": bucket.blob(name).public_url,
+                "category": "not_food",
+                "userId": f"user_{user}",
+            }
+    # 判定できない写真: urlの無いもの (スキップ) と、画像が消えたもの (失敗)
+    db.documents["users/user_0/photos/no_url"] = {"storeId": "place_0", "userId": "user_0"}
+    db.documents["users/user_0/photos/missing"] = {
+        "url": bucket.blob(f"{GCS_PREFIX}/users_photo/user_0/missing.jpg").public_url,
+        "category": "ramen",
+    }
+    return users * photos_per_user
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--photos-per-user", type=int, default=10)
+    parser.add_argument("--gemini-ms", type=float, default=300.0)
+    parser.add_argument("--gcs-ms", type=float, default=30.0)
+    parser.add_argument("--firestore-ms", type=float, default=20.0)
+    parser.add_argument("--workers", type=int, default=32)
+    args = parser.parse_args()
+    logging.getLogger("api").setLevel(logging.ERROR)
+
+    # First Party Library
+    from api.core import gemini, rate_limit
+    from api.jobs.reclassify_photos import load_engine, reclassify
+
+    upstreams = Upstreams(
+        {
+            "gemini": UpstreamProfile(args.gemini_ms, args.gemini_ms / 4),
+            "gcs": UpstreamProfile(args.gcs_ms, args.gcs_ms / 4),
+            "firestore": UpstreamProfile(args.firestore_ms, args.firestore_ms / 4),
+        }
+    )
+    db = FakeFirestore(upstreams)
+    storage = FakeStorage(upstreams)
+    photos = seed(db, storage, args.users, args.photos_per_user)
+    module = FakeGeminiModule(upstreams)
+
+    # ペース制御の影響を除くため上限を十分大きくし、ヘッジによる重複呼び出しも止める
+    rate_limit._limits["gemini"] = (1e6, 1e6)
+    calls: Dict[str, int] = {}
+    lock = threading.Lock()
+    gemini_engine = load_engine("gemini")
+
+    def engine(photo_data: bytes) -> str:
+        with lock:
+            calls["total"] = calls.get("total", 0) + 1
+        return gemini_engine(photo_data)
+
+    with mock.patch.object(
+        gemini, "get_gemini_model", lambda api_key: module.GenerativeModel("fake")
+    ), mock.patch.object(gemini, "HEDGE_PERCENTILE", 0.0):
+        for workers in (1, 8, args.workers):
+            sample = min(photos, 20 * workers)
+            started = time.perf_counter()
+            report = reclassify(
+                db, storage, engine, dry_run=True, workers=workers, page_size=sample, limit=sample
+            )
+            rate = report.scanned / (time.perf_counter() - started)
+            print(f"workers {workers:>3}  {rate:7.1f} photos/s  ({report.scanned} photos, dry run)")
+
+        calls.clear()
+        with tempfile.TemporaryDirectory() as directory:
+            checkpoint = os.path.join(directory, "reclassify.json")
+            # 半分ほどで止め、同じチェックポイントから再開する
+            first = reclassify(
+                db, storage, engine, checkpoint, workers=args.workers, limit=photos // 2
+            )
+            print(f"\nstopped  scanned {first.scanned}  complete {first.complete}")
+            report = reclassify(db, storage, engine, checkpoint, workers=args.workers)
+            again = reclassify(db, storage, engine, checkpoint, workers=args.workers)
+        engine_calls = calls.get("total", 0)
+
+        # 期限切れの写真はフォールバックのカテゴリで書き換えず、失敗として数える
+        with mock.patch.object(gemini, "FALLBACK_CATEGORY", "飲食物ではない"), mock.patch.object(
+            gemini, "DEADLINE_SECONDS", args.gemini_ms / 1e3 / 10
+        ):
+            timed_out = reclassify(
+                db, storage, engine, dry_run=True, workers=8, page_size=40, limit=40
+            )
+
+    print(
+        f"resumed  scanned {report.scanned}  changed {report.changed}"
+        f"  unchanged {report.unchanged}  skipped {report.skipped}  failed {report.failed}"
+        f"  written {report.written} in {report.batches} batches"
+        f"\n         {report.photos_per_second} photos/s  engine calls {engine_calls}"
+        f"\n         {report.transitions}"
+        f"\ndeadline scanned {timed_out.scanned}  failed {timed_out.failed}"
+        f"  changed {timed_out.changed}"
+    )
+    documents = [data for path, data in db.documents.items() if path.startswith("users/")]
+    changed = sum(1 for data in documents if data.get("updatedAt") is not None)
+    failures = 0
+    failures += first.complete or not report.complete or again.scanned != report.scanned
+    failures += report.scanned != photos + 2 or report.skipped != 1 or report.failed != 1
+    # 再開しても同じ写真を2回判定しない
+    failures += engine_calls != photos
+    failures += timed_out.changed != 0 or timed_out.failed != timed_out.scanned - timed_out.skipped
+    failures += report.written != report.changed or changed != report.changed
+    if failures:
+        raise SystemExit(f"{failures} check(s) failed")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+# 店舗データの鮮度 (api/core/store_freshness.py) と一括更新ジョブ (api/jobs/refresh_stores.py) を
+# フェイクのPlaces / Firestore / GCSで実行し、Placesの呼び出し回数と、createdAtが保たれることを確認する
+# 実行方法: python -m bench.bench_refresh_stores --requests 200 --spots 20
+# Standard Library
+import argparse
+import random
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict
+from unittest import mock
+
+# First Party Library
+from bench.fakes import UpstreamProfile, Upstreams
+from bench.harness import FakeBackend, make_backend, patched_app
+
+
+def run_requests(backend: FakeBackend, mode: str, requests: int, spots: int) -> Dict[str, Any]:
+    # First Party Library
+    from api.cruds.write_behind import get_write_buffer
+    from api.schemas import find_nearby_restaurant
+
+    before = backend.upstreams.snapshot()
+    rng = random.Random(0)
+    started = time.perf_counter()
+    with mock.patch.object(find_nearby_restaurant, "STORE_REFRESH_MODE", mode), mock.patch(
+        "api.core.store_freshness.STORE_REFRESH_MODE", mode
+    ):
+        for index in range(requests):
+            # 同じ地点の写真が何度も届く (人気の店舗は繰り返し検索される)
+            spot = rng.randrange(spots)
+            find_nearby_restaurant.find_nearby_restaurants(
+                35.0 + spot / 1000,
+                139.0,
+                "key",
+                f"user_{index % 10}",
+                f"photo_{index}",
+                backend.db,
+                backend.storage,
+            )
+            # 次のリクエストから保存済みの店舗が見えるよう、書き込みをすぐに反映する
+            get_write_buffer().flush()
+    elapsed = time.perf_counter() - started
+    after = backend.upstreams.snapshot()
+    return {
+        "details": after.get("places.details", 0) - before.get("places.details", 0),
+        "photos": after.get("places.photo", 0) - before.get("places.photo", 0),
+        "ms": elapsed / requests * 1e3,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--spots", type=int, default=20)
+    parser.add_argument("--places-ms", type=float, default=60.0)
+    parser.add_argument("--workers", type=int, default=8)
+    args = parser.parse_args()
+
+    # First Party Library
+    from api.core import rate_limit
+    from api.jobs.refresh_stores import refresh_stores
+
+    # ペース制御の影響を除くため上限を十分大きくする
+    rate_limit._limits["places"] = (1e6, 1e6)
+    failures = 0
+    for mode in ("always", "ttl"):
+        upstreams = Upstreams(
+            {
+                "places": UpstreamProfile(args.places_ms, args.places_ms / 4),
+                "firestore": UpstreamProfile(8, 2),
+                "gcs": UpstreamProfile(25, 5),
+            }
+        )
+        backend = make_backend(upstreams)
+        with patched_app(backend):
+            result = run_requests(backend, mode, args.requests, args.spots)
+        print(
+            f"{mode:<7} {args.requests} requests  details {result['details']:>4}"
+            f"  photo downloads {result['photos']:>4}  {result['ms']:6.1f} ms/request"
+        )
+
+    # 全店舗の期限を切らして一括更新する。作成日時は変わらず、期限は未来に延びるはず
+    stores = {
+        path: data for path, data in backend.db.documents.items() if path.startswith("stores/")
+    }
+    created = {path: data["createdAt"] for path, data in stores.items()}
+    past = datetime.now(timezone.utc) - timedelta(seconds=1)
+    for data in stores.values():
+        data["staleAt"] = past
+    with patched_app(backend):
+        for workers in (1, args.workers):
+            before = backend.upstreams.snapshot().get("places.details", 0)
+            report = refresh_stores(backend.db, backend.storage, "key", workers=workers)
+            details = backend.upstreams.snapshot().get("places.details", 0) - before
+            print(
+                f"\nrefresh job  workers {workers:>2}  {report.stores_per_second:6.1f} stores/s"
+                f"  refreshed {report.refreshed}/{len(stores)} in {report.batches} batches"
+                f"  details {details}"
+            )
+            failures += report.refreshed != len(stores) or details != len(stores)
+            for data in stores.values():
+                data["staleAt"] = past
+
+    now = datetime.now(timezone.utc)
+    changed = sum(1 for path, data in stores.items() if data["createdAt"] != created[path])
+    failures += changed
+    print(f"createdAt changed on {changed} of {len(stores)} stores")
+    with patched_app(backend):
+        # 期限内の店舗は対象にならない
+        for data in stores.values():
+            data["staleAt"] = now + timedelta(days=1)
+        failures += refresh_stores(backend.db, backend.storage, "key").scanned != 0
+    if failures:
+        raise SystemExit(f"{failures} check(s) failed")
+
+
+if __name__ == "__main__":
+    main()
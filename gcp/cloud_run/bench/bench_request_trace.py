@@ -0,0 +1,172 @@
+# リクエストの記録 (api/core/request_trace.py) と再生 (bench/replay.py) を通しで確認する
+# 写真をまとめて撮る・再送する・写真のサイズがばらつくユーザーの操作をフェイクの上流に流して記録し、
+# 記録に個人を特定できる値や画像が含まれないこと、記録のオーバーヘッドを確かめてから1倍・N倍で再生する
+# 実行方法: python -m bench.bench_request_trace --users 20 --speed 4
+# Standard Library
+import argparse
+import asyncio
+import base64
+import random
+import statistics
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+from unittest import mock
+
+# First Party Library
+from bench.fakes import UpstreamProfile, Upstreams
+from bench.harness import FakeBackend, lifespan, make_backend, make_jpeg, patched_app, request
+from bench.load_test import HOT_SPOTS
+from bench.replay import load_trace, print_report, replay, workload_shape
+
+# 再生を短くするため、上流の遅延は load_test の既定より小さくする
+PROFILES = {
+    "firestore": UpstreamProfile(4, 2),
+    "gcs": UpstreamProfile(10, 4),
+    "places": UpstreamProfile(30, 10),
+    "gemini": UpstreamProfile(120, 40),
+}
+
+Step = Tuple[float, str, str, Optional[Dict[str, Any]], str]
+
+
+def make_session(user: int, rng: random.Random, photos: List[str]) -> List[Step]:
+    # (開始からの秒数, メソッド, パス, 本文, ユーザー) の一連の操作
+    user_id = f"user_{user}"
+    at = rng.uniform(0, 8)
+    lat, lon = rng.choice(HOT_SPOTS)
+    lat, lon = lat + rng.uniform(-2e-3, 2e-3), lon + rng.uniform(-2e-3, 2e-3)
+    steps: List[Step] = []
+    for index in range(rng.randint(1, 6)):
+        photo_id = f"photo_{user}_{index}"
+        photo = rng.choice(photos)
+        # 同じ店で数秒おきに撮る (座標はほぼ同じ)
+        at += rng.uniform(0.5, 3)
+        near = {
+            "userId": user_id,
+            "lat": lat + rng.uniform(-2e-5, 2e-5),
+            "lon": lon + rng.uniform(-2e-5, 2e-5),
+            "photo_id": photo_id,
+        }
+        food = {"userId": user_id, "photoId": photo_id, "photo": photo}
+        steps.append((at, "POST", "/findNearbyRestaurants", near, user_id))
+        steps.append((at + 0.05, "POST", "/categorizeFood", food, user_id))
+        if rng.random() < 0.15:
+            # 電波が悪く再送する
+            steps.append((at + 1.5, "POST", "/categorizeFood", food, user_id))
+    at += rng.uniform(1, 3)
+    steps.append((at, "GET", f"/photos?userId={user_id}&pageSize=20", None, user_id))
+    steps.append((at + 0.2, "POST", "/categoryCounts", {"userId": user_id}, user_id))
+    query = {"userId": user_id, "query": "ラーメン 渋谷"}
+    steps.append((at + 1, "POST", "/searchStores", query, user_id))
+    return steps
+
+
+async def run_sessions(app: Any, backend: FakeBackend, steps: List[Step]) -> List[float]:
+    latencies: List[float] = []
+    started = time.perf_counter()
+
+    async def send(step: Step) -> None:
+        at, method, path, body, user_id = step
+        delay = started + at - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        headers = {"Authorization": f"Bearer {backend.auth.token_for(user_id)}"}
+        begin = time.perf_counter()
+        await request(app, method, path, body, headers)
+        latencies.append((time.perf_counter() - begin) * 1e3)
+
+    await asyncio.gather(*(send(step) for step in steps))
+    return latencies
+
+
+def leaked(text: str, steps: List[Step]) -> List[str]:
+    # 記録に残ってはいけない値 (ユーザーID・写真ID・IDトークン・検索語・画像)
+    secrets = {"Bearer", "ラーメン"}
+    for _, _, _, body, user_id in steps:
+        secrets.add(f'"{user_id}"')
+        if body and "photo" in body:
+            secrets.update({f'"{body["photoId"]}"', body["photo"][:64]})
+    return sorted(secret for secret in secrets if secret in text)
+
+
+async def run(args: argparse.Namespace) -> int:
+    # First Party Library
+    from api.core import request_trace
+
+    rng = random.Random(args.seed)
+    photos = [
+        base64.b64encode(make_jpeg((size, size))).decode()
+        for size in (48, 96, 160, 320, 640)
+        for _ in range(2)
+    ]
+    steps = [step for user in range(args.users) for step in make_session(user, rng, photos)]
+    failures = 0
+
+    with tempfile.TemporaryDirectory() as directory:
+        recorder = request_trace.TraceRecorder(directory)
+        timings: Dict[str, List[float]] = {}
+        for traced in (False, True):
+            backend = make_backend(Upstreams(PROFILES, seed=args.seed))
+            with patched_app(backend) as app, mock.patch.object(
+                request_trace, "TRACE_DIR", directory if traced else ""
+            ), mock.patch.object(request_trace, "_recorder", recorder):
+                async with lifespan(app):
+                    timings["on" if traced else "off"] = await run_sessions(app, backend, steps)
+            recorder.close()
+
+        text = "".join(path.read_text() for path in Path(directory).glob("*.jsonl"))
+        records = load_trace(str(path) for path in Path(directory).glob("*.jsonl"))
+        found = leaked(text, steps)
+        # 座標は TRACE_COORD_DECIMALS 桁より細かく残さない
+        precise = sum(
+            round(value, request_trace.TRACE_COORD_DECIMALS) != value
+            for record in records
+            for key, value in (record.get("body") or {}).items()
+            if key in request_trace.COORD_FIELDS
+        )
+        failures += len(records) != len(steps) or bool(found) or bool(precise)
+        print(
+            f"recorded {len(records)} of {len(steps)} requests"
+            f"  {len(text.encode()) / len(records):.0f} B/record"
+            f"  leaked {found or 'nothing'}"
+            f"  precise coordinates {precise}"
+        )
+        print(
+            "capture overhead  p50 "
+            f"{statistics.median(timings['off']):.1f} -> {statistics.median(timings['on']):.1f} ms"
+        )
+
+    shape = workload_shape(records)
+    for speed in (1.0, args.speed):
+        backend = make_backend(Upstreams(PROFILES, seed=args.seed))
+        with patched_app(backend) as app:
+            async with lifespan(app):
+                result = await replay(app, backend, records, speed)
+        print()
+        print_report(shape, result)
+        errors = sum(
+            count
+            for route in result["routes"].values()
+            for status, count in route["statuses"].items()
+            if not status.startswith(("2", "3", "429", "503"))
+        )
+        failures += errors
+    return failures
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--speed", type=float, default=4.0)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    failures = asyncio.run(run(args))
+    if failures:
+        raise SystemExit(f"{failures} check(s) failed")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,41 @@
+# convert_to_romaji のマイクロベンチマーク
+# 実行方法: python -m bench.bench_romaji
+# Standard Library
+import argparse
+import time
+from typing import Any, Callable, List
+
+# First Party Library
+from api.core.romaji import convert_to_romaji, get_converter
+from api.core.romaji_conversion_dict import romaji_conversion_dict
+
+SAMPLES = ["横浜市中区", "大阪市北区", "札幌市 中央区", "かすみがうら市", "ニセコ町", "箱根町"]
+
+
+def measure(func: Callable[[str], Any], texts: List[str], repeat: int) -> float:
+    started = time.perf_counter()
+    for _ in range(repeat):
+        for text in texts:
+            func(text)
+    return (time.perf_counter() - started) / (repeat * len(texts)) * 1e9
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    converter = get_converter()
+    print(f"lazy load: {(time.perf_counter() - started) * 1e3:.2f} ms")
+
+    texts = list(romaji_conversion_dict) + SAMPLES
+    baseline = measure(romaji_conversion_dict.get, texts, args.repeat)
+    print(f"dict.get (baseline): {baseline:.0f} ns/lookup")
+    print(f"decompose (uncached): {measure(converter.convert, texts, args.repeat):.0f} ns/lookup")
+    convert_to_romaji.cache_clear()
+    print(f"convert_to_romaji: {measure(convert_to_romaji, texts, args.repeat):.0f} ns/lookup")
+
+
+if __name__ == "__main__":
+    main()
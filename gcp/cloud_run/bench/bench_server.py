@@ -0,0 +1,218 @@
+# 従来の起動方法と本番用の起動方法 (api.serve) のスループットを実際のソケット越しに比較する
+# 実行方法: python -m bench.bench_server --requests 100 --concurrency 32
+#
+# 各モードでフェイクの上流に繋いだサーバーを子プロセスで起動し、keep-aliveの接続から負荷をかける
+#   uvicorn: entrypoint.sh と同じ1プロセスのuvicorn (エンドポイントの処理はイベントループ上で実行)
+#   serve:   api.serve (fork済みワーカー + uvloop/httptools + スレッドプール)
+# Standard Library
+import argparse
+import asyncio
+import base64
+import json
+import os
+import random
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import ExitStack
+from pathlib import Path
+from typing import Any, Dict, List, Tuple
+from unittest import mock
+
+# First Party Library
+from bench.fakes import FakeFirebaseAuth, Upstreams
+from bench.harness import make_backend, make_jpeg, patched_app
+from bench.load_test import DEFAULT_PROFILES, build_requests, percentile, seed_users
+
+MODES = ("uvicorn", "serve")
+
+
+async def _inline(func: Any, *args: Any, **kwargs: Any) -> Any:
+    return func(*args, **kwargs)
+
+
+def run_server(mode: str, port: int, workers: int, users: int, auth_key: str) -> None:
+    # 子プロセス側: フェイクの上流に差し替えたアプリを指定のモードで起動する
+    # (IDトークンは親プロセスと同じ鍵で検証する)
+    auth = FakeFirebaseAuth(private_key_pem=Path(auth_key).read_bytes())
+    backend = make_backend(Upstreams(dict(DEFAULT_PROFILES), seed=os.getpid()), auth=auth)
+    seed_users(backend, users)
+    with ExitStack() as stack:
+        app = stack.enter_context(patched_app(backend))
+        if mode == "uvicorn":
+            # Third Party Library
+            import uvicorn  # type: ignore
+
+            # First Party Library
+            from api.routers import router
+
+            # 変更前と同じくエンドポイントの処理をイベントループ上で直接実行する
+            stack.enter_context(mock.patch.object(router, "run_in_threadpool", _inline))
+            uvicorn.run(app, host="127.0.0.1", port=port, log_config=None, access_log=False)
+        else:
+            # First Party Library
+            from api import serve
+
+            settings = serve.load_settings()
+            settings.update({"host": "127.0.0.1", "port": port, "workers": workers})
+            serve.serve(app, settings)
+
+
+async def _send(
+    reader: asyncio.StreamReader,
+    writer: asyncio.StreamWriter,
+    path: str,
+    body: bytes,
+    headers: Dict[str, str],
+) -> int:
+    header_lines = "".join(f"{key}: {value}\r\n" for key, value in headers.items())
+    writer.write(
+        (
+            f"POST {path} HTTP/1.1\r\nHost: bench\r\nContent-Type: application/json\r\n"
+            f"{header_lines}Content-Length: {len(body)}\r\n\r\n"
+        ).encode()
+        + body
+    )
+    await writer.drain()
+    status_line = await reader.readline()
+    length = 0
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b""):
+            break
+        name, _, value = line.decode().partition(":")
+        if name.lower() == "content-length":
+            length = int(value)
+    await reader.readexactly(length)
+    return int(status_line.split()[1])
+
+
+async def load(
+    port: int, route: str, auth: FakeFirebaseAuth, total: int, concurrency: int, users: int
+) -> Dict[str, Any]:
+    photo = base64.b64encode(make_jpeg()).decode()
+    make = build_requests(route, auth, users, photo, random.Random(0))
+    latencies: List[float] = []
+    statuses: Dict[int, int] = {}
+    queue: asyncio.Queue = asyncio.Queue()
+    for index in range(total):
+        queue.put_nowait(index)
+
+    async def connection() -> None:
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        try:
+            while not queue.empty():
+                _, path, body, headers = make(queue.get_nowait())
+                started = time.perf_counter()
+                status = await _send(reader, writer, path, json.dumps(body).encode(), headers)
+                latencies.append((time.perf_counter() - started) * 1e3)
+                statuses[status] = statuses.get(status, 0) + 1
+        finally:
+            writer.close()
+
+    started = time.perf_counter()
+    await asyncio.gather(*(connection() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    return {
+        "throughputRps": round(total / elapsed, 2),
+        "p50Ms": round(percentile(latencies, 0.50), 2),
+        "p99Ms": round(percentile(latencies, 0.99), 2),
+        "statuses": statuses,
+    }
+
+
+def wait_for_port(port: int, timeout: float = 30.0) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        with socket.socket() as sock:
+            if sock.connect_ex(("127.0.0.1", port)) == 0:
+                return
+        time.sleep(0.1)
+    raise TimeoutError(f"server on port {port} did not start")
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return int(sock.getsockname()[1])
+
+
+def bench_mode(
+    mode: str, args: argparse.Namespace, auth: FakeFirebaseAuth, auth_key: str
+) -> Dict[str, Dict[str, Any]]:
+    port = free_port()
+    server = subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            "bench.bench_server",
+            "--serve",
+            mode,
+            "--port",
+            str(port),
+            "--workers",
+            str(args.workers),
+            "--users",
+            str(args.users),
+            "--auth-key",
+            auth_key,
+        ]
+    )
+    try:
+        wait_for_port(port)
+        # ウォームアップ (初回のimportやキャッシュ構築を計測から外す)
+        asyncio.run(
+            load(port, args.routes[0], auth, args.concurrency, args.concurrency, args.users)
+        )
+        return {
+            route: asyncio.run(load(port, route, auth, args.requests, args.concurrency, args.users))
+            for route in args.routes
+        }
+    finally:
+        server.send_signal(signal.SIGTERM)
+        server.wait(timeout=30)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=100, help="requests per route")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument(
+        "--routes", nargs="+", default=["/updateUserStatus", "/findNearbyRestaurants"]
+    )
+    parser.add_argument("--serve", choices=MODES, help=argparse.SUPPRESS)
+    parser.add_argument("--port", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--auth-key", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        run_server(args.serve, args.port, args.workers, args.users, args.auth_key)
+        return
+
+    auth = FakeFirebaseAuth()
+    with tempfile.NamedTemporaryFile(suffix=".pem") as key_file:
+        key_file.write(auth.private_key_pem)
+        key_file.flush()
+        results: Dict[str, Dict[str, Dict[str, Any]]] = {
+            mode: bench_mode(mode, args, auth, key_file.name) for mode in MODES
+        }
+    for route in args.routes:
+        print(f"\n{route}")
+        rows: List[Tuple[str, Dict[str, Any]]] = [(mode, results[mode][route]) for mode in MODES]
+        for mode, result in rows:
+            print(
+                f"  {mode:<8}{result['throughputRps']:>9} req/s"
+                f"  p50 {result['p50Ms']:>8} ms  p99 {result['p99Ms']:>8} ms"
+                f"  {result['statuses']}"
+            )
+        speedup = rows[1][1]["throughputRps"] / max(rows[0][1]["throughputRps"], 1e-9)
+        print(f"  serve / uvicorn: {speedup:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
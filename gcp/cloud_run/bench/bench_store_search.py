@@ -0,0 +1,253 @@
+# 店舗の検索インデックス (api/core/store_search.py) を合成した店舗で作り、作成時間・メモリ・検索の遅延を測る
+# 検索結果は全件を1件ずつ確かめた結果と比べる。最後にフェイクのFirestoreで /searchStores を呼び、
+# 保存時の反映と、他のインスタンスの更新の取り込みを確認する
+# 実行方法: python -m bench.bench_store_search --sizes 100000,1000000
+# Standard Library
+import argparse
+import asyncio
+import gc
+import os
+import random
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Tuple
+from unittest import mock
+
+# First Party Library
+from bench.fakes import UpstreamProfile, Upstreams
+from bench.harness import make_backend, patched_app, request
+
+GENRES = [
+    "ラーメン",
+    "らーめん",
+    "鮨",
+    "焼肉",
+    "カフェ",
+    "珈琲",
+    "居酒屋",
+    "食堂",
+    "Cafe",
+    "Bistro",
+]
+SYLLABLES = list(
+    "あいうえおかきくけこさしすせそたちつてとなにぬねのはひふへほまみむめもやゆよらりるれろわ"
+)
+KANJI = list("山川田中本森林松竹梅花月星海空風雲金銀大小東西南北一二三")
+LATIN = ["noodle", "grill", "kitchen", "garden", "house", "table", "bar", "dining", "tokyo", "star"]
+QUERIES = [
+    "ラーメン",
+    "らーめん 渋谷",
+    "鮨",
+    "焼肉 大阪",
+    "カフェ",
+    "山田",
+    "caf",
+    "tok",
+    "osaka",
+    "yokohama naka",
+    "kitchen tokyo",
+    "珈琲 sap",
+    "星",
+    "存在しない店",
+]
+
+Store = Tuple[str, str, str, str]
+
+
+def make_places() -> Tuple[List[str], List[str]]:
+    # First Party Library
+    from api.core.romaji_conversion_dict import romaji_conversion_dict
+
+    prefectures = [name for name in romaji_conversion_dict if name[-1] in "都道府県"][:47]
+    cities = [name for name in romaji_conversion_dict if name[-1] in "市区町村"]
+    return prefectures, cities
+
+
+def make_stores(count: int, seed: int = 0) -> List[Store]:
+    rng = random.Random(seed)
+    prefectures, cities = make_places()
+    stores = []
+    for index in range(count):
+        kind = rng.random()
+        if kind < 0.4:
+            proper = "".join(rng.choices(SYLLABLES, k=rng.randint(2, 4)))
+            if rng.random() < 0.5:
+                proper = proper.translate({c: c + 0x60 for c in range(ord("ぁ"), ord("ゖ") + 1)})
+        elif kind < 0.8:
+            proper = "".join(rng.choices(KANJI, k=2))
+        else:
+            proper = " ".join(rng.choices(LATIN, k=2)).title()
+        city = rng.choice(cities)
+        name = f"{rng.choice(GENRES)} {proper}"
+        if rng.random() < 0.3:
+            name += f" {city[:-1]}店"
+        stores.append((f"place_{index}", name, city, rng.choice(prefectures)))
+    return stores
+
+
+def rss_bytes() -> int:
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+
+def percentile(values: List[float], rate: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(rate * len(ordered)))]
+
+
+def brute_force(index: object, query: str, within: Optional[List[str]] = None) -> List[str]:
+    # First Party Library
+    from api.core.store_search import matches, parse_query
+
+    terms = parse_query(query)
+    allowed = set(within) if within is not None else None
+    found = []
+    for store_id, searchable in zip(index._ids, index._searchable):  # type: ignore[attr-defined]
+        if store_id is None or searchable is None:
+            continue
+        if allowed is not None and store_id not in allowed:
+            continue
+        if all(matches(term, searchable) for term in terms):
+            found.append(store_id)
+    return sorted(found)
+
+
+def measure(size: int, rounds: int, check: bool) -> int:
+    # First Party Library
+    from api.core.store_search import StoreSearchIndex
+
+    stores = make_stores(size)
+    gc.collect()
+    before = rss_bytes()
+    index = StoreSearchIndex()
+    started = time.perf_counter()
+    index.build(stores)
+    build_seconds = time.perf_counter() - started
+    gc.collect()
+    memory = rss_bytes() - before
+    print(
+        f"\n{size:>9,} stores  built in {build_seconds:5.1f}s ({size / build_seconds:,.0f}/s)"
+        f"  memory {memory / 2**20:,.0f} MiB ({memory / size:,.0f} B/store)"
+    )
+
+    rng = random.Random(1)
+    failures = 0
+    user_stores = [store_id for store_id, _, _, _ in rng.sample(stores, 300)]
+    for scope, within in (("all stores", None), ("300 user stores", user_stores)):
+        latencies: Dict[str, List[float]] = {query: [] for query in QUERIES}
+        for _ in range(rounds):
+            for query in QUERIES:
+                started = time.perf_counter()
+                index.search(query, 20, within)
+                latencies[query].append((time.perf_counter() - started) * 1e3)
+        every = [latency for values in latencies.values() for latency in values]
+        slowest = max(QUERIES, key=lambda query: percentile(latencies[query], 0.5))
+        print(
+            f"  {scope:<16} p50 {percentile(every, 0.5):7.2f} ms"
+            f"  p99 {percentile(every, 0.99):7.2f} ms"
+            f"  slowest {slowest!r} {percentile(latencies[slowest], 0.5):.2f} ms"
+        )
+        if check:
+            for query in QUERIES:
+                expected = brute_force(index, query, within)
+                found = sorted(hit.store_id for hit in index.search(query, size, within))
+                if found != expected:
+                    failures += 1
+                    print(f"  MISMATCH {query!r}: {len(found)} != {len(expected)}")
+
+    # 店舗の更新 (内容が変わると古い連番を消して足し直す)
+    started = time.perf_counter()
+    for store_id, name, city, prefecture in stores[:10000]:
+        index.upsert(store_id, name + " 本店", city, prefecture)
+    upsert_us = (time.perf_counter() - started) / 10000 * 1e6
+    upserted = {hit.store_id for hit in index.search("本店", size)}
+    failures += not {store_id for store_id, _, _, _ in stores[:10000]} <= upserted
+    print(f"  upsert {upsert_us:6.1f} us/store  indexed {len(index):,}")
+    return failures
+
+
+async def check_endpoint() -> int:
+    # First Party Library
+    from api.core import store_search
+    from api.core.data_class import StoreData
+    from api.cruds import firestore, store_index
+
+    backend = make_backend(Upstreams({"firestore": UpstreamProfile(2, 1)}))
+    now = datetime.now(timezone.utc)
+    for number, (store_id, name, city, prefecture) in enumerate(make_stores(500, seed=2)):
+        backend.db.documents[f"stores/{store_id}"] = {
+            "name": name,
+            "city": city,
+            "prefecture": prefecture,
+            "updatedAt": now - timedelta(days=1, seconds=number),
+        }
+    backend.db.documents["users/user_0/photos/photo_0"] = {
+        "storeId": "place_0",
+        "areaStoreIds": [f"place_{index}" for index in range(0, 500, 5)],
+        "userId": "user_0",
+    }
+    headers = {"Authorization": f"Bearer {backend.auth.token_for('user_0')}"}
+
+    async def search(query: str) -> List[str]:
+        response = await request(
+            app, "POST", "/searchStores", {"userId": "user_0", "query": query}, headers
+        )
+        if response.status != 200:
+            raise RuntimeError(f"/searchStores returned {response.status}: {response.body!r}")
+        return [store["storeId"] for store in response.json()["stores"]]
+
+    failures = 0
+    fresh = store_search.StoreSearchIndex()
+    with patched_app(backend) as app, mock.patch.object(
+        store_search, "_index", fresh
+    ), mock.patch.object(store_index, "_loader", None), mock.patch.object(
+        store_index, "SYNC_SECONDS", 0.0
+    ), mock.patch.object(
+        store_index, "PRELOAD", True
+    ):
+        # 全件の読み込みを待たずに、ユーザーの店舗だけで答える
+        visited = {f"place_{index}" for index in range(0, 500, 5)}
+        first = await search("ラーメン")
+        failures += not first or not set(first) <= visited
+        assert store_index._loader is not None
+        store_index._loader.join()
+
+        # 保存した店舗はすぐ検索できる
+        store = StoreData(
+            "place_5", now, now, "極上ラーメン 新店", "", "渋谷区", "東京都", "Japan", ""
+        )
+        await asyncio.to_thread(
+            firestore.save_store_data_to_firestore, store, "photo_0", "user_0", backend.db
+        )
+        failures += "place_5" not in await search("極上")
+
+        # 他のインスタンスが更新した店舗は、次の検索の前に取り込む
+        backend.db.documents["stores/place_10"].update(
+            {"name": "幻の鮨 別館", "updatedAt": datetime.now(timezone.utc)}
+        )
+        failures += "place_10" not in await search("幻の鮨")
+        failures += bool(await search("存在しない店"))
+    print(
+        f"\n/searchStores  first answer {len(first)} stores  {'ok' if not failures else 'FAILED'}"
+    )
+    return failures
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", default="100000,1000000")
+    parser.add_argument("--rounds", type=int, default=20)
+    parser.add_argument("--check-up-to", type=int, default=100000, help="compare with brute force")
+    args = parser.parse_args()
+
+    failures = 0
+    for size in (int(value) for value in args.sizes.split(",")):
+        failures += measure(size, args.rounds, size <= args.check_up_to)
+        gc.collect()
+    failures += asyncio.run(check_endpoint())
+    if failures:
+        raise SystemExit(f"{failures} check(s) failed")
+
+
+if __name__ == "__main__":
+    main()
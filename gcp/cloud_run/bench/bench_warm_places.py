@@ -0,0 +1,222 @@
+# 地域ごとのキャッシュの事前取得 (api/jobs/warm_places_cache.py) をフェイクのPlaces / Firestore / GCSで実行する
+# 前日のリクエストのログから温め、翌朝のリクエストを流して、Placesを呼ばずに済んだ割合とレイテンシを
+# 温めない場合と比べる。Placesの呼び出しが予算を超えないことも確認する
+# タイルのキャッシュから返す店舗が、写真の座標で検索した場合 (半径15m) と一致することも確かめる
+# 実行方法: python -m bench.bench_warm_places --requests 300 --budget 400
+# Standard Library
+import argparse
+import json
+import random
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Tuple
+from unittest import mock
+
+# First Party Library
+from bench.fakes import UpstreamProfile, Upstreams
+from bench.harness import FakeBackend, make_backend, patched_app
+
+# 写真が撮られやすい地域 (この周りに店舗が集まる)
+AREAS = [(35.6595, 139.7005), (35.4437, 139.6380), (34.7025, 135.4959), (43.0687, 141.3508)]
+PLACES_CALLS = ("places.nearby", "places.details", "places.photo")
+
+
+def make_spots(count: int, rng: random.Random) -> List[Tuple[float, float]]:
+    # 店舗の位置 (地域の中心から数百m以内)
+    spots = []
+    for _ in range(count):
+        lat, lon = rng.choice(AREAS)
+        spots.append((lat + rng.uniform(-3e-3, 3e-3), lon + rng.uniform(-3e-3, 3e-3)))
+    return spots
+
+
+def make_requests(
+    spots: List[Tuple[float, float]], count: int, tail: float, rng: random.Random
+) -> List[Tuple[float, float]]:
+    # 人気の店舗ほど写真が多い (Zipf)。一部は日本中のどこか (温められない)
+    weights = [1 / (rank + 1) for rank in range(len(spots))]
+    requests = []
+    for _ in range(count):
+        if rng.random() < tail:
+            requests.append((rng.uniform(31.0, 43.0), rng.uniform(130.0, 145.0)))
+        else:
+            lat, lon = rng.choices(spots, weights)[0]
+            # 同じ店舗でも数m離れて撮る
+            requests.append((lat + rng.uniform(-4e-5, 4e-5), lon + rng.uniform(-4e-5, 4e-5)))
+    return requests
+
+
+def write_log(requests: List[Tuple[float, float]], now: datetime) -> List[str]:
+    # api.core.log の出力とCloud Loggingのエクスポートを混ぜる。2日より前の行は使われない
+    lines = []
+    for index, (lat, lon) in enumerate(requests):
+        at = now - timedelta(hours=20) + timedelta(seconds=index)
+        entry = {"message": f"Finding restaurants near {lat},{lon}", "lat": lat, "lon": lon}
+        if index % 2:
+            lines.append(json.dumps({"timestamp": at.isoformat(), "jsonPayload": entry}))
+        else:
+            lines.append(json.dumps({"severity": "INFO", "time": at.isoformat(), **entry}))
+    old = (now - timedelta(days=3)).isoformat()
+    lines.append(json.dumps({"time": old, "lat": 26.2, "lon": 127.7}))
+    lines.append("not json")
+    return lines
+
+
+def places_calls(backend: FakeBackend) -> int:
+    snapshot = backend.upstreams.snapshot()
+    return sum(snapshot.get(name, 0) for name in PLACES_CALLS)
+
+
+def replay(backend: FakeBackend, requests: List[Tuple[float, float]]) -> Dict[str, Any]:
+    # First Party Library
+    from api.cruds.write_behind import get_write_buffer
+    from api.schemas import find_nearby_restaurant
+
+    hits = 0
+    latencies = []
+    for index, (lat, lon) in enumerate(requests):
+        before = places_calls(backend)
+        started = time.perf_counter()
+        find_nearby_restaurant.find_nearby_restaurants(
+            lat, lon, "key", f"user_{index % 10}", f"photo_{index}", backend.db, backend.storage
+        )
+        latencies.append((time.perf_counter() - started) * 1e3)
+        hits += places_calls(backend) == before
+        get_write_buffer().flush()
+    latencies.sort()
+    return {
+        "hit_rate": hits / len(requests),
+        "p50": latencies[len(latencies) // 2],
+        "p99": latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))],
+    }
+
+
+class WorldMaps:
+    # 決まった位置の店舗から、検索した座標の半径内のものを評価の高い順に1ページ (20件) まで返すPlaces
+    # (実際のPlacesと同じく、近い店舗より遠くの評価の高い店舗が先に返ることがある)
+
+    PAGE_SIZE = 20
+
+    def __init__(self, stores: List[Tuple[float, float]], rng: random.Random) -> None:
+        self.stores = stores
+        self.prominence = [rng.random() for _ in stores]
+        self.capped = 0
+
+    def places_nearby(self, location: Tuple[float, float], radius: float, **kwargs: Any) -> Any:
+        # First Party Library
+        from api.core.geotile import distance_meters
+
+        found = sorted(
+            (
+                index
+                for index, (lat, lon) in enumerate(self.stores)
+                if distance_meters(*location, lat, lon) <= radius
+            ),
+            key=lambda index: -self.prominence[index],
+        )
+        results = [
+            {
+                "place_id": f"world_{index}",
+                "geometry": {
+                    "location": {"lat": self.stores[index][0], "lng": self.stores[index][1]}
+                },
+            }
+            for index in found[: self.PAGE_SIZE]
+        ]
+        response = {"results": results, "status": "OK"}
+        if len(found) > self.PAGE_SIZE:
+            self.capped += 1
+            response["next_page_token"] = "next"
+        return response
+
+
+def check_coverage(count: int, rng: random.Random) -> int:
+    # タイルの端で撮った写真や店舗の密集した場所でも、写真の座標で検索した場合と同じ店舗を返すか
+    # First Party Library
+    from api.schemas import find_nearby_restaurant
+
+    lat, lon = AREAS[0]
+    # 100m四方にまばらな店舗と、10m四方に店舗が密集した場所 (1ページに収まらない)
+    stores = [(lat + rng.uniform(-5e-4, 5e-4), lon + rng.uniform(-5e-4, 5e-4)) for _ in range(80)]
+    stores += [(lat + rng.uniform(-5e-5, 5e-5), lon + rng.uniform(-5e-5, 5e-5)) for _ in range(40)]
+    world = WorldMaps(stores, rng)
+    backend = make_backend(Upstreams())
+    mismatches = 0
+    with patched_app(backend), mock.patch.object(
+        find_nearby_restaurant, "get_gmaps_client", lambda api_key: world
+    ):
+        for _ in range(count):
+            photo = (lat + rng.uniform(-4e-4, 4e-4), lon + rng.uniform(-4e-4, 4e-4))
+            cached = find_nearby_restaurant.nearby_place_ids(*photo, "key", backend.db)
+            direct = find_nearby_restaurant.search_nearby_place_ids(*photo, "key")
+            mismatches += set(cached) != set(direct)
+    print(
+        f"tile cache vs direct search  {count} photos  mismatches {mismatches}"
+        f"  searches over one page {world.capped}"
+    )
+    return mismatches
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=300)
+    parser.add_argument("--spots", type=int, default=150)
+    parser.add_argument("--tail", type=float, default=0.15, help="share of one-off locations")
+    parser.add_argument("--budget", type=int, default=400)
+    parser.add_argument("--places-ms", type=float, default=10.0)
+    args = parser.parse_args()
+
+    # First Party Library
+    from api.core import rate_limit
+    from api.jobs.warm_places_cache import read_samples, warm_places_cache
+
+    # ペース制御の影響を除くため上限を十分大きくする
+    rate_limit._limits["places"] = (1e6, 1e6)
+    rng = random.Random(0)
+    spots = make_spots(args.spots, rng)
+    now = datetime.now(timezone.utc)
+    yesterday = write_log(make_requests(spots, args.requests * 3, args.tail, rng), now)
+    morning = make_requests(spots, args.requests, args.tail, rng)
+    samples = list(read_samples(yesterday, now - timedelta(days=2)))
+
+    failures = check_coverage(args.requests, rng)
+    failures += int(len(samples) != args.requests * 3)
+    print(f"{len(samples)} request coordinates from {len(yesterday)} log lines")
+    for budget in (0, args.budget // 4, args.budget):
+        upstreams = Upstreams(
+            {
+                "places": UpstreamProfile(args.places_ms, args.places_ms / 4),
+                "firestore": UpstreamProfile(2, 0.5),
+                "gcs": UpstreamProfile(5, 1),
+            }
+        )
+        backend = make_backend(upstreams)
+        with patched_app(backend):
+            if budget:
+                report = warm_places_cache(samples, backend.db, backend.storage, "key", budget)
+                spent = places_calls(backend)
+                failures += spent > budget or report.budget - report.budget_left != spent
+                print(
+                    f"\nwarm  budget {budget:>4}  spent {spent:>4}"
+                    f"  tiles {report.hot_tiles} cells {report.cells_warmed}/{report.cells_planned}"
+                    f"  stores {report.stores_warmed}  {report.elapsed_seconds:.1f}s"
+                    f"\n      expected hit rate {report.hit_rate_before:.0%}"
+                    f" -> {report.hit_rate_after:.0%}"
+                    f"  (nearby {report.nearby_hit_rate_before:.0%}"
+                    f" -> {report.nearby_hit_rate_after:.0%})"
+                )
+            else:
+                print("\ncold (no warming)")
+            result = replay(backend, morning)
+        print(
+            f"      morning {len(morning)} requests  no Places call {result['hit_rate']:.0%}"
+            f"  p50 {result['p50']:6.1f} ms  p99 {result['p99']:6.1f} ms"
+        )
+        if budget == args.budget:
+            failures += result["hit_rate"] < 0.5
+    if failures:
+        raise SystemExit(f"{failures} check(s) failed")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,971 @@
+# ベンチマーク用の外部サービスのフェイク実装 (ネットワーク不要)
+# Firestore / Cloud Storage / googlemaps / Gemini / Place Photo のダウンロード / Firebase Authを
+# インメモリで模倣し、上流ごとに遅延・ジッタ・エラー率を設定できる
+# Standard Library
+import asyncio
+import contextlib
+import copy
+import math
+import random
+import threading
+import time
+from collections import Counter
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from typing import Any, AsyncIterator, Dict, Iterable, List, Optional, Tuple
+
+
+@dataclass
+class UpstreamProfile:
+    latency_ms: float = 0.0
+    jitter_ms: float = 0.0
+    error_rate: float = 0.0
+
+
+class FakeUpstreamError(Exception):
+    pass
+
+
+# google.api_core.exceptions.AlreadyExists と同じ名前にする (呼び出し側はクラス名で判定する)
+class AlreadyExists(FakeUpstreamError):
+    pass
+
+
+class Upstreams:
+    # 上流ごとの遅延プロファイルと呼び出し回数を保持する
+
+    def __init__(self, profiles: Optional[Dict[str, UpstreamProfile]] = None, seed: int = 0):
+        self.profiles = profiles or {}
+        self.calls: Counter = Counter()
+        self._lock = threading.Lock()
+        self._random = random.Random(seed)
+
+    def _draw(self, upstream: str, operation: str) -> Tuple[float, bool]:
+        with self._lock:
+            self.calls[f"{upstream}.{operation}"] += 1
+            profile = self.profiles.get(upstream, UpstreamProfile())
+            delay = profile.latency_ms + self._random.uniform(-1, 1) * profile.jitter_ms
+            failed = self._random.random() < profile.error_rate
+        return delay, failed
+
+    def call(self, upstream: str, operation: str) -> None:
+        delay, failed = self._draw(upstream, operation)
+        if delay > 0:
+            time.sleep(delay / 1e3)
+        if failed:
+            raise FakeUpstreamError(f"injected {upstream}.{operation} error")
+
+    async def acall(self, upstream: str, operation: str) -> None:
+        # 非同期クライアント用 (待ち時間にイベントループを止めない)
+        delay, failed = self._draw(upstream, operation)
+        if delay > 0:
+            await asyncio.sleep(delay / 1e3)
+        if failed:
+            raise FakeUpstreamError(f"injected {upstream}.{operation} error")
+
+    def snapshot(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self.calls)
+
+
+# ---- Firestore ----
+
+
+class ArrayUnion:
+    def __init__(self, values: List[Any]) -> None:
+        self.values = values
+
+
+class Increment:
+    def __init__(self, value: float) -> None:
+        self.value = value
+
+
+def _apply_field(data: Dict[str, Any], key: str, value: Any) -> None:
+    # "a.b" のようなフィールドパスとArrayUnion/Incrementを解釈する
+    *parents, leaf = key.split(".")
+    for parent in parents:
+        data = data.setdefault(parent, {})
+    if isinstance(value, ArrayUnion) or type(value).__name__ == "ArrayUnion":
+        current = list(data.get(leaf) or [])
+        current.extend(v for v in value.values if v not in current)
+        data[leaf] = current
+    elif isinstance(value, Increment) or type(value).__name__ == "Increment":
+        data[leaf] = (data.get(leaf) or 0) + value.value
+    else:
+        data[leaf] = copy.deepcopy(value)
+
+
+def _merge_field(data: Dict[str, Any], key: str, value: Any) -> None:
+    # set(merge=True) と同じく、マップは置き換えずにフィールドごとにマージする
+    if isinstance(value, dict):
+        if not isinstance(data.get(key), dict):
+            data[key] = {}
+        for name, item in value.items():
+            _merge_field(data[key], name, item)
+    else:
+        _apply_field(data, key, value)
+
+
+def _get_field(data: Dict[str, Any], key: str) -> Any:
+    for part in key.split("."):
+        if not isinstance(data, dict) or part not in data:
+            return None
+        data = data[part]
+    return data
+
+
+class FakeDocumentSnapshot:
+    def __init__(self, reference: "FakeDocumentReference", data: Optional[Dict[str, Any]]):
+        self.reference = reference
+        self.id = reference.id
+        self._data = data
+        self.exists = data is not None
+
+    def to_dict(self) -> Optional[Dict[str, Any]]:
+        return copy.deepcopy(self._data)
+
+    def get(self, field: str) -> Any:
+        # 実際のDocumentSnapshotと同じく、存在しないフィールドはKeyErrorにする
+        data: Any = self._data or {}
+        for part in field.split("."):
+            if not isinstance(data, dict) or part not in data:
+                raise KeyError(field)
+            data = data[part]
+        return copy.deepcopy(data)
+
+
+class FakeQuery:
+    def __init__(self, db: "FakeFirestore", path: str, group: bool = False) -> None:
+        self._db = db
+        self._path = path
+        self._group = group
+        self._fields: Optional[List[str]] = None
+        self._filters: List[Tuple[str, str, Any]] = []
+        self._orders: List[Tuple[str, str]] = []
+        self._limit: Optional[int] = None
+        self._start_after: Optional[Any] = None
+
+    def _copy(self) -> "FakeQuery":
+        query = copy.copy(self)
+        query._filters = list(self._filters)
+        query._orders = list(self._orders)
+        return query
+
+    def select(self, fields: Iterable[str]) -> "FakeQuery":
+        query = self._copy()
+        query._fields = list(fields)
+        return query
+
+    def where(self, field: str, op: str, value: Any) -> "FakeQuery":
+        query = self._copy()
+        query._filters.append((field, op, value))
+        return query
+
+    def order_by(self, field: str, direction: str = "ASCENDING") -> "FakeQuery":
+        query = self._copy()
+        query._orders.append((field, direction))
+        return query
+
+    def limit(self, count: int) -> "FakeQuery":
+        query = self._copy()
+        query._limit = count
+        return query
+
+    def start_after(self, cursor: Any) -> "FakeQuery":
+        query = self._copy()
+        query._start_after = cursor
+        return query
+
+    def _sort_key(self, path: str) -> Tuple:
+        return self._key(self._db.documents[path], path)
+
+    def _key(self, data: Dict[str, Any], path: str) -> Tuple:
+        # "__name__" はドキュメントのパスで並べる
+        return tuple(
+            path if field == "__name__" else _get_field(data, field) for field, _ in self._orders
+        ) + (path,)
+
+    def _cursor_key(self, cursor: Any) -> Tuple:
+        if isinstance(cursor, FakeDocumentSnapshot):
+            return self._key(cursor.to_dict() or {}, cursor.reference.path)
+        # {"フィールド": 値, "__name__": ドキュメントID} (サーバー向けSDKと同じくIDはこのコレクションのもの)
+        return self._key(cursor, f"{self._path}/{cursor['__name__']}")
+
+    def _ordered(self, data: Dict[str, Any]) -> bool:
+        # Firestoreと同じく、order_byのフィールドを持たないドキュメントは結果に含めない
+        return all(
+            field == "__name__" or _get_field(data, field) is not None for field, _ in self._orders
+        )
+
+    def _matches(self, data: Dict[str, Any]) -> bool:
+        for field, op, value in self._filters:
+            current = _get_field(data, field)
+            if op == "==" and current != value:
+                return False
+            if op == "<" and not (current is not None and current < value):
+                return False
+            if op == ">=" and not (current is not None and current >= value):
+                return False
+            if op == "array_contains" and value not in (current or []):
+                return False
+        return True
+
+    def _paths(self) -> List[str]:
+        depth = self._path.count("/") + 1
+        paths = []
+        for path in self._db.documents:
+            parts = path.split("/")
+            if self._group:
+                if len(parts) % 2 == 0 and parts[-2] == self._path:
+                    paths.append(path)
+            elif path.startswith(self._path + "/") and len(parts) == depth + 1:
+                paths.append(path)
+        return paths
+
+    def stream(self, transaction: Any = None) -> Iterable[FakeDocumentSnapshot]:
+        self._db.upstreams.call("firestore", "query")
+        return iter(self._snapshots())
+
+    def _snapshots(self) -> List[FakeDocumentSnapshot]:
+        with self._db.lock:
+            paths = [
+                p
+                for p in self._paths()
+                if self._matches(self._db.documents[p]) and self._ordered(self._db.documents[p])
+            ]
+            descending = any(direction == "DESCENDING" for _, direction in self._orders)
+            paths.sort(key=self._sort_key, reverse=descending)
+            if self._start_after is not None:
+                # Firestoreと同じく、カーソルの値より後ろから返す
+                # (カーソルのドキュメントがその後に更新・削除されていても位置は変わらない)
+                cursor_key = self._cursor_key(self._start_after)
+                if descending:
+                    paths = [path for path in paths if self._sort_key(path) < cursor_key]
+                else:
+                    paths = [path for path in paths if self._sort_key(path) > cursor_key]
+            if self._limit is not None:
+                paths = paths[: self._limit]
+            snapshots = []
+            for path in paths:
+                data = copy.deepcopy(self._db.documents[path])
+                if self._fields is not None:
+                    data = {k: v for k, v in data.items() if k in self._fields}
+                snapshots.append(FakeDocumentSnapshot(FakeDocumentReference(self._db, path), data))
+        return snapshots
+
+    def get(self) -> List[FakeDocumentSnapshot]:
+        return list(self.stream())
+
+
+class FakeCollectionReference(FakeQuery):
+    def __init__(self, db: "FakeFirestore", path: str) -> None:
+        super().__init__(db, path)
+        self.id = path.split("/")[-1]
+
+    def document(self, document_id: str) -> "FakeDocumentReference":
+        return FakeDocumentReference(self._db, f"{self._path}/{document_id}")
+
+
+class FakeDocumentReference:
+    def __init__(self, db: "FakeFirestore", path: str) -> None:
+        self._db = db
+        self.path = path
+        self.id = path.split("/")[-1]
+
+    def collection(self, name: str) -> FakeCollectionReference:
+        return FakeCollectionReference(self._db, f"{self.path}/{name}")
+
+    def get(
+        self, field_paths: Optional[List[str]] = None, transaction: Any = None
+    ) -> FakeDocumentSnapshot:
+        self._db.upstreams.call("firestore", "get")
+        return self._db._snapshot(self.path, field_paths)
+
+    def create(self, data: Dict[str, Any]) -> None:
+        self._db.upstreams.call("firestore", "create")
+        self._db._create(self.path, data)
+
+    def set(self, data: Dict[str, Any], merge: bool = False) -> None:
+        self._db.upstreams.call("firestore", "set")
+        self._db._set(self.path, data, merge)
+
+    def update(self, data: Dict[str, Any]) -> None:
+        self._db.upstreams.call("firestore", "update")
+        self._db._update(self.path, data)
+
+    def delete(self) -> None:
+        self._db.upstreams.call("firestore", "delete")
+        self._db._delete(self.path)
+
+
+class FakeWriteBatch:
+    def __init__(self, db: "FakeFirestore") -> None:
+        self._db = db
+        self._writes: List[Tuple[str, FakeDocumentReference, Any, bool]] = []
+
+    def set(
+        self, reference: FakeDocumentReference, data: Dict[str, Any], merge: bool = False
+    ) -> None:
+        self._writes.append(("set", reference, data, merge))
+
+    def update(self, reference: FakeDocumentReference, data: Dict[str, Any]) -> None:
+        self._writes.append(("update", reference, data, False))
+
+    def delete(self, reference: FakeDocumentReference) -> None:
+        self._writes.append(("delete", reference, None, False))
+
+    def __len__(self) -> int:
+        return len(self._writes)
+
+    def commit(self) -> None:
+        if len(self._writes) > 500:
+            raise ValueError("A write batch can have at most 500 operations")
+        self._db.upstreams.call("firestore", "commit")
+        self._apply()
+
+    def _apply(self) -> None:
+        with self._db.lock:
+            for kind, reference, data, merge in self._writes:
+                if kind == "set":
+                    self._db._set(reference.path, data, merge)
+                elif kind == "update":
+                    self._db._update(reference.path, data)
+                else:
+                    self._db._delete(reference.path)
+        self._writes = []
+
+
+class FakeTransaction(FakeWriteBatch):
+    # google.cloud.firestore.transactional から呼ばれるメソッドを実装する
+    # サーバー向けSDKと同じく悲観ロックで、コミットまで他のトランザクションを待たせる
+
+    def __init__(self, db: "FakeFirestore", max_attempts: int = 5) -> None:
+        super().__init__(db)
+        self._max_attempts = max_attempts
+        self._read_only = False
+        self._id: Optional[bytes] = None
+
+    def _clean_up(self) -> None:
+        self._writes = []
+        self._id = None
+
+    def _begin(self, retry_id: Optional[bytes] = None) -> None:
+        self._db.transaction_lock.acquire()
+        self._id = b"fake-transaction"
+
+    def _commit(self) -> List[Any]:
+        try:
+            self._db.upstreams.call("firestore", "commit")
+            self._apply()
+            return []
+        finally:
+            self._release()
+
+    def _rollback(self) -> None:
+        self._release()
+
+    def _release(self) -> None:
+        if self._id is not None:
+            self._id = None
+            self._db.transaction_lock.release()
+
+
+class FakeFirestore:
+    def __init__(self, upstreams: Upstreams) -> None:
+        self.upstreams = upstreams
+        self.documents: Dict[str, Dict[str, Any]] = {}
+        self.lock = threading.RLock()
+        self.transaction_lock = threading.Lock()
+
+    def collection(self, name: str) -> FakeCollectionReference:
+        return FakeCollectionReference(self, name)
+
+    def collection_group(self, name: str) -> FakeQuery:
+        return FakeQuery(self, name, group=True)
+
+    def document(self, path: str) -> FakeDocumentReference:
+        return FakeDocumentReference(self, path)
+
+    def batch(self) -> FakeWriteBatch:
+        return FakeWriteBatch(self)
+
+    def transaction(self, max_attempts: int = 5, read_only: bool = False) -> FakeTransaction:
+        return FakeTransaction(self, max_attempts)
+
+    def get_all(
+        self,
+        references: Iterable[FakeDocumentReference],
+        field_paths: Optional[List[str]] = None,
+        transaction: Any = None,
+    ) -> Iterable[FakeDocumentSnapshot]:
+        self.upstreams.call("firestore", "get_all")
+        return [self._snapshot(reference.path, field_paths) for reference in references]
+
+    def _snapshot(self, path: str, field_paths: Optional[List[str]]) -> FakeDocumentSnapshot:
+        with self.lock:
+            data = copy.deepcopy(self.documents.get(path))
+        if data is not None and field_paths is not None:
+            data = {k: v for k, v in data.items() if k in field_paths}
+        return FakeDocumentSnapshot(FakeDocumentReference(self, path), data)
+
+    def _set(self, path: str, data: Dict[str, Any], merge: bool) -> None:
+        with self.lock:
+            document = self.documents.get(path, {}) if merge else {}
+            for key, value in data.items():
+                if merge:
+                    _merge_field(document, key, value)
+                else:
+                    _apply_field(document, key, value)
+            self.documents[path] = document
+
+    def _create(self, path: str, data: Dict[str, Any]) -> None:
+        with self.lock:
+            if path in self.documents:
+                raise AlreadyExists(f"Document already exists: {path}")
+            self._set(path, data, merge=False)
+
+    def _update(self, path: str, data: Dict[str, Any]) -> None:
+        with self.lock:
+            if path not in self.documents:
+                raise FakeUpstreamError(f"No document to update: {path}")
+            for key, value in data.items():
+                _apply_field(self.documents[path], key, value)
+
+    def _delete(self, path: str) -> None:
+        with self.lock:
+            self.documents.pop(path, None)
+
+
+# 非同期クライアント (google.cloud.firestore.AsyncClient) のフェイク。データは同期版と共有する
+
+
+class FakeAsyncQuery:
+    def __init__(self, db: "FakeAsyncFirestore", query: FakeQuery) -> None:
+        self._db = db
+        self._query = query
+
+    def select(self, fields: Iterable[str]) -> "FakeAsyncQuery":
+        return FakeAsyncQuery(self._db, self._query.select(fields))
+
+    def where(self, field: str, op: str, value: Any) -> "FakeAsyncQuery":
+        return FakeAsyncQuery(self._db, self._query.where(field, op, value))
+
+    def order_by(self, field: str, direction: str = "ASCENDING") -> "FakeAsyncQuery":
+        return FakeAsyncQuery(self._db, self._query.order_by(field, direction))
+
+    def limit(self, count: int) -> "FakeAsyncQuery":
+        return FakeAsyncQuery(self._db, self._query.limit(count))
+
+    def start_after(self, cursor: Any) -> "FakeAsyncQuery":
+        return FakeAsyncQuery(self._db, self._query.start_after(cursor))
+
+    async def stream(self, transaction: Any = None) -> AsyncIterator[FakeDocumentSnapshot]:
+        await self._db.upstreams.acall("firestore", "query")
+        for snapshot in self._query._snapshots():
+            yield snapshot
+
+    async def get(self) -> List[FakeDocumentSnapshot]:
+        return [snapshot async for snapshot in self.stream()]
+
+
+class FakeAsyncCollectionReference(FakeAsyncQuery):
+    def __init__(self, db: "FakeAsyncFirestore", path: str) -> None:
+        super().__init__(db, FakeCollectionReference(db.sync, path))
+        self._path = path
+        self.id = path.split("/")[-1]
+
+    def document(self, document_id: str) -> "FakeAsyncDocumentReference":
+        return FakeAsyncDocumentReference(self._db, f"{self._path}/{document_id}")
+
+
+class FakeAsyncDocumentReference:
+    def __init__(self, db: "FakeAsyncFirestore", path: str) -> None:
+        self._db = db
+        self.path = path
+        self.id = path.split("/")[-1]
+
+    def collection(self, name: str) -> FakeAsyncCollectionReference:
+        return FakeAsyncCollectionReference(self._db, f"{self.path}/{name}")
+
+    async def get(
+        self, field_paths: Optional[List[str]] = None, transaction: Any = None
+    ) -> FakeDocumentSnapshot:
+        await self._db.upstreams.acall("firestore", "get")
+        return self._db.sync._snapshot(self.path, field_paths)
+
+    async def set(self, data: Dict[str, Any], merge: bool = False) -> None:
+        await self._db.upstreams.acall("firestore", "set")
+        self._db.sync._set(self.path, data, merge)
+
+    async def update(self, data: Dict[str, Any]) -> None:
+        await self._db.upstreams.acall("firestore", "update")
+        self._db.sync._update(self.path, data)
+
+    async def delete(self) -> None:
+        await self._db.upstreams.acall("firestore", "delete")
+        self._db.sync._delete(self.path)
+
+
+class FakeAsyncTransaction(FakeWriteBatch):
+    # google.cloud.firestore.async_transactional から呼ばれるメソッドを実装する
+    # サーバー向けSDKと同じく悲観ロックで、コミットまで他のトランザクションを待たせる
+
+    def __init__(self, db: "FakeAsyncFirestore", max_attempts: int = 5) -> None:
+        super().__init__(db.sync)
+        self._async_db = db
+        self._max_attempts = max_attempts
+        self._read_only = False
+        self._id: Optional[bytes] = None
+
+    def _clean_up(self) -> None:
+        self._writes = []
+        self._id = None
+
+    async def _begin(self, retry_id: Optional[bytes] = None) -> None:
+        await self._async_db.transaction_lock.acquire()
+        self._id = b"fake-transaction"
+
+    async def _commit(self) -> List[Any]:
+        try:
+            await self._async_db.upstreams.acall("firestore", "commit")
+            self._apply()
+            return []
+        finally:
+            self._release()
+
+    async def _rollback(self) -> None:
+        self._release()
+
+    def _release(self) -> None:
+        if self._id is not None:
+            self._id = None
+            self._async_db.transaction_lock.release()
+
+
+class FakeAsyncFirestore:
+    def __init__(self, sync: FakeFirestore) -> None:
+        self.sync = sync
+        self.upstreams = sync.upstreams
+        self.transaction_lock = asyncio.Lock()
+
+    def collection(self, name: str) -> FakeAsyncCollectionReference:
+        return FakeAsyncCollectionReference(self, name)
+
+    def transaction(self, max_attempts: int = 5, read_only: bool = False) -> FakeAsyncTransaction:
+        return FakeAsyncTransaction(self, max_attempts)
+
+    async def get_all(
+        self,
+        references: Iterable[FakeAsyncDocumentReference],
+        field_paths: Optional[List[str]] = None,
+        transaction: Any = None,
+    ) -> AsyncIterator[FakeDocumentSnapshot]:
+        await self.upstreams.acall("firestore", "get_all")
+        for reference in list(references):
+            yield self.sync._snapshot(reference.path, field_paths)
+
+
+# ---- Cloud Storage ----
+
+
+class FakeBlob:
+    def __init__(self, bucket: "FakeBucket", name: str) -> None:
+        self.bucket = bucket
+        self.name = name
+
+    @property
+    def public_url(self) -> str:
+        return f"https://storage.googleapis.com/{self.bucket.name}/{self.name}"
+
+    @property
+    def size(self) -> int:
+        return len(self.bucket.objects.get(self.name, b""))
+
+    @property
+    def time_created(self) -> Optional[datetime]:
+        # 直接 objects に入れたオブジェクトは作成日時を持たない
+        return self.bucket.created.get(self.name)
+
+    def upload_from_string(self, data: bytes, content_type: str = "") -> None:
+        self.bucket.upstreams.call("gcs", "upload")
+        with self.bucket.lock:
+            self.bucket.objects[self.name] = data
+            self.bucket.created[self.name] = datetime.now(timezone.utc)
+
+    def make_public(self) -> None:
+        self.bucket.upstreams.call("gcs", "make_public")
+
+    def download_as_bytes(self) -> bytes:
+        self.bucket.upstreams.call("gcs", "download")
+        with self.bucket.lock:
+            if self.name not in self.bucket.objects:
+                raise FakeUpstreamError(f"No such object: {self.name}")
+            return self.bucket.objects[self.name]
+
+    def delete(self) -> None:
+        self.bucket.upstreams.call("gcs", "delete")
+        with self.bucket.lock:
+            self.bucket.objects.pop(self.name, None)
+
+
+class FakeBlobPage:
+    def __init__(self, blobs: List[FakeBlob]) -> None:
+        self._blobs = blobs
+        self.num_items = len(blobs)
+
+    def __iter__(self) -> Any:
+        return iter(self._blobs)
+
+
+class FakeBlobIterator:
+    def __init__(self, bucket: "FakeBucket", prefix: str, page_size: int) -> None:
+        self._bucket = bucket
+        self._prefix = prefix
+        self._page_size = page_size
+
+    @property
+    def pages(self) -> Iterable[FakeBlobPage]:
+        # ページごとに上流を呼び出し、その時点の一覧を返す
+        marker = ""
+        while True:
+            self._bucket.upstreams.call("gcs", "list")
+            with self._bucket.lock:
+                names = sorted(
+                    name
+                    for name in self._bucket.objects
+                    if name.startswith(self._prefix) and name > marker
+                )[: self._page_size]
+            if not names:
+                return
+            marker = names[-1]
+            yield FakeBlobPage([FakeBlob(self._bucket, name) for name in names])
+
+    def __iter__(self) -> Any:
+        for page in self.pages:
+            yield from page
+
+
+class FakeBucket:
+    def __init__(self, storage: "FakeStorage", name: str) -> None:
+        self.name = name
+        self.upstreams = storage.upstreams
+        self.objects = storage.objects.setdefault(name, {})
+        self.created = storage.created.setdefault(name, {})
+        self.lock = storage.lock
+
+    def blob(self, name: str) -> FakeBlob:
+        return FakeBlob(self, name)
+
+    def list_blobs(self, prefix: str = "", page_size: int = 1000) -> FakeBlobIterator:
+        return FakeBlobIterator(self, prefix, page_size)
+
+    def delete_blobs(self, blobs: Iterable[FakeBlob], on_error: Any = None) -> None:
+        self.upstreams.call("gcs", "delete_batch")
+        with self.lock:
+            for blob in blobs:
+                self.objects.pop(blob.name, None)
+
+
+class FakeStorage:
+    def __init__(self, upstreams: Upstreams) -> None:
+        self.upstreams = upstreams
+        self.objects: Dict[str, Dict[str, bytes]] = {}
+        self.created: Dict[str, Dict[str, datetime]] = {}
+        self.lock = threading.RLock()
+
+    def bucket(self, name: str) -> FakeBucket:
+        return FakeBucket(self, name)
+
+    def list_blobs(self, bucket: Any, prefix: str = "", page_size: int = 1000) -> Any:
+        name = bucket.name if isinstance(bucket, FakeBucket) else bucket
+        return self.bucket(name).list_blobs(prefix=prefix, page_size=page_size)
+
+    def batch(self, raise_exception: bool = True) -> Any:
+        # delete_blobsは1回の呼び出しとして数えるため、バッチのまとめ処理は何もしない
+        return contextlib.nullcontext()
+
+
+# ---- googlemaps / Place Photo ----
+
+PREFECTURES = [
+    ("東京都", "渋谷区"),
+    ("神奈川県", "横浜市"),
+    ("大阪府", "大阪市"),
+    ("北海道", "札幌市"),
+]
+
+
+class FakeGoogleMapsClient:
+    def __init__(self, upstreams: Upstreams, places_per_search: int = 3, photos_per_place: int = 2):
+        self.upstreams = upstreams
+        self.places_per_search = places_per_search
+        self.photos_per_place = photos_per_place
+
+    def places_nearby(self, location: Tuple[float, float], **kwargs: Any) -> Dict[str, Any]:
+        self.upstreams.call("places", "nearby")
+        lat, lon = location
+        # 同じ座標からは同じ店舗IDが返るようにする
+        tile = f"{round(lat, 4)}_{round(lon, 4)}"
+        radius = float(kwargs.get("radius", 15))
+        results = []
+        for index in range(self.places_per_search):
+            # 店舗は検索した座標から近い順に半径内に並べる (最初の店舗は検索した座標)
+            distance = radius * index / self.places_per_search
+            bearing = random.Random(f"{tile}_{index}").uniform(0, 2 * math.pi)
+            dlat = distance * math.cos(bearing) / 111320
+            dlon = distance * math.sin(bearing) / (111320 * math.cos(math.radians(lat)))
+            results.append(
+                {
+                    "place_id": f"place_{tile}_{index}",
+                    "geometry": {"location": {"lat": lat + dlat, "lng": lon + dlon}},
+                }
+            )
+        return {"results": results, "status": "OK"}
+
+    def place(self, place_id: str, **kwargs: Any) -> Dict[str, Any]:
+        self.upstreams.call("places", "details")
+        prefecture, city = PREFECTURES[hash(place_id) % len(PREFECTURES)]
+        return {
+            "result": {
+                "name": f"店舗 {place_id[-6:]}",
+                "formatted_address": f"日本、{prefecture}{city}1-2-3",
+                "address_components": [
+                    {"long_name": city, "types": ["locality", "political"]},
+                    {"long_name": prefecture, "types": ["administrative_area_level_1"]},
+                    {"long_name": "日本", "types": ["country", "political"]},
+                ],
+                "formatted_phone_number": "03-1234-5678",
+                "website": "https://example.com",
+                "opening_hours": {
+                    "periods": [
+                        {
+                            "open": {"day": day, "time": "1100"},
+                            "close": {"day": day, "time": "2200"},
+                        }
+                        for day in range(7)
+                    ]
+                },
+                "photos": [
+                    {"photo_reference": f"{place_id}_photo_{index}"}
+                    for index in range(self.photos_per_place)
+                ],
+            },
+            "status": "OK",
+        }
+
+
+class FakeGoogleMapsModule:
+    # `googlemaps` モジュールの置き換え (Client(key=...) を提供する)
+
+    def __init__(self, upstreams: Upstreams, **client_options: Any) -> None:
+        self._upstreams = upstreams
+        self._client_options = client_options
+
+    def Client(self, key: str = "", **kwargs: Any) -> FakeGoogleMapsClient:
+        return FakeGoogleMapsClient(self._upstreams, **self._client_options)
+
+
+class FakeHttpResponse:
+    def __init__(self, content: bytes) -> None:
+        self.content = content
+        self.status_code = 200
+
+    def raise_for_status(self) -> None:
+        return None
+
+
+class FakeRequestsModule:
+    # Place Photoのダウンロードに使う `requests` モジュールの置き換え
+
+    def __init__(self, upstreams: Upstreams, photo_bytes: bytes) -> None:
+        self._upstreams = upstreams
+        self._photo_bytes = photo_bytes
+
+    def get(self, url: str, **kwargs: Any) -> FakeHttpResponse:
+        self._upstreams.call("places", "photo")
+        return FakeHttpResponse(self._photo_bytes)
+
+
+# ---- Gemini ----
+
+
+class FakeGeminiChunk:
+    def __init__(self, text: str) -> None:
+        self.text = text
+
+
+class FakeGeminiResponse:
+    def __init__(self, upstreams: Upstreams, answer: str) -> None:
+        self._upstreams = upstreams
+        self._answer = answer
+        self._resolved = False
+
+    def __iter__(self) -> Any:
+        # ストリーミングは1文字ずつ返す
+        self._upstreams.call("gemini", "generate")
+        self._resolved = True
+        for char in self._answer:
+            yield FakeGeminiChunk(char)
+
+    def resolve(self) -> None:
+        if not self._resolved:
+            self._upstreams.call("gemini", "generate")
+            self._resolved = True
+
+    @property
+    def text(self) -> str:
+        return self._answer
+
+
+class FakeGenerativeModel:
+    def __init__(self, module: "FakeGeminiModule", model_name: str) -> None:
+        self._module = module
+
+    def generate_content(self, contents: Any, stream: bool = False, **kwargs: Any) -> Any:
+        answer = self._module.answers[self._module.random.randrange(len(self._module.answers))]
+        response = FakeGeminiResponse(self._module.upstreams, answer)
+        if not stream:
+            response.resolve()
+        return response
+
+
+class FakeGeminiModule:
+    # `google.generativeai` モジュールの置き換え
+
+    def __init__(self, upstreams: Upstreams, answers: Optional[List[str]] = None) -> None:
+        self.upstreams = upstreams
+        self.answers = answers or [
+            "ラーメン",
+            "カフェ",
+            "和食",
+            "洋食",
+            "エスニック",
+            "飲食物ではない",
+        ]
+        self.random = random.Random(0)
+
+    def configure(self, api_key: str = "", **kwargs: Any) -> None:
+        return None
+
+    def GenerativeModel(self, model_name: str, **kwargs: Any) -> FakeGenerativeModel:
+        return FakeGenerativeModel(self, model_name)
+
+
+# ---- Firebase Auth ----
+
+
+@dataclass
+class FakeDeleteError:
+    index: int
+    reason: str
+
+
+@dataclass
+class FakeBatchDeleteResult:
+    success_count: int
+    failure_count: int
+    errors: List[FakeDeleteError]
+
+
+class FakeAuthAdmin:
+    # firebase_admin.auth のユーザー削除 (delete_user / delete_users) のフェイク
+
+    def __init__(self, upstreams: Upstreams, uids: Iterable[str] = ()) -> None:
+        self.upstreams = upstreams
+        self.users = set(uids)
+        # 削除に失敗させるuid
+        self.failing: Dict[str, str] = {}
+        self._lock = threading.Lock()
+
+    def delete_user(self, uid: str) -> None:
+        self.upstreams.call("auth", "delete_user")
+        with self._lock:
+            if uid in self.failing:
+                raise FakeUpstreamError(self.failing[uid])
+            self.users.discard(uid)
+
+    def delete_users(self, uids: List[str]) -> FakeBatchDeleteResult:
+        if len(uids) > 1000:
+            raise ValueError("uids must have at most 1000 entries")
+        self.upstreams.call("auth", "delete_users")
+        errors = []
+        with self._lock:
+            for index, uid in enumerate(uids):
+                if uid in self.failing:
+                    errors.append(FakeDeleteError(index, self.failing[uid]))
+                else:
+                    # 存在しないユーザーも成功として扱う (Admin SDKと同じ)
+                    self.users.discard(uid)
+        return FakeBatchDeleteResult(len(uids) - len(errors), len(errors), errors)
+
+
+class FakeFirebaseAuth:
+    # ローカルで生成した鍵でFirebase IDトークンを発行する (公開鍵はGoogleと同じ証明書の形式)
+
+    def __init__(
+        self, project_id: str = "bench-project", private_key_pem: Optional[bytes] = None
+    ) -> None:
+        # Third Party Library
+        from cryptography import x509
+        from cryptography.hazmat.primitives import hashes, serialization
+        from cryptography.hazmat.primitives.asymmetric import rsa
+        from cryptography.x509.oid import NameOID
+
+        self.project_id = project_id
+        self.kid = "bench-key"
+        if private_key_pem is None:
+            key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+            private_key_pem = key.private_bytes(
+                serialization.Encoding.PEM,
+                serialization.PrivateFormat.PKCS8,
+                serialization.NoEncryption(),
+            )
+        else:
+            loaded = serialization.load_pem_private_key(private_key_pem, password=None)
+            if not isinstance(loaded, rsa.RSAPrivateKey):
+                raise ValueError("The Firebase Auth fake needs an RSA private key")
+            key = loaded
+        self.private_key_pem = private_key_pem
+
+        name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, "securetoken.bench")])
+        now = datetime.now(timezone.utc)
+        cert = (
+            x509.CertificateBuilder()
+            .subject_name(name)
+            .issuer_name(name)
+            .public_key(key.public_key())
+            .serial_number(1)
+            .not_valid_before(now - timedelta(days=1))
+            .not_valid_after(now + timedelta(days=1))
+            .sign(key, hashes.SHA256())
+        )
+        self.certs = {self.kid: cert.public_bytes(serialization.Encoding.PEM).decode()}
+        self._tokens: Dict[str, str] = {}
+        self._lock = threading.Lock()
+
+    def mint(self, uid: str, expires_in: int = 3600, **overrides: Any) -> str:
+        # Third Party Library
+        from google.auth import crypt, jwt  # type: ignore
+
+        now = int(time.time())
+        claims = {
+            "iss": f"https://securetoken.google.com/{self.project_id}",
+            "aud": self.project_id,
+            "auth_time": now,
+            "sub": uid,
+            "iat": now,
+            "exp": now + expires_in,
+        }
+        claims.update(overrides)
+        signer = crypt.RSASigner.from_string(self.private_key_pem.decode(), self.kid)
+        token: bytes = jwt.encode(signer, claims)
+        return token.decode()
+
+    def token_for(self, uid: str) -> str:
+        # 負荷試験ではユーザーごとに同じトークンを使い回す (クライアントSDKと同じ)
+        with self._lock:
+            token = self._tokens.get(uid)
+            if token is None:
+                token = self._tokens[uid] = self.mint(uid)
+            return token
@@ -0,0 +1,201 @@
+# FastAPIアプリをプロセス内でフェイクの上流に繋いで起動し、ASGIで直接リクエストする
+# Standard Library
+import asyncio
+import contextlib
+import io
+import json
+import logging
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional, Tuple
+from unittest import mock
+
+# First Party Library
+from bench.fakes import (
+    FakeAsyncFirestore,
+    FakeFirebaseAuth,
+    FakeFirestore,
+    FakeGeminiModule,
+    FakeGoogleMapsModule,
+    FakeRequestsModule,
+    FakeStorage,
+    Upstreams,
+)
+
+
+def make_jpeg(size: Tuple[int, int] = (64, 64)) -> bytes:
+    # Third Party Library
+    from PIL import Image
+
+    buffer = io.BytesIO()
+    Image.new("RGB", size, (200, 120, 40)).save(buffer, format="JPEG")
+    return buffer.getvalue()
+
+
+@dataclass
+class FakeBackend:
+    upstreams: Upstreams
+    db: FakeFirestore
+    async_db: FakeAsyncFirestore
+    storage: FakeStorage
+    gmaps: FakeGoogleMapsModule
+    gemini: FakeGeminiModule
+    requests: FakeRequestsModule
+    auth: FakeFirebaseAuth
+
+
+def make_backend(
+    upstreams: Upstreams,
+    photo_bytes: Optional[bytes] = None,
+    auth: Optional[FakeFirebaseAuth] = None,
+) -> FakeBackend:
+    db = FakeFirestore(upstreams)
+    return FakeBackend(
+        upstreams=upstreams,
+        db=db,
+        async_db=FakeAsyncFirestore(db),
+        storage=FakeStorage(upstreams),
+        gmaps=FakeGoogleMapsModule(upstreams),
+        gemini=FakeGeminiModule(upstreams),
+        requests=FakeRequestsModule(upstreams, photo_bytes or make_jpeg()),
+        auth=auth or FakeFirebaseAuth(),
+    )
+
+
+@contextlib.contextmanager
+def patched_app(backend: FakeBackend, log_level: int = logging.WARNING) -> Iterator[Any]:
+    # 外部クライアントの取得処理をフェイクに差し替えたアプリを返す
+    # First Party Library
+    from api.core import gemini, id_token, startup
+    from api.cruds import write_behind
+    from api.main import app
+    from api.routers import router
+    from api.schemas import find_nearby_restaurant
+
+    # 計測結果が読めるようアプリのログは既定でWARNING以上のみ出す
+    logging.getLogger().setLevel(log_level)
+
+    # IDトークンはフェイクの鍵で検証する (Googleから公開鍵を取得しない)
+    id_token.get_signing_keys().install(backend.auth.certs, max_age=86400)
+    id_token._memo.clear()
+
+    warmup_steps = [
+        (name, step) for name, step in startup.WARMUP_STEPS if name == "romaji_converter"
+    ]
+    with mock.patch.object(
+        find_nearby_restaurant,
+        "get_gmaps_client",
+        lambda api_key: backend.gmaps.Client(key=api_key),
+    ), mock.patch.object(
+        find_nearby_restaurant, "get_http_session", lambda: backend.requests
+    ), mock.patch.object(
+        gemini,
+        "get_gemini_model",
+        lambda api_key, model_name="gemini-1.5-flash": backend.gemini.GenerativeModel(model_name),
+    ), mock.patch.object(
+        startup, "WARMUP_STEPS", warmup_steps
+    ), mock.patch.object(
+        id_token, "_project_id", backend.auth.project_id
+    ), mock.patch.object(
+        # 存在するドキュメントと直近の書き込みの記録はバックエンド (データベース) ごとに持つ
+        write_behind,
+        "_buffer",
+        write_behind.WriteBehindBuffer(),
+    ):
+        app.dependency_overrides[router.get_firestore_client] = lambda: backend.db
+        app.dependency_overrides[router.get_async_firestore_client] = lambda: (
+            backend.async_db if router.FIRESTORE_ASYNC else None
+        )
+        app.dependency_overrides[router.get_storage_client] = lambda: backend.storage
+        try:
+            yield app
+        finally:
+            app.dependency_overrides.clear()
+
+
+@contextlib.asynccontextmanager
+async def lifespan(app: Any) -> AsyncIterator[None]:
+    # ASGIのlifespanプロトコルでstartup/shutdownイベントを実行する
+    receive_queue: asyncio.Queue = asyncio.Queue()
+    send_queue: asyncio.Queue = asyncio.Queue()
+    scope = {"type": "lifespan", "asgi": {"version": "3.0"}, "state": {}}
+    task = asyncio.ensure_future(app(scope, receive_queue.get, send_queue.put))
+    await receive_queue.put({"type": "lifespan.startup"})
+    message = await send_queue.get()
+    if message["type"] != "lifespan.startup.complete":
+        raise RuntimeError(f"startup failed: {message}")
+    try:
+        yield
+    finally:
+        await receive_queue.put({"type": "lifespan.shutdown"})
+        await send_queue.get()
+        await task
+
+
+@dataclass
+class Response:
+    status: int
+    headers: Dict[str, str]
+    body: bytes
+
+    def json(self) -> Any:
+        return json.loads(self.body)
+
+
+async def request(
+    app: Any,
+    method: str,
+    path: str,
+    json_body: Any = None,
+    headers: Optional[Dict[str, str]] = None,
+) -> Response:
+    path, _, query_string = path.partition("?")
+    body = json.dumps(json_body).encode() if json_body is not None else b""
+    raw_headers: List[Tuple[bytes, bytes]] = [
+        (key.lower().encode(), value.encode()) for key, value in (headers or {}).items()
+    ]
+    if json_body is not None:
+        raw_headers.append((b"content-type", b"application/json"))
+    raw_headers.append((b"content-length", str(len(body)).encode()))
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": method,
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "query_string": query_string.encode(),
+        "root_path": "",
+        "headers": raw_headers,
+        "client": ("127.0.0.1", 50000),
+        "server": ("testserver", 80),
+    }
+
+    request_sent = False
+    response_complete = asyncio.Event()
+    status = 0
+    response_headers: Dict[str, str] = {}
+    chunks: List[bytes] = []
+
+    async def receive() -> Dict[str, Any]:
+        nonlocal request_sent
+        if not request_sent:
+            request_sent = True
+            return {"type": "http.request", "body": body, "more_body": False}
+        await response_complete.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message: Dict[str, Any]) -> None:
+        nonlocal status
+        if message["type"] == "http.response.start":
+            status = message["status"]
+            response_headers.update(
+                (key.decode(), value.decode()) for key, value in message.get("headers", [])
+            )
+        elif message["type"] == "http.response.body":
+            chunks.append(message.get("body", b""))
+            if not message.get("more_body", False):
+                response_complete.set()
+
+    await app(scope, receive, send)
+    return Response(status=status, headers=response_headers, body=b"".join(chunks))
@@ -0,0 +1,210 @@
+# フェイクの上流に対してAPIへ負荷をかけ、スループット・レイテンシ・上流呼び出し回数を計測する
+# 実行方法:
+#   python -m bench.load_test --requests 200 --concurrency 16 --label baseline
+#   python -m bench.load_test --upstream places=80,20,0.01 --compare bench/results/baseline.json
+# Standard Library
+import argparse
+import asyncio
+import base64
+import json
+import random
+import statistics
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Tuple
+
+# First Party Library
+from bench.fakes import FakeFirebaseAuth, UpstreamProfile, Upstreams
+from bench.harness import FakeBackend, lifespan, make_backend, make_jpeg, patched_app, request
+
+RESULTS_DIR = Path(__file__).parent / "results"
+
+# 上流ごとの既定の遅延 (ms) / ジッタ (ms) / エラー率
+DEFAULT_PROFILES = {
+    "firestore": UpstreamProfile(8, 4, 0.0),
+    "gcs": UpstreamProfile(25, 10, 0.0),
+    "places": UpstreamProfile(60, 20, 0.0),
+    "gemini": UpstreamProfile(400, 150, 0.0),
+}
+
+# 写真が撮られやすい地点 (同じ地点の写真はまとまって届く)
+HOT_SPOTS = [(35.6595, 139.7005), (35.4437, 139.6380), (34.7025, 135.4959), (43.0687, 141.3508)]
+
+
+def parse_profile(value: str) -> Tuple[str, UpstreamProfile]:
+    # "places=80,20,0.01" → 遅延80ms・ジッタ20ms・エラー率1%
+    name, _, spec = value.partition("=")
+    numbers = [float(number) for number in spec.split(",") if number]
+    return name, UpstreamProfile(*numbers)
+
+
+def percentile(values: List[float], rate: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(rate * len(ordered)))]
+
+
+def build_requests(
+    route: str, auth: FakeFirebaseAuth, users: int, photo: str, rng: random.Random
+) -> Callable[[int], Tuple[str, str, Dict[str, Any], Dict[str, str]]]:
+    def make(index: int) -> Tuple[str, str, Dict[str, Any], Dict[str, str]]:
+        user_id = f"user_{index % users}"
+        headers = {"Authorization": f"Bearer {auth.token_for(user_id)}"}
+        if route == "/findNearbyRestaurants":
+            lat, lon = rng.choice(HOT_SPOTS)
+            body = {
+                "userId": user_id,
+                "lat": lat + rng.uniform(-2e-4, 2e-4),
+                "lon": lon + rng.uniform(-2e-4, 2e-4),
+                "photo_id": f"photo_{index}",
+            }
+        elif route == "/categorizeFood":
+            body = {"userId": user_id, "photoId": f"photo_{index}", "photo": photo}
+        else:
+            body = {"userId": user_id}
+        return "POST", route, body, headers
+
+    return make
+
+
+async def run_route(
+    app: Any,
+    backend: FakeBackend,
+    route: str,
+    total: int,
+    concurrency: int,
+    users: int,
+    photo: str,
+    seed: int,
+) -> Dict[str, Any]:
+    make = build_requests(route, backend.auth, users, photo, random.Random(seed))
+    latencies: List[float] = []
+    statuses: Dict[str, int] = {}
+    queue: asyncio.Queue = asyncio.Queue()
+    for index in range(total):
+        queue.put_nowait(index)
+
+    async def worker() -> None:
+        while not queue.empty():
+            method, path, body, headers = make(queue.get_nowait())
+            started = time.perf_counter()
+            try:
+                response = await request(app, method, path, body, headers)
+                status = str(response.status)
+            except Exception as e:
+                status = type(e).__name__
+            latencies.append((time.perf_counter() - started) * 1e3)
+            statuses[status] = statuses.get(status, 0) + 1
+
+    calls_before = backend.upstreams.snapshot()
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    calls_after = backend.upstreams.snapshot()
+
+    return {
+        "requests": total,
+        "elapsedSeconds": round(elapsed, 3),
+        "throughputRps": round(total / elapsed, 2),
+        "p50Ms": round(percentile(latencies, 0.50), 2),
+        "p95Ms": round(percentile(latencies, 0.95), 2),
+        "p99Ms": round(percentile(latencies, 0.99), 2),
+        "meanMs": round(statistics.fmean(latencies), 2) if latencies else 0.0,
+        "statuses": statuses,
+        "upstreamCallsPerRequest": {
+            name: round((count - calls_before.get(name, 0)) / total, 3)
+            for name, count in sorted(calls_after.items())
+            if count - calls_before.get(name, 0)
+        },
+    }
+
+
+def seed_users(backend: FakeBackend, users: int) -> None:
+    for index in range(users):
+        backend.db.documents[f"users/user_{index}"] = {"classifyPhotosStatus": "initial"}
+
+
+def print_report(results: Dict[str, Any], baseline: Dict[str, Any]) -> None:
+    for route, result in results["routes"].items():
+        previous = baseline.get("routes", {}).get(route)
+        print(f"\n{route}")
+        for key in ("throughputRps", "p50Ms", "p95Ms", "p99Ms"):
+            line = f"  {key:<14}{result[key]:>10}"
+            if previous and previous.get(key):
+                change = (result[key] - previous[key]) / previous[key] * 100
+                line += f"   (baseline {previous[key]}, {change:+.1f}%)"
+            print(line)
+        print(f"  statuses      {result['statuses']}")
+        for name, count in result["upstreamCallsPerRequest"].items():
+            print(f"  {name:<24}{count:>8} calls/request")
+
+
+async def main_async(args: argparse.Namespace) -> Dict[str, Any]:
+    profiles = dict(DEFAULT_PROFILES)
+    profiles.update(dict(parse_profile(value) for value in args.upstream))
+    backend = make_backend(Upstreams(profiles, seed=args.seed))
+    seed_users(backend, args.users)
+    photo = base64.b64encode(make_jpeg()).decode()
+
+    routes: Dict[str, Any] = {}
+    with patched_app(backend) as app:
+        async with lifespan(app):
+            for route in args.routes:
+                routes[route] = await run_route(
+                    app,
+                    backend,
+                    route,
+                    args.requests,
+                    args.concurrency,
+                    args.users,
+                    photo,
+                    args.seed,
+                )
+
+    return {
+        "label": args.label,
+        "config": {
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "users": args.users,
+            "upstreams": {name: vars(profile) for name, profile in profiles.items()},
+        },
+        "routes": routes,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=100, help="requests per route")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--routes",
+        nargs="+",
+        default=["/categorizeFood", "/findNearbyRestaurants", "/updateUserStatus"],
+    )
+    parser.add_argument(
+        "--upstream",
+        action="append",
+        default=[],
+        help="NAME=LATENCY_MS[,JITTER_MS[,ERROR_RATE]] (firestore/gcs/places/gemini)",
+    )
+    parser.add_argument("--label", default="latest", help="results are saved as <label>.json")
+    parser.add_argument("--compare", help="path to a previous result to compare against")
+    args = parser.parse_args()
+
+    results = asyncio.run(main_async(args))
+
+    RESULTS_DIR.mkdir(exist_ok=True)
+    output = RESULTS_DIR / f"{args.label}.json"
+    output.write_text(json.dumps(results, indent=2, ensure_ascii=False))
+
+    baseline = json.loads(Path(args.compare).read_text()) if args.compare else {}
+    print_report(results, baseline)
+    print(f"\nsaved to {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,340 @@
+# 記録したリクエスト (api/core/request_trace.py) を、フェイクの上流に繋いだアプリへ記録どおりの間隔で流す
+# 実行方法:
+#   REQUEST_TRACE_DIR=traces uvicorn api.main:app ...    (記録)
+#   python -m bench.replay traces/*.jsonl --speed 1
+#   python -m bench.replay traces/*.jsonl --speed 4 --upstream places=120,40 --label morning_4x
+#
+# - 到着時刻どおりに送る (前のリクエストの完了を待たない)。--speed N で間隔を1/Nにする
+# - ユーザーは user_<n>、写真は記録したバイト数のJPEG (同じハッシュは同じ内容) で置き換える
+#   (カーソルは再生できないため最初のページを読む。検索語などは記録した文字数のダミーになる)
+# - 記録の形 (ルートの内訳・ピークのリクエスト数・再送・同じ地点の連続・本文のサイズ) と、
+#   ルートごとのレイテンシ (記録時との比較)、上流の呼び出し回数、キャッシュ・書き込みのまとめ・
+#   流量制御のメトリクスの増分を表示する
+# Standard Library
+import argparse
+import asyncio
+import base64
+import json
+import math
+import random
+import time
+from collections import Counter
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+from urllib.parse import urlencode
+
+# First Party Library
+from bench.fakes import Upstreams
+from bench.harness import FakeBackend, lifespan, make_backend, make_jpeg, patched_app, request
+from bench.load_test import DEFAULT_PROFILES, RESULTS_DIR, parse_profile, percentile
+
+# 増分を表示するメトリクス (キャッシュ・書き込みのまとめ・流量制御)
+REPORTED_METRICS = (
+    "places_nearby_cache_total",
+    "store_refresh_total",
+    "cache_hits_total",
+    "cache_misses_total",
+    "write_behind_coalesced_total",
+    "write_behind_skipped_total",
+    "write_behind_commits_total",
+    "admission_shed_total",
+    "admission_degraded_total",
+    "admission_queue_seconds_sum",
+    "admission_queue_seconds_count",
+    "rate_limit_wait_seconds_sum",
+    "rate_limit_throttled_total",
+    "rate_limit_rejected_total",
+    "gemini_hedged_total",
+)
+# 同じ地点の連続とみなす距離 (度) と間隔 (秒)
+BURST_DEGREES = 2e-4
+BURST_SECONDS = 60.0
+# 再生できないフィールド
+DROPPED_FIELDS = frozenset({"cursor"})
+
+Request = Tuple[str, str, Any, Dict[str, str]]
+
+
+def load_trace(paths: Iterable[str], limit: Optional[int] = None) -> List[Dict[str, Any]]:
+    records = []
+    for path in paths:
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                if isinstance(record, dict) and "t" in record and "route" in record:
+                    records.append(record)
+    records.sort(key=lambda record: record["t"])
+    return records[:limit] if limit is not None else records
+
+
+class RequestBuilder:
+    # 記録を実際に送るリクエストに戻す
+
+    def __init__(self, backend: FakeBackend) -> None:
+        self.backend = backend
+        self.users: Dict[str, str] = {}
+        self._photos: Dict[str, str] = {}
+        self._jpeg = make_jpeg()
+
+    def user_for(self, pseudonym: Optional[str]) -> str:
+        if pseudonym is None:
+            return "user_anonymous"
+        if pseudonym not in self.users:
+            self.users[pseudonym] = f"user_{len(self.users)}"
+        return self.users[pseudonym]
+
+    def photo(self, sha: str, size: int) -> str:
+        # 同じハッシュには同じ内容を返す (JPEGの後ろを埋めて記録したバイト数にする)
+        encoded = self._photos.get(sha)
+        if encoded is None:
+            missing = max(0, size - len(self._jpeg))
+            padding = (sha.encode() * (missing // len(sha) + 1))[:missing]
+            encoded = self._photos[sha] = base64.b64encode(self._jpeg + padding).decode()
+        return encoded
+
+    def value(self, key: str, value: Any, user_id: str) -> Any:
+        if isinstance(value, str) and value.startswith("id:"):
+            # 同じ値は (写真IDと店舗IDのように) フィールドが違っても同じIDにする
+            return user_id if key == "userId" else f"id_{value[3:]}"
+        if isinstance(value, str) and value.startswith("text:"):
+            return "x" * int(value[5:] or 0)
+        if isinstance(value, dict) and "sha" in value and "bytes" in value:
+            return self.photo(value["sha"], value["bytes"])
+        if isinstance(value, dict):
+            return self.fields(value, user_id)
+        if isinstance(value, list):
+            return [self.value(key, item, user_id) for item in value]
+        return value
+
+    def fields(self, fields: Dict[str, Any], user_id: str) -> Dict[str, Any]:
+        return {
+            key: self.value(key, value, user_id)
+            for key, value in fields.items()
+            if key not in DROPPED_FIELDS
+        }
+
+    def build(self, record: Dict[str, Any]) -> Request:
+        user_id = self.user_for(record.get("user"))
+        headers = {"Authorization": f"Bearer {self.backend.auth.token_for(user_id)}"}
+        path = record["route"]
+        query = self.fields(record.get("query") or {}, user_id)
+        if query:
+            path += "?" + urlencode(query)
+        body = record.get("body")
+        return (
+            record["method"],
+            path,
+            self.fields(body, user_id) if body is not None else None,
+            headers,
+        )
+
+
+def workload_shape(records: List[Dict[str, Any]]) -> Dict[str, Any]:
+    # 記録したトラフィックの形
+    span = max(records[-1]["t"] - records[0]["t"], 1e-9)
+    per_second = Counter(int(record["t"] - records[0]["t"]) for record in records)
+    seen: set = set()
+    retries = 0
+    bursts = 0
+    recent: List[Tuple[float, float, float]] = []
+    for record in records:
+        body = record.get("body") or {}
+        photo = body.get("photo")
+        key = (
+            record["route"],
+            body.get("photoId") or body.get("photo_id"),
+            photo.get("sha") if isinstance(photo, dict) else None,
+        )
+        if key[1] is not None or key[2] is not None:
+            retries += key in seen
+            seen.add(key)
+        lat, lon = body.get("lat"), body.get("lon")
+        if isinstance(lat, (int, float)) and isinstance(lon, (int, float)):
+            recent = [item for item in recent if record["t"] - item[0] <= BURST_SECONDS]
+            bursts += any(
+                abs(lat - item[1]) <= BURST_DEGREES and abs(lon - item[2]) <= BURST_DEGREES
+                for item in recent
+            )
+            recent.append((record["t"], lat, lon))
+    request_bytes = [record.get("requestBytes", 0) for record in records]
+    return {
+        "requests": len(records),
+        "users": len({record.get("user") for record in records}),
+        "seconds": round(span, 2),
+        "meanRps": round(len(records) / span, 2),
+        "peakRps": max(per_second.values()),
+        "routes": dict(Counter(record["route"] for record in records).most_common()),
+        "repeatedPhotos": retries,
+        "sameSpotWithin60s": bursts,
+        "requestBytesP50": percentile(request_bytes, 0.5),
+        "requestBytesP99": percentile(request_bytes, 0.99),
+    }
+
+
+def read_metrics() -> Dict[str, float]:
+    # First Party Library
+    from api.core.metrics import render_prometheus
+
+    values: Dict[str, float] = {}
+    for line in render_prometheus().splitlines():
+        if line.startswith("#") or not line:
+            continue
+        name_labels, _, value = line.rpartition(" ")
+        name = name_labels.split("{", 1)[0]
+        if name in REPORTED_METRICS:
+            values[name_labels] = values.get(name_labels, 0.0) + float(value)
+    return values
+
+
+async def replay(
+    app: Any, backend: FakeBackend, records: List[Dict[str, Any]], speed: float
+) -> Dict[str, Any]:
+    builder = RequestBuilder(backend)
+    requests = [builder.build(record) for record in records]
+    for user_id in builder.users.values():
+        backend.db.documents[f"users/{user_id}"] = {"classifyPhotosStatus": "initial"}
+
+    origin = records[0]["t"]
+    results: List[Optional[Tuple[str, float, float]]] = [None] * len(records)
+
+    async def send(index: int, scheduled: float) -> None:
+        lag = time.perf_counter() - scheduled
+        method, path, body, headers = requests[index]
+        started = time.perf_counter()
+        try:
+            response = await request(app, method, path, body, headers)
+            status = str(response.status)
+        except Exception as e:
+            status = type(e).__name__
+        results[index] = (status, (time.perf_counter() - started) * 1e3, lag * 1e3)
+
+    metrics_before = read_metrics()
+    calls_before = backend.upstreams.snapshot()
+    started = time.perf_counter()
+    tasks = []
+    for index, record in enumerate(records):
+        scheduled = started + (record["t"] - origin) / speed
+        delay = scheduled - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        tasks.append(asyncio.ensure_future(send(index, scheduled)))
+    await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - started
+    calls_after = backend.upstreams.snapshot()
+    metrics_after = read_metrics()
+
+    routes: Dict[str, Any] = {}
+    for record, result in zip(records, results):
+        assert result is not None
+        route = routes.setdefault(
+            record["route"], {"statuses": Counter(), "latency": [], "recorded": [], "lag": []}
+        )
+        status, latency, lag = result
+        route["statuses"][status] += 1
+        route["latency"].append(latency)
+        route["lag"].append(lag)
+        if "durationMs" in record:
+            route["recorded"].append(record["durationMs"])
+    return {
+        "speed": speed,
+        "elapsedSeconds": round(elapsed, 3),
+        "routes": {
+            name: {
+                "requests": len(route["latency"]),
+                "statuses": dict(route["statuses"]),
+                "p50Ms": round(percentile(route["latency"], 0.5), 2),
+                "p95Ms": round(percentile(route["latency"], 0.95), 2),
+                "p99Ms": round(percentile(route["latency"], 0.99), 2),
+                "recordedP50Ms": round(percentile(route["recorded"], 0.5), 2),
+                "recordedP99Ms": round(percentile(route["recorded"], 0.99), 2),
+                "startLagP99Ms": round(percentile(route["lag"], 0.99), 2),
+            }
+            for name, route in routes.items()
+        },
+        "upstreamCallsPerRequest": {
+            name: round((count - calls_before.get(name, 0)) / len(records), 3)
+            for name, count in sorted(calls_after.items())
+            if count - calls_before.get(name, 0)
+        },
+        "metrics": {
+            name: round(value - metrics_before.get(name, 0.0), 4)
+            for name, value in sorted(metrics_after.items())
+            if not math.isclose(value, metrics_before.get(name, 0.0))
+        },
+    }
+
+
+def print_report(shape: Dict[str, Any], result: Dict[str, Any]) -> None:
+    print(
+        f"trace  {shape['requests']} requests from {shape['users']} users"
+        f" over {shape['seconds']}s  mean {shape['meanRps']} rps  peak {shape['peakRps']} rps"
+    )
+    print(
+        f"       repeated photos {shape['repeatedPhotos']}"
+        f"  same spot within {BURST_SECONDS:.0f}s {shape['sameSpotWithin60s']}"
+        f"  request bytes p50 {shape['requestBytesP50']} p99 {shape['requestBytesP99']}"
+    )
+    print(f"       routes {shape['routes']}")
+    print(f"\nreplay at {result['speed']}x in {result['elapsedSeconds']}s")
+    for name, route in result["routes"].items():
+        print(
+            f"  {name:<24} {route['requests']:>5}  p50 {route['p50Ms']:>8} ms"
+            f"  p99 {route['p99Ms']:>8} ms  (recorded {route['recordedP50Ms']}"
+            f" / {route['recordedP99Ms']})  start lag p99 {route['startLagP99Ms']} ms"
+            f"  {route['statuses']}"
+        )
+    for name, count in result["upstreamCallsPerRequest"].items():
+        print(f"  {name:<32}{count:>8} calls/request")
+    for name, value in result["metrics"].items():
+        print(f"  {name:<64}{value:>10}")
+
+
+async def main_async(args: argparse.Namespace) -> Dict[str, Any]:
+    records = load_trace(args.traces, args.limit)
+    if not records:
+        raise SystemExit("no trace records found")
+    profiles = dict(DEFAULT_PROFILES)
+    profiles.update(dict(parse_profile(value) for value in args.upstream))
+    backend = make_backend(Upstreams(profiles, seed=args.seed))
+    random.seed(args.seed)
+
+    shape = workload_shape(records)
+    with patched_app(backend) as app:
+        async with lifespan(app):
+            result = await replay(app, backend, records, args.speed)
+    print_report(shape, result)
+    return {
+        "label": args.label,
+        "shape": shape,
+        "config": {"upstreams": {name: vars(profile) for name, profile in profiles.items()}},
+        **result,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("traces", nargs="+", help="trace files (JSON lines)")
+    parser.add_argument("--speed", type=float, default=1.0, help="replay N times faster")
+    parser.add_argument("--limit", type=int, help="replay only the first N requests")
+    parser.add_argument(
+        "--upstream",
+        action="append",
+        default=[],
+        help="NAME=LATENCY_MS[,JITTER_MS[,ERROR_RATE]] (firestore/gcs/places/gemini)",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--label", help="save the result as bench/results/<label>.json")
+    args = parser.parse_args()
+
+    results = asyncio.run(main_async(args))
+    if args.label:
+        RESULTS_DIR.mkdir(exist_ok=True)
+        output = RESULTS_DIR / f"{args.label}.json"
+        output.write_text(json.dumps(results, indent=2, ensure_ascii=False))
+        print(f"\nsaved to {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,4 @@
 #! /bin/bash
 
-# uvicorn のサーバーを立ち上げる
-poetry run uvicorn api.main:app --host 0.0.0.0 --port 8000
\ No newline at end of file
+# 本番用のサーバーを立ち上げる (ワーカー数や同時実行数は api/serve.py の環境変数で調整する)
+exec poetry run python -m api.serve
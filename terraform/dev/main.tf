@@ -47,6 +47,38 @@ resource "google_firestore_database" "default" {
   name        = "(default)"
 }
 
+# GET /photos のカテゴリでの絞り込み (category == X を createdAt の新しい順に読む)
+resource "google_firestore_index" "photos_category_created_at" {
+  provider   = google-beta
+  project    = var.project_id
+  database   = google_firestore_database.default.name
+  collection = "photos"
+
+  fields {
+    field_path = "category"
+    order      = "ASCENDING"
+  }
+
+  fields {
+    field_path = "createdAt"
+    order      = "DESCENDING"
+  }
+}
+
+# アカウント削除の途中経過 (accountDeletions/{uid}) は expireAt を過ぎたら消す
+resource "google_firestore_field" "account_deletions_expire_at" {
+  provider   = google-beta
+  project    = var.project_id
+  database   = google_firestore_database.default.name
+  collection = "accountDeletions"
+  field      = "expireAt"
+
+  ttl_config {}
+
+  # TTLのフィールドには単一フィールドのインデックスを作らない
+  index_config {}
+}
+
 # Update android app configurations for development
 resource "google_firebase_android_app" "default" {
   provider     = google-beta